@@ -66,6 +66,8 @@ export default function TsumePage() {
   const [gameStatus, setGameStatus] = useState<GameStatus>("playing");
   const [message, setMessage] = useState("");
   const [isProcessing, setIsProcessing] = useState(false);
+  // 問題図から指した攻め方の手数（サーバーが残り手数を判定するのに使う）
+  const [attackerMoves, setAttackerMoves] = useState(0);
 
   // 盤面状態の計算
   const { board, hands, turn } = useMemo(() => {
@@ -107,6 +109,7 @@ export default function TsumePage() {
       const data = await res.json();
       setCurrentProblem(data);
       setCurrentSfen(data.sfen);
+      setAttackerMoves(0);
       setGameStatus("playing");
       setMessage(data.description);
     } catch (e) {
@@ -134,6 +137,7 @@ export default function TsumePage() {
   const handleReset = useCallback(() => {
     if (currentProblem) {
         setCurrentSfen(currentProblem.sfen);
+        setAttackerMoves(0);
         setGameStatus("playing");
         setMessage(currentProblem.description);
         setIsProcessing(false);
@@ -148,13 +152,16 @@ export default function TsumePage() {
     const nextSfen = boardToSfen(newBoard, newHands || hands, nextTurn);
     setCurrentSfen(nextSfen);
     setIsProcessing(true);
+    // 攻め方の手と受け方の応手が交互に進むので、今の手までの手数は 2n - 1
+    const moveCount = attackerMoves + 1;
+    setAttackerMoves(moveCount);
 
     try {
       // 2. AIに手を送る
       const res = await fetchWithAuth(`${API_BASE}/api/tsume/play`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ sfen: nextSfen }),
+        body: JSON.stringify({ sfen: nextSfen, problem_id: currentProblem?.id, plies_played: 2 * moveCount - 1 }),
       });
       const data = await res.json();
 
@@ -197,7 +204,7 @@ export default function TsumePage() {
     } finally {
       setIsProcessing(false);
     }
-  }, [gameStatus, isProcessing, turn, hands]);
+  }, [gameStatus, isProcessing, turn, hands, currentProblem, attackerMoves]);
 
   return (
     <div className="min-h-screen bg-[#f6f1e6] text-[#2b2b2b] flex flex-col">
@@ -10,9 +10,13 @@ except Exception:
 def build_pv_reason_fallback(position_cmd: str, pv_str: str, options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
     Fallback PV reasoning without python-shogi.
-    Uses the lightweight USI/SFEN parser already used for rule-based explanations.
+    Replays the PV on the ingest Board with the pure-Python legal move
+    generator: captures, promotions and checks are read off the position, and
+    the line is cut at the first illegal move (a stale or garbled PV).
     """
-    from backend.api.utils.shogi_explain_core import parse_position_cmd, apply_usi_move  # local import
+    from backend.ingest.board import Board, IllegalMoveError  # local import
+    from backend.ingest.move_codec import DROP_BASE, PROMOTE_FLAG
+    from backend.ingest.movegen import check_move, in_check, make_move
 
     pv_tokens: List[str] = [t for t in (pv_str or "").split() if t]
     if not pv_tokens:
@@ -22,15 +26,19 @@ def build_pv_reason_fallback(position_cmd: str, pv_str: str, options: Dict[str,
     used_h = 0
 
     try:
-        pos = parse_position_cmd(position_cmd or "position startpos")
-        board = pos.board
-        turn = pos.turn
-    except Exception:
+        text = (position_cmd or "position startpos").strip()
+        if text.startswith("position"):
+            text = text[len("position"):].strip()
+        base, _, history = text.partition(" moves")
+        board = Board.from_sfen(base or "startpos")
+        for mv in history.split():
+            make_move(board, check_move(board, mv))
+    except ValueError:      # IllegalMoveError included
         return None
 
     events: List[Dict[str, Any]] = []
     threat_event: Optional[Dict[str, Any]] = None
-    initial_side = "black" if turn == "b" else "white"
+    initial_side = "black" if board.turn == 0 else "white"
 
     def _append(ev: Dict[str, Any]):
         nonlocal threat_event
@@ -41,34 +49,27 @@ def build_pv_reason_fallback(position_cmd: str, pv_str: str, options: Dict[str,
     for token in pv_tokens:
         if used_h >= max_h:
             break
+        try:
+            code = check_move(board, token)
+        except IllegalMoveError:
+            break
 
-        side = "black" if turn == "b" else "white"
+        side = "black" if board.turn == 0 else "white"
         early_stop = False
-
-        if "*" in token:
+        if (code >> 7) & 0x7F >= DROP_BASE:
             _append({"type": "drop", "move": token, "side": side})
-
-        # capture detection (non-strict legality; based on dst occupancy)
-        try:
-            next_board, captured = apply_usi_move(board, token, turn)
-            if captured is not None:
-                _append({"type": "capture", "move": token, "side": side})
-                early_stop = True
-            board = next_board
-        except Exception:
-            break
+        if make_move(board, code):
+            _append({"type": "capture", "move": token, "side": side})
+            early_stop = True
 
         used_h += 1
-        if token.endswith("+"):
+        if code & PROMOTE_FLAG:
             _append({"type": "promotion", "move": token, "side": side})
             early_stop = True
-
-        # simple check marker: "+" in token (best-effort)
-        if "+" in token:
+        if in_check(board, board.turn):
             _append({"type": "check", "move": token, "side": side})
             early_stop = True
 
-        turn = "w" if turn == "b" else "b"
         if early_stop:
             break
 
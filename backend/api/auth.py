@@ -6,6 +6,7 @@ from typing import Optional, Set, Any, Dict
 
 from fastapi import Header, HTTPException, status, Request
 
+from backend.api.jwt_verify import get_token_verifier
 from backend.api.subscriptions import is_pro_user
 from backend.api.supabase_admin import get_supabase_admin_client
 
@@ -55,6 +56,18 @@ def _parse_bearer_token(authorization: Optional[str]) -> Optional[str]:
 
 
 def _get_supabase_claims(token: str) -> Optional[Dict[str, Any]]:
+    verifier = get_token_verifier()
+    if verifier is not None and verifier.can_check(token):
+        # Verified locally against the cached JWKS. A rejected token gets no
+        # second chance over the network; that would hand every forged token
+        # a remote round trip.
+        return verifier.verify(token)
+    # Not configured, or signed in a way it has no key for (HS256 without
+    # SUPABASE_JWT_SECRET on a legacy-secret project): ask Supabase.
+    return _get_supabase_claims_remote(token)
+
+
+def _get_supabase_claims_remote(token: str) -> Optional[Dict[str, Any]]:
     client = get_supabase_admin_client()
     if client is None:
         return None
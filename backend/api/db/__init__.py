@@ -1,3 +1,3 @@
-from .wkbk_db import lookup_by_sfen, WkbkDbResult
+from .wkbk_db import lookup, lookup_by_sfen, WkbkDbResult
 
-__all__ = ["lookup_by_sfen", "WkbkDbResult"]
+__all__ = ["lookup", "lookup_by_sfen", "WkbkDbResult"]
@@ -8,7 +8,10 @@ wkbk_articles.jsonl (shogi-extend 由来) への読み取り専用アクセス
 - 返すのは: key / lineage_key / tags / difficulty / category_hint / author / short_note
 - short_note は description の先頭 80 文字以内に切り詰める（丸写し禁止）
 - SFEN による正規化一致検索（プレフィックス除去・手数除去）
-- 起動時に一度ロード → メモリ上の dict で高速参照
+- 補助インデックス: 盤面のみ一致（持駒・手番を無視）/ 左右反転局面 /
+  玉周辺の駒配置ベクトルによる類似検索（NumPy, top-k）
+- 結果には match（一致の種類）と score（0..1）を付け、表示可否は呼び出し側が決める
+- 起動時に一度ロード → メモリ上の dict / 行列で高速参照
 - 落ちない設計: ファイルなし/パースエラーは空マップに degradeして続行
 
 著作権方針 (CLAUDE.md より):
@@ -22,9 +25,17 @@ import json
 import logging
 import os
 import re
+import zlib
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:  # pragma: no cover - numpy は requirements に含まれる
+    np = None  # type: ignore[assignment]
+    HAS_NUMPY = False
 
 _LOG = logging.getLogger("uvicorn.error")
 
@@ -90,6 +101,62 @@ def normalize_sfen(raw: str) -> str:
     return s
 
 
+def board_key(sfen_norm: str) -> str:
+    """正規化済み SFEN から盤面部分だけを取り出す（持駒・手番を無視するキー）"""
+    return sfen_norm.split(" ", 1)[0] if sfen_norm else ""
+
+
+def _board_cells(board_part: str) -> List[List[str]]:
+    """SFEN 盤面 → 9x9 のセル表（空マスは ""、成駒は "+P" のような2文字）"""
+    rows: List[List[str]] = []
+    for row in board_part.split("/"):
+        cells: List[str] = []
+        i = 0
+        while i < len(row):
+            ch = row[i]
+            if ch.isdigit():
+                cells.extend([""] * int(ch))
+                i += 1
+            elif ch == "+" and i + 1 < len(row):
+                cells.append(row[i:i + 2])
+                i += 2
+            else:
+                cells.append(ch)
+                i += 1
+        if len(cells) != 9:
+            raise ValueError(f"invalid SFEN rank: {row!r}")
+        rows.append(cells)
+    if len(rows) != 9:
+        raise ValueError(f"invalid SFEN board: {board_part!r}")
+    return rows
+
+
+def _join_board_cells(rows: List[List[str]]) -> str:
+    out: List[str] = []
+    for cells in rows:
+        buf = ""
+        empty = 0
+        for c in cells:
+            if not c:
+                empty += 1
+                continue
+            if empty:
+                buf += str(empty)
+                empty = 0
+            buf += c
+        if empty:
+            buf += str(empty)
+        out.append(buf)
+    return "/".join(out)
+
+
+def mirror_sfen(sfen_norm: str) -> str:
+    """左右反転（9筋 ⇔ 1筋）した正規化 SFEN を返す。手番・持駒はそのまま。"""
+    parts = sfen_norm.split(" ", 1)
+    mirrored = _join_board_cells([cells[::-1] for cells in _board_cells(parts[0])])
+    return mirrored if len(parts) == 1 else f"{mirrored} {parts[1]}"
+
+
 # ---------------------------------------------------------------------------
 # 内部インデックス
 # ---------------------------------------------------------------------------
@@ -130,12 +197,129 @@ class _ArticleEntry:
     sfen_full: str
 
 
+# ---------------------------------------------------------------------------
+# 類似検索用の特徴ベクトル
+# ---------------------------------------------------------------------------
+# 先後それぞれの玉を中心とした 5x5 窓を、玉の持ち主から見た向きに揃えて
+# 自駒/敵駒 × {金系, 銀, 小駒, 大駒} の 8 チャネルで one-hot 化する。
+# これに持駒とタグ（ハッシュで 16 バケットに畳む）を連結し L2 正規化する。
+# 内積 = コサイン類似度なので、top-k は行列積 1 回 + argpartition で済む。
+
+_WIN = 2
+_WIN_SIDE = 2 * _WIN + 1
+_PIECE_GROUP: Dict[str, int] = {
+    "G": 0, "+P": 0, "+L": 0, "+N": 0, "+S": 0,
+    "S": 1,
+    "P": 2, "L": 2, "N": 2,
+    "B": 3, "R": 3, "+B": 3, "+R": 3,
+}
+_N_GROUPS = 4
+_KING_BLOCK = _WIN_SIDE * _WIN_SIDE * _N_GROUPS * 2
+_HAND_KINDS = "RBGSNLP"
+_HAND_MAX = {"R": 2, "B": 2, "G": 4, "S": 4, "N": 4, "L": 4, "P": 18}
+_HAND_WEIGHT = 0.5
+_TAG_BUCKETS = 16
+_TAG_WEIGHT = 0.5
+FEATURE_DIM = _KING_BLOCK * 2 + len(_HAND_KINDS) * 2 + _TAG_BUCKETS
+
+
+def _parse_hands(hands: str) -> Dict[str, int]:
+    """SFEN 持駒 "2P3pB" → {"P": 2, "p": 3, "B": 1}（"-" は空）"""
+    out: Dict[str, int] = {}
+    if not hands or hands == "-":
+        return out
+    num = ""
+    for ch in hands:
+        if ch.isdigit():
+            num += ch
+            continue
+        out[ch] = out.get(ch, 0) + (int(num) if num else 1)
+        num = ""
+    return out
+
+
+def board_features(sfen_norm: str, tags: Optional[Sequence[str]] = None) -> "np.ndarray":
+    """正規化 SFEN（＋任意のタグ）から L2 正規化済みの特徴ベクトルを作る。"""
+    parts = sfen_norm.split()
+    rows = _board_cells(parts[0])
+    vec = np.zeros(FEATURE_DIM, dtype=np.float32)
+
+    for block, king in enumerate(("K", "k")):
+        pos = next(((x, y) for y in range(9) for x in range(9) if rows[y][x] == king), None)
+        if pos is None:
+            continue  # 詰将棋など片玉の局面
+        kx, ky = pos
+        # 後手玉は 180 度回転して「玉の持ち主から見た前方」を揃える
+        sign = 1 if king == "K" else -1
+        base = block * _KING_BLOCK
+        for dy in range(-_WIN, _WIN + 1):
+            for dx in range(-_WIN, _WIN + 1):
+                x, y = kx + dx * sign, ky + dy * sign
+                if not (0 <= x < 9 and 0 <= y < 9):
+                    continue
+                cell = rows[y][x]
+                group = _PIECE_GROUP.get(cell.upper()) if cell else None
+                if group is None:
+                    continue
+                own = cell[-1].isupper() == (king == "K")
+                cell_idx = (dy + _WIN) * _WIN_SIDE + (dx + _WIN)
+                vec[base + cell_idx * _N_GROUPS * 2 + (0 if own else _N_GROUPS) + group] = 1.0
+
+    offset = 2 * _KING_BLOCK
+    for ch, n in _parse_hands(parts[2] if len(parts) > 2 else "-").items():
+        kind = ch.upper()
+        if kind not in _HAND_MAX:
+            continue
+        side = 0 if ch.isupper() else 1
+        idx = offset + side * len(_HAND_KINDS) + _HAND_KINDS.index(kind)
+        vec[idx] = _HAND_WEIGHT * min(n, _HAND_MAX[kind]) / _HAND_MAX[kind]
+
+    offset += 2 * len(_HAND_KINDS)
+    for tag in tags or ():
+        bucket = zlib.crc32(str(tag).encode("utf-8")) % _TAG_BUCKETS
+        vec[offset + bucket] += _TAG_WEIGHT
+
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
 # グローバルインデックス（起動時に一度構築）
 _INDEX_BY_SFEN_NORM: Dict[str, _ArticleEntry] = {}
+_INDEX_BY_BOARD: Dict[str, List[_ArticleEntry]] = {}  # 盤面のみ（持駒・手番無視）
+_SIM_ENTRIES: List[_ArticleEntry] = []                # _SIM_MATRIX の行順
+_SIM_MATRIX = None                                    # np.ndarray (N, FEATURE_DIM) / numpy なしなら None
 _EXPLANATIONS_GOALS: Dict[str, str] = {}  # key → goal (LLM生成済みの場合のみ)
 _LOADED = False
 
 
+def _build_aux_indexes(entries: List[_ArticleEntry]) -> None:
+    """盤面のみインデックスと類似検索行列を構築する（失敗しても完全一致検索は生かす）"""
+    global _INDEX_BY_BOARD, _SIM_ENTRIES, _SIM_MATRIX
+
+    by_board: Dict[str, List[_ArticleEntry]] = {}
+    for entry in entries:
+        by_board.setdefault(board_key(entry.sfen_norm), []).append(entry)
+    _INDEX_BY_BOARD = by_board
+
+    if not HAS_NUMPY:
+        _LOG.info("[wkbk_db] numpy not available — similarity index disabled.")
+        return
+
+    rows: List["np.ndarray"] = []
+    sim_entries: List[_ArticleEntry] = []
+    for entry in entries:
+        try:
+            rows.append(board_features(entry.sfen_norm, entry.tags))
+            sim_entries.append(entry)
+        except Exception as e:
+            _LOG.debug("[wkbk_db] feature build failed for %s: %s", entry.key, e)
+    if rows:
+        _SIM_MATRIX = np.vstack(rows)
+        _SIM_ENTRIES = sim_entries
+
+
 def _load() -> None:
     global _LOADED, _INDEX_BY_SFEN_NORM, _EXPLANATIONS_GOALS
     if _LOADED:
@@ -152,6 +336,7 @@ def _load() -> None:
     count = 0
     skipped = 0
     index: Dict[str, _ArticleEntry] = {}
+    entries: List[_ArticleEntry] = []
 
     try:
         with articles_path.open("r", encoding="utf-8") as f:
@@ -199,6 +384,7 @@ def _load() -> None:
                 # 重複 SFEN は最初のエントリを優先（実際にはほぼない）
                 if sfen_norm not in index:
                     index[sfen_norm] = entry
+                entries.append(entry)
                 count += 1
 
     except Exception as e:
@@ -209,6 +395,11 @@ def _load() -> None:
     _INDEX_BY_SFEN_NORM = index
     _LOG.info("[wkbk_db] loaded %d articles, %d skipped.", count, skipped)
 
+    try:
+        _build_aux_indexes(entries)
+    except Exception as e:
+        _LOG.warning("[wkbk_db] failed to build auxiliary indexes: %s", e)
+
     # explanations（LLM生成済みの goal のみ読む）
     _load_explanations()
     _LOADED = True
@@ -245,6 +436,17 @@ def _load_explanations() -> None:
 # 公開 API
 # ---------------------------------------------------------------------------
 
+# 一致の種類ごとのスコア（explain 側はこれで採否・言い回しを決める）
+MATCH_SCORES: Dict[str, float] = {
+    "exact": 1.0,          # 盤面・持駒・手番すべて一致
+    "mirror": 0.95,        # 左右反転で完全一致
+    "board": 0.9,          # 盤面のみ一致（持駒・手番違い）
+    "mirror_board": 0.85,  # 左右反転で盤面のみ一致
+}
+# 類似検索はコサイン類似度にこの係数を掛ける（構造一致より必ず下になる）
+_SIMILAR_SCALE = 0.8
+
+
 @dataclass
 class WkbkDbResult:
     hit: bool
@@ -256,6 +458,8 @@ class WkbkDbResult:
     goal_summary: Optional[str] = None
     author: Optional[str] = None        # 投稿者名 (user.name)
     short_note: Optional[str] = None    # description の先頭N文字
+    match: Optional[str] = None         # exact / mirror / board / mirror_board / similar
+    score: float = 0.0                  # 一致度 0..1
 
     def to_dict(self) -> dict:
         return {
@@ -268,17 +472,35 @@ class WkbkDbResult:
             "goal_summary": self.goal_summary,
             "author": self.author,
             "short_note": self.short_note,
+            "match": self.match,
+            "score": self.score,
         }
 
 
 _NO_HIT = WkbkDbResult(hit=False)
 
 
+def _to_result(entry: _ArticleEntry, match: str, score: float) -> WkbkDbResult:
+    return WkbkDbResult(
+        hit=True,
+        key=entry.key,
+        lineage_key=entry.lineage_key,
+        tags=entry.tags,
+        difficulty=entry.difficulty,
+        category_hint=_lineage_hint(entry.lineage_key),
+        goal_summary=_EXPLANATIONS_GOALS.get(entry.key),
+        author=entry.author,
+        short_note=entry.short_note,
+        match=match,
+        score=round(float(score), 4),
+    )
+
+
 def lookup_by_sfen(sfen: str) -> WkbkDbResult:
     """
     SFEN 文字列で wkbk_articles を検索し、ヒット情報を返す。
 
-    - 完全一致（正規化後）が最優先
+    - 完全一致（正規化後）のみ。近い局面も欲しい場合は lookup() を使う
     - ヒット時は lineage_key / tags / difficulty / category_hint のみ返す
     - title など元テキストは著作権保護のため返さない
     - 落ちない設計: 例外は全て WkbkDbResult(hit=False) に degradeする
@@ -299,29 +521,85 @@ def lookup_by_sfen(sfen: str) -> WkbkDbResult:
         entry = _INDEX_BY_SFEN_NORM.get(sfen_norm)
         if entry is None:
             return _NO_HIT
-
-        goal_summary = _EXPLANATIONS_GOALS.get(entry.key)
-
-        return WkbkDbResult(
-            hit=True,
-            key=entry.key,
-            lineage_key=entry.lineage_key,
-            tags=entry.tags,
-            difficulty=entry.difficulty,
-            category_hint=_lineage_hint(entry.lineage_key),
-            goal_summary=goal_summary,
-            author=entry.author,
-            short_note=entry.short_note,
-        )
+        return _to_result(entry, "exact", MATCH_SCORES["exact"])
     except Exception as e:
         _LOG.warning("[wkbk_db] lookup_by_sfen error: %s", e)
         return _NO_HIT
 
 
+def _similar(sfen_norm: str, mirrored: str, k: int,
+             tags: Optional[Sequence[str]]) -> List[Tuple[_ArticleEntry, float]]:
+    """類似検索行列から top-k（左右反転も考慮）を返す"""
+    if _SIM_MATRIX is None or not _SIM_ENTRIES:
+        return []
+    q = board_features(sfen_norm, tags)
+    if not q.any():
+        return []
+    scores = _SIM_MATRIX @ q
+    if mirrored != sfen_norm:
+        np.maximum(scores, _SIM_MATRIX @ board_features(mirrored, tags), out=scores)
+    kk = min(k, len(scores))
+    top = np.argpartition(-scores, kk - 1)[:kk]
+    top = top[np.argsort(-scores[top])]
+    return [(_SIM_ENTRIES[i], float(scores[i])) for i in top if scores[i] > 0.0]
+
+
+def lookup(
+    sfen: str,
+    k: int = 3,
+    tags: Optional[Sequence[str]] = None,
+    min_score: float = 0.0,
+) -> List[WkbkDbResult]:
+    """
+    完全一致 → 左右反転 → 盤面のみ一致 → 類似局面 の順に探し、一致度の高い順に最大 k 件返す。
+
+    - 同じ記事が複数の経路でヒットした場合は最も高いスコアを採用する
+    - 構造一致で k 件埋まらなかったときだけ類似検索（行列積 1 回）を行う
+    - tags を渡すと類似検索でタグの近さも加味する
+    - 落ちない設計: 例外時は空リスト
+    """
+    if not sfen or k <= 0:
+        return []
+
+    _load()
+
+    try:
+        sfen_norm = normalize_sfen(sfen)
+        mirrored = mirror_sfen(sfen_norm)
+        best: Dict[str, Tuple[float, str, _ArticleEntry]] = {}
+
+        def _offer(entry: _ArticleEntry, match: str, score: float) -> None:
+            prev = best.get(entry.key)
+            if prev is None or score > prev[0]:
+                best[entry.key] = (score, match, entry)
+
+        for norm, exact_match, board_match in (
+            (sfen_norm, "exact", "board"),
+            (mirrored, "mirror", "mirror_board"),
+        ):
+            entry = _INDEX_BY_SFEN_NORM.get(norm)
+            if entry is not None:
+                _offer(entry, exact_match, MATCH_SCORES[exact_match])
+            for entry in _INDEX_BY_BOARD.get(board_key(norm), ()):
+                _offer(entry, board_match, MATCH_SCORES[board_match])
+
+        if len(best) < k:
+            for entry, sim in _similar(sfen_norm, mirrored, k, tags):
+                _offer(entry, "similar", sim * _SIMILAR_SCALE)
+
+        ranked = sorted(best.values(), key=lambda t: -t[0])
+        return [_to_result(e, m, sc) for sc, m, e in ranked if sc >= min_score][:k]
+    except Exception as e:
+        _LOG.warning("[wkbk_db] lookup error: %s", e)
+        return []
+
+
 def db_stats() -> dict:
     """デバッグ用: ロード済みエントリ数を返す"""
     _load()
     return {
         "articles_loaded": len(_INDEX_BY_SFEN_NORM),
+        "boards_indexed": len(_INDEX_BY_BOARD),
+        "similarity_rows": len(_SIM_ENTRIES),
         "explanations_loaded": len(_EXPLANATIONS_GOALS),
     }
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import jwt  # PyJWT (supabase の依存として入る)
+    HAS_JWT = True
+except Exception:  # pragma: no cover - 未導入環境では従来のリモート検証にフォールバック
+    jwt = None  # type: ignore[assignment]
+    HAS_JWT = False
+
+
+# Asymmetric algorithms accepted from a JWKS; the algorithm is taken from the
+# key, never from the token header, so a token cannot pick "none" or HS256.
+_ASYMMETRIC = {"RS256", "RS384", "RS512", "ES256", "ES384", "ES512", "EdDSA"}
+
+
+def _http_get_json(url: str) -> Dict[str, Any]:
+    import httpx
+
+    res = httpx.get(url, timeout=5.0)
+    res.raise_for_status()
+    return res.json()
+
+
+class JWKSCache:
+    """Signing keys of an issuer, fetched once and kept for `ttl_s`.
+
+    A token signed with an unknown `kid` triggers an early refresh (key
+    rotation), but at most once per `min_refresh_s`, so a flood of tokens
+    with made-up kids cannot turn into a flood of JWKS fetches. When a
+    refresh fails the previous keys stay in use.
+    """
+
+    def __init__(self, url: str, fetcher: Callable[[str], Dict[str, Any]] = _http_get_json,
+                 ttl_s: float = 600.0, min_refresh_s: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.url = url
+        self.ttl_s = ttl_s
+        self.min_refresh_s = min_refresh_s
+        self._fetcher = fetcher
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys: Dict[str, Any] = {}      # kid -> PyJWK
+        self._fetched_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._fetched_at is not None
+
+    def _refresh(self, now: float) -> None:
+        self._fetched_at = now   # also on failure: back off for min_refresh_s / ttl_s
+        try:
+            document = self._fetcher(self.url)
+        except Exception as e:
+            print(f"[auth] JWKS fetch failed ({self.url}): {e}")
+            return
+        keys: Dict[str, Any] = {}
+        for entry in (document or {}).get("keys", []):
+            if entry.get("use", "sig") != "sig":
+                continue
+            try:
+                key = jwt.PyJWK(entry)
+            except Exception:
+                continue   # unsupported key type; skip it rather than the whole set
+            if key.algorithm_name in _ASYMMETRIC:
+                keys[entry.get("kid") or ""] = key
+        if keys:
+            self._keys = keys
+
+    def get(self, kid: Optional[str], allow_fetch: bool = True):
+        """PyJWK for `kid` (None when unknown). allow_fetch=False never does I/O."""
+        kid = kid or ""
+        with self._lock:
+            now = self._clock()
+            if not allow_fetch:
+                return self._keys.get(kid)
+            age = None if self._fetched_at is None else now - self._fetched_at
+            if age is None or age >= self.ttl_s or (kid not in self._keys and age >= self.min_refresh_s):
+                self._refresh(now)
+            return self._keys.get(kid)
+
+
+class TokenVerifier:
+    """Verifies access tokens locally: signature, exp/nbf, issuer and audience."""
+
+    def __init__(self, jwks: Optional[JWKSCache] = None, hs256_secret: Optional[str] = None,
+                 issuer: Optional[str] = None, audience: Optional[str] = "authenticated",
+                 leeway_s: float = 30.0):
+        if not HAS_JWT:
+            raise RuntimeError("PyJWT is required for local token verification")
+        self.jwks = jwks
+        self.hs256_secret = hs256_secret
+        self.issuer = issuer
+        self.audience = audience
+        self.leeway_s = leeway_s
+
+    def can_check(self, token: str) -> bool:
+        """False for a well-formed token signed with an algorithm this verifier has no key for.
+
+        HS256 without SUPABASE_JWT_SECRET (a project still on the legacy secret)
+        or an asymmetric token without a JWKS: the caller falls back to the
+        remote check. Malformed tokens and other algorithms are rejected here.
+        """
+        try:
+            alg = jwt.get_unverified_header(token).get("alg")
+        except jwt.PyJWTError:
+            return True
+        if alg == "HS256":
+            return bool(self.hs256_secret)
+        if alg in _ASYMMETRIC:
+            return self.jwks is not None
+        return True
+
+    def verify(self, token: str, allow_fetch: bool = True) -> Optional[Dict[str, Any]]:
+        """Claims of a valid token, else None. allow_fetch=False: cached keys only."""
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError:
+            return None
+        alg = header.get("alg")
+        if alg == "HS256" and self.hs256_secret:
+            key, algorithm = self.hs256_secret, "HS256"
+        elif alg in _ASYMMETRIC and self.jwks is not None:
+            jwk = self.jwks.get(header.get("kid"), allow_fetch=allow_fetch)
+            if jwk is None:
+                return None
+            key, algorithm = jwk.key, jwk.algorithm_name
+        else:
+            return None
+        options = {"require": ["exp", "sub"], "verify_aud": self.audience is not None}
+        try:
+            return jwt.decode(token, key=key, algorithms=[algorithm], audience=self.audience,
+                              issuer=self.issuer, leeway=self.leeway_s, options=options)
+        except jwt.PyJWTError:
+            return None
+
+
+@lru_cache(maxsize=1)
+def get_token_verifier() -> Optional[TokenVerifier]:
+    """Verifier for the configured Supabase project (None: not configured / PyJWT missing).
+
+    SUPABASE_URL gives the JWKS (<url>/auth/v1/.well-known/jwks.json) and the
+    issuer (<url>/auth/v1); SUPABASE_JWT_SECRET enables legacy HS256 tokens.
+    SUPABASE_JWKS_URL / SUPABASE_JWT_ISSUER / SUPABASE_JWT_AUDIENCE override.
+    """
+    if not HAS_JWT or (os.getenv("SUPABASE_JWT_VERIFY", "local") or "local").lower() != "local":
+        return None
+    base = (os.getenv("SUPABASE_URL") or "").rstrip("/")
+    jwks_url = os.getenv("SUPABASE_JWKS_URL") or (f"{base}/auth/v1/.well-known/jwks.json" if base else "")
+    secret = os.getenv("SUPABASE_JWT_SECRET") or None
+    if not jwks_url and not secret:
+        return None
+    try:
+        ttl = float(os.getenv("JWKS_CACHE_TTL_S", "600") or "600")
+    except ValueError:
+        ttl = 600.0
+    issuer = os.getenv("SUPABASE_JWT_ISSUER") or (f"{base}/auth/v1" if base else None)
+    audience = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated") or None
+    return TokenVerifier(
+        jwks=JWKSCache(jwks_url, ttl_s=ttl) if jwks_url else None,
+        hs256_secret=secret,
+        issuer=issuer,
+        audience=audience,
+    )
+
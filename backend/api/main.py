@@ -17,6 +17,11 @@ from backend.api.services.ai_service import AIService
 from backend.api.auth import Principal, require_api_key, require_user
 from backend.api.middleware.rate_limit import RateLimitMiddleware
 from backend.api.tsume_data import TSUME_PROBLEMS
+from backend.services.engine_pool import EngineError
+from backend.services.mate_search import get_mate_service, shutdown_mate_service
+from backend.services.mate_solver import get_mate_solver
+from backend.services.tsume_table import get_tsume_table, tsume_response
+from backend.api.routers.ingest import router as ingest_router
 
 # ====== 設定 ======
 # NOTE:
@@ -35,6 +40,8 @@ print(f"[Config] Eval Dir:   {EVAL_DIR}")
 
 USI_BOOT_TIMEOUT = 10.0
 USI_GO_TIMEOUT = 20.0
+# 詰将棋の手を詰み探索で確かめるときの制限時間 (ms)
+TSUME_MATE_TIMEOUT_MS = int(os.getenv("TSUME_MATE_TIMEOUT_MS", "1000"))
 
 _MAIN_LOOP: Optional[asyncio.AbstractEventLoop] = None
 
@@ -48,11 +55,23 @@ async def _on_startup() -> None:
         batch_engine.ensure_alive(),
     )
     print("[App] Startup: Engines ready!")
+    # 前回の停止時に未完了だった注釈ジョブを再開する（完了済みファイルはマニフェストでスキップ）
+    try:
+        from backend.services.ingest_jobs import get_job_manager
+        get_job_manager()
+    except Exception as e:
+        print(f"[App] Startup: ingest job manager unavailable: {e}")
 
 
 async def _on_shutdown() -> None:
-    # 明示的 shutdown が無いので将来用のフックだけ用意
-    return
+    # 実行中の注釈ジョブは途中で止めて queued に戻す（次回起動時に再開）
+    from backend.services.ingest_jobs import shutdown_job_manager
+    await asyncio.to_thread(shutdown_job_manager)
+    # 詰み探索専用エンジンを止める
+    await asyncio.to_thread(shutdown_mate_service)
+    # バッファ中の学習回答を書き出す
+    from backend.learning.storage import close_storage
+    await asyncio.to_thread(close_storage)
 
 
 @asynccontextmanager
@@ -76,6 +95,7 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["Retry-After", "X-Digest-Source"],
 )
+app.include_router(ingest_router)
 
 # ====== テスト互換: 公開モデル ======
 class PVItem(BaseModel):
@@ -223,6 +243,15 @@ class BatchAnalysisRequest(BaseModel):
 
 class TsumePlayRequest(BaseModel):
     sfen: str
+    # 分かれば問題の手数から残り手数を決め、その範囲で詰まなければ不正解と判定できる
+    problem_id: Optional[int] = None
+    # 問題図からこの局面までに指された手数（直前の攻め方の手を含む）。省略時は SFEN の手数から求める
+    plies_played: Optional[int] = Field(None, ge=1)
+
+class MateRequest(BaseModel):
+    sfen: str
+    moves: Optional[List[str]] = None
+    timeout: int = Field(3000, description="探索の制限時間 (ms)")
 
 
 def _extract_moves_from_usi(usi: str) -> List[str]:
@@ -434,8 +463,7 @@ def digest_endpoint_compat(payload: Dict[str, Any]):
 
 
 # ====== テスト互換: learning ルート ======
-_LEARNING_SESSIONS: Dict[str, Dict[str, Any]] = {}
-_LEARNING_USERS: Dict[str, Dict[str, Any]] = {}
+# セッション・問題・回答・ユーザー集計は backend.learning.storage（SQLite, LEARNING_DB）に保存する
 
 
 def _phase_to_jp(phase: str) -> str:
@@ -447,17 +475,68 @@ def _phase_to_jp(phase: str) -> str:
     return "中盤"
 
 
-def _ensure_user(user_id: str) -> Dict[str, Any]:
-    uid = user_id or "guest"
-    if uid not in _LEARNING_USERS:
-        _LEARNING_USERS[uid] = {
-            "user_id": uid,
-            "total_score": 0,
-            "total_attempts": 0,
-            "correct_answers": 0,
-            "recent_improvements": ["学習を開始しました"],
-        }
-    return _LEARNING_USERS[uid]
+def _learning_progress(user_id: str) -> Dict[str, Any]:
+    from backend.learning.storage import get_storage
+
+    user = get_storage().get_user(user_id or "guest")
+    attempts = user.total_attempts
+    correct = user.correct_answers
+    acc = (correct / attempts) if attempts else 0.0
+    recent = ["学習を開始しました"] + [
+        "正解できました" if ok else "次は根拠を確認してみましょう" for ok in user.recent_results
+    ]
+    return {
+        "user_id": user.user_id,
+        "total_score": user.total_score,
+        "stats": {
+            "total_attempts": attempts,
+            "correct_answers": correct,
+            "accuracy": acc,
+        },
+        "recent_improvements": recent[-5:],
+    }
+
+
+def _learning_generate_from_bank(payload: Dict[str, Any], quiz_count: int, user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    注釈なしの出題は事前構築したクイズバンク（QUIZ_BANK_DB）から選ぶ。バンクが無ければ None。
+    復習期限の来た局面 → 苦手な局面段階・タグ → その他、の順（learning.scheduler）。
+    """
+    from backend.learning.quiz_bank import draw_for_user, get_quiz_bank
+    from backend.learning.storage import get_storage
+
+    bank = get_quiz_bank()
+    if bank is None:
+        return None
+    try:
+        difficulty = int(payload["difficulty"]) if payload.get("difficulty") else None
+    except (TypeError, ValueError):
+        difficulty = None
+    storage = get_storage()
+    picked = draw_for_user(bank, storage.scheduler, user_id, quiz_count, phase=payload.get("phase"),
+                           difficulty=difficulty, tag=payload.get("tag"), opening=payload.get("opening"),
+                           castle=payload.get("castle"))
+    if not picked:
+        return None
+
+    quizzes = []
+    for item in picked:
+        quiz = item.to_quiz()
+        storage.save_quiz(quiz)
+        quizzes.append({
+            "id": quiz.id,
+            "quiz_type": quiz.quiz_type.value,
+            "phase": quiz.phase.value,
+            "difficulty": quiz.difficulty,
+            "question": quiz.question,
+            "choices": quiz.choices,
+            "correct_answer": quiz.correct_answer,
+            "hint": quiz.hint,
+            "sfen": item.sfen,
+            "tags": item.tags,
+        })
+    session_id = storage.create_session([q["id"] for q in quizzes], user_id=user_id)
+    return {"session_id": session_id, "total_count": len(quizzes), "quizzes": quizzes}
 
 
 @app.post("/learning/generate", status_code=201)
@@ -468,17 +547,27 @@ def learning_generate(payload: Dict[str, Any]):
     quiz_count = int(payload.get("quiz_count") or 1)
     user_id = payload.get("user_id") or "guest"
 
-    _ensure_user(user_id)
-    session_id = str(uuid.uuid4())
+    if not notes:
+        banked = _learning_generate_from_bank(payload, quiz_count, user_id)
+        if banked is not None:
+            return banked
+
+    from backend.ingest.movegen import is_legal
+    from backend.learning.generator import note_position
+    from backend.learning.quiz_bank import legal_distractors
 
     quizzes: List[Dict[str, Any]] = []
-    for i in range(quiz_count):
-        note = notes[i] if i < len(notes) else {}
+    for i in range(quiz_count if notes else 0):
+        note = notes[i % len(notes)]
         reasoning = note.get("reasoning") or {}
         ctx = (reasoning.get("context") or {})
         phase_jp = _phase_to_jp(ctx.get("phase") or "")
 
+        # 選択肢は注釈の局面の合法手から作る。局面が分からない・推奨手が指せない注釈は飛ばす
         best = note.get("bestmove") or note.get("move") or ""
+        board = note_position(note, payload.get("usi"))
+        if board is None or not best or not is_legal(board, best):
+            continue
         # type cycle
         quiz_type = ["best_move", "evaluation", "principles"][i % 3]
         question = "この局面の最善手は？" if quiz_type == "best_move" else "次の一手として適切なのは？"
@@ -488,24 +577,10 @@ def learning_generate(payload: Dict[str, Any]):
         difficulty = 1
         if isinstance(delta, (int, float)):
             difficulty = min(5, max(1, int(abs(delta) // 40) + 1))
-        if not notes:
-            difficulty = 1
 
         # choices
         import uuid as _uuid
-        distractors = ["3c3d", "2g2f", "8c8d", "5i4h"]
-        pool = [best] + [d for d in distractors if d != best]
-        pool = (pool + distractors)[:4]
-        seen = set()
-        moves4 = []
-        for m in pool:
-            if m not in seen:
-                moves4.append(m)
-                seen.add(m)
-            if len(moves4) == 4:
-                break
-        while len(moves4) < 4:
-            moves4.append(distractors[len(moves4) % len(distractors)])
+        moves4 = [best] + legal_distractors(board, best, preferred=[note.get("move") or ""], seed=i)
 
         correct_choice_id = str(_uuid.uuid4())
         choices = []
@@ -535,20 +610,26 @@ def learning_generate(payload: Dict[str, Any]):
             "question": "この局面の最善手は？",
             "choices": [
                 {"id": "A", "move": "7g7f"},
-                {"id": "B", "move": "3c3d"},
-                {"id": "C", "move": "2g2f"},
-                {"id": "D", "move": "8c8d"},
+                {"id": "B", "move": "2g2f"},
+                {"id": "C", "move": "5i6h"},
+                {"id": "D", "move": "9g9f"},
             ],
             "correct_answer": "A",
         }]
 
     # store session
-    quiz_map = {q["id"]: q for q in quizzes}
-    _LEARNING_SESSIONS[session_id] = {
-        "session_id": session_id,
-        "user_id": user_id,
-        "quizzes": quiz_map,
-    }
+    from backend.learning.models import Quiz as LearningQuiz
+    from backend.learning.schemas import GamePhase, QuizType
+    from backend.learning.storage import get_storage
+
+    storage = get_storage()
+    for q in quizzes:
+        storage.save_quiz(LearningQuiz(
+            id=q["id"], question=q["question"], choices=q["choices"], correct_answer=q["correct_answer"],
+            hint=None, phase=GamePhase(q["phase"]), quiz_type=QuizType(q["quiz_type"]),
+            difficulty=q["difficulty"], source_move=q["choices"][0]["move"], source_reasoning={},
+        ))
+    session_id = storage.create_session([q["id"] for q in quizzes], user_id=user_id)
 
     # fallback detection (for tests)
     if not notes:
@@ -564,38 +645,38 @@ def learning_generate(payload: Dict[str, Any]):
 
 @app.post("/learning/submit")
 def learning_submit(payload: Dict[str, Any]):
+    from backend.learning.models import Attempt
+    from backend.learning.storage import get_storage
+
     session_id = payload.get("session_id")
     quiz_id = payload.get("quiz_id")
     answer = payload.get("answer")
     user_id = payload.get("user_id") or "guest"
 
-    session = _LEARNING_SESSIONS.get(session_id)
-    if not session:
+    storage = get_storage()
+    quiz_ids = storage.get_session_quizzes(session_id or "")
+    if not quiz_ids:
         raise HTTPException(status_code=404, detail="Session not found")
-    quiz = (session.get("quizzes") or {}).get(quiz_id)
+    quiz = storage.get_quiz(quiz_id) if quiz_id in quiz_ids else None
     if not quiz:
         raise HTTPException(status_code=404, detail="Quiz not found")
 
-    correct_id = quiz.get("correct_answer")
+    correct_id = quiz.correct_answer
     correct = (answer == correct_id)
 
     # lookup correct move
     correct_move = None
-    for c in (quiz.get("choices") or []):
+    for c in (quiz.choices or []):
         if c.get("id") == correct_id:
             correct_move = c.get("move")
             break
     correct_move = correct_move or ""
 
     score = 10 if correct else 0
-    user = _ensure_user(user_id)
-    user["total_attempts"] += 1
-    if correct:
-        user["correct_answers"] += 1
-        user["total_score"] += score
-        user["recent_improvements"].append("正解できました")
-    else:
-        user["recent_improvements"].append("次は根拠を確認してみましょう")
+    storage.save_attempt(Attempt(
+        id=str(uuid.uuid4()), user_id=user_id, quiz_id=quiz_id, session_id=session_id,
+        answer=str(answer), correct=correct, score=score, time_taken_ms=payload.get("time_taken_ms"),
+    ))
 
     return {
         "correct": correct,
@@ -608,38 +689,12 @@ def learning_submit(payload: Dict[str, Any]):
 
 @app.get("/learning/progress")
 def learning_progress_guest():
-    user = _ensure_user("guest")
-    attempts = user["total_attempts"]
-    correct = user["correct_answers"]
-    acc = (correct / attempts) if attempts else 0.0
-    return {
-        "user_id": user["user_id"],
-        "total_score": user["total_score"],
-        "stats": {
-            "total_attempts": attempts,
-            "correct_answers": correct,
-            "accuracy": acc,
-        },
-        "recent_improvements": user["recent_improvements"][-5:] or ["学習を開始しました"],
-    }
+    return _learning_progress("guest")
 
 
 @app.get("/learning/progress/{user_id}")
 def learning_progress_user(user_id: str):
-    user = _ensure_user(user_id)
-    attempts = user["total_attempts"]
-    correct = user["correct_answers"]
-    acc = (correct / attempts) if attempts else 0.0
-    return {
-        "user_id": user["user_id"],
-        "total_score": user["total_score"],
-        "stats": {
-            "total_attempts": attempts,
-            "correct_answers": correct,
-            "accuracy": acc,
-        },
-        "recent_improvements": user["recent_improvements"][-5:] or ["学習を開始しました"],
-    }
+    return _learning_progress(user_id)
 
 # ====== エンジン基底クラス ======
 class BaseEngine:
@@ -901,14 +956,11 @@ class EngineState(BaseEngine):
             print(f"[{self.name}] Escape: {bestmove}, Mate: {mate_found}")
             
             if bestmove == "resign":
-                return {"status": "win", "bestmove": "resign", "message": "正解！詰みました！"}
+                return tsume_response("win", "resign")
             elif bestmove == "win":
-                return {"status": "lose", "bestmove": "win", "message": "不正解：入玉されてしまいました"}
+                return tsume_response("lose", "win")
             else:
-                if mate_found:
-                    return {"status": "continue", "bestmove": bestmove, "message": "正解！"}
-                else:
-                    return {"status": "incorrect", "bestmove": bestmove, "message": "その手では詰みません"}
+                return tsume_response("continue" if mate_found else "incorrect", bestmove)
 
 # ====== バッチ用エンジン (常駐化対応) ======
 class BatchEngineState(EngineState):
@@ -1041,9 +1093,51 @@ def get_tsume_detail(problem_id: int):
         return {"error": "Problem not found"}
     return problem
 
+def _tsume_plies_left(problem: Optional[Dict[str, Any]], req: TsumePlayRequest) -> Optional[int]:
+    """問題の残り手数（受け方の応手を含む）。何手目か分からなければ None"""
+    if problem is None:
+        return None
+    played = req.plies_played
+    if played is None:
+        # SFEN の手数が問題図から進んでいればその差を使う（手数を 1 のまま送られると分からない）
+        from backend.ingest.board import Board
+        try:
+            played = Board.from_sfen(req.sfen).ply - Board.from_sfen(problem["sfen"]).ply
+        except ValueError:
+            return None
+        if played < 1:
+            return None
+    return max(0, problem["steps"] - played)
+
 @app.post("/api/tsume/play")
 async def tsume_play_endpoint(req: TsumePlayRequest, _principal: Principal = Depends(require_api_key)):
-    return await stream_engine.solve_tsume_hand(req.sfen)
+    # 問題の正解手順上の局面は事前計算表（python -m backend.services.tsume_table build）で即答する
+    problem = next((p for p in TSUME_PROBLEMS if p["id"] == req.problem_id), None)
+    plies_left = _tsume_plies_left(problem, req)
+    table = get_tsume_table()
+    reply = table.lookup(req.sfen, plies_left) if table is not None else None
+    if reply is not None:
+        return reply
+    # 短手数なら df-pn で解いてエンジンを使わずに答える（判定できなければエンジンへ）
+    solver = get_mate_solver()
+    if solver is not None:
+        try:
+            verdict = await asyncio.to_thread(solver.respond, req.sfen, plies_left)
+        except ValueError:
+            verdict = None
+        if verdict is not None:
+            return tsume_response(*verdict)
+    reply = await stream_engine.solve_tsume_hand(req.sfen)
+    bestmove = reply.get("bestmove")
+    if reply.get("status") in ("continue", "incorrect") and bestmove:
+        # 詰み筋かどうかは go nodes 2000 の評価値ではなく詰み探索（go mate）で確かめる
+        try:
+            mate = await asyncio.to_thread(get_mate_service().solve, req.sfen, [bestmove], TSUME_MATE_TIMEOUT_MS)
+        except (ValueError, EngineError):
+            mate = None
+        if mate is not None and mate.status in ("mate", "nomate"):
+            reply = tsume_response("continue" if mate.status == "mate" else "incorrect", bestmove)
+    return reply
 
 @app.post("/api/analysis/batch")
 async def batch_endpoint(
@@ -1111,12 +1205,105 @@ async def stream_endpoint(
 
     return StreamingResponse(generator(), media_type="text/event-stream")
 
+@app.get("/api/analytics/corpus")
+def corpus_analytics_endpoint(
+    player: Optional[str] = None,
+    top: int = 20,
+    min_moves: int = 1,
+    _principal: Principal = Depends(require_api_key),
+):
+    """KIFU_OUT 配下の注釈済み棋譜 (JSON / 列指向コーパス) の集計"""
+    from backend.services.corpus_analytics import cached_frame, corpus_report
+
+    out_dir = os.getenv("KIFU_OUT", "data/out")
+    if not os.path.isdir(out_dir):
+        raise HTTPException(status_code=404, detail="annotation output folder not found")
+    frame = cached_frame(out_dir)
+    return corpus_report(frame, player=player, top=max(1, min(top, 200)), min_moves=min_moves)
+
+@app.get("/api/positions/{sfen:path}/games")
+def position_games_endpoint(
+    sfen: str,
+    offset: int = 0,
+    limit: int = 50,
+    _principal: Principal = Depends(require_api_key),
+):
+    """
+    局面 (SFEN / "startpos"、後ろに "moves ..." も可) に到達したコーパス内の対局一覧。
+    索引は python -m backend.services.position_index build で作成する。
+    """
+    from dataclasses import asdict
+    from backend.services.position_index import cached_index, default_index_dir, parse_position
+
+    index_dir = os.getenv("POSITION_INDEX_DIR") or default_index_dir(os.getenv("KIFU_OUT", "data/out"))
+    if not os.path.isfile(os.path.join(index_dir, "meta.json")):
+        raise HTTPException(status_code=404, detail="position index not built")
+    try:
+        position_hash, normalized = parse_position(sfen)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid position: {e}")
+    page = cached_index(index_dir).find(position_hash, offset=max(0, offset),
+                                        limit=max(1, min(limit, 200)))
+    return {
+        "sfen": normalized,
+        "hash": page.hash,
+        "total_games": page.total_games,
+        "occurrences": page.occurrences,
+        "offset": page.offset,
+        "limit": page.limit,
+        "has_more": page.has_more,
+        "items": [asdict(m) for m in page.items],
+    }
+
+@app.get("/api/openings/{sfen:path}")
+def opening_explorer_endpoint(
+    sfen: str,
+    limit: int = 30,
+    _principal: Principal = Depends(require_api_key),
+):
+    """
+    定跡エクスプローラ: 局面から指された手ごとの対局数・勝敗・平均評価値 (先手視点)。
+    木は python -m backend.services.opening_explorer build で作成する。
+    """
+    from dataclasses import asdict
+    from backend.services.opening_explorer import cached_tree, default_tree_dir
+    from backend.services.position_index import parse_position
+
+    tree_dir = os.getenv("OPENING_TREE_DIR") or default_tree_dir(os.getenv("KIFU_OUT", "data/out"))
+    if not os.path.isfile(os.path.join(tree_dir, "meta.json")):
+        raise HTTPException(status_code=404, detail="opening tree not built")
+    try:
+        position_hash, normalized = parse_position(sfen)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid position: {e}")
+    tree = cached_tree(tree_dir)
+    node = tree.lookup(position_hash, limit=max(1, min(limit, 200)))
+    return {"sfen": normalized, "max_plies": tree.max_plies, **asdict(node)}
+
+@app.post("/api/internal/subscriptions/{user_id}/invalidate")
+def invalidate_subscription_endpoint(user_id: str, _principal: Principal = Depends(require_api_key)):
+    """
+    課金状態が変わったユーザーのサブスクリプションキャッシュを破棄する
+    （Stripe webhook 処理の後に呼ぶ想定。呼ばなくても SUBSCRIPTION_CACHE_TTL_S で失効する）。
+    """
+    from backend.api.subscriptions import invalidate_subscription
+
+    invalidate_subscription(user_id)
+    return {"invalidated": user_id}
+
 @app.post("/api/solve/mate")
-async def solve_mate_endpoint(req: MateRequest):
+async def solve_mate_endpoint(req: MateRequest, _principal: Principal = Depends(require_api_key)):
     """
-    詰み探索を実行するエンドポイント
+    詰み探索を実行するエンドポイント（解析用エンジンとは別の詰み探索専用プールで go mate）。
+    制限時間内に見つからなければ status "timeout" を返す。
     """
-    return await stream_engine.solve_mate(req.sfen, req.timeout)
+    try:
+        result = await asyncio.to_thread(get_mate_service().solve, req.sfen, req.moves or [], req.timeout)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid position: {e}")
+    except EngineError as e:
+        raise HTTPException(status_code=503, detail=f"mate engine unavailable: {e}")
+    return result.to_dict()
 
 if __name__ == "__main__":
     import uvicorn
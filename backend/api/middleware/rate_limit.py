@@ -1,13 +1,33 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import math
 import os
+import sqlite3
 import threading
 import time
-from typing import Dict, Tuple, Optional
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
 from starlette.responses import JSONResponse
 
 
+# Cost per request in tokens; routes not listed are not limited.
+# "<METHOD> <path>" matches the path itself and anything below it.
+DEFAULT_ROUTE_COSTS: Dict[str, float] = {
+    "POST /annotate": 1,
+    "POST /digest": 2,
+    "POST /api/explain": 2,
+    "POST /api/explain/digest": 2,
+    "POST /api/tsume/play": 2,
+    "POST /api/solve/mate": 3,
+    "GET /api/analysis/stream": 5,
+    "POST /api/analysis/batch": 10,
+    "POST /api/analysis/batch-stream": 10,
+}
+
+
 def _get_first_header(scope_headers, name_lower: bytes) -> Optional[str]:
     for k, v in scope_headers or []:
         if k.lower() == name_lower:
@@ -32,54 +52,236 @@ def _get_client_ip(scope) -> str:
     return "unknown"
 
 
+def default_rate_limit_key(scope) -> str:
+    """Bucket key: the authenticated principal, else the client IP.
+
+    Only credentials that can be checked here without I/O count as a principal
+    (a bearer token verified against already cached signing keys, a configured
+    API key); anything else falls back to the IP so a client cannot mint fresh
+    buckets by inventing credentials.
+    """
+    from backend.api.auth import _parse_bearer_token, get_configured_api_keys
+    from backend.api.jwt_verify import get_token_verifier
+
+    token = _parse_bearer_token(_get_first_header(scope.get("headers"), b"authorization"))
+    verifier = get_token_verifier() if token else None
+    if verifier is not None:
+        claims = verifier.verify(token, allow_fetch=False)
+        if claims:
+            return f"user:{claims['sub']}"
+
+    api_key = _get_first_header(scope.get("headers"), b"x-api-key")
+    if api_key and api_key in get_configured_api_keys():
+        # the key itself is a secret; keep only a digest in the store
+        return "key:" + hashlib.blake2b(api_key.encode("utf-8"), digest_size=8).hexdigest()
+    return "ip:" + _get_client_ip(scope)
+
+
+def parse_route_costs(raw: str) -> Dict[str, float]:
+    """'POST /api/analysis/batch=10, GET /api/analysis/stream=5' -> {route: cost}."""
+    costs: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        route, sep, cost = part.strip().rpartition("=")
+        fields = route.split()
+        if not sep or len(fields) != 2:
+            continue
+        try:
+            costs[f"{fields[0].upper()} {fields[1]}"] = float(cost)
+        except ValueError:
+            continue
+    return costs
+
+
+class MemoryBucketStore:
+    """Process-local buckets.
+
+    A bucket idle long enough to refill completely is indistinguishable from a
+    new one, so those are swept; beyond `max_keys` the least recently used
+    bucket is dropped as well, which keeps memory bounded under key churn.
+    """
+
+    # take() only holds an in-process lock: cheap enough to call on the event loop
+    blocking = False
+
+    def __init__(self, max_keys: int = 100_000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max(1, max_keys)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (tokens, updated_at); oldest update first
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> Tuple[bool, float, float]:
+        """Spend `cost` tokens. Returns (allowed, tokens_left, retry_after_s)."""
+        now = self._clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._evict(now, capacity, rate)
+        retry_after = 0.0 if allowed else (cost - tokens) / rate
+        return allowed, tokens, retry_after
+
+    def _evict(self, now: float, capacity: float, rate: float) -> None:
+        full_after = capacity / rate
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if now - updated < full_after and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite (WAL) file, shared by every worker process on the host.
+
+    Same contract as a Redis token-bucket script: each take() reads, refills
+    and writes one row inside a single write transaction, so concurrent
+    workers never double-spend a token. Timestamps are wall-clock seconds
+    because monotonic clocks are not comparable across processes.
+    take() can wait up to the 5s busy timeout for another worker's lock, so the
+    middleware runs it in a worker thread rather than on the event loop.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time, sweep_every: int = 1000):
+        self.path = path
+        self._clock = clock
+        self._sweep_every = max(1, sweep_every)
+        self._calls = 0
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets(updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> Tuple[bool, float, float]:
+        now = self._clock()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT INTO buckets(key, tokens, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+            self._calls += 1
+            if self._calls % self._sweep_every == 0:
+                conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - capacity / rate,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        retry_after = 0.0 if allowed else (cost - tokens) / rate
+        return allowed, tokens, retry_after
+
+
+def store_from_env() -> "MemoryBucketStore | SQLiteBucketStore":
+    """RATE_LIMIT_STORE: "memory" (default) or "sqlite:<path>" to share buckets across workers."""
+    spec = (os.getenv("RATE_LIMIT_STORE", "memory") or "memory").strip()
+    if spec.startswith("sqlite:"):
+        return SQLiteBucketStore(spec[len("sqlite:"):] or "data/rate_limit.sqlite3")
+    try:
+        max_keys = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000") or "100000")
+    except ValueError:
+        max_keys = 100_000
+    return MemoryBucketStore(max_keys=max_keys)
+
+
 class RateLimitMiddleware:
-    """In-memory, per-IP fixed-window rate limiter for /annotate.
+    """Token-bucket rate limiter keyed by principal (API key) or client IP.
 
-    Enabled only when RATE_LIMIT_PER_MINUTE > 0.
-    Designed to be swapped to Redis later.
+    Every client gets a bucket of RATE_LIMIT_BURST tokens (default: one
+    minute's worth) refilled at RATE_LIMIT_PER_MINUTE tokens per minute; a
+    request spends its route's cost (DEFAULT_ROUTE_COSTS, overridable with
+    RATE_LIMIT_COSTS="POST /api/analysis/batch=20,..."). Enabled only when
+    RATE_LIMIT_PER_MINUTE > 0.
     """
 
-    def __init__(self, app):
+    def __init__(self, app, store=None, costs: Optional[Dict[str, float]] = None,
+                 key_func: Optional[Callable[[dict], str]] = None):
         self.app = app
         try:
-            self.limit = int(os.getenv("RATE_LIMIT_PER_MINUTE", "0") or "0")
+            self.limit = float(os.getenv("RATE_LIMIT_PER_MINUTE", "0") or "0")
         except Exception:
             self.limit = 0
+        try:
+            self.burst = float(os.getenv("RATE_LIMIT_BURST", "0") or "0") or self.limit
+        except Exception:
+            self.burst = self.limit
+        self.rate = self.limit / 60.0
 
-        self._lock = threading.Lock()
-        # ip -> (window_start_epoch_sec, count)
-        self._state: Dict[str, Tuple[int, int]] = {}
+        if costs is None:
+            costs = {**DEFAULT_ROUTE_COSTS, **parse_route_costs(os.getenv("RATE_LIMIT_COSTS", ""))}
+        # longest route first so "/api/explain/digest" wins over "/api/explain"
+        self.costs: List[Tuple[str, str, float]] = sorted(
+            ((r.split(" ", 1)[0], r.split(" ", 1)[1], c) for r, c in costs.items() if " " in r),
+            key=lambda item: len(item[1]), reverse=True,
+        )
+        self.key_func = key_func or default_rate_limit_key
+        self._store = store
+
+    @property
+    def store(self):
+        if self._store is None:   # created on first use so a disabled limiter opens nothing
+            self._store = store_from_env()
+        return self._store
+
+    def cost_of(self, method: str, path: str) -> float:
+        for route_method, route_path, cost in self.costs:
+            if method == route_method and (path == route_path or path.startswith(route_path.rstrip("/") + "/")):
+                return cost
+        return 0.0
 
     async def __call__(self, scope, receive, send):
         if scope.get("type") != "http" or self.limit <= 0:
             return await self.app(scope, receive, send)
 
-        path = scope.get("path") or ""
-        method = (scope.get("method") or "").upper()
-
-        if not path.startswith("/annotate") or method != "POST":
+        cost = self.cost_of((scope.get("method") or "").upper(), scope.get("path") or "")
+        if cost <= 0:
             return await self.app(scope, receive, send)
 
-        ip = _get_client_ip(scope)
-        now = int(time.time())
-        window_start = now - (now % 60)
-
-        with self._lock:
-            prev = self._state.get(ip)
-            if prev is None or prev[0] != window_start:
-                self._state[ip] = (window_start, 1)
-                allowed = True
-            else:
-                count = prev[1] + 1
-                self._state[ip] = (window_start, count)
-                allowed = count <= self.limit
-
+        # a request costing more than the whole bucket would never pass
+        cost = min(cost, self.burst)
+        key = self.key_func(scope)
+        store = self.store
+        if getattr(store, "blocking", True):
+            allowed, _, retry_after = await asyncio.to_thread(store.take, key, cost, self.burst, self.rate)
+        else:
+            allowed, _, retry_after = store.take(key, cost, self.burst, self.rate)
         if allowed:
             return await self.app(scope, receive, send)
 
         res = JSONResponse(
             {"detail": "Rate limit exceeded"},
             status_code=429,
-            headers={"Retry-After": str((window_start + 60) - now)},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
         )
         return await res(scope, receive, send)
@@ -1,65 +1,193 @@
 """
 ingest.py
 
-API router stub for Kifu ingestion and batch annotation.
-This is a placeholder for future ingestion functionality.
+API router for Kifu ingestion and batch annotation.
+
+Folder annotation runs as a background job (backend.services.ingest_jobs):
+POST /ingest/annotate/folder returns a job id right away, and the job is
+followed by polling GET /ingest/jobs/{id} or by the SSE stream
+GET /ingest/jobs/{id}/events.
 """
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from backend.api.auth import Principal, require_api_key
+from backend.services.ingest_jobs import TERMINAL_STATUSES, JobQueueFull, get_job_manager
+
+SSE_POLL_INTERVAL_S = 0.5
+SSE_HEARTBEAT_S = 15.0
 
 
 # Request/Response models
 class FolderAnnotateRequest(BaseModel):
-    dir: Optional[str] = None  # Directory to process (defaults to KIFU_DIR)
+    dir: Optional[str] = None  # Directory to process: KIFU_DIR (default), relative to it, or in INGEST_ALLOWED_DIRS
     recursive: bool = True
-    byoyomi_ms: Optional[int] = None
+    byoyomi_ms: Optional[int] = Field(default=None, ge=10, le=60000)
     skip_validation: bool = False
+    out: Optional[str] = None  # Subfolder of KIFU_OUT for the outputs (defaults to KIFU_OUT)
+    workers: Optional[int] = Field(default=None, ge=1, le=64)
+    output_format: Optional[str] = Field(default=None, pattern="^(json|columnar)$")
+
 
+class JobResponse(BaseModel):
+    id: str
+    status: str
+    params: Dict[str, Any]
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    progress: Dict[str, Any]
+    summary: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
 
-class AnnotationSummaryResponse(BaseModel):
-    success: bool
-    message: str
+
+class JobListResponse(BaseModel):
+    jobs: List[JobResponse]
+    queued: int
 
 
 # Router setup
 router = APIRouter(prefix="/ingest", tags=["ingest"])
 
 
-@router.post("/annotate/folder", response_model=AnnotationSummaryResponse)
-async def annotate_folder(request: FolderAnnotateRequest):
+def _source_dir(path: Optional[str]) -> str:
+    """Input folder: KIFU_DIR, a path relative to it, or a path inside INGEST_ALLOWED_DIRS."""
+    base = os.path.realpath(os.getenv("KIFU_DIR", "data/kifu"))
+    if not path:
+        return base
+    roots = [base] + [os.path.realpath(p) for p in os.getenv("INGEST_ALLOWED_DIRS", "").split(os.pathsep) if p]
+    target = os.path.realpath(os.path.join(base, path))
+    if not any(os.path.commonpath([root, target]) == root for root in roots):
+        raise HTTPException(status_code=400, detail="dir must stay inside KIFU_DIR or INGEST_ALLOWED_DIRS")
+    return target
+
+
+def _output_dir(sub: Optional[str]) -> str:
+    base = os.path.abspath(os.getenv("KIFU_OUT", "data/out"))
+    if not sub:
+        return base
+    target = os.path.abspath(os.path.join(base, sub))
+    if os.path.commonpath([base, target]) != base:
+        raise HTTPException(status_code=400, detail="out must stay inside KIFU_OUT")
+    return target
+
+
+def _job_or_404(job_id: str) -> Dict[str, Any]:
+    snapshot = get_job_manager().snapshot(job_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return snapshot
+
+
+@router.post("/annotate/folder", response_model=JobResponse, status_code=202)
+def annotate_folder(request: FolderAnnotateRequest, _principal: Principal = Depends(require_api_key)):
     """
-    Batch annotate all Kifu files in a folder.
-    
-    Currently returns a stub response. Full implementation available
-    in feat/kifu-ingestion branch.
+    Queue a batch annotation of all Kifu files in a folder.
+
+    Returns 429 when the job queue is full.
     """
-    return AnnotationSummaryResponse(
-        success=False,
-        message="Kifu ingestion functionality is available in feat/kifu-ingestion branch. "
-                "Merge that branch to enable batch processing capabilities."
-    )
+    source_dir = _source_dir(request.dir)
+    if not os.path.isdir(source_dir):
+        raise HTTPException(status_code=400, detail=f"folder not found: {request.dir or source_dir}")
+    params = {
+        "dir": source_dir,
+        "out_dir": _output_dir(request.out),
+        "recursive": request.recursive,
+        "byoyomi_ms": request.byoyomi_ms,
+        "skip_validation": request.skip_validation,
+        "workers": request.workers,
+        "output_format": request.output_format,
+    }
+    try:
+        job = get_job_manager().submit(params)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return job.to_dict()
 
 
-@router.get("/folder/stats")
-async def get_folder_stats(dir: Optional[str] = None):
+@router.get("/jobs", response_model=JobListResponse)
+def list_jobs(status: Optional[str] = None, limit: int = 50, offset: int = 0,
+              _principal: Principal = Depends(require_api_key)):
+    """Job history, newest first."""
+    manager = get_job_manager()
+    jobs = manager.list(status=status, limit=max(1, min(limit, 500)), offset=max(0, offset))
+    return {"jobs": [j.to_dict() for j in jobs], "queued": manager.queued}
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: str, _principal: Principal = Depends(require_api_key)):
+    """Current status and progress (files done, plies/s, ETA) of a job."""
+    return _job_or_404(job_id)
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+def cancel_job(job_id: str, _principal: Principal = Depends(require_api_key)):
     """
-    Get statistics about a Kifu folder.
-    
-    Currently returns a stub response.
+    Cancel a job. A queued job is dropped; a running job finishes the files
+    in flight (they stay checkpointed) and then stops.
     """
-    return {
-        "success": False,
-        "message": "Kifu ingestion functionality is available in feat/kifu-ingestion branch."
-    }
+    if get_job_manager().cancel(job_id) is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return _job_or_404(job_id)
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, _principal: Principal = Depends(require_api_key)):
+    """
+    Server-Sent Events: a "progress" event whenever the job changes and a
+    final "end" event once it has finished.
+    """
+    first = _job_or_404(job_id)
+    manager = get_job_manager()
+
+    async def generator():
+        snapshot, version = first, None
+        idle = 0.0
+        while True:
+            if snapshot["version"] != version:
+                version = snapshot["version"]
+                snapshot.pop("version")
+                event = "end" if snapshot["status"] in TERMINAL_STATUSES else "progress"
+                yield f"event: {event}\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+                if event == "end":
+                    return
+                idle = 0.0
+            elif idle >= SSE_HEARTBEAT_S:
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(SSE_POLL_INTERVAL_S)
+            idle += SSE_POLL_INTERVAL_S
+            snapshot = manager.snapshot(job_id)
+            if snapshot is None:
+                return
+
+    return StreamingResponse(generator(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/folder/stats")
+def get_folder_stats(dir: Optional[str] = None, _principal: Principal = Depends(require_api_key)):
+    """File counts and sizes of a Kifu folder, without processing it."""
+    from backend.services.annotate_batch import BatchAnnotationService
+
+    return BatchAnnotationService(engine_pool=None).get_folder_stats(_source_dir(dir))
 
 
 @router.get("/providers")
 async def get_available_providers():
     """
     List available Kifu providers.
-    
+
     Currently returns a stub response.
     """
     return {
@@ -16,7 +16,7 @@ from backend.api.utils.shogi_explain_core import (
     render_rule_based_explanation,
 )
 
-from backend.api.db.wkbk_db import lookup_by_sfen
+from backend.api.db.wkbk_db import lookup as wkbk_lookup
 
 from backend.api.utils.ai_explain_json import (
     ExplainJson,
@@ -31,6 +31,10 @@ _LOG = logging.getLogger("uvicorn.error")
 _DIGEST_CACHE_TTL_SEC = int(os.getenv("DIGEST_CACHE_TTL_SEC", "600"))
 _DIGEST_CACHE: Dict[str, Dict[str, Any]] = {}
 
+# --- wkbk DB 参照: 一致度の下限（近似ヒットをどこまで explain に渡すか） ---
+_WKBK_MIN_MATCH_SCORE = float(os.getenv("WKBK_MIN_MATCH_SCORE", "0.6"))
+_WKBK_PROMPT_MIN_SCORE = 0.85  # プロンプトに入れるのは反転/盤面一致まで
+
 
 def _get_gemini_api_key() -> Optional[str]:
     k = os.getenv("GEMINI_API_KEY")
@@ -207,21 +211,23 @@ class AIService:
         # --- DB 参照（wkbk / shogi-extend 由来） ---
         sfen = (data.get("sfen") or "").strip()
         try:
-            db_result = lookup_by_sfen(sfen)
-            db_refs: Dict[str, Any] = {"hit": db_result.hit, "items": []}
-            if db_result.hit:
-                db_refs["items"] = [
-                    {
-                        "key": db_result.key,
-                        "lineage_key": db_result.lineage_key,
-                        "tags": db_result.tags,
-                        "difficulty": db_result.difficulty,
-                        "category_hint": db_result.category_hint,
-                        "goal_summary": db_result.goal_summary,
-                        "author": db_result.author,
-                        "short_note": db_result.short_note,
-                    }
-                ]
+            db_results = wkbk_lookup(sfen, k=3, min_score=_WKBK_MIN_MATCH_SCORE)
+            db_refs: Dict[str, Any] = {"hit": bool(db_results), "items": []}
+            db_refs["items"] = [
+                {
+                    "key": r.key,
+                    "lineage_key": r.lineage_key,
+                    "tags": r.tags,
+                    "difficulty": r.difficulty,
+                    "category_hint": r.category_hint,
+                    "goal_summary": r.goal_summary,
+                    "author": r.author,
+                    "short_note": r.short_note,
+                    "match": r.match,
+                    "score": r.score,
+                }
+                for r in db_results
+            ]
             payload["db_refs"] = db_refs
         except Exception as e:
             _LOG.debug("[ai_service] db_refs lookup failed (non-fatal): %s", e)
@@ -270,8 +276,9 @@ class AIService:
         # 著作権方針: タグ/カテゴリのみ渡す。元テキスト丸写し禁止。
         db_hint_block = ""
         try:
-            db_result = lookup_by_sfen(sfen)
-            if db_result.hit:
+            db_results = wkbk_lookup(sfen, k=1, min_score=_WKBK_PROMPT_MIN_SCORE)
+            if db_results:
+                db_result = db_results[0]
                 hint_lines = [f"- パターン種別: {db_result.category_hint} ({db_result.lineage_key})"]
                 if db_result.tags:
                     hint_lines.append(f"- タグ: {', '.join(db_result.tags)}")
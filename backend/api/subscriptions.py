@@ -1,14 +1,32 @@
 from __future__ import annotations
 
-from typing import Optional
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
 
 from backend.api.supabase_admin import get_supabase_admin_client
 
+# user_id -> (status, expires_at). Failed lookups are cached briefly too, so a
+# Supabase outage does not turn every request into another doomed query.
+_CACHE: Dict[str, Tuple[Optional[str], float]] = {}
+_CACHE_LOCK = threading.Lock()
+_CACHE_MAX = 50_000
+_ERROR_TTL_S = 5.0
 
-def get_subscription_status(user_id: str) -> Optional[str]:
+
+def _cache_ttl_s() -> float:
+    try:
+        return float(os.getenv("SUBSCRIPTION_CACHE_TTL_S", "60") or "0")
+    except ValueError:
+        return 60.0
+
+
+def _fetch_subscription_status(user_id: str) -> Tuple[Optional[str], bool]:
+    """(status, ok); ok=False when the query itself failed."""
     client = get_supabase_admin_client()
-    if client is None or not user_id:
-        return None
+    if client is None:
+        return None, True
     try:
         res = (
             client.table("user_subscriptions")
@@ -19,12 +37,43 @@ def get_subscription_status(user_id: str) -> Optional[str]:
         )
         data = getattr(res, "data", None) or []
         if isinstance(data, list) and data:
-            return data[0].get("status")
+            return data[0].get("status"), True
         if isinstance(data, dict):
-            return data.get("status")
-        return None
+            return data.get("status"), True
+        return None, True
     except Exception:
+        return None, False
+
+
+def get_subscription_status(user_id: str) -> Optional[str]:
+    """Subscription status, cached for SUBSCRIPTION_CACHE_TTL_S seconds (0 disables)."""
+    if not user_id:
         return None
+    ttl = _cache_ttl_s()
+    now = time.monotonic()
+    if ttl > 0:
+        with _CACHE_LOCK:
+            hit = _CACHE.get(user_id)
+            if hit is not None and hit[1] > now:
+                return hit[0]
+    status, ok = _fetch_subscription_status(user_id)
+    if ttl > 0:
+        with _CACHE_LOCK:
+            if len(_CACHE) >= _CACHE_MAX:
+                # drop expired entries; if everything is live, start over
+                for key in [k for k, (_, exp) in _CACHE.items() if exp <= now] or list(_CACHE):
+                    del _CACHE[key]
+            _CACHE[user_id] = (status, now + (ttl if ok else min(ttl, _ERROR_TTL_S)))
+    return status
+
+
+def invalidate_subscription(user_id: Optional[str] = None) -> None:
+    """Forget the cached status of one user (after a billing change), or of everyone."""
+    with _CACHE_LOCK:
+        if user_id is None:
+            _CACHE.clear()
+        else:
+            _CACHE.pop(user_id, None)
 
 
 def is_pro_user(user_id: str) -> bool:
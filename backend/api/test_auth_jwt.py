@@ -0,0 +1,193 @@
+import json
+import time
+
+import pytest
+
+jwt = pytest.importorskip("jwt")
+pytest.importorskip("cryptography")
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from starlette.requests import Request
+
+from backend.api import auth, subscriptions
+from backend.api.jwt_verify import JWKSCache, TokenVerifier
+from backend.api.middleware.rate_limit import default_rate_limit_key
+
+ISSUER = "https://example.supabase.co/auth/v1"
+
+
+class LocalIssuer:
+    """Stand-in for the Supabase auth server: signs tokens and serves its JWKS."""
+
+    def __init__(self):
+        self.keys = {}
+        self.fetches = 0
+        self.rotate()
+
+    def rotate(self):
+        self.kid = f"k{len(self.keys) + 1}"
+        self.keys[self.kid] = ec.generate_private_key(ec.SECP256R1())
+
+    def jwks(self, _url):
+        self.fetches += 1
+        docs = []
+        for kid, key in self.keys.items():
+            jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(key.public_key()))
+            docs.append({**jwk, "kid": kid, "alg": "ES256", "use": "sig"})
+        return {"keys": docs}
+
+    def token(self, sub="user-1", kid=None, **overrides):
+        claims = {"sub": sub, "aud": "authenticated", "iss": ISSUER, "exp": int(time.time()) + 3600}
+        claims.update(overrides)
+        kid = kid or self.kid
+        return jwt.encode(claims, self.keys[kid], algorithm="ES256", headers={"kid": kid})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def issuer():
+    return LocalIssuer()
+
+
+def _verifier(issuer, clock=None):
+    cache = JWKSCache("https://example.supabase.co/jwks", fetcher=issuer.jwks, clock=clock or FakeClock())
+    return TokenVerifier(jwks=cache, issuer=ISSUER)
+
+
+def test_verifies_signature_and_claims(issuer):
+    verifier = _verifier(issuer)
+    assert verifier.verify(issuer.token())["sub"] == "user-1"
+
+    for bad in (
+        issuer.token(exp=int(time.time()) - 3600),
+        issuer.token(aud="someone-else"),
+        issuer.token(iss="https://evil.example/auth/v1"),
+        issuer.token()[:-4] + "AAAA",
+        jwt.encode({"sub": "x", "exp": int(time.time()) + 60}, None, algorithm="none"),
+        # HS256 "signed" with the public key: rejected without a configured secret
+        jwt.encode({"sub": "x", "aud": "authenticated", "iss": ISSUER, "exp": int(time.time()) + 60},
+                   "public-key-bytes-" * 4, algorithm="HS256", headers={"kid": issuer.kid}),
+        "not a token",
+    ):
+        assert verifier.verify(bad) is None
+    assert issuer.fetches == 1
+
+    hs = TokenVerifier(hs256_secret="s3cret" * 8, issuer=ISSUER)
+    token = jwt.encode({"sub": "u", "aud": "authenticated", "iss": ISSUER, "exp": int(time.time()) + 60},
+                       "s3cret" * 8, algorithm="HS256")
+    assert hs.verify(token)["sub"] == "u"
+
+
+def test_key_rotation_and_refresh_backoff(issuer):
+    clock = FakeClock()
+    verifier = _verifier(issuer, clock)
+    assert verifier.verify(issuer.token())
+    issuer.rotate()
+
+    # a new kid inside the back-off window is not fetched yet
+    assert verifier.verify(issuer.token()) is None
+    for _ in range(20):
+        verifier.verify(issuer.token(kid=issuer.kid)[:-2] + "xx")
+    assert issuer.fetches == 1
+
+    clock.now += 31
+    assert verifier.verify(issuer.token())["sub"] == "user-1"
+    assert verifier.verify(issuer.token(kid="k1"))           # the old key is still published
+    assert issuer.fetches == 2
+
+    # cached keys only: nothing is fetched, unknown kids fail
+    cold = _verifier(issuer, clock)
+    assert cold.verify(issuer.token(), allow_fetch=False) is None
+    assert issuer.fetches == 2
+
+
+def _request(headers):
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": b"",
+             "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+             "client": ("10.0.0.1", 1234)}
+    return Request(scope), scope
+
+
+def test_principal_without_network(issuer, monkeypatch):
+    verifier = _verifier(issuer)
+    monkeypatch.setattr(auth, "get_token_verifier", lambda: verifier)
+    monkeypatch.setattr("backend.api.jwt_verify.get_token_verifier", lambda: verifier)
+
+    def no_network(_token):
+        raise AssertionError("remote claims lookup on the hot path")
+
+    monkeypatch.setattr(auth, "_get_supabase_claims_remote", no_network)
+    lookups = []
+
+    def fetch(user_id):
+        lookups.append(user_id)
+        return "active", True
+
+    monkeypatch.setattr(subscriptions, "_fetch_subscription_status", fetch)
+    monkeypatch.setenv("SUBSCRIPTION_CACHE_TTL_S", "60")
+    subscriptions.invalidate_subscription()
+
+    token = issuer.token()
+    for _ in range(3):
+        request, _ = _request({"Authorization": f"Bearer {token}"})
+        principal = auth.get_principal_from_request(request, authorization=f"Bearer {token}")
+        assert (principal.scheme, principal.subject, principal.is_pro) == ("supabase", "user-1", True)
+    assert lookups == ["user-1"]
+
+    subscriptions.invalidate_subscription("user-1")
+    assert subscriptions.is_pro_user("user-1") and lookups == ["user-1", "user-1"]
+
+    forged, _ = _request({})
+    assert auth.get_principal_from_request(forged, authorization="Bearer forged.token.x").scheme == "none"
+
+    # the rate limiter keys verified users by subject, everyone else by IP
+    _, scope = _request({"Authorization": f"Bearer {token}"})
+    assert default_rate_limit_key(scope) == "user:user-1"
+    _, scope = _request({"Authorization": "Bearer forged.token.x"})
+    assert default_rate_limit_key(scope) == "ip:10.0.0.1"
+    subscriptions.invalidate_subscription()
+
+
+def test_legacy_hs256_tokens_fall_back_to_remote(issuer, monkeypatch):
+    # SUPABASE_URL set, SUPABASE_JWT_SECRET not: HS256 tokens cannot be checked locally
+    verifier = _verifier(issuer)
+    monkeypatch.setattr(auth, "get_token_verifier", lambda: verifier)
+    remote = []
+
+    def remote_claims(token):
+        remote.append(token)
+        return {"sub": "legacy-user"}
+
+    monkeypatch.setattr(auth, "_get_supabase_claims_remote", remote_claims)
+    legacy = jwt.encode({"sub": "legacy-user", "aud": "authenticated", "exp": int(time.time()) + 60},
+                        "legacy-secret" * 4, algorithm="HS256")
+    assert auth._get_supabase_claims(legacy) == {"sub": "legacy-user"} and remote == [legacy]
+
+    # tokens the verifier can judge never leave the process
+    assert auth._get_supabase_claims(issuer.token())["sub"] == "user-1"
+    assert auth._get_supabase_claims("forged.token.x") is None
+    assert remote == [legacy]
+
+
+def test_failed_subscription_lookup_is_cached_briefly(monkeypatch):
+    calls = []
+
+    def fetch(user_id):
+        calls.append(user_id)
+        return None, False
+
+    monkeypatch.setattr(subscriptions, "_fetch_subscription_status", fetch)
+    monkeypatch.setenv("SUBSCRIPTION_CACHE_TTL_S", "60")
+    subscriptions.invalidate_subscription()
+    assert not subscriptions.is_pro_user("u") and not subscriptions.is_pro_user("u")
+    assert calls == ["u"]
+    expires = subscriptions._CACHE["u"][1] - time.monotonic()
+    assert 0 < expires <= subscriptions._ERROR_TTL_S
+    subscriptions.invalidate_subscription()
@@ -95,10 +95,11 @@ def test_pv_reason_capture_event(monkeypatch):
 
     monkeypatch.setattr(api_main.engine, "analyze", fake_analyze)
 
-    resp = client.post("/annotate", json={"usi": "startpos moves 7g7f", "options": {"explain_level": "advanced"}})
+    # the PV is legal before the third move (7g7f 3c3d opened the bishops' diagonal)
+    resp = client.post("/annotate", json={"usi": "startpos moves 7g7f 3c3d 2g2f", "options": {"explain_level": "advanced"}})
     assert resp.status_code == 200
     data = resp.json()
-    pv_reason = data["notes"][0]["evidence"].get("pv_reason")
+    pv_reason = data["notes"][2]["evidence"].get("pv_reason")
     assert pv_reason
     events = pv_reason.get("events") or []
     # At least one capture event present
@@ -0,0 +1,119 @@
+import threading
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from backend.api.middleware.rate_limit import (
+    MemoryBucketStore, RateLimitMiddleware, SQLiteBucketStore, parse_route_costs,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _client(monkeypatch, per_minute="60", burst="", costs=None, store=None):
+    monkeypatch.setenv("RATE_LIMIT_PER_MINUTE", per_minute)
+    monkeypatch.setenv("RATE_LIMIT_BURST", burst)
+    monkeypatch.setenv("API_KEYS", "k1,k2")
+
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    inner = Starlette(routes=[Route("/annotate", ok, methods=["POST"]),
+                              Route("/api/analysis/batch", ok, methods=["POST"]),
+                              Route("/health", ok)])
+    app = RateLimitMiddleware(inner, store=store, costs=costs)
+    return TestClient(app), app
+
+
+def test_bucket_refills_over_time():
+    clock = FakeClock()
+    store = MemoryBucketStore(clock=clock)
+    assert [store.take("a", 1, 3, 1.0)[0] for _ in range(4)] == [True, True, True, False]
+    allowed, _, retry = store.take("a", 2, 3, 1.0)
+    assert not allowed and retry == 2.0
+    clock.now += 2
+    assert store.take("a", 2, 3, 1.0)[0]
+    clock.now += 100                       # refill is capped at the capacity
+    assert store.take("a", 3, 3, 1.0)[0] and not store.take("a", 1, 3, 1.0)[0]
+
+
+def test_memory_store_evicts_idle_and_caps_keys():
+    clock = FakeClock()
+    store = MemoryBucketStore(max_keys=3, clock=clock)
+    for key in "abc":
+        store.take(key, 1, 10, 1.0)
+    store.take("d", 1, 10, 1.0)
+    assert len(store) == 3                 # "a" was the least recently used
+    clock.now += 11                        # every bucket is full again: nothing to remember
+    store.take("e", 1, 10, 1.0)
+    assert len(store) == 1
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / "rl.sqlite3")
+    first = SQLiteBucketStore(path, clock=clock, sweep_every=1)
+    second = SQLiteBucketStore(path, clock=clock)
+    assert first.take("a", 2, 3, 1.0)[0]
+    assert not second.take("a", 2, 3, 1.0)[0]   # the other worker sees the spent tokens
+    clock.now += 1
+    assert second.take("a", 2, 3, 1.0)[0]
+    clock.now += 10
+    first.take("b", 1, 3, 1.0)                  # sweep drops the idle "a"
+    assert len(second) == 1
+
+
+def test_sqlite_store_runs_off_the_event_loop(monkeypatch, tmp_path):
+    threads = {}
+
+    class RecordingStore(SQLiteBucketStore):
+        def take(self, *args):
+            threads["take"] = threading.get_ident()
+            return super().take(*args)
+
+    async def ok(request):
+        threads["loop"] = threading.get_ident()
+        return PlainTextResponse("ok")
+
+    monkeypatch.setenv("RATE_LIMIT_PER_MINUTE", "60")
+    inner = Starlette(routes=[Route("/annotate", ok, methods=["POST"])])
+    app = RateLimitMiddleware(inner, store=RecordingStore(str(tmp_path / "rl.sqlite3")))
+    assert TestClient(app).post("/annotate").status_code == 200
+    assert threads["take"] != threads["loop"]
+
+
+def test_route_costs_and_keys(monkeypatch):
+    client, app = _client(monkeypatch, per_minute="60", burst="10")
+    assert app.cost_of("POST", "/api/analysis/batch") == 10
+    assert app.cost_of("GET", "/health") == 0
+
+    assert client.post("/api/analysis/batch").status_code == 200
+    res = client.post("/annotate")
+    assert res.status_code == 429 and int(res.headers["Retry-After"]) == 1
+    # unlimited routes and other principals are unaffected
+    assert all(client.get("/health").status_code == 200 for _ in range(20))
+    assert client.post("/annotate", headers={"X-API-Key": "k1"}).status_code == 200
+    # an unknown key is not a principal: it shares the IP's empty bucket
+    assert client.post("/annotate", headers={"X-API-Key": "bogus"}).status_code == 429
+
+
+def test_disabled_and_cost_overrides(monkeypatch):
+    client, _ = _client(monkeypatch, per_minute="0")
+    assert all(client.post("/api/analysis/batch").status_code == 200 for _ in range(5))
+
+    assert parse_route_costs("post /api/analysis/batch=3, GET /x = 1.5, junk, =2") == {
+        "POST /api/analysis/batch": 3.0, "GET /x": 1.5,
+    }
+    client, _ = _client(monkeypatch, per_minute="60", burst="5",
+                        costs={"POST /api/analysis": 3}, store=MemoryBucketStore())
+    assert client.post("/api/analysis/batch").status_code == 200    # prefix match
+    assert client.post("/api/analysis/batch").status_code == 429
+    assert client.post("/annotate").status_code == 200              # not in the override table
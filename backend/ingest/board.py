@@ -0,0 +1,366 @@
+"""
+board.py
+
+Compact shogi board used by the ingest parsers (KIF/CSA -> USI).
+
+Squares are a flat list of 81 ints in SFEN order (rank a..i, file 9..1):
+
+    sq = (rank - 1) * 9 + (9 - file)        # "9a" -> 0, "1a" -> 8, "1i" -> 80
+
+A piece is its kind (1..15) with WHITE_FLAG set for gote pieces; 0 is empty.
+Promoted kinds are the base kind + PROMOTED, so unpromoting is a subtraction.
+Hands are per-color count lists indexed by (unpromoted) kind.
+
+The board only checks what a converter needs to stay honest (right color on
+the source square, piece in hand, no self-capture, promotion zone); it does
+not look for checks or pins.
+"""
+
+from typing import List, Optional, Tuple
+
+BLACK, WHITE = 0, 1  # 先手 / 後手
+
+PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK, KING = range(1, 9)
+PROMOTED = 8
+PRO_PAWN, PRO_LANCE, PRO_KNIGHT, PRO_SILVER = 9, 10, 11, 12
+HORSE, DRAGON = 14, 15
+KIND_MASK = 15
+WHITE_FLAG = 16
+
+PROMOTABLE = frozenset((PAWN, LANCE, KNIGHT, SILVER, BISHOP, ROOK))
+HAND_KINDS = (ROOK, BISHOP, GOLD, SILVER, KNIGHT, LANCE, PAWN)  # SFEN 持駒の並び順
+
+STARTPOS_SFEN = "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+
+SFEN_TO_KIND = {"P": PAWN, "L": LANCE, "N": KNIGHT, "S": SILVER,
+                "G": GOLD, "B": BISHOP, "R": ROOK, "K": KING}
+KIND_TO_SFEN = {v: k for k, v in SFEN_TO_KIND.items()}
+KIND_TO_SFEN.update({k + PROMOTED: "+" + KIND_TO_SFEN[k] for k in PROMOTABLE})
+
+USI_SQUARES: List[str] = [f"{9 - (sq % 9)}{chr(97 + sq // 9)}" for sq in range(81)]
+_USI_TO_SQ = {name: sq for sq, name in enumerate(USI_SQUARES)}
+
+
+class IllegalMoveError(ValueError):
+    """A move that cannot be played on the current board."""
+
+
+def square(file: int, rank: int) -> int:
+    """(file 1..9, rank 1..9) -> square index"""
+    return (rank - 1) * 9 + (9 - file)
+
+
+def square_file(sq: int) -> int:
+    return 9 - (sq % 9)
+
+
+def square_rank(sq: int) -> int:
+    return sq // 9 + 1
+
+
+def usi_square(sq: int) -> str:
+    return USI_SQUARES[sq]
+
+
+def parse_usi_square(name: str) -> int:
+    try:
+        return _USI_TO_SQ[name]
+    except KeyError:
+        raise IllegalMoveError(f"bad square: {name!r}") from None
+
+
+def piece_color(piece: int) -> int:
+    return piece >> 4
+
+
+def piece_kind(piece: int) -> int:
+    return piece & KIND_MASK
+
+
+def unpromote(kind: int) -> int:
+    return kind - PROMOTED if kind > KING else kind
+
+
+def in_promotion_zone(sq: int, color: int) -> bool:
+    row = sq // 9
+    return row <= 2 if color == BLACK else row >= 6
+
+
+# ---------------------------------------------------------------------------
+# Piece geometry, from black's point of view: (d_col, d_row) where col grows
+# toward file 1 and row grows toward rank i, so "forward" for black is d_row=-1.
+# ---------------------------------------------------------------------------
+
+_GOLD_STEPS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (0, 1))
+_DIAG = ((-1, -1), (1, -1), (-1, 1), (1, 1))
+_ORTHO = ((0, -1), (-1, 0), (1, 0), (0, 1))
+
+STEPS = {
+    PAWN: ((0, -1),),
+    KNIGHT: ((-1, -2), (1, -2)),
+    SILVER: ((-1, -1), (0, -1), (1, -1), (-1, 1), (1, 1)),
+    GOLD: _GOLD_STEPS,
+    PRO_PAWN: _GOLD_STEPS,
+    PRO_LANCE: _GOLD_STEPS,
+    PRO_KNIGHT: _GOLD_STEPS,
+    PRO_SILVER: _GOLD_STEPS,
+    KING: _DIAG + _ORTHO,
+    HORSE: _ORTHO,
+    DRAGON: _DIAG,
+}
+SLIDES = {
+    LANCE: ((0, -1),),
+    BISHOP: _DIAG,
+    ROOK: _ORTHO,
+    HORSE: _DIAG,
+    DRAGON: _ORTHO,
+}
+
+
+def _slide_count(dc: int, dr: int, ux: int, uy: int) -> int:
+    """Number of (ux, uy) steps that make (dc, dr), or 0 if not on that ray."""
+    if ux == 0:
+        if dc != 0 or uy == 0:
+            return 0
+        n = dr // uy
+        return n if n > 0 and n * uy == dr else 0
+    n = dc // ux
+    if n <= 0 or n * ux != dc or n * uy != dr:
+        return 0
+    return n
+
+
+class Board:
+    """Mutable position: squares, hands, side to move and ply number."""
+
+    __slots__ = ("squares", "hands", "turn", "ply")
+
+    def __init__(self) -> None:
+        self.squares: List[int] = [0] * 81
+        self.hands: List[List[int]] = [[0] * 9, [0] * 9]
+        self.turn: int = BLACK
+        self.ply: int = 1
+
+    # ---- construction ----------------------------------------------------
+
+    @classmethod
+    def from_sfen(cls, sfen: Optional[str] = None) -> "Board":
+        """
+        Build a board from an SFEN string. Accepts "startpos", None,
+        "position sfen ...", "sfen ..." and a bare SFEN; a trailing
+        "moves ..." part is ignored.
+        """
+        text = (sfen or "startpos").strip()
+        if text.startswith("position "):
+            text = text[len("position "):].lstrip()
+        if text.startswith("startpos"):
+            text = STARTPOS_SFEN
+        elif text.startswith("sfen "):
+            text = text[len("sfen "):]
+        parts = text.split(" moves", 1)[0].split()
+        if len(parts) < 3:
+            raise ValueError(f"bad SFEN: {sfen!r}")
+
+        board = cls()
+        ranks = parts[0].split("/")
+        if len(ranks) != 9:
+            raise ValueError(f"bad SFEN board: {parts[0]!r}")
+        sq = 0
+        for rank in ranks:
+            row_end = sq + 9
+            promoted = False
+            for ch in rank:
+                if ch.isdigit():
+                    sq += int(ch)
+                elif ch == "+":
+                    promoted = True
+                else:
+                    kind = SFEN_TO_KIND.get(ch.upper())
+                    if kind is None or sq >= row_end:
+                        raise ValueError(f"bad SFEN board: {parts[0]!r}")
+                    if promoted:
+                        if kind not in PROMOTABLE:
+                            raise ValueError(f"bad SFEN board: {parts[0]!r}")
+                        kind += PROMOTED
+                    board.squares[sq] = kind | (WHITE_FLAG if ch.islower() else 0)
+                    sq += 1
+                    promoted = False
+            if sq != row_end:
+                raise ValueError(f"bad SFEN board: {parts[0]!r}")
+
+        if parts[1] not in ("b", "w"):
+            raise ValueError(f"bad SFEN turn: {parts[1]!r}")
+        board.turn = BLACK if parts[1] == "b" else WHITE
+
+        if parts[2] != "-":
+            count = 0
+            for ch in parts[2]:
+                if ch.isdigit():
+                    count = count * 10 + int(ch)
+                    continue
+                kind = SFEN_TO_KIND.get(ch.upper())
+                if kind is None or kind == KING:
+                    raise ValueError(f"bad SFEN hands: {parts[2]!r}")
+                board.hands[WHITE if ch.islower() else BLACK][kind] += count or 1
+                count = 0
+
+        if len(parts) > 3 and parts[3].isdigit():
+            board.ply = int(parts[3])
+        return board
+
+    def copy(self) -> "Board":
+        other = Board.__new__(Board)
+        other.squares = self.squares[:]
+        other.hands = [self.hands[0][:], self.hands[1][:]]
+        other.turn = self.turn
+        other.ply = self.ply
+        return other
+
+    # ---- serialization ---------------------------------------------------
+
+    def board_sfen(self) -> str:
+        rows = []
+        for r in range(9):
+            out = []
+            empty = 0
+            for piece in self.squares[r * 9:r * 9 + 9]:
+                if not piece:
+                    empty += 1
+                    continue
+                if empty:
+                    out.append(str(empty))
+                    empty = 0
+                name = KIND_TO_SFEN[piece & KIND_MASK]
+                out.append(name.lower() if piece & WHITE_FLAG else name)
+            if empty:
+                out.append(str(empty))
+            rows.append("".join(out))
+        return "/".join(rows)
+
+    def hands_sfen(self) -> str:
+        out = []
+        for color in (BLACK, WHITE):
+            hand = self.hands[color]
+            for kind in HAND_KINDS:
+                n = hand[kind]
+                if n:
+                    name = KIND_TO_SFEN[kind]
+                    out.append((str(n) if n > 1 else "") + (name.lower() if color else name))
+        return "".join(out) or "-"
+
+    def sfen(self, with_ply: bool = True) -> str:
+        s = f"{self.board_sfen()} {'b' if self.turn == BLACK else 'w'} {self.hands_sfen()}"
+        return f"{s} {self.ply}" if with_ply else s
+
+    # ---- geometry --------------------------------------------------------
+
+    def reaches(self, from_sq: int, to_sq: int) -> bool:
+        """Can the piece on from_sq move to to_sq (ignoring checks and pins)?"""
+        piece = self.squares[from_sq]
+        if not piece or from_sq == to_sq:
+            return False
+        kind = piece & KIND_MASK
+        fc, fr = from_sq % 9, from_sq // 9
+        dc, dr = to_sq % 9 - fc, to_sq // 9 - fr
+        white = piece & WHITE_FLAG
+        if white:
+            dc, dr = -dc, -dr
+        if (dc, dr) in STEPS.get(kind, ()):
+            return True
+        squares = self.squares
+        for ux, uy in SLIDES.get(kind, ()):
+            n = _slide_count(dc, dr, ux, uy)
+            if not n:
+                continue
+            sx, sy = (-ux, -uy) if white else (ux, uy)
+            step = sy * 9 + sx
+            sq = from_sq
+            for _ in range(n - 1):
+                sq += step
+                if squares[sq]:
+                    return False
+            return True
+        return False
+
+    def sources(self, piece: int, to_sq: int) -> List[int]:
+        """Squares holding `piece` (kind | color flag) that can move to to_sq."""
+        squares = self.squares
+        return [sq for sq in range(81) if squares[sq] == piece and self.reaches(sq, to_sq)]
+
+    # ---- moves -----------------------------------------------------------
+
+    def push(self, from_sq: Optional[int], to_sq: int, promote: bool = False,
+             drop_kind: int = 0) -> int:
+        """Play a move given as squares. Returns the captured piece (0 if none)."""
+        color = self.turn
+        squares = self.squares
+        if from_sq is None:
+            hand = self.hands[color]
+            if drop_kind not in PROMOTABLE and drop_kind != GOLD:
+                raise IllegalMoveError(f"cannot drop kind {drop_kind}")
+            if hand[drop_kind] <= 0:
+                raise IllegalMoveError(f"no {KIND_TO_SFEN[drop_kind]} in hand")
+            if squares[to_sq]:
+                raise IllegalMoveError(f"drop on occupied square {USI_SQUARES[to_sq]}")
+            hand[drop_kind] -= 1
+            squares[to_sq] = drop_kind | (WHITE_FLAG if color else 0)
+            captured = 0
+        else:
+            piece = squares[from_sq]
+            if not piece or (piece >> 4) != color:
+                raise IllegalMoveError(
+                    f"no {'gote' if color else 'sente'} piece on {USI_SQUARES[from_sq]}"
+                )
+            captured = squares[to_sq]
+            if captured:
+                if (captured >> 4) == color:
+                    raise IllegalMoveError(f"capture of own piece on {USI_SQUARES[to_sq]}")
+                kind = unpromote(captured & KIND_MASK)
+                if kind == KING:
+                    raise IllegalMoveError("king capture")
+                self.hands[color][kind] += 1
+            if promote:
+                kind = piece & KIND_MASK
+                if kind not in PROMOTABLE:
+                    raise IllegalMoveError(f"{KIND_TO_SFEN[kind]} cannot promote")
+                if not (in_promotion_zone(from_sq, color) or in_promotion_zone(to_sq, color)):
+                    raise IllegalMoveError("promotion outside the zone")
+                piece += PROMOTED
+            squares[from_sq] = 0
+            squares[to_sq] = piece
+        self.turn = color ^ 1
+        self.ply += 1
+        return captured
+
+    def push_usi(self, move: str) -> int:
+        """Play a USI move ("7g7f", "8h2b+", "P*5e"). Returns the captured piece."""
+        if len(move) < 4:
+            raise IllegalMoveError(f"bad USI move: {move!r}")
+        if move[1] == "*":
+            kind = SFEN_TO_KIND.get(move[0], 0)
+            return self.push(None, parse_usi_square(move[2:4]), drop_kind=kind)
+        promote = move.endswith("+")
+        if len(move) != (5 if promote else 4):
+            raise IllegalMoveError(f"bad USI move: {move!r}")
+        return self.push(parse_usi_square(move[0:2]), parse_usi_square(move[2:4]), promote)
+
+
+def move_to_usi(from_sq: Optional[int], to_sq: int, promote: bool = False,
+                drop_kind: int = 0) -> str:
+    if from_sq is None:
+        return f"{KIND_TO_SFEN[drop_kind]}*{USI_SQUARES[to_sq]}"
+    return f"{USI_SQUARES[from_sq]}{USI_SQUARES[to_sq]}{'+' if promote else ''}"
+
+
+def replay(moves: List[str], start_sfen: Optional[str] = None) -> Tuple[Board, int]:
+    """
+    Play USI moves from start_sfen (None = startpos).
+    Returns (board, number of moves applied); stops at the first illegal move.
+    """
+    board = Board.from_sfen(start_sfen)
+    for i, move in enumerate(moves):
+        try:
+            board.push_usi(move)
+        except IllegalMoveError:
+            return board, i
+    return board, len(moves)
@@ -0,0 +1,276 @@
+"""
+csa_parser.py
+
+CSA -> USI converter with board tracking.
+
+CSA only records the piece *after* the move ("+8822UM"), so whether a move
+promotes depends on what stood on the source square. Moves are therefore
+played on a Board and the "+" suffix is emitted when the kind changed.
+
+Handles:
+- "PI" (optionally with removed pieces, e.g. "PI82HI22KA"), "P1".."P9" rows
+  and "P+" / "P-" piece placement (including "00AL") -> start SFEN
+- the "+" / "-" side-to-move line
+- several statements on one line separated by ","
+- time lines ("T12"), comments ("'"), "N+"/"N-" names and "$KEY:value" headers
+- "%" terminal statements (%TORYO, %TSUMI, %SENNICHITE, ...) -> result
+
+Like kif_parser, parsing stops at the first move that cannot be played and the
+reason is recorded in CsaGame.error.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Union
+
+from .board import (
+    BLACK,
+    WHITE,
+    WHITE_FLAG,
+    KIND_MASK,
+    PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK, KING,
+    PRO_PAWN, PRO_LANCE, PRO_KNIGHT, PRO_SILVER, HORSE, DRAGON,
+    PROMOTED,
+    STARTPOS_SFEN,
+    Board,
+    IllegalMoveError,
+    move_to_usi,
+    square,
+    unpromote,
+)
+from .kif_parser import SENTE_WIN, GOTE_WIN, DRAW
+
+CSA_PIECE_KINDS = {
+    "FU": PAWN, "KY": LANCE, "KE": KNIGHT, "GI": SILVER, "KI": GOLD,
+    "KA": BISHOP, "HI": ROOK, "OU": KING, "GY": KING,
+    "TO": PRO_PAWN, "NY": PRO_LANCE, "NK": PRO_KNIGHT, "NG": PRO_SILVER,
+    "UM": HORSE, "RY": DRAGON,
+}
+
+_MOVE_RE = re.compile(r"^([+-])([0-9])([0-9])([1-9])([1-9])([A-Z]{2})$")
+_FULL_SET = {PAWN: 18, LANCE: 4, KNIGHT: 4, SILVER: 4, GOLD: 4, BISHOP: 2, ROOK: 2, KING: 2}
+
+# %statement -> does the side to move win (True), lose (False) or draw (None)
+_TERMINAL_OUTCOME = {
+    "%TORYO": False, "%TSUMI": False, "%TIME_UP": False, "%ILLEGAL_MOVE": False,
+    "%KACHI": True,
+    "%SENNICHITE": None, "%JISHOGI": None, "%HIKIWAKE": None,
+}
+
+
+class CsaParseError(ValueError):
+    """A CSA statement that cannot be applied to the current board."""
+
+
+@dataclass
+class CsaGame:
+    """One parsed CSA game."""
+    moves: List[str] = field(default_factory=list)   # USI
+    start_sfen: Optional[str] = None                  # None means startpos
+    headers: Dict[str, str] = field(default_factory=dict)
+    result: Optional[str] = None                      # SENTE_WIN / GOTE_WIN / DRAW
+    end_reason: Optional[str] = None                  # "%TORYO", "%CHUDAN", ...
+    error: Optional[str] = None
+
+
+def csa_move_to_usi(csa_move: str, board: Board) -> str:
+    """
+    Convert one CSA move ("+7776FU", "-0055KA") to USI and play it on `board`.
+    Raises CsaParseError when the move does not fit the position.
+    """
+    m = _MOVE_RE.match(csa_move)
+    if m is None:
+        raise CsaParseError(f"bad move: {csa_move!r}")
+    sign, ff, fr, tf, tr, code = m.groups()
+    kind = CSA_PIECE_KINDS.get(code)
+    if kind is None:
+        raise CsaParseError(f"bad piece: {code!r}")
+    color = BLACK if sign == "+" else WHITE
+    if color != board.turn:
+        raise CsaParseError(f"{sign} to move out of turn")
+    to_sq = square(int(tf), int(tr))
+
+    try:
+        if ff == "0" and fr == "0":
+            board.push(None, to_sq, drop_kind=kind)
+            return move_to_usi(None, to_sq, drop_kind=kind)
+        if ff == "0" or fr == "0":
+            raise CsaParseError(f"bad source square: {ff}{fr}")
+        from_sq = square(int(ff), int(fr))
+        before = board.squares[from_sq] & KIND_MASK
+        if before == kind:
+            promote = False
+        elif before + PROMOTED == kind and before != KING:
+            promote = True
+        else:
+            raise CsaParseError(f"{code} does not match the piece on {ff}{fr}")
+        board.push(from_sq, to_sq, promote)
+        return move_to_usi(from_sq, to_sq, promote)
+    except IllegalMoveError as e:
+        raise CsaParseError(str(e)) from e
+
+
+def _apply_placement(board: Board, stmt: str) -> None:
+    """Apply a "P1".."P9", "PI..." or "P+"/"P-" statement to a board being set up."""
+    tag = stmt[1]
+    if tag == "I":
+        start = Board.from_sfen(STARTPOS_SFEN)
+        board.squares = start.squares
+        for i in range(2, len(stmt) - 3, 4):  # "PI82HI22KA": remove listed pieces
+            f, r, code = stmt[i], stmt[i + 1], stmt[i + 2:i + 4]
+            sq = square(int(f), int(r))
+            if board.squares[sq] & KIND_MASK != CSA_PIECE_KINDS.get(code):
+                raise CsaParseError(f"no {code} on {f}{r} to remove")
+            board.squares[sq] = 0
+        return
+
+    if tag.isdigit():
+        rank = int(tag)
+        cells = stmt[2:].ljust(27)
+        for col in range(9):
+            cell = cells[col * 3:col * 3 + 3]
+            sq = (rank - 1) * 9 + col
+            if cell.strip() in ("*", ""):
+                board.squares[sq] = 0
+                continue
+            kind = CSA_PIECE_KINDS.get(cell[1:])
+            if kind is None or cell[0] not in "+-":
+                raise CsaParseError(f"bad board cell {cell!r} in {stmt!r}")
+            board.squares[sq] = kind | (WHITE_FLAG if cell[0] == "-" else 0)
+        return
+
+    if tag in "+-":
+        color = BLACK if tag == "+" else WHITE
+        flag = WHITE_FLAG if color == WHITE else 0
+        body = stmt[2:]
+        for i in range(0, len(body) - 3, 4):
+            f, r, code = body[i], body[i + 1], body[i + 2:i + 4]
+            if f == "0" and r == "0" and code == "AL":
+                _all_remaining_to_hand(board, color)
+                continue
+            kind = CSA_PIECE_KINDS.get(code)
+            if kind is None:
+                raise CsaParseError(f"bad piece {code!r} in {stmt!r}")
+            if f == "0" and r == "0":
+                if kind == KING or kind > KING:
+                    raise CsaParseError(f"{code} cannot be in hand")
+                board.hands[color][kind] += 1
+            else:
+                board.squares[square(int(f), int(r))] = kind | flag
+        return
+
+    raise CsaParseError(f"bad placement: {stmt!r}")
+
+
+def _all_remaining_to_hand(board: Board, color: int) -> None:
+    used = dict.fromkeys(_FULL_SET, 0)
+    for piece in board.squares:
+        if piece:
+            used[unpromote(piece & KIND_MASK)] += 1
+    for hand in board.hands:
+        for kind in _FULL_SET:
+            used[kind] += hand[kind]
+    for kind, total in _FULL_SET.items():
+        if kind != KING and total > used[kind]:
+            board.hands[color][kind] += total - used[kind]
+
+
+def _statements(lines: Iterable[str]) -> Iterable[str]:
+    for raw in lines:
+        line = raw.strip()
+        if not line or line[0] == "'":
+            continue
+        if line[0] == "$" or line[0] == "N":
+            yield line  # headers may contain "," inside values
+            continue
+        for stmt in line.split(","):
+            stmt = stmt.strip()
+            if stmt:
+                yield stmt
+
+
+def parse_csa(source: Union[str, Iterable[str]]) -> CsaGame:
+    """Parse one CSA game from text or an iterable of lines."""
+    lines = source.splitlines() if isinstance(source, str) else source
+    game = CsaGame()
+    headers = game.headers
+    setup: Optional[Board] = None   # board while the initial position is being described
+    board: Optional[Board] = None   # board once moves start
+    turn = BLACK
+    stopped = False
+
+    for stmt in _statements(lines):
+        head = stmt[0]
+
+        if head in "+-" and len(stmt) > 1:
+            if stopped:
+                continue
+            if board is None:
+                board = _finish_setup(game, setup, turn)
+                if board is None:
+                    return game
+            try:
+                game.moves.append(csa_move_to_usi(stmt, board))
+            except CsaParseError as e:
+                game.error = f"ply {board.ply}: {e}"
+                stopped = True
+            continue
+
+        if head in "+-":  # side-to-move line after the position
+            turn = BLACK if head == "+" else WHITE
+            continue
+        if head == "T" or head == "V":
+            continue
+        if head == "%":
+            if stopped and game.end_reason is not None:
+                continue
+            word = stmt.split(",")[0]
+            if word.startswith(("%+", "%-")):
+                # %+ILLEGAL_ACTION: the named side forfeits
+                game.result = GOTE_WIN if word[1] == "+" else SENTE_WIN
+            elif word in _TERMINAL_OUTCOME:
+                mover_wins = _TERMINAL_OUTCOME[word]
+                if mover_wins is None:
+                    game.result = DRAW
+                else:
+                    to_move = board.turn if board is not None else turn
+                    black_wins = mover_wins == (to_move == BLACK)
+                    game.result = SENTE_WIN if black_wins else GOTE_WIN
+            game.end_reason = word
+            stopped = True
+            continue
+        if head == "N" and len(stmt) > 2 and stmt[1] in "+-":
+            headers["N" + stmt[1]] = stmt[2:].strip()
+            continue
+        if head == "$":
+            key, _, value = stmt[1:].partition(":")
+            headers[key.strip()] = value.strip()
+            continue
+        if head == "P" and board is None and len(stmt) > 1:
+            if setup is None:
+                setup = Board()
+            try:
+                _apply_placement(setup, stmt)
+            except (CsaParseError, ValueError, IndexError) as e:
+                game.error = f"start position: {e}"
+                return game
+            continue
+
+    if board is None and setup is not None and game.error is None:
+        _finish_setup(game, setup, turn)
+    return game
+
+
+def _finish_setup(game: CsaGame, setup: Optional[Board], turn: int) -> Optional[Board]:
+    if setup is None:
+        return Board.from_sfen(STARTPOS_SFEN)  # no position given: assume hirate
+    setup.turn = turn
+    setup.ply = 1
+    sfen = setup.sfen()
+    if sfen != STARTPOS_SFEN:
+        game.start_sfen = sfen
+    try:
+        return Board.from_sfen(sfen)
+    except ValueError as e:
+        game.error = f"start position: {e}"
+        return None
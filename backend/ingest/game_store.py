@@ -0,0 +1,342 @@
+"""
+game_store.py
+
+Compact single-file container for large game collections.
+
+Every move is a 16-bit code (move_codec: from/drop piece, to, promotion), so a
+game of 120 plies costs 240 bytes instead of 120 Python strings. The file is
+read through mmap and per-game move slices are memoryviews into it, so
+iterating a million-game corpus never materialises the whole move list.
+
+Layout (little-endian):
+
+    header   "KGS1", u32 version, u64 n_games, u64 moves_at, u64 index_at, u64 meta_at
+    moves    u16 codes of all games, back to back
+    index    u64 move_offsets[n_games + 1], u64 meta_offsets[n_games + 1]
+    meta     one compact JSON line per game (start_sfen, source, players, ...)
+
+Games are stored losslessly: add() rejects a token that does not round-trip
+through the codec instead of silently storing "no move". pack_games() also
+replays every game with the legal move generator and skips games with an
+illegal move.
+
+CLI:
+    python -m backend.ingest.game_store pack data/kifu data/games.kgs
+    python -m backend.ingest.game_store info data/games.kgs
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from .kifu_loader import KifuData, KifuMetadata
+from .move_codec import NO_MOVE, decode_move, decode_moves, encode_move
+from .movegen import validate_game
+
+MAGIC = b"KGS1"
+VERSION = 1
+GAME_STORE_SUFFIX = ".kgs"
+_HEADER = struct.Struct("<4sIQQQQ")
+_BIG_ENDIAN = sys.byteorder == "big"
+_METADATA_FIELDS = {f for f in KifuMetadata.__dataclass_fields__}
+
+
+@lru_cache(maxsize=1 << 15)   # a corpus uses a few thousand distinct move strings
+def _checked_code(move: str) -> int:
+    code = encode_move(move)
+    if code == NO_MOVE or decode_move(code) != move:
+        raise ValueError(f"not a USI move: {move!r}")
+    return code
+
+
+def encode_game(moves: Iterable[str]) -> array:
+    """USI moves -> array('H') of codes; ValueError for a token that would not round-trip."""
+    try:
+        return array("H", map(_checked_code, moves))
+    except TypeError:
+        raise ValueError(f"not a USI move list: {moves!r}") from None
+
+
+def is_game_store(path: str) -> bool:
+    if not os.path.isfile(path):
+        return False
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+@dataclass
+class StoredGame:
+    """One game of a GameStoreReader; `codes` is a view into the mapped file."""
+    index: int
+    codes: Sequence[int]
+    meta: Dict[str, Any]
+
+    @property
+    def start_sfen(self) -> Optional[str]:
+        return self.meta.get("start_sfen")
+
+    @property
+    def moves(self) -> List[str]:
+        return decode_moves(self.codes)
+
+    def kifu_data(self) -> KifuData:
+        metadata = KifuMetadata(**{k: v for k, v in self.meta.items() if k in _METADATA_FIELDS})
+        return KifuData(usi_moves=self.moves, metadata=metadata, start_sfen=self.start_sfen)
+
+
+class GameStoreWriter:
+    """Streams games into a new store; the file appears atomically on close()."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(prefix=".tmp-", suffix=GAME_STORE_SUFFIX, dir=directory)
+        self._f = os.fdopen(fd, "w+b")
+        self._f.write(b"\0" * _HEADER.size)
+        # metadata lines wait in a spooled buffer until the moves are all written
+        self._meta = tempfile.SpooledTemporaryFile(max_size=16 << 20)
+        self._move_offsets = array("Q", [0])
+        self._meta_offsets = array("Q", [0])
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._move_offsets) - 1
+
+    def add(self, moves: Iterable[str], start_sfen: Optional[str] = None,
+            meta: Optional[Dict[str, Any]] = None) -> int:
+        """Append one game; returns its index."""
+        codes = encode_game(moves)
+        if _BIG_ENDIAN:
+            codes.byteswap()
+        codes.tofile(self._f)
+        self._move_offsets.append(self._move_offsets[-1] + len(codes))
+        record = {"start_sfen": start_sfen} if start_sfen else {}
+        record.update({k: v for k, v in (meta or {}).items() if v is not None})
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._meta.write(line)
+        self._meta_offsets.append(self._meta_offsets[-1] + len(line))
+        return len(self) - 1
+
+    def add_kifu(self, kifu: KifuData, **extra: Any) -> int:
+        return self.add(kifu.usi_moves, kifu.start_sfen, {**asdict(kifu.metadata), **extra})
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        f = self._f
+        try:
+            moves_at = _HEADER.size
+            f.write(b"\0" * (-f.tell() % 8))
+            index_at = f.tell()
+            for offsets in (self._move_offsets, self._meta_offsets):
+                if _BIG_ENDIAN:
+                    offsets = array("Q", offsets)
+                    offsets.byteswap()
+                offsets.tofile(f)
+            meta_at = f.tell()
+            self._meta.seek(0)
+            while True:
+                block = self._meta.read(1 << 20)
+                if not block:
+                    break
+                f.write(block)
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, len(self), moves_at, index_at, meta_at))
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            self._meta.close()
+            os.replace(self._tmp, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        """Discard everything written so far."""
+        self._closed = True
+        for handle in (self._f, self._meta):
+            try:
+                handle.close()
+            except OSError:
+                pass
+        try:
+            os.unlink(self._tmp)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "GameStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class GameStoreReader:
+    """
+    Memory-mapped read access. codes(i) is a zero-copy uint16 view (a copy on
+    big-endian hosts); views must not be used after close().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._f.close()
+            raise ValueError(f"not a game store: {path}")
+        try:
+            magic, version, n, moves_at, index_at, meta_at = _HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            magic, version = b"", 0
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"not a game store: {path}")
+        self.n_games = n
+        self._meta_at = meta_at
+        view = memoryview(self._mm)
+        self._move_offsets = view[index_at:index_at + 8 * (n + 1)].cast("Q")
+        self._meta_offsets = view[index_at + 8 * (n + 1):meta_at].cast("Q")
+        n_moves = self._offset(self._move_offsets, n)
+        self._codes = view[moves_at:moves_at + 2 * n_moves].cast("H")
+        self._views = [view, self._move_offsets, self._meta_offsets, self._codes]
+
+    @staticmethod
+    def _offset(offsets: memoryview, i: int) -> int:
+        value = offsets[i]
+        if _BIG_ENDIAN:
+            value = int.from_bytes(value.to_bytes(8, "big"), "little")
+        return value
+
+    def __len__(self) -> int:
+        return self.n_games
+
+    @property
+    def n_moves(self) -> int:
+        return len(self._codes)
+
+    def _check(self, i: int) -> int:
+        if not 0 <= i < self.n_games:
+            raise IndexError(f"game {i} out of range (0..{self.n_games - 1})")
+        return i
+
+    def codes(self, i: int) -> Sequence[int]:
+        self._check(i)
+        lo, hi = self._offset(self._move_offsets, i), self._offset(self._move_offsets, i + 1)
+        if _BIG_ENDIAN:
+            out = array("H", self._codes[lo:hi])
+            out.byteswap()
+            return out
+        return self._codes[lo:hi]
+
+    def moves(self, i: int) -> List[str]:
+        return decode_moves(self.codes(i))
+
+    def meta(self, i: int) -> Dict[str, Any]:
+        self._check(i)
+        lo = self._meta_at + self._offset(self._meta_offsets, i)
+        hi = self._meta_at + self._offset(self._meta_offsets, i + 1)
+        return json.loads(self._mm[lo:hi])
+
+    def game(self, i: int) -> StoredGame:
+        return StoredGame(i, self.codes(i), self.meta(i))
+
+    def __iter__(self) -> Iterator[StoredGame]:
+        for i in range(self.n_games):
+            yield self.game(i)
+
+    def iter_kifu_data(self) -> Iterator[KifuData]:
+        """Games as the loader's KifuData, decoded one at a time."""
+        for game in self:
+            yield game.kifu_data()
+
+    def close(self) -> None:
+        for view in getattr(self, "_views", []):
+            view.release()
+        self._views = []
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # a caller still holds a codes() view; the map goes with it
+        self._f.close()
+
+    def __enter__(self) -> "GameStoreReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+@dataclass
+class PackStats:
+    games: int = 0
+    moves: int = 0
+    skipped: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+def pack_games(source: str, path: str) -> PackStats:
+    """Pack every legal game under `source` (file, folder or archive) into a store."""
+    from .kifu_stream import iter_games
+
+    stats = PackStats()
+    with GameStoreWriter(path) as writer:
+        for game in iter_games(source):
+            if game.data is None or not game.data.usi_moves:
+                stats.skipped += 1
+                continue
+            try:
+                _, error = validate_game(game.data.usi_moves, game.data.start_sfen)
+                if error:
+                    raise ValueError(error)
+                writer.add_kifu(game.data, source_path=game.source)
+            except ValueError as e:
+                stats.skipped += 1
+                stats.errors.append(f"{game.source}#{game.index}: {e}")
+                continue
+            stats.games += 1
+            stats.moves += len(game.data.usi_moves)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Pack kifu into / inspect a compact game store")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack", help="pack a file, folder or archive")
+    p.add_argument("source")
+    p.add_argument("out")
+    i = sub.add_parser("info", help="print game/move counts")
+    i.add_argument("store")
+    args = ap.parse_args(argv)
+
+    if args.command == "pack":
+        stats = pack_games(args.source, args.out)
+        report = asdict(stats)
+        report["errors"] = report["errors"][:20]
+        report["bytes"] = os.path.getsize(args.out)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0
+    with GameStoreReader(args.store) as reader:
+        print(json.dumps({"games": len(reader), "moves": reader.n_moves,
+                          "bytes": os.path.getsize(args.store)}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,358 @@
+"""
+kif_parser.py
+
+KIF (Japanese notation) -> USI converter with board tracking.
+
+Handles the move forms produced by Shogi Wars, 81Dojo, KIFU for Windows and
+similar exporters:
+
+- destination squares in full-width or ASCII digits + kanji ranks (７六 / 7六)
+- 同 (recapture on the previous destination)
+- 打 (drops; also inferred when no piece on the board can reach the square)
+- 成 / 不成 (生)
+- the (77) source-square suffix
+- relative disambiguation 右 左 直 上 引 寄 行 入 when the suffix is missing
+- 手合割 handicap presets and BOD board diagrams as the starting position
+- terminal lines (投了, 詰み, 千日手, ...) and "まで..." summaries -> result
+
+Parsing stops at the first 変化 (variation) block and at the first move that
+cannot be played; the moves before it are kept and the reason is recorded in
+KifGame.error.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Union
+
+from .board import (
+    BLACK,
+    WHITE,
+    WHITE_FLAG,
+    KIND_MASK,
+    PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK, KING,
+    PRO_PAWN, PRO_LANCE, PRO_KNIGHT, PRO_SILVER, HORSE, DRAGON,
+    PROMOTABLE,
+    Board,
+    IllegalMoveError,
+    move_to_usi,
+    square,
+)
+
+# Result values shared by the ingest parsers (KifuMetadata.result)
+SENTE_WIN = "sente_win"
+GOTE_WIN = "gote_win"
+DRAW = "draw"
+
+KIF_PIECE_KINDS = {
+    "歩": PAWN, "香": LANCE, "桂": KNIGHT, "銀": SILVER, "金": GOLD,
+    "角": BISHOP, "飛": ROOK, "玉": KING, "王": KING,
+    "と": PRO_PAWN, "成香": PRO_LANCE, "杏": PRO_LANCE, "成桂": PRO_KNIGHT, "圭": PRO_KNIGHT,
+    "成銀": PRO_SILVER, "全": PRO_SILVER, "馬": HORSE, "龍": DRAGON, "竜": DRAGON,
+}
+
+_DIGITS = {c: i + 1 for i, c in enumerate("１２３４５６７８９")}
+_DIGITS.update({str(i): i for i in range(1, 10)})
+_KANJI_NUM = {c: i + 1 for i, c in enumerate("一二三四五六七八九")}
+_KANJI_NUM.update({str(i): i for i in range(1, 10)})
+
+_MOVE_RE = re.compile(
+    r"^\s*(?P<no>\d+)\s+"
+    r"(?:(?P<file>[１-９1-9])(?P<rank>[一二三四五六七八九1-9])|(?P<same>同))[\s　]*"
+    r"(?P<piece>成香|成桂|成銀|[歩香桂銀金角飛玉王と杏圭全馬龍竜])"
+    r"(?P<rel>[右左直上引寄行入]*)"
+    r"(?P<act>打|不成|生|成)?"
+    r"(?:\((?P<src>[1-9][1-9])\))?"
+)
+_TERMINAL_RE = re.compile(
+    r"^\s*\d+\s+(?P<word>投了|中断|千日手|持将棋|詰み|切れ負け|反則勝ち|反則負け|"
+    r"入玉勝ち|宣言勝ち|不戦勝|不戦敗|封じ手)"
+)
+
+# terminal word -> does the side to move win (True), lose (False) or draw (None)
+_TERMINAL_OUTCOME = {
+    "投了": False, "詰み": False, "切れ負け": False, "反則負け": False, "不戦敗": False,
+    "反則勝ち": True, "入玉勝ち": True, "宣言勝ち": True, "不戦勝": True,
+    "千日手": None, "持将棋": None,
+}
+
+_REST = "ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL w - 1"
+HANDICAP_SFENS = {
+    "香落ち": "lnsgkgsn1/1r5b1/" + _REST,
+    "右香落ち": "1nsgkgsnl/1r5b1/" + _REST,
+    "角落ち": "lnsgkgsnl/1r7/" + _REST,
+    "飛車落ち": "lnsgkgsnl/7b1/" + _REST,
+    "飛香落ち": "lnsgkgsn1/7b1/" + _REST,
+    "二枚落ち": "lnsgkgsnl/9/" + _REST,
+    "三枚落ち": "lnsgkgsn1/9/" + _REST,
+    "四枚落ち": "1nsgkgsn1/9/" + _REST,
+    "五枚落ち": "2sgkgsn1/9/" + _REST,
+    "左五枚落ち": "1nsgkgs2/9/" + _REST,
+    "六枚落ち": "2sgkgs2/9/" + _REST,
+    "左七枚落ち": "2sgkg3/9/" + _REST,
+    "右七枚落ち": "3gkgs2/9/" + _REST,
+    "八枚落ち": "3gkg3/9/" + _REST,
+    "十枚落ち": "4k4/9/" + _REST,
+}
+
+_BOD_PIECES = {"歩": "P", "香": "L", "桂": "N", "銀": "S", "金": "G", "角": "B", "飛": "R",
+               "玉": "K", "王": "K", "と": "+P", "杏": "+L", "圭": "+N", "全": "+S",
+               "馬": "+B", "龍": "+R", "竜": "+R"}
+_HAND_NUM = {"": 1, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8,
+             "九": 9, "十": 10, "十一": 11, "十二": 12, "十三": 13, "十四": 14, "十五": 15,
+             "十六": 16, "十七": 17, "十八": 18}
+
+
+class KifParseError(ValueError):
+    """A KIF move that cannot be converted on the current board."""
+
+
+@dataclass
+class KifGame:
+    """One parsed KIF game."""
+    moves: List[str] = field(default_factory=list)   # USI
+    start_sfen: Optional[str] = None                  # None means startpos
+    headers: Dict[str, str] = field(default_factory=dict)
+    result: Optional[str] = None                      # SENTE_WIN / GOTE_WIN / DRAW
+    end_reason: Optional[str] = None                  # 投了, 詰み, 中断, ...
+    error: Optional[str] = None                       # why parsing stopped early
+
+
+def _perspective(sq: int, color: int):
+    """(col, row) seen from `color`: row decreases going forward, col grows to the right."""
+    c, r = sq % 9, sq // 9
+    return (8 - c, 8 - r) if color == WHITE else (c, r)
+
+
+def _disambiguate(cands: List[int], to_sq: int, rel: str, color: int) -> List[int]:
+    tc, tr = _perspective(to_sq, color)
+    out = cands
+    for ch in rel:
+        if ch in "上行入":
+            out = [s for s in out if _perspective(s, color)[1] > tr]
+        elif ch == "引":
+            out = [s for s in out if _perspective(s, color)[1] < tr]
+        elif ch == "寄":
+            out = [s for s in out if _perspective(s, color)[1] == tr]
+        elif ch == "直":
+            out = [s for s in out
+                   if _perspective(s, color)[0] == tc and _perspective(s, color)[1] > tr]
+    if len(out) > 1 and ("右" in rel or "左" in rel):
+        cols = [_perspective(s, color)[0] for s in out]
+        pick = max(cols) if "右" in rel else min(cols)
+        out = [s for s, c in zip(out, cols) if c == pick]
+    return out
+
+
+def _dest(match: "re.Match[str]", last_to: Optional[int]) -> int:
+    if match.group("same"):
+        if last_to is None:
+            raise KifParseError("同 without a previous move")
+        return last_to
+    return square(_DIGITS[match.group("file")], _KANJI_NUM[match.group("rank")])
+
+
+def kif_move_to_usi(match: "re.Match[str]", board: Board, last_to: Optional[int]) -> str:
+    """
+    Convert one matched KIF move to USI on `board` and play it.
+    Raises KifParseError when the move does not fit the position.
+    """
+    to_sq = _dest(match, last_to)
+
+    kind = KIF_PIECE_KINDS[match.group("piece")]
+    act = match.group("act")
+    color = board.turn
+    flag = WHITE_FLAG if color == WHITE else 0
+
+    try:
+        if act == "打":
+            board.push(None, to_sq, drop_kind=kind)
+            return move_to_usi(None, to_sq, drop_kind=kind)
+
+        src = match.group("src")
+        if src:
+            from_sq = square(int(src[0]), int(src[1]))
+            if board.squares[from_sq] & KIND_MASK != kind:
+                raise KifParseError(f"{match.group('piece')} is not on {src}")
+        else:
+            cands = board.sources(kind | flag, to_sq)
+            rel = match.group("rel")
+            if rel and len(cands) > 1:
+                cands = _disambiguate(cands, to_sq, rel, color)
+            if not cands:
+                # 打 may be omitted when no piece on the board can get there
+                if kind in PROMOTABLE or kind == GOLD:
+                    board.push(None, to_sq, drop_kind=kind)
+                    return move_to_usi(None, to_sq, drop_kind=kind)
+                raise KifParseError(f"no {match.group('piece')} can reach the square")
+            if len(cands) > 1:
+                raise KifParseError(f"ambiguous {match.group('piece')}{match.group('rel')}")
+            from_sq = cands[0]
+
+        promote = act == "成"
+        board.push(from_sq, to_sq, promote)
+        return move_to_usi(from_sq, to_sq, promote)
+    except IllegalMoveError as e:
+        raise KifParseError(str(e)) from e
+
+
+def _parse_hand(text: str, upper: bool) -> str:
+    """KIF hand text ("角　歩三") -> SFEN hand fragment ("B3P")."""
+    text = text.strip()
+    if not text or text == "なし":
+        return ""
+    out = []
+    for token in re.split(r"[\s　]+", text):
+        if not token:
+            continue
+        name = _BOD_PIECES.get(token[0])
+        n = _HAND_NUM.get(token[1:])
+        if not name or name == "K" or name.startswith("+") or n is None:
+            raise KifParseError(f"bad hand: {text!r}")
+        out.append((str(n) if n > 1 else "") + (name if upper else name.lower()))
+    return "".join(out)
+
+
+def _bod_to_sfen(rows: List[str], black_hand: str, white_hand: str, turn: str) -> str:
+    sfen_rows = []
+    for row in rows:
+        body = row.split("|")[1]
+        out = []
+        empty = 0
+        for i in range(0, 18, 2):
+            mark, ch = body[i:i + 2]
+            if ch == "・":
+                empty += 1
+                continue
+            name = _BOD_PIECES.get(ch)
+            if name is None:
+                raise KifParseError(f"bad board row: {row!r}")
+            if empty:
+                out.append(str(empty))
+                empty = 0
+            out.append(name.lower() if mark == "v" else name)
+        if empty:
+            out.append(str(empty))
+        sfen_rows.append("".join(out))
+    hands = (black_hand + white_hand) or "-"
+    return f"{'/'.join(sfen_rows)} {turn} {hands} 1"
+
+
+def _result_from_summary(line: str) -> Optional[str]:
+    if "先手の勝ち" in line or "下手の勝ち" in line or "先手の反則勝ち" in line:
+        return SENTE_WIN
+    if "後手の勝ち" in line or "上手の勝ち" in line or "後手の反則勝ち" in line:
+        return GOTE_WIN
+    if "千日手" in line or "持将棋" in line:
+        return DRAW
+    return None
+
+
+def parse_kif(source: Union[str, Iterable[str]]) -> KifGame:
+    """Parse one KIF game from text or an iterable of lines."""
+    lines = source.splitlines() if isinstance(source, str) else source
+    game = KifGame()
+    headers = game.headers
+    bod_rows: List[str] = []
+    hands = {"black": "", "white": ""}
+    bod_turn = "b"
+    board: Optional[Board] = None
+    last_to: Optional[int] = None
+    stopped = False
+
+    for raw in lines:
+        line = raw.rstrip("\r\n")
+        s = line.strip()
+        if not s or s[0] in "*&#":
+            continue
+        if s.startswith("変化："):
+            break
+        if s.startswith("まで"):
+            if game.result is None:
+                game.result = _result_from_summary(s)
+            continue
+
+        if s[0] in "0123456789":
+            if stopped:
+                continue
+            if board is None:
+                board = _initial_board(game, headers, bod_rows, hands, bod_turn)
+                if board is None:
+                    return game
+            m = _MOVE_RE.match(line)
+            if m is None:
+                t = _TERMINAL_RE.match(line)
+                if t is not None:
+                    word = t.group("word")
+                    if word != "封じ手":
+                        game.end_reason = word
+                        if word in _TERMINAL_OUTCOME:
+                            mover_wins = _TERMINAL_OUTCOME[word]
+                            if mover_wins is None:
+                                game.result = DRAW
+                            else:
+                                black_wins = mover_wins == (board.turn == BLACK)
+                                game.result = SENTE_WIN if black_wins else GOTE_WIN
+                        stopped = True
+                    continue
+                game.error = f"ply {board.ply}: unrecognized move {s!r}"
+                stopped = True
+                continue
+            try:
+                game.moves.append(kif_move_to_usi(m, board, last_to))
+            except KifParseError as e:
+                game.error = f"ply {board.ply}: {e} ({s!r})"
+                stopped = True
+                continue
+            last_to = _dest(m, last_to)
+            continue
+
+        if s.startswith("|"):
+            bod_rows.append(s)
+            continue
+        if s in ("先手番", "下手番"):
+            bod_turn = "b"
+            continue
+        if s in ("後手番", "上手番"):
+            bod_turn = "w"
+            continue
+
+        for sep in ("：", ":"):
+            if sep in s:
+                key, value = s.split(sep, 1)
+                key = key.strip()
+                value = value.strip()
+                if key in ("先手の持駒", "下手の持駒"):
+                    hands["black"] = value
+                elif key in ("後手の持駒", "上手の持駒"):
+                    hands["white"] = value
+                else:
+                    headers[key] = value
+                break
+
+    if board is None and game.start_sfen is None and (bod_rows or headers.get("手合割")):
+        _initial_board(game, headers, bod_rows, hands, bod_turn)
+    return game
+
+
+def _initial_board(game: KifGame, headers: Dict[str, str], bod_rows: List[str],
+                   hands: Dict[str, str], bod_turn: str) -> Optional[Board]:
+    """Starting position from a BOD diagram, a 手合割 preset or startpos."""
+    try:
+        if len(bod_rows) == 9:
+            game.start_sfen = _bod_to_sfen(
+                bod_rows,
+                _parse_hand(hands["black"], upper=True),
+                _parse_hand(hands["white"], upper=False),
+                bod_turn,
+            )
+        else:
+            preset = (headers.get("手合割") or "平手").replace("　", "").strip()
+            if preset not in ("平手", ""):
+                sfen = HANDICAP_SFENS.get(preset)
+                if sfen is None:
+                    raise KifParseError(f"unsupported 手合割: {preset}")
+                game.start_sfen = sfen
+        return Board.from_sfen(game.start_sfen)
+    except (KifParseError, ValueError) as e:
+        game.error = f"start position: {e}"
+        return None
@@ -0,0 +1,51 @@
+"""
+kifu_encoding.py
+
+Encoding sniffing for kifu files. Japanese exporters still write Shift_JIS /
+CP932 (KIFU for Windows, older Shogi Wars dumps) next to UTF-8 with or without
+a BOM, so files are read as bytes and decoded with the sniffed codec.
+"""
+
+import codecs
+import re
+from typing import Union
+
+SNIFF_BYTES = 8 * 1024
+_ENCODING_DIRECTIVE = re.compile(rb"encoding=([A-Za-z0-9_\-]+)")
+_SJIS_NAMES = ("shift-jis", "sjis", "shiftjis", "cp932", "windows-31j", "ms932")
+
+
+def sniff_encoding(head: bytes) -> str:
+    """Guess the text encoding from the first bytes of a kifu file."""
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    m = _ENCODING_DIRECTIVE.search(head[:256])  # "#KIF version=2.0 encoding=UTF-8"
+    if m:
+        name = m.group(1).decode("ascii").lower().replace("_", "-")
+        if name in _SJIS_NAMES:
+            return "cp932"  # superset of Shift_JIS (NEC/IBM extensions)
+        try:
+            return codecs.lookup(name).name
+        except LookupError:
+            pass
+    try:
+        # final=False: a multibyte character cut at the sniff boundary is fine
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp932"
+
+
+def decode_kifu_bytes(data: Union[bytes, str]) -> str:
+    """Decode a whole kifu file's bytes with the sniffed encoding."""
+    if isinstance(data, str):  # already decoded (text-mode file object)
+        return data
+    return data.decode(sniff_encoding(data[:SNIFF_BYTES]), errors="replace")
+
+
+def read_kifu_text(file_path: str) -> str:
+    """Read a kifu file as text, whatever its encoding."""
+    with open(file_path, "rb") as f:
+        return decode_kifu_bytes(f.read())
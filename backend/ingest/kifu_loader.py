@@ -3,14 +3,22 @@ kifu_loader.py
 
 Parse KIF/CSA/USI files into standardized USI format.
 Supports multiple file formats with lightweight pure-Python parsing.
+Files are read as bytes and decoded with a sniffed encoding (UTF-8 / BOM /
+Shift_JIS). For multi-game files and archives use kifu_stream.iter_games().
 """
 
 import os
 import re
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 from dataclasses import dataclass
 from pathlib import Path
 
+from .board import Board, KING
+from .csa_parser import CSA_PIECE_KINDS, CsaParseError, csa_move_to_usi, parse_csa
+from .kif_parser import parse_kif
+from .kifu_encoding import decode_kifu_bytes, read_kifu_text
+from .movegen import validate_game
+
 
 @dataclass 
 class KifuMetadata:
@@ -19,10 +27,11 @@ class KifuMetadata:
     date: Optional[str] = None
     sente: Optional[str] = None  # 先手
     gote: Optional[str] = None   # 後手
-    result: Optional[str] = None
+    result: Optional[str] = None     # "sente_win" / "gote_win" / "draw"
     time_rules: Optional[str] = None
     source_format: Optional[str] = None
     source_path: Optional[str] = None
+    parse_error: Optional[str] = None  # set when parsing stopped before the end
 
 
 @dataclass
@@ -36,15 +45,6 @@ class KifuData:
 class KifuLoader:
     """Parse various Kifu formats into standardized USI"""
     
-    # KIF notation mappings
-    KIF_PIECE_MAP = {
-        "歩": "P", "香": "L", "桂": "N", "銀": "S", "金": "G", "角": "B", "飛": "R", "玉": "K", "王": "K",
-        "と": "+P", "成香": "+L", "成桂": "+N", "成銀": "+S", "馬": "+B", "龍": "+R", "竜": "+R"
-    }
-    
-    KIF_FILE_MAP = {"１": "1", "２": "2", "３": "3", "４": "4", "５": "5", "６": "6", "７": "7", "８": "8", "９": "9"}
-    KIF_RANK_MAP = {"一": "a", "二": "b", "三": "c", "四": "d", "五": "e", "六": "f", "七": "g", "八": "h", "九": "i"}
-    
     @classmethod
     def detect_format(cls, file_path: str) -> str:
         """Detect format based on file extension"""
@@ -58,8 +58,8 @@ class KifuLoader:
         else:
             # Try to detect by content
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    first_lines = f.read(1000)
+                with open(file_path, 'rb') as f:
+                    first_lines = decode_kifu_bytes(f.read(1000))
                     if 'V2.2' in first_lines or "'" in first_lines:
                         return 'csa'
                     elif 'startpos' in first_lines or 'position' in first_lines:
@@ -83,16 +83,32 @@ class KifuLoader:
         else:
             raise ValueError(f"Unsupported format: {format_type}")
     
+    @classmethod
+    def parse_text(cls, content: str, format_type: str,
+                   source_path: Optional[str] = None) -> KifuData:
+        """Parse already-decoded Kifu text of the given format"""
+        if format_type == 'usi':
+            return cls._parse_usi_text(content, source_path)
+        elif format_type == 'csa':
+            return cls._parse_csa_text(content, source_path)
+        elif format_type == 'kif':
+            return cls._parse_kif_text(content, source_path)
+        else:
+            raise ValueError(f"Unsupported format: {format_type}")
+    
     @classmethod
     def _parse_usi_file(cls, file_path: str) -> KifuData:
         """Parse USI format file (passthrough)"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
+        return cls._parse_usi_text(read_kifu_text(file_path), file_path)
+    
+    @classmethod
+    def _parse_usi_text(cls, content: str, source_path: Optional[str] = None) -> KifuData:
+        content = content.strip()
         
         metadata = KifuMetadata(
             source_format='usi',
-            source_path=file_path,
-            title=os.path.basename(file_path)
+            source_path=source_path,
+            title=os.path.basename(source_path) if source_path else None
         )
         
         # Extract moves from USI string
@@ -158,85 +174,60 @@ class KifuLoader:
         
         return None
     
-    @classmethod 
+    @classmethod
     def _parse_csa_file(cls, file_path: str) -> KifuData:
-        """Parse CSA format file (simplified)"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f.readlines()]
+        """Parse CSA format file (board-tracked, see csa_parser)"""
+        return cls._parse_csa_text(read_kifu_text(file_path), file_path)
+    
+    @classmethod
+    def _parse_csa_text(cls, content: str, source_path: Optional[str] = None) -> KifuData:
+        game = parse_csa(content)
+        headers = game.headers
         
         metadata = KifuMetadata(
+            title=headers.get("TITLE") or headers.get("EVENT"),
+            date=headers.get("START_TIME") or headers.get("DATE"),
+            sente=headers.get("N+") or headers.get("SENTE"),
+            gote=headers.get("N-") or headers.get("GOTE"),
+            result=game.result,
+            time_rules=headers.get("TIME_LIMIT") or headers.get("TIME"),
             source_format='csa',
-            source_path=file_path
+            source_path=source_path,
+            parse_error=game.error
         )
         
-        usi_moves = []
-        in_moves = False
-        
-        for line in lines:
-            # Extract metadata
-            if line.startswith("$TITLE:"):
-                metadata.title = line[7:].strip()
-            elif line.startswith("$DATE:"):
-                metadata.date = line[6:].strip()
-            elif line.startswith("$SENTE:"):
-                metadata.sente = line[7:].strip()
-            elif line.startswith("$GOTE:"):
-                metadata.gote = line[6:].strip()
-            elif line.startswith("$TIME_LIMIT:"):
-                metadata.time_rules = line[12:].strip()
-            
-            # Parse moves (simplified CSA->USI conversion)
-            elif line.startswith("+") or line.startswith("-"):
-                if len(line) >= 7:  # Minimum CSA move length
-                    try:
-                        usi_move = cls._csa_to_usi(line)
-                        if usi_move:
-                            usi_moves.append(usi_move)
-                    except Exception:
-                        # Skip invalid moves
-                        continue
-        
         return KifuData(
-            usi_moves=usi_moves,
-            metadata=metadata
+            usi_moves=game.moves,
+            metadata=metadata,
+            start_sfen=game.start_sfen
         )
     
     @classmethod
-    def _csa_to_usi(cls, csa_move: str) -> Optional[str]:
-        """Convert CSA move to USI (simplified)"""
-        # CSA format: +7776FU (from 77 to 76, FU piece)
-        # USI format: 7g7f
+    def _csa_to_usi(cls, csa_move: str, board: Optional[Board] = None) -> Optional[str]:
+        """
+        Convert one CSA move to USI.
         
-        if len(csa_move) < 7:
-            return None
+        With a board the move is played on it and promotion is decided from the
+        piece on the source square. Without one only unpromoted piece codes can
+        be converted (a promoted code could be a promotion or a promoted piece
+        moving), so those return None.
+        """
+        if board is not None:
+            try:
+                return csa_move_to_usi(csa_move.split(",")[0].strip(), board)
+            except CsaParseError:
+                return None
         
-        try:
-            player = csa_move[0]  # + or -
-            from_file = int(csa_move[1])
-            from_rank = int(csa_move[2])
-            to_file = int(csa_move[3])
-            to_rank = int(csa_move[4])
-            piece = csa_move[5:7]
-        except (ValueError, IndexError):
+        m = re.match(r'^[+-](\d)(\d)([1-9])([1-9])([A-Z]{2})$', csa_move.strip())
+        if not m or m.group(5) not in CSA_PIECE_KINDS:
             return None
-        
-        # Handle drops
-        if from_file == 0 and from_rank == 0:
-            # Drop: piece*to_square
-            piece_usi = cls._csa_piece_to_usi(piece)
-            to_square = f"{to_file}{chr(ord('a') + to_rank - 1)}"
-            return f"{piece_usi}*{to_square}"
-        
-        # Normal move
-        from_square = f"{from_file}{chr(ord('a') + from_rank - 1)}"
-        to_square = f"{to_file}{chr(ord('a') + to_rank - 1)}"
-        
-        # Check for promotion
-        promote = ""
-        if len(csa_move) > 7 and csa_move[7:9] in ["TO", "NY", "NK", "NG", "UM", "RY"]:
-            promote = "+"
-        
-        return f"{from_square}{to_square}{promote}"
+        from_file, from_rank, to_file, to_rank, piece = m.groups()
+        to_square = f"{to_file}{chr(ord('a') + int(to_rank) - 1)}"
+        if from_file == "0" and from_rank == "0":
+            return f"{cls._csa_piece_to_usi(piece)}*{to_square}"
+        if CSA_PIECE_KINDS[piece] > KING:
+            return None
+        return f"{from_file}{chr(ord('a') + int(from_rank) - 1)}{to_square}"
     
     @classmethod
     def _csa_piece_to_usi(cls, csa_piece: str) -> str:
@@ -249,82 +240,31 @@ class KifuLoader:
     
     @classmethod
     def _parse_kif_file(cls, file_path: str) -> KifuData:
-        """Parse KIF format file (simplified Japanese notation)"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f.readlines()]
+        """Parse KIF format file (board-tracked, see kif_parser)"""
+        return cls._parse_kif_text(read_kifu_text(file_path), file_path)
+    
+    @classmethod
+    def _parse_kif_text(cls, content: str, source_path: Optional[str] = None) -> KifuData:
+        game = parse_kif(content)
+        headers = game.headers
         
         metadata = KifuMetadata(
+            title=headers.get("表題") or headers.get("棋戦"),
+            date=headers.get("開始日時"),
+            sente=headers.get("先手") or headers.get("下手"),
+            gote=headers.get("後手") or headers.get("上手"),
+            result=game.result,
+            time_rules=headers.get("持ち時間"),
             source_format='kif',
-            source_path=file_path
+            source_path=source_path,
+            parse_error=game.error
         )
         
-        usi_moves = []
-        in_header = True
-        
-        for line in lines:
-            # Parse header information
-            if in_header:
-                if line.startswith("先手：") or line.startswith("下手："):
-                    metadata.sente = line.split("：", 1)[1] if "：" in line else None
-                elif line.startswith("後手：") or line.startswith("上手："):
-                    metadata.gote = line.split("：", 1)[1] if "：" in line else None
-                elif line.startswith("開始日時："):
-                    metadata.date = line.split("：", 1)[1] if "：" in line else None
-                elif line.startswith("表題："):
-                    metadata.title = line.split("：", 1)[1] if "：" in line else None
-                elif line.startswith("手数----指手"):
-                    in_header = False
-                continue
-            
-            # Parse moves
-            if re.match(r'^\s*\d+', line):  # Line starts with move number
-                try:
-                    usi_move = cls._kif_line_to_usi(line)
-                    if usi_move:
-                        usi_moves.append(usi_move)
-                except Exception:
-                    # Skip invalid moves
-                    continue
-        
         return KifuData(
-            usi_moves=usi_moves,
-            metadata=metadata
+            usi_moves=game.moves,
+            metadata=metadata,
+            start_sfen=game.start_sfen
         )
-    
-    @classmethod
-    def _kif_line_to_usi(cls, line: str) -> Optional[str]:
-        """Convert KIF move line to USI (very simplified)"""
-        # KIF format example: "   1 ７六歩(77)   ( 0:01/00:00:01)"
-        # This is a simplified parser - a full implementation would need
-        # much more complex Japanese notation parsing
-        
-        # Extract basic move pattern
-        match = re.search(r'([１-９])([一-九])([歩香桂銀金角飛王玉と全圭])(\([0-9][0-9]\))?', line)
-        if not match:
-            return None
-        
-        file_jp = match.group(1)
-        rank_jp = match.group(2)
-        piece_jp = match.group(3)
-        from_square = match.group(4)
-        
-        # Convert Japanese numbers to USI
-        file_num = cls.KIF_FILE_MAP.get(file_jp)
-        rank_char = cls.KIF_RANK_MAP.get(rank_jp)
-        
-        if not file_num or not rank_char:
-            return None
-        
-        to_square = f"{file_num}{rank_char}"
-        
-        # This is a very basic conversion - real KIF parsing would need:
-        # - Proper from-square detection
-        # - Disambiguation (同 notation)
-        # - Drop notation
-        # - Promotion detection
-        # For now, return a placeholder that indicates parsing limitation
-        
-        return f"0000"  # Placeholder - indicates KIF parsing needs improvement
 
 
 def load_kifu_file(file_path: str) -> KifuData:
@@ -332,25 +272,64 @@ def load_kifu_file(file_path: str) -> KifuData:
     return KifuLoader.load_file(file_path)
 
 
+KIFU_FILE_EXTENSIONS = frozenset({'.kif', '.kifu', '.csa', '.usi'})
+
+
+@dataclass
+class KifuFileEntry:
+    """A Kifu file found by iter_kifu_files (stat data comes from the scan)."""
+    path: str
+    size: int
+    mtime_ns: int
+
+
+def iter_kifu_files(directory: str, recursive: bool = True) -> Iterator[KifuFileEntry]:
+    """
+    Walk a directory with os.scandir and yield Kifu files (unsorted).
+
+    scandir hands back file types without extra syscalls and one stat per
+    matching file, which keeps 100k+ file trees fast compared to Path.glob.
+    Symlinked directories are not followed.
+    """
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            it = os.scandir(current)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                        continue
+                    if os.path.splitext(entry.name)[1].lower() not in KIFU_FILE_EXTENSIONS:
+                        continue
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue  # vanished or unreadable while scanning
+                yield KifuFileEntry(entry.path, st.st_size, st.st_mtime_ns)
+
+
 def scan_kifu_directory(directory: str, recursive: bool = True) -> List[str]:
     """Scan directory for Kifu files"""
-    kifu_extensions = ['.kif', '.kifu', '.csa', '.usi']
-    kifu_files = []
-    
-    path_obj = Path(directory)
-    if not path_obj.exists():
+    if not os.path.isdir(directory):
         return []
-    
-    pattern = "**/*" if recursive else "*"
-    for file_path in path_obj.glob(pattern):
-        if file_path.is_file() and file_path.suffix.lower() in kifu_extensions:
-            kifu_files.append(str(file_path))
-    
-    return sorted(kifu_files)
+    return sorted(entry.path for entry in iter_kifu_files(directory, recursive))
 
 
-def validate_usi_moves(moves: List[str]) -> Tuple[bool, List[str]]:
-    """Validate USI move format and return errors"""
+def validate_usi_moves(moves: List[str], start_sfen: Optional[str] = None,
+                       legal: bool = False) -> Tuple[bool, List[str]]:
+    """
+    Validate USI move format and return errors. With legal=True the game is
+    also replayed from start_sfen (None = startpos) with the legal move
+    generator, and the first illegal move (pins, checks, drop rules,
+    promotion) is reported.
+    """
     errors = []
     
     for i, move in enumerate(moves):
@@ -362,5 +341,13 @@ def validate_usi_moves(moves: List[str]) -> Tuple[bool, List[str]]:
         if not (re.match(r'^[1-9][a-i][1-9][a-i][+]?$', move) or  # Normal move
                 re.match(r'^[PLNSGBRKP]\*[1-9][a-i]$', move)):      # Drop move
             errors.append(f"Move {i+1}: Invalid USI format '{move}'")
-    
+
+    if legal and not errors:
+        try:
+            _, error = validate_game(moves, start_sfen)
+        except ValueError as e:
+            error = f"Invalid start position: {e}"
+        if error:
+            errors.append(error[0].upper() + error[1:])
+
     return len(errors) == 0, errors
\ No newline at end of file
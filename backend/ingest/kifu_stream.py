@@ -0,0 +1,244 @@
+"""
+kifu_stream.py
+
+Streaming reader for kifu collections.
+
+iter_games() yields one game at a time from:
+
+- a single KIF/CSA/USI file
+- a multi-game file (CSA games separated by "/", concatenated KIF exports,
+  one USI position per line)
+- a zip / tar (optionally gz/bz2/xz compressed) archive, read member by member
+  without extracting to disk
+- a directory containing any of the above
+
+Text is decoded incrementally in fixed-size chunks after sniffing the encoding
+(BOM, "#KIF ... encoding=" directive, UTF-8 validity, else CP932 which is a
+superset of Shift_JIS), so memory stays bounded by the largest single game
+rather than by the file or archive size.
+"""
+
+import bz2
+import codecs
+import gzip
+import lzma
+import os
+import re
+import tarfile
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Iterable, Iterator, List, Optional
+
+from .kifu_encoding import SNIFF_BYTES, decode_kifu_bytes, read_kifu_text, sniff_encoding  # noqa: F401
+from .kifu_loader import KifuData, KifuLoader
+
+KIFU_EXTENSIONS = {".kif": "kif", ".kifu": "kif", ".csa": "csa", ".usi": "usi"}
+_TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+_COMPRESSED = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+_CHUNK = 64 * 1024
+_KIF_HEADER = re.compile(r"^[^\s\d*&#|][^：]*：")
+
+
+@dataclass
+class StreamedGame:
+    """One game read from a file or archive member."""
+    source: str                    # path, or "archive.zip!member.kif"
+    index: int                     # game number within the source (0-based)
+    format: str                    # "kif" / "csa" / "usi"
+    data: Optional[KifuData]       # None when the game could not be parsed at all
+    error: Optional[str] = None    # parse error (moves before it are kept in data)
+
+
+# ---------------------------------------------------------------------------
+# Decoding
+# ---------------------------------------------------------------------------
+
+def iter_text_lines(stream: IO[bytes], encoding: Optional[str] = None) -> Iterator[str]:
+    """Decode a binary stream chunk by chunk and yield lines without line endings."""
+    head = stream.read(SNIFF_BYTES)
+    if isinstance(head, str):  # text-mode stream: nothing to decode
+        def decode(data, final=False):
+            return data
+    else:
+        decode = codecs.getincrementaldecoder(encoding or sniff_encoding(head))(errors="replace").decode
+    buf = ""
+    chunk = head
+    while True:
+        buf += decode(chunk, final=not chunk)
+        if "\n" in buf:
+            *lines, buf = buf.split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+        if not chunk:
+            break
+        chunk = stream.read(_CHUNK)
+    if buf:
+        yield buf.rstrip("\r")
+
+
+# ---------------------------------------------------------------------------
+# Game splitting
+# ---------------------------------------------------------------------------
+
+def split_games(lines: Iterable[str], fmt: str) -> Iterator[List[str]]:
+    """Group lines into per-game chunks for the given format."""
+    if fmt == "usi":
+        for line in lines:
+            if line.strip():
+                yield [line]
+        return
+
+    chunk: List[str] = []
+    if fmt == "csa":
+        for line in lines:
+            if line.strip() == "/":
+                if chunk:
+                    yield chunk
+                chunk = []
+            else:
+                chunk.append(line)
+        if any(line.strip() for line in chunk):
+            yield chunk
+        return
+
+    # KIF: a header line after move lines starts the next game
+    seen_moves = False
+    for line in lines:
+        s = line.strip()
+        if s[:1].isascii() and s[:1].isdigit():
+            seen_moves = True
+        elif seen_moves and _KIF_HEADER.match(s) and not s.startswith("変化："):
+            yield chunk
+            chunk = []
+            seen_moves = False
+        chunk.append(line)
+    if seen_moves or any(line.strip() for line in chunk):
+        yield chunk
+
+
+def detect_text_format(name: str, head: str) -> Optional[str]:
+    """Format from the file name, else from the first lines of text."""
+    fmt = KIFU_EXTENSIONS.get(Path(name).suffix.lower())
+    if fmt:
+        return fmt
+    for line in head.splitlines()[:50]:
+        s = line.strip()
+        if not s:
+            continue
+        if s.startswith(("startpos", "position", "sfen ")):
+            return "usi"
+        if s.startswith(("V2", "PI", "P1", "N+", "N-", "$")) or re.match(r"^[+-]\d{4}[A-Z]{2}", s):
+            return "csa"
+        if "：" in s or "手数----指手" in s:
+            return "kif"
+    return None
+
+
+def _games_from_lines(lines: Iterable[str], fmt: str, source: str) -> Iterator[StreamedGame]:
+    for index, chunk in enumerate(split_games(lines, fmt)):
+        try:
+            data = KifuLoader.parse_text("\n".join(chunk), fmt, source)
+            yield StreamedGame(source, index, fmt, data, data.metadata.parse_error)
+        except Exception as e:  # one broken game must not stop the stream
+            yield StreamedGame(source, index, fmt, None, f"{type(e).__name__}: {e}")
+
+
+def _games_from_stream(stream: IO[bytes], name: str, source: str) -> Iterator[StreamedGame]:
+    lines = iter_text_lines(stream)
+    head: List[str] = []
+    for line in lines:
+        head.append(line)
+        if len(head) >= 50:
+            break
+    fmt = detect_text_format(name, "\n".join(head))
+    if fmt is None:
+        return
+
+    def _all() -> Iterator[str]:
+        yield from head
+        yield from lines
+
+    yield from _games_from_lines(_all(), fmt, source)
+
+
+# ---------------------------------------------------------------------------
+# Sources
+# ---------------------------------------------------------------------------
+
+def _member_name(info: zipfile.ZipInfo) -> str:
+    """Zip names without the UTF-8 flag are cp437-decoded; most Japanese tools wrote CP932."""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("cp932")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def is_archive(path: str) -> bool:
+    lower = path.lower()
+    return lower.endswith(".zip") or lower.endswith(_TAR_SUFFIXES)
+
+
+def _iter_zip(path: str) -> Iterator[StreamedGame]:
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            name = _member_name(info)
+            with zf.open(info) as member:
+                yield from _games_from_stream(member, name, f"{path}!{name}")
+
+
+def _iter_tar(path: str) -> Iterator[StreamedGame]:
+    # "r|*" reads the archive strictly sequentially (no seeking, no index in memory)
+    with tarfile.open(path, mode="r|*") as tf:
+        for member in tf:
+            if not member.isfile():
+                continue
+            f = tf.extractfile(member)
+            if f is None:
+                continue
+            with f:
+                yield from _games_from_stream(f, member.name, f"{path}!{member.name}")
+
+
+def _iter_file(path: str) -> Iterator[StreamedGame]:
+    lower = path.lower()
+    opener = _COMPRESSED.get(Path(lower).suffix)
+    if opener is not None:
+        inner = path[: -len(Path(path).suffix)]
+        with opener(path, "rb") as f:
+            yield from _games_from_stream(f, inner, path)
+        return
+    with open(path, "rb") as f:
+        yield from _games_from_stream(f, path, path)
+
+
+def iter_games(path: str) -> Iterator[StreamedGame]:
+    """
+    Stream games from a file, multi-game file, zip/tar archive or directory.
+    Unknown files are skipped; broken games are yielded with `error` set.
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                lower = name.lower()
+                if is_archive(lower) or Path(lower).suffix in KIFU_EXTENSIONS or (
+                    Path(lower).suffix in _COMPRESSED
+                    and Path(lower[: -len(Path(lower).suffix)]).suffix in KIFU_EXTENSIONS
+                ):
+                    yield from iter_games(full)
+        return
+
+    lower = path.lower()
+    if lower.endswith(".zip") or (not lower.endswith(_TAR_SUFFIXES) and zipfile.is_zipfile(path)):
+        yield from _iter_zip(path)
+    elif lower.endswith(_TAR_SUFFIXES):
+        yield from _iter_tar(path)
+    else:
+        yield from _iter_file(path)
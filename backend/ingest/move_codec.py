@@ -0,0 +1,62 @@
+"""
+move_codec.py
+
+16-bit integer codes for USI moves, for compact array storage.
+
+    bits 0-6   destination square (0..80, board.py numbering)
+    bits 7-13  source square (0..80), or 81 + kind - 1 for a drop (P..R)
+    bit  14    promotion
+
+Code 0 would be "9a9a", which is never a move, so it is used for "no move"
+(empty string, "resign", unparsable input). Every syntactically valid USI
+move round-trips exactly.
+"""
+
+from typing import Iterable, List, Optional
+
+from .board import KIND_TO_SFEN, SFEN_TO_KIND, USI_SQUARES, IllegalMoveError, parse_usi_square
+
+NO_MOVE = 0
+DROP_BASE = 81
+PROMOTE_FLAG = 1 << 14
+
+_DROP_CODES = {SFEN_TO_KIND[c]: DROP_BASE + SFEN_TO_KIND[c] - 1 for c in "PLNSGBR"}
+
+
+def encode_move(move: Optional[str]) -> int:
+    """USI move -> 16-bit code; NO_MOVE for empty or non-move strings."""
+    if not move or len(move) < 4:
+        return NO_MOVE
+    try:
+        if move[1] == "*":
+            kind = SFEN_TO_KIND.get(move[0])
+            if kind not in _DROP_CODES or len(move) != 4:
+                return NO_MOVE
+            return (_DROP_CODES[kind] << 7) | parse_usi_square(move[2:4])
+        promote = move.endswith("+")
+        if len(move) != (5 if promote else 4):
+            return NO_MOVE
+        code = (parse_usi_square(move[0:2]) << 7) | parse_usi_square(move[2:4])
+    except IllegalMoveError:
+        return NO_MOVE
+    return code | PROMOTE_FLAG if promote else code
+
+
+def decode_move(code: int) -> str:
+    """16-bit code -> USI move; "" for NO_MOVE."""
+    code = int(code)
+    if code == NO_MOVE:
+        return ""
+    to_sq = code & 0x7F
+    src = (code >> 7) & 0x7F
+    if src >= DROP_BASE:
+        return f"{KIND_TO_SFEN[src - DROP_BASE + 1]}*{USI_SQUARES[to_sq]}"
+    return f"{USI_SQUARES[src]}{USI_SQUARES[to_sq]}{'+' if code & PROMOTE_FLAG else ''}"
+
+
+def encode_moves(moves: Iterable[Optional[str]]) -> List[int]:
+    return [encode_move(m) for m in moves]
+
+
+def decode_moves(codes: Iterable[int]) -> List[str]:
+    return [decode_move(c) for c in codes]
@@ -5,11 +5,14 @@ Abstract base class for Kifu providers.
 Defines interface for fetching game data from various sources.
 """
 
+import asyncio
 from abc import ABC, abstractmethod
 from typing import List, Optional, Dict, Any
 from dataclasses import dataclass
 from datetime import datetime
 
+from .catalog import CatalogEntry, KifuCatalog, ScanStats
+
 
 @dataclass
 class KifuInfo:
@@ -42,8 +45,10 @@ class KifuContent:
 class KifuProvider(ABC):
     """Abstract base class for Kifu providers"""
     
-    def __init__(self, name: str):
+    def __init__(self, name: str, catalog: Optional[KifuCatalog] = None):
         self.name = name
+        # With a catalog, search() is an indexed query; refresh_catalog() rescans
+        self.catalog = catalog
     
     @abstractmethod
     def search(self, query: Dict[str, Any]) -> List[KifuInfo]:
@@ -104,14 +109,85 @@ class KifuProvider(ABC):
         """
         return {"requests_per_minute": 60, "concurrent_requests": 1}
 
+    # ---- async interface (used by fetch_scheduler.FetchScheduler) ----
+
+    async def asearch(self, query: Dict[str, Any]) -> List[KifuInfo]:
+        """Async search(); the default runs the sync method in a worker thread"""
+        return await asyncio.to_thread(self.search, query)
+
+    async def afetch(self, game_id: str) -> Optional[KifuContent]:
+        """
+        Async fetch(); the default runs the sync method in a worker thread.
+        Network-backed providers override this with a native coroutine and
+        raise fetch_scheduler.TransientFetchError for retryable failures.
+        """
+        return await asyncio.to_thread(self.fetch, game_id)
+
+    # ---- catalog support (file-backed providers) ----
+
+    def catalog_root(self) -> Optional[str]:
+        """Folder the catalog scanner walks (None: provider is not file-backed)"""
+        return None
+
+    def catalog_metadata(self, path: str, kifu_data) -> Dict[str, Any]:
+        """Provider-specific overrides for a catalog row (default: none)"""
+        return {}
+
+    def refresh_catalog(self) -> ScanStats:
+        """Incrementally rescan catalog_root() into the catalog"""
+        if self.catalog is None or self.catalog_root() is None:
+            raise RuntimeError(f"provider {self.name} has no catalog")
+        return self.catalog.scan(self.name, self.catalog_root(),
+                                 metadata_hook=self.catalog_metadata)
+
+    def _search_catalog(self, query: Dict[str, Any], default_limit: int) -> List[KifuInfo]:
+        if self.catalog.last_scan(self.name) is None:
+            self.refresh_catalog()
+        page = self.catalog.query(
+            self.name,
+            player=query.get("player"),
+            date_from=query.get("date_from"),
+            date_to=query.get("date_to"),
+            result=query.get("result"),
+            limit=query.get("limit", default_limit),
+            offset=query.get("offset", 0),
+        )
+        return [self._info_from_entry(e) for e in page.items]
+
+    def _info_from_entry(self, entry: CatalogEntry) -> KifuInfo:
+        return KifuInfo(
+            id=entry.id,
+            source=self.name,
+            title=entry.title,
+            date=datetime.fromisoformat(entry.date) if entry.date else None,
+            sente=entry.sente,
+            gote=entry.gote,
+            result=entry.result,
+            metadata={
+                "file_path": entry.path,
+                "file_size": entry.size,
+                "source_format": entry.format,
+                "move_count": entry.moves,
+                "content_hash": entry.hash,
+            },
+        )
+
 
 class LocalFolderProvider(KifuProvider):
     """Provider for local folder scanning"""
     
-    def __init__(self, folder_path: str):
-        super().__init__("local_folder")
+    def __init__(self, folder_path: str, catalog: Optional[KifuCatalog] = None):
+        super().__init__("local_folder", catalog)
         self.folder_path = folder_path
     
+    def catalog_root(self) -> Optional[str]:
+        return self.folder_path
+
+    def get_supported_query_params(self) -> List[str]:
+        if self.catalog is not None:
+            return ["player", "date_from", "date_to", "result", "limit", "offset"]
+        return super().get_supported_query_params()
+
     def search(self, query: Dict[str, Any]) -> List[KifuInfo]:
         """Search local files based on query"""
         from ..kifu_loader import scan_kifu_directory
@@ -120,6 +196,8 @@ class LocalFolderProvider(KifuProvider):
         
         if not os.path.exists(self.folder_path):
             return []
+        if self.catalog is not None:
+            return self._search_catalog(query, default_limit=100)
         
         files = scan_kifu_directory(self.folder_path, recursive=True)
         results = []
@@ -163,7 +241,7 @@ class LocalFolderProvider(KifuProvider):
                 gote=kifu_data.metadata.gote,
                 result=kifu_data.metadata.result,
                 time_rules=kifu_data.metadata.time_rules,
-                metadata={"file_path": game_id}
+                metadata={"file_path": game_id, "format": kifu_data.metadata.source_format}
             )
             
             return KifuContent(
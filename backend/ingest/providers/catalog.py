@@ -0,0 +1,354 @@
+"""
+catalog.py
+
+SQLite catalog of provider games, so searches are index lookups instead of
+a folder walk + stat + filename parsing per query.
+
+One row per (provider, game id) with the file path, players, game date
+(parsed from the kifu header, else from the filename; never the mtime),
+result, source format, move count and a BLAKE2b-128 content hash.
+
+- scan(): incremental. Files whose size and mtime match the stored row are
+  not opened; changed files are hashed and only re-parsed when the hash
+  changed; rows of deleted files are removed. All writes of a scan happen in
+  one transaction.
+- query(): player (either side, case-insensitive exact match), date range
+  and result filters on indexed columns, newest first, limit/offset pages.
+
+CLI (e.g. from cron after new exports land):
+    python -m backend.ingest.providers.catalog --db data/kifu_catalog.sqlite3 \
+        --provider shogi_wars --root data/kifu/wars
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from ..kifu_encoding import decode_kifu_bytes
+from ..kifu_loader import KifuData, KifuLoader, iter_kifu_files
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    provider    TEXT NOT NULL,
+    id          TEXT NOT NULL,
+    path        TEXT NOT NULL,
+    title       TEXT,
+    sente       TEXT,
+    gote        TEXT,
+    sente_key   TEXT,
+    gote_key    TEXT,
+    date        TEXT,
+    result      TEXT,
+    format      TEXT,
+    moves       INTEGER NOT NULL DEFAULT 0,
+    hash        TEXT,
+    size        INTEGER NOT NULL,
+    mtime_ns    INTEGER NOT NULL,
+    error       TEXT,
+    PRIMARY KEY (provider, id)
+);
+CREATE INDEX IF NOT EXISTS games_date ON games (provider, date);
+CREATE INDEX IF NOT EXISTS games_sente ON games (provider, sente_key, date);
+CREATE INDEX IF NOT EXISTS games_gote ON games (provider, gote_key, date);
+CREATE INDEX IF NOT EXISTS games_result ON games (provider, result, date);
+CREATE INDEX IF NOT EXISTS games_hash ON games (hash);
+CREATE TABLE IF NOT EXISTS scans (
+    provider    TEXT PRIMARY KEY,
+    root        TEXT NOT NULL,
+    scanned_at  TEXT NOT NULL
+);
+"""
+
+_COLUMNS = ("provider", "id", "path", "title", "sente", "gote", "sente_key", "gote_key",
+            "date", "result", "format", "moves", "hash", "size", "mtime_ns", "error")
+
+_HEADER_DATE = re.compile(
+    r"(\d{4})\s*[/\-.年]\s*(\d{1,2})\s*[/\-.月]\s*(\d{1,2})"
+    r"(?:[^\d]{0,12}?(\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+_FILENAME_DATE = re.compile(
+    r"(?<!\d)(20\d{2}|19\d{2})-?(\d{2})-?(\d{2})(?:[_T\-]?(\d{2})(\d{2})(\d{2}))?(?!\d)")
+
+
+def _iso(parts: Tuple[Optional[str], ...]) -> Optional[str]:
+    y, mo, d, h, mi, s = (int(p) if p else 0 for p in (parts + (None,) * 6)[:6])
+    try:
+        return datetime(y, mo, d, h, mi, s).isoformat(timespec="seconds")
+    except ValueError:
+        return None
+
+
+def parse_game_date(header: Optional[str] = None, filename: Optional[str] = None) -> Optional[str]:
+    """
+    ISO-8601 game date from a kifu date header ("2024/01/02(火) 10:00:00",
+    "2024-01-02", "2024年1月2日") or a filename ("..._20240102_101500.kif").
+    """
+    if header:
+        m = _HEADER_DATE.search(header)
+        if m:
+            iso = _iso(m.groups())
+            if iso:
+                return iso
+    if filename:
+        m = _FILENAME_DATE.search(Path(filename).stem)
+        if m:
+            return _iso(m.groups())
+    return None
+
+
+def _player_key(name: Optional[str]) -> Optional[str]:
+    return name.strip().casefold() if name and name.strip() else None
+
+
+def _date_bound(value: Any, end: bool = False) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="seconds")
+    text = str(value)
+    if end and len(text) == 10:  # a bare date includes the whole day
+        return text + "T23:59:59"
+    return text
+
+
+@dataclass
+class CatalogEntry:
+    provider: str
+    id: str
+    path: str
+    title: Optional[str] = None
+    sente: Optional[str] = None
+    gote: Optional[str] = None
+    date: Optional[str] = None
+    result: Optional[str] = None
+    format: Optional[str] = None
+    moves: int = 0
+    hash: Optional[str] = None
+    size: int = 0
+    mtime_ns: int = 0
+    error: Optional[str] = None   # parse failure; the file is still listed
+
+
+@dataclass
+class CatalogPage:
+    items: List[CatalogEntry]
+    offset: int
+    limit: int
+    has_more: bool
+
+
+@dataclass
+class ScanStats:
+    added: int = 0
+    updated: int = 0
+    touched: int = 0      # mtime changed, same content: not re-parsed
+    unchanged: int = 0
+    removed: int = 0
+    errors: int = 0
+    error_details: List[Dict[str, str]] = field(default_factory=list)
+
+
+# (path, parsed kifu or None) -> overrides for the row (e.g. players from a filename)
+MetadataHook = Callable[[str, Optional[KifuData]], Dict[str, Any]]
+
+
+class KifuCatalog:
+    """SQLite-backed game catalog shared by providers (one row set per provider name)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---- scanning --------------------------------------------------------
+
+    def last_scan(self, provider: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT scanned_at FROM scans WHERE provider = ?",
+                                     (provider,)).fetchone()
+        return row[0] if row else None
+
+    def scan(self, provider: str, root: str, recursive: bool = True,
+             metadata_hook: Optional[MetadataHook] = None) -> ScanStats:
+        """Bring the provider's rows in line with the files under `root`."""
+        stats = ScanStats()
+        with self._lock:
+            known = {row[0]: (row[1], row[2], row[3]) for row in self._conn.execute(
+                "SELECT id, size, mtime_ns, hash FROM games WHERE provider = ?", (provider,))}
+
+        upserts: List[CatalogEntry] = []
+        touched: List[Tuple[int, str]] = []
+        seen = set()
+        entries = iter_kifu_files(root, recursive) if os.path.isdir(root) else iter(())
+        for f in entries:
+            seen.add(f.path)
+            old = known.get(f.path)
+            if old is not None and old[0] == f.size and old[1] == f.mtime_ns:
+                stats.unchanged += 1
+                continue
+            try:
+                with open(f.path, "rb") as fh:
+                    data = fh.read()
+            except OSError as e:
+                stats.errors += 1
+                stats.error_details.append({"file": f.path, "reason": str(e)})
+                continue
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            if old is not None and old[2] == digest:
+                touched.append((f.mtime_ns, f.path))
+                stats.touched += 1
+                continue
+            entry = self._describe(provider, f.path, data, digest, f.size, f.mtime_ns, metadata_hook)
+            if entry.error:
+                stats.errors += 1
+                stats.error_details.append({"file": f.path, "reason": entry.error})
+            upserts.append(entry)
+            if old is None:
+                stats.added += 1
+            else:
+                stats.updated += 1
+
+        removed = [gid for gid in known if gid not in seen]
+        stats.removed = len(removed)
+        placeholders = ",".join("?" * len(_COLUMNS))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO games ({','.join(_COLUMNS)}) VALUES ({placeholders})",
+                (self._row(e) for e in upserts))
+            self._conn.executemany("UPDATE games SET mtime_ns = ? WHERE provider = ? AND id = ?",
+                                   ((m, provider, p) for m, p in touched))
+            self._conn.executemany("DELETE FROM games WHERE provider = ? AND id = ?",
+                                   ((provider, gid) for gid in removed))
+            self._conn.execute("INSERT OR REPLACE INTO scans VALUES (?, ?, ?)",
+                               (provider, root, datetime.now().isoformat(timespec="seconds")))
+        return stats
+
+    @staticmethod
+    def _describe(provider: str, path: str, data: bytes, digest: str, size: int, mtime_ns: int,
+                  metadata_hook: Optional[MetadataHook]) -> CatalogEntry:
+        entry = CatalogEntry(provider=provider, id=path, path=path, hash=digest,
+                             size=size, mtime_ns=mtime_ns, title=Path(path).stem)
+        kifu: Optional[KifuData] = None
+        try:
+            fmt = KifuLoader.detect_format(path)
+            kifu = KifuLoader.parse_text(decode_kifu_bytes(data), fmt, path)
+            meta = kifu.metadata
+            entry.format = meta.source_format or fmt
+            entry.title = meta.title or entry.title
+            entry.sente, entry.gote, entry.result = meta.sente, meta.gote, meta.result
+            entry.moves = len(kifu.usi_moves)
+            entry.date = parse_game_date(meta.date, path)
+            if meta.parse_error:
+                entry.error = meta.parse_error
+        except Exception as e:
+            entry.error = f"{type(e).__name__}: {e}"
+            entry.date = parse_game_date(None, path)
+        if metadata_hook is not None:
+            for key, value in (metadata_hook(path, kifu) or {}).items():
+                if value is not None and hasattr(entry, key):
+                    setattr(entry, key, value)
+        return entry
+
+    @staticmethod
+    def _row(e: CatalogEntry) -> Tuple[Any, ...]:
+        return (e.provider, e.id, e.path, e.title, e.sente, e.gote, _player_key(e.sente),
+                _player_key(e.gote), e.date, e.result, e.format, e.moves, e.hash, e.size,
+                e.mtime_ns, e.error)
+
+    # ---- queries ---------------------------------------------------------
+
+    def query(self, provider: str,
+              player: Optional[str] = None,
+              date_from: Any = None,
+              date_to: Any = None,
+              result: Optional[str] = None,
+              limit: int = 50,
+              offset: int = 0) -> CatalogPage:
+        """Newest games first (undated games last); one page of at most `limit` rows."""
+        where, args = ["provider = ?"], [provider]
+        lo, hi = _date_bound(date_from), _date_bound(date_to, end=True)
+        if lo:
+            where.append("date >= ?")
+            args.append(lo)
+        if hi:
+            where.append("date <= ?")
+            args.append(hi)
+        if result:
+            where.append("result = ?")
+            args.append(result)
+        cond = " AND ".join(where)
+        limit = max(1, int(limit))
+        offset = max(0, int(offset))
+        order = " ORDER BY date IS NULL, date DESC, id"
+        cols = ", ".join(c for c in _COLUMNS if not c.endswith("_key"))
+        key = _player_key(player)
+        if key:
+            # two index range scans (one per side) instead of an OR over both columns
+            sql = (f"SELECT {cols} FROM games WHERE {cond} AND sente_key = ? "
+                   f"UNION SELECT {cols} FROM games WHERE {cond} AND gote_key = ?")
+            sql = f"SELECT * FROM ({sql}){order} LIMIT ? OFFSET ?"
+            params = args + [key] + args + [key] + [limit + 1, offset]
+        else:
+            sql = f"SELECT {cols} FROM games WHERE {cond}{order} LIMIT ? OFFSET ?"
+            params = args + [limit + 1, offset]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        items = [CatalogEntry(*row) for row in rows[:limit]]
+        return CatalogPage(items=items, offset=offset, limit=limit, has_more=len(rows) > limit)
+
+    def get(self, provider: str, game_id: str) -> Optional[CatalogEntry]:
+        cols = ", ".join(c for c in _COLUMNS if not c.endswith("_key"))
+        with self._lock:
+            row = self._conn.execute(f"SELECT {cols} FROM games WHERE provider = ? AND id = ?",
+                                     (provider, game_id)).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def count(self, provider: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM games WHERE provider = ?",
+                                      (provider,)).fetchone()[0]
+
+    def iter_entries(self, provider: str) -> Iterator[CatalogEntry]:
+        page = self.query(provider, limit=1000)
+        while True:
+            yield from page.items
+            if not page.has_more:
+                return
+            page = self.query(provider, limit=1000, offset=page.offset + page.limit)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Incrementally scan a kifu folder into the catalog")
+    ap.add_argument("--db", default=os.getenv("KIFU_CATALOG_DB", "data/kifu_catalog.sqlite3"))
+    ap.add_argument("--provider", default="local_folder")
+    ap.add_argument("--root", default=os.getenv("KIFU_DIR", "data/kifu"))
+    args = ap.parse_args(argv)
+
+    catalog = KifuCatalog(args.db)
+    try:
+        stats = catalog.scan(args.provider, args.root)
+        print(json.dumps(dict(asdict(stats), total=catalog.count(args.provider)), ensure_ascii=False))
+    finally:
+        catalog.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
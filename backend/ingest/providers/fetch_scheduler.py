@@ -0,0 +1,237 @@
+"""
+fetch_scheduler.py
+
+Concurrent, rate-limited fetching from a KifuProvider.
+
+FetchScheduler honours the provider's get_rate_limits():
+
+- concurrent_requests: at most this many afetch() calls in flight
+  (0 = no network limit, DEFAULT_LOCAL_CONCURRENCY is used)
+- requests_per_minute: a token bucket (burst = concurrent_requests) paces
+  every attempt, retries included (0 = unlimited)
+
+Transient failures (TransientFetchError, OSError, TimeoutError) are retried
+with exponential backoff and jitter; any other exception, or a provider
+returning None, is final. Results are yielded as soon as each fetch
+completes, not in input order.
+
+iter_fetched() runs the scheduler on its own event loop thread and hands the
+outcomes to synchronous code (the batch annotator) through a bounded queue,
+so a slow consumer slows the fetching down instead of buffering everything.
+"""
+
+import asyncio
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterable, Iterator, List, Optional
+
+from .base import KifuContent, KifuProvider
+
+DEFAULT_LOCAL_CONCURRENCY = 8
+
+
+class TransientFetchError(Exception):
+    """A fetch failure worth retrying (timeouts, 429/5xx, flaky mounts)."""
+
+
+RETRYABLE = (TransientFetchError, OSError, TimeoutError)
+
+
+class TokenBucket:
+    """Async token bucket: `rate_per_minute` sustained, up to `burst` at once."""
+
+    def __init__(self, rate_per_minute: float, burst: int = 1,
+                 clock=time.monotonic, sleep=asyncio.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        # the lock keeps waiters FIFO: each one sleeps for its own token in turn
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1.0:
+                await self._sleep((1.0 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1.0
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay_s: float = 0.5
+    max_delay_s: float = 30.0
+    jitter: float = 0.2          # +-20% so retries from parallel fetches spread out
+
+    def delay(self, attempt: int, rng: random.Random) -> float:
+        """Sleep before attempt number `attempt + 1` (attempt counts from 1)."""
+        d = min(self.max_delay_s, self.base_delay_s * (2 ** (attempt - 1)))
+        return d * (1.0 + rng.uniform(-self.jitter, self.jitter))
+
+
+@dataclass
+class FetchOutcome:
+    game_id: str
+    content: Optional[KifuContent] = None
+    error: Optional[str] = None      # None with content None means "not found"
+    attempts: int = 0
+    elapsed_s: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.content is not None
+
+
+@dataclass
+class FetchStats:
+    requests: int = 0
+    retries: int = 0
+    succeeded: int = 0
+    not_found: int = 0
+    failed: int = 0
+    max_in_flight: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+class FetchScheduler:
+    """Fan out provider.afetch() under the provider's concurrency and rate limits."""
+
+    def __init__(self, provider: KifuProvider,
+                 concurrent: Optional[int] = None,
+                 requests_per_minute: Optional[float] = None,
+                 retry: Optional[RetryPolicy] = None,
+                 seed: Optional[int] = None):
+        limits = provider.get_rate_limits() or {}
+        if concurrent is None:
+            concurrent = int(limits.get("concurrent_requests") or 0)
+        if requests_per_minute is None:
+            requests_per_minute = float(limits.get("requests_per_minute") or 0)
+        self.provider = provider
+        self.concurrent = concurrent if concurrent > 0 else DEFAULT_LOCAL_CONCURRENCY
+        self.requests_per_minute = requests_per_minute
+        self.retry = retry or RetryPolicy()
+        self.stats = FetchStats()
+        self._rng = random.Random(seed)
+        self._bucket: Optional[TokenBucket] = None
+        self._in_flight = 0
+
+    async def _fetch_one(self, game_id: str) -> FetchOutcome:
+        t0 = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            if self._bucket is not None:
+                await self._bucket.acquire()
+            self.stats.requests += 1
+            self._in_flight += 1
+            self.stats.max_in_flight = max(self.stats.max_in_flight, self._in_flight)
+            try:
+                content = await self.provider.afetch(game_id)
+            except RETRYABLE as e:
+                error = f"{type(e).__name__}: {e}"
+                if attempt >= self.retry.max_attempts:
+                    self.stats.failed += 1
+                    self.stats.errors.append(f"{game_id}: {error}")
+                    return FetchOutcome(game_id, error=error, attempts=attempt,
+                                        elapsed_s=time.perf_counter() - t0)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                self.stats.failed += 1
+                self.stats.errors.append(f"{game_id}: {error}")
+                return FetchOutcome(game_id, error=error, attempts=attempt,
+                                    elapsed_s=time.perf_counter() - t0)
+            else:
+                if content is None:
+                    self.stats.not_found += 1
+                else:
+                    self.stats.succeeded += 1
+                return FetchOutcome(game_id, content=content, attempts=attempt,
+                                    elapsed_s=time.perf_counter() - t0)
+            finally:
+                self._in_flight -= 1
+            self.stats.retries += 1
+            await asyncio.sleep(self.retry.delay(attempt, self._rng))
+
+    async def fetch_many(self, game_ids: Iterable[str]) -> AsyncIterator[FetchOutcome]:
+        """Yield outcomes as fetches complete; never more than `concurrent` in flight."""
+        if self.requests_per_minute and self.requests_per_minute > 0:
+            # asyncio primitives belong to one loop: a fresh bucket per run
+            self._bucket = TokenBucket(self.requests_per_minute, burst=self.concurrent)
+        ids = iter(game_ids)
+        pending = set()
+        try:
+            while True:
+                while len(pending) < self.concurrent:
+                    game_id = next(ids, None)
+                    if game_id is None:
+                        break
+                    pending.add(asyncio.ensure_future(self._fetch_one(game_id)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def iter_fetched(scheduler: FetchScheduler, game_ids: Iterable[str],
+                 buffer: Optional[int] = None,
+                 stop: Optional[threading.Event] = None) -> Iterator[FetchOutcome]:
+    """
+    Synchronous view of scheduler.fetch_many(): the event loop runs in a
+    background thread and at most `buffer` finished outcomes wait for the
+    consumer. Setting `stop` (or closing the iterator) ends fetching early.
+    """
+    out: "queue.Queue" = queue.Queue(maxsize=max(1, buffer or scheduler.concurrent * 2))
+    stop = stop or threading.Event()
+    done = object()
+
+    async def produce() -> None:
+        try:
+            async for outcome in scheduler.fetch_many(game_ids):
+                while not stop.is_set():
+                    try:
+                        out.put_nowait(outcome)
+                        break
+                    except queue.Full:
+                        await asyncio.sleep(0.01)
+                if stop.is_set():
+                    return
+        except BaseException as e:  # surfaced to the consumer below
+            out.put(e)
+        finally:
+            out.put(done)
+
+    thread = threading.Thread(target=lambda: asyncio.run(produce()),
+                              name="kifu-fetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = out.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive():   # unblock a producer stuck on a full queue
+            try:
+                out.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        thread.join()
@@ -11,6 +11,7 @@ import os
 from pathlib import Path
 
 from .base import KifuProvider, KifuInfo, KifuContent
+from .catalog import KifuCatalog
 
 
 class ShogiWarsProvider(KifuProvider):
@@ -26,8 +27,9 @@ class ShogiWarsProvider(KifuProvider):
     3. Use this provider to access the exported files
     """
     
-    def __init__(self, exported_folder: str = "data/kifu/wars"):
-        super().__init__("shogi_wars")
+    def __init__(self, exported_folder: str = "data/kifu/wars",
+                 catalog: Optional[KifuCatalog] = None):
+        super().__init__("shogi_wars", catalog)
         self.exported_folder = exported_folder
         self._rate_limits = {
             "requests_per_minute": 0,  # No network requests
@@ -45,12 +47,17 @@ class ShogiWarsProvider(KifuProvider):
                 - date_from: datetime - Filter by file modification date
                 - date_to: datetime - Filter by file modification date
                 - limit: int - Maximum results (default: 50)
+                With a catalog, player is an exact (case-insensitive) match on
+                either side, dates are game dates, and result / offset are
+                supported too.
                 
         Returns:
             List of KifuInfo objects from exported files
         """
         if not self.is_available():
             return []
+        if self.catalog is not None:
+            return self._search_catalog(query, default_limit=50)
         
         from ..kifu_loader import scan_kifu_directory
         
@@ -155,7 +162,17 @@ class ShogiWarsProvider(KifuProvider):
     
     def get_supported_query_params(self) -> List[str]:
         """Parameters supported by this provider"""
+        if self.catalog is not None:
+            return ["player", "date_from", "date_to", "result", "limit", "offset"]
         return ["player", "date_from", "date_to", "limit"]
+
+    def catalog_root(self) -> Optional[str]:
+        return self.exported_folder
+
+    def catalog_metadata(self, path: str, kifu_data) -> Dict[str, Any]:
+        """Players from the export filename win over the file headers (as in fetch)"""
+        title, sente, gote = self._parse_filename_metadata(os.path.basename(path))
+        return {"title": title if sente else None, "sente": sente, "gote": gote}
     
     def get_rate_limits(self) -> Dict[str, Any]:
         """No rate limits for local file access"""
@@ -265,14 +282,16 @@ For now, this provider only supports manually exported files.
 """
 
 
-def from_exported_folder(folder_path: str = "data/kifu/wars") -> ShogiWarsProvider:
+def from_exported_folder(folder_path: str = "data/kifu/wars",
+                         catalog: Optional[KifuCatalog] = None) -> ShogiWarsProvider:
     """
     Convenience function to create provider from exported folder.
     
     Args:
         folder_path: Path to folder containing exported files
+        catalog: Optional KifuCatalog for indexed searches
         
     Returns:
         Configured ShogiWarsProvider instance
     """
-    return ShogiWarsProvider(folder_path)
\ No newline at end of file
+    return ShogiWarsProvider(folder_path, catalog)
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""
+simulated.py
+
+Local stand-in for a network-backed provider: serves the games of a
+LocalFolderProvider through a native async afetch() that adds artificial
+latency and, optionally, random transient failures, and advertises
+configurable rate limits. Used to exercise FetchScheduler and the streaming
+annotation path without any network access.
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from .base import KifuContent, KifuInfo, KifuProvider, LocalFolderProvider
+from .fetch_scheduler import TransientFetchError
+
+
+class SimulatedLatencyProvider(KifuProvider):
+    """Wraps a local folder; every fetch takes `latency_s` (+- jitter) and may fail."""
+
+    def __init__(self, folder_path: str,
+                 latency_s: float = 0.2,
+                 jitter_s: float = 0.0,
+                 failure_rate: float = 0.0,
+                 requests_per_minute: int = 60,
+                 concurrent_requests: int = 4,
+                 seed: Optional[int] = None):
+        super().__init__("simulated")
+        self.local = LocalFolderProvider(folder_path)
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.failure_rate = failure_rate
+        self._limits = {"requests_per_minute": requests_per_minute,
+                        "concurrent_requests": concurrent_requests}
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.call_times: List[float] = []   # monotonic start time of every fetch
+
+    def _latency(self) -> float:
+        return max(0.0, self.latency_s + self._rng.uniform(-self.jitter_s, self.jitter_s))
+
+    def search(self, query: Dict[str, Any]) -> List[KifuInfo]:
+        return [KifuInfo(**{**info.__dict__, "source": self.name})
+                for info in self.local.search(query)]
+
+    def fetch(self, game_id: str) -> Optional[KifuContent]:
+        time.sleep(self._latency())
+        return self.local.fetch(game_id)
+
+    async def afetch(self, game_id: str) -> Optional[KifuContent]:
+        self.calls += 1
+        self.call_times.append(time.monotonic())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self._latency())
+            if self._rng.random() < self.failure_rate:
+                raise TransientFetchError(f"simulated failure for {game_id}")
+        finally:
+            self.in_flight -= 1
+        content = await asyncio.to_thread(self.local.fetch, game_id)
+        if content is not None:
+            content.info.source = self.name
+        return content
+
+    def is_available(self) -> bool:
+        return self.local.is_available()
+
+    def get_rate_limits(self) -> Dict[str, Any]:
+        return dict(self._limits)
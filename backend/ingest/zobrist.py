@@ -0,0 +1,89 @@
+"""
+zobrist.py
+
+64-bit Zobrist hashes of shogi positions (board + hands + side to move; the
+move number is not part of the position).
+
+position_hash() hashes a Board from scratch; HashedBoard wraps a Board and
+updates the hash incrementally on every push_usi(), which is what corpus
+indexers use to hash every position of every game in one pass. Both give the
+same value for the same position, however it was reached.
+"""
+
+import random
+from typing import List, Optional
+
+from .board import KIND_MASK, WHITE, Board, IllegalMoveError, SFEN_TO_KIND, parse_usi_square, unpromote
+
+_SEED = 0x5F3759DF
+_MAX_HAND = 18
+
+_rng = random.Random(_SEED)
+# piece codes are kind | WHITE_FLAG (< 32); code 0 (empty) hashes to 0
+ZOBRIST_PIECE: List[List[int]] = [[0] + [_rng.getrandbits(64) for _ in range(31)] for _ in range(81)]
+# [color][kind][count]; count 0 hashes to 0
+ZOBRIST_HAND: List[List[List[int]]] = [
+    [[0] + [_rng.getrandbits(64) for _ in range(_MAX_HAND)] for _ in range(9)] for _ in range(2)
+]
+ZOBRIST_WHITE_TO_MOVE = _rng.getrandbits(64)
+
+
+def position_hash(board: Board) -> int:
+    h = 0
+    for sq, piece in enumerate(board.squares):
+        if piece:
+            h ^= ZOBRIST_PIECE[sq][piece]
+    for color in (0, 1):
+        for kind, count in enumerate(board.hands[color]):
+            if count:
+                h ^= ZOBRIST_HAND[color][kind][count]
+    if board.turn == WHITE:
+        h ^= ZOBRIST_WHITE_TO_MOVE
+    return h
+
+
+def sfen_hash(sfen: Optional[str]) -> int:
+    """Hash of an SFEN ("startpos", "sfen ...", bare); ValueError when it does not parse."""
+    return position_hash(Board.from_sfen(sfen))
+
+
+class HashedBoard:
+    """A Board plus its Zobrist hash, kept up to date move by move."""
+
+    __slots__ = ("board", "hash")
+
+    def __init__(self, board: Optional[Board] = None):
+        self.board = board if board is not None else Board.from_sfen(None)
+        self.hash = position_hash(self.board)
+
+    @classmethod
+    def from_sfen(cls, sfen: Optional[str] = None) -> "HashedBoard":
+        return cls(Board.from_sfen(sfen))
+
+    def push_usi(self, move: str) -> int:
+        """Board.push_usi() plus the hash update. After IllegalMoveError the hash is stale."""
+        board = self.board
+        color = board.turn
+        squares = board.squares
+        if len(move) >= 4 and move[1] == "*":
+            kind = SFEN_TO_KIND.get(move[0], 0)
+            to_sq = parse_usi_square(move[2:4])
+            board.push_usi(move)
+            count = board.hands[color][kind]
+            self.hash ^= (ZOBRIST_HAND[color][kind][count + 1] ^ ZOBRIST_HAND[color][kind][count]
+                          ^ ZOBRIST_PIECE[to_sq][squares[to_sq]] ^ ZOBRIST_WHITE_TO_MOVE)
+            return 0
+        if len(move) < 4:
+            raise IllegalMoveError(f"bad USI move: {move!r}")
+        from_sq = parse_usi_square(move[0:2])
+        to_sq = parse_usi_square(move[2:4])
+        moved, target = squares[from_sq], squares[to_sq]
+        captured = board.push_usi(move)
+        h = self.hash ^ ZOBRIST_PIECE[from_sq][moved] ^ ZOBRIST_PIECE[to_sq][target]
+        h ^= ZOBRIST_PIECE[to_sq][squares[to_sq]] ^ ZOBRIST_WHITE_TO_MOVE
+        if captured:
+            kind = unpromote(captured & KIND_MASK)
+            count = board.hands[color][kind]
+            h ^= ZOBRIST_HAND[color][kind][count - 1] ^ ZOBRIST_HAND[color][kind][count]
+        self.hash = h
+        return captured
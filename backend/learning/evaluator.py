@@ -5,7 +5,8 @@ Answer evaluator and feedback generator
 import uuid
 from typing import Dict, List, Any
 from datetime import datetime
-from .models import Quiz, Attempt, storage
+from .models import Quiz, Attempt
+from .storage import get_storage
 from .schemas import (
     SubmitAnswerResponse, 
     FeedbackItem, 
@@ -65,7 +66,7 @@ class AnswerEvaluator:
         """回答を評価してフィードバックを生成"""
         
         # クイズ取得
-        quiz = storage.get_quiz(quiz_id)
+        quiz = get_storage().get_quiz(quiz_id)
         if not quiz:
             raise ValueError(f"Quiz not found: {quiz_id}")
         
@@ -90,7 +91,7 @@ class AnswerEvaluator:
             score=score,
             time_taken_ms=time_taken_ms
         )
-        storage.save_attempt(attempt)
+        get_storage().save_attempt(attempt)
         
         # 正解選択肢の手を取得
         correct_choice = next(
@@ -5,22 +5,41 @@ Quiz generator from reasoning output
 import uuid
 import random
 from typing import List, Dict, Any, Optional
-from .models import Quiz, storage
+from ..ingest.board import Board, IllegalMoveError
+from ..ingest.movegen import is_legal
+from .models import Quiz
+from .quiz_bank import draw_for_user, get_quiz_bank, legal_distractors
+from .storage import get_storage
 from .schemas import GamePhase, QuizType
 
 
+def note_position(note: Dict[str, Any], usi: Optional[str] = None) -> Optional[Board]:
+    """
+    注釈の手を指す前の局面。note の "sfen"、無ければ棋譜 usi（"startpos moves ..."）を
+    ply - 1 手目まで進めた局面。どちらも無ければ ply 1（または ply なし）のときだけ平手初期局面。
+    局面が分からないときは None
+    """
+    ply = note.get("ply")
+    try:
+        if note.get("sfen"):
+            return Board.from_sfen(note["sfen"])
+        base, _, tail = (usi or "startpos").partition(" moves")
+        if not usi and isinstance(ply, int) and ply > 1:
+            return None
+        board = Board.from_sfen(base)
+        for move in tail.split()[:max(0, ply - 1) if isinstance(ply, int) else 0]:
+            board.push_usi(move)
+        return board
+    except (ValueError, IllegalMoveError):
+        return None
+
+
 class QuizGenerator:
     """reasoning出力からクイズを生成"""
     
-    def __init__(self):
-        self.move_options = [
-            "7g7f", "2g2f", "8h8f", "6i7h", "5i6h", "3g3f", "4g4f", "1g1f",
-            "7i6h", "3i4h", "2h3h", "5g5f", "6g6f", "9g9f", "8g8f",
-            "2f2e", "7f7e", "3f3e", "4f4e", "5f5e", "6f6e", "8f8e"
-        ]
-    
-    def generate_quizzes(self, reasoning_notes: List[Dict[str, Any]], count: int = 3) -> List[Quiz]:
-        """reasoning出力から複数の問題を生成"""
+    def generate_quizzes(self, reasoning_notes: List[Dict[str, Any]], count: int = 3,
+                         user_id: Optional[str] = None, usi: Optional[str] = None) -> List[Quiz]:
+        """reasoning出力から複数の問題を生成（usi: 注釈に sfen が無いときに局面を復元する棋譜）"""
         quizzes = []
         
         # 有効な注釈データをフィルタ
@@ -30,15 +49,15 @@ class QuizGenerator:
         ]
         
         if not valid_notes:
-            # フォールバック: ダミー問題を生成
-            return self._generate_fallback_quizzes(count)
+            # 事前構築したクイズバンクから抽選し、無ければダミー問題
+            return self._generate_bank_quizzes(count, user_id) or self._generate_fallback_quizzes(count)
         
         # 問題種類を決定
         quiz_types = self._select_quiz_types(valid_notes, count)
         
         for i, quiz_type in enumerate(quiz_types):
             note = valid_notes[i % len(valid_notes)]
-            quiz = self._generate_single_quiz(note, quiz_type)
+            quiz = self._generate_single_quiz(note, quiz_type, usi)
             if quiz:
                 quizzes.append(quiz)
         
@@ -62,7 +81,8 @@ class QuizGenerator:
         
         return types
     
-    def _generate_single_quiz(self, note: Dict[str, Any], quiz_type: QuizType) -> Optional[Quiz]:
+    def _generate_single_quiz(self, note: Dict[str, Any], quiz_type: QuizType,
+                              usi: Optional[str] = None) -> Optional[Quiz]:
         """単一問題生成"""
         try:
             reasoning = note.get("reasoning", {})
@@ -74,7 +94,7 @@ class QuizGenerator:
             
             # 問題種別ごとの生成
             if quiz_type == QuizType.BEST_MOVE:
-                return self._generate_best_move_quiz(note, phase)
+                return self._generate_best_move_quiz(note, phase, usi)
             elif quiz_type == QuizType.EVALUATION:
                 return self._generate_evaluation_quiz(note, phase)
             elif quiz_type == QuizType.PRINCIPLES:
@@ -84,12 +104,16 @@ class QuizGenerator:
             print(f"Quiz generation error: {e}")
             return None
     
-    def _generate_best_move_quiz(self, note: Dict[str, Any], phase: GamePhase) -> Quiz:
-        """最善手問題生成"""
+    def _generate_best_move_quiz(self, note: Dict[str, Any], phase: GamePhase,
+                                 usi: Optional[str] = None) -> Optional[Quiz]:
+        """最善手問題生成（局面が分からない、または推奨手が指せない注釈からは作らない）"""
         move = note.get("move", "7g7f")
         bestmove = note.get("bestmove", move)
         reasoning = note.get("reasoning", {})
         summary = reasoning.get("summary", "手筋を考える局面")
+        board = note_position(note, usi)
+        if board is None or not is_legal(board, bestmove):
+            return None
         
         # 選択肢生成（正解 + ダミー3つ）
         choices = []
@@ -102,10 +126,9 @@ class QuizGenerator:
             "description": "推奨手"
         })
         
-        # ダミー選択肢
-        dummy_moves = random.sample(
-            [m for m in self.move_options if m != correct_move], 3
-        )
+        # ダミー選択肢（その局面の合法手から、実際に指された手を優先）
+        dummy_moves = legal_distractors(board, correct_move, preferred=[move],
+                                        seed=random.randrange(1 << 30))
         for i, dummy_move in enumerate(dummy_moves):
             choices.append({
                 "id": chr(66 + i),  # B, C, D
@@ -261,6 +284,17 @@ class QuizGenerator:
         else:
             return 5  # 難しい
     
+    def _generate_bank_quizzes(self, count: int, user_id: Optional[str] = None) -> List[Quiz]:
+        """クイズバンク（QUIZ_BANK_DB）から出題。ユーザー指定時は復習・苦手分野を優先。未構築なら空リスト"""
+        bank = get_quiz_bank()
+        if bank is None:
+            return []
+        if user_id:
+            items = draw_for_user(bank, get_storage().scheduler, user_id, count)
+        else:
+            items = bank.sample(count)
+        return [item.to_quiz() for item in items]
+
     def _generate_fallback_quizzes(self, count: int) -> List[Quiz]:
         """フォールバック問題生成"""
         fallback_quizzes = []
@@ -291,7 +325,7 @@ class QuizGenerator:
         """問題を保存してセッション作成"""
         quiz_ids = []
         for quiz in quizzes:
-            storage.save_quiz(quiz)
+            get_storage().save_quiz(quiz)
             quiz_ids.append(quiz.id)
         
-        return storage.create_session(quiz_ids)
\ No newline at end of file
+        return get_storage().create_session(quiz_ids)
\ No newline at end of file
@@ -1,14 +1,24 @@
 """
-Data models for learning system (in-memory implementation)
+Data models and storage interface for the learning system
+
+LearningStorage is the storage contract; InMemoryStorage keeps everything in
+dicts (tests, throwaway dev servers) and storage.SQLiteLearningStorage is the
+persistent implementation. storage.get_storage() returns the process-wide one.
 """
 
+import time
 import uuid
+from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Sequence
 from dataclasses import dataclass, field
+from .scheduler import ReviewScheduler, ReviewState
 from .schemas import GamePhase, QuizType, Quiz as QuizSchema
 
 
+RECENT_RESULTS = 5
+
+
 @dataclass
 class UserProgress:
     """ユーザー学習進捗"""
@@ -23,13 +33,17 @@ class UserProgress:
     correct_answers: int = 0
     phase_stats: Dict[GamePhase, Dict[str, Any]] = field(default_factory=dict)
     type_stats: Dict[QuizType, Dict[str, Any]] = field(default_factory=dict)
+    tag_stats: Dict[str, Dict[str, Any]] = field(default_factory=dict)    # クイズバンクのタグ別
+    recent_results: List[bool] = field(default_factory=list)  # 直近 RECENT_RESULTS 回の正誤（古い順）
     
-    def add_attempt(self, quiz_type: QuizType, phase: GamePhase, correct: bool, score: int):
+    def add_attempt(self, quiz_type: QuizType, phase: GamePhase, correct: bool, score: int,
+                    tags: Sequence[str] = ()):
         """回答試行を記録"""
         self.total_attempts += 1
         if correct:
             self.correct_answers += 1
         self.total_score += score
+        self.recent_results = (self.recent_results + [correct])[-RECENT_RESULTS:]
         
         # レベル計算（100点毎にレベルアップ）
         self.level = max(1, self.total_score // 100 + 1)
@@ -49,6 +63,14 @@ class UserProgress:
         if correct:
             self.type_stats[quiz_type]["correct"] += 1
         self.type_stats[quiz_type]["total_score"] += score
+
+        # タグ別統計
+        for tag in tags:
+            stats = self.tag_stats.setdefault(tag, {"attempts": 0, "correct": 0, "total_score": 0})
+            stats["attempts"] += 1
+            if correct:
+                stats["correct"] += 1
+            stats["total_score"] += score
         
         self.updated_at = datetime.now()
     
@@ -78,6 +100,15 @@ class Quiz:
     source_reasoning: Dict[str, Any]
     created_at: datetime = field(default_factory=datetime.now)
     
+    @property
+    def review_key(self) -> Optional[str]:
+        """復習キュー上のキー（クイズバンクの局面のみ。再構築しても変わらない）"""
+        return (self.source_reasoning or {}).get("position_hash")
+
+    @property
+    def tags(self) -> List[str]:
+        return list((self.source_reasoning or {}).get("tags") or [])
+
     def to_schema(self) -> QuizSchema:
         """Pydanticスキーマに変換"""
         from .schemas import QuizChoice
@@ -108,14 +139,73 @@ class Attempt:
     created_at: datetime = field(default_factory=datetime.now)
 
 
-class InMemoryStorage:
-    """インメモリストレージ（MVP用）"""
+class LearningStorage(ABC):
+    """学習データの保存先インターフェース"""
+
+    @abstractmethod
+    def get_user(self, user_id: str) -> UserProgress:
+        """ユーザー進捗取得（未登録なら初期状態）"""
+        pass
+
+    @abstractmethod
+    def save_quiz(self, quiz: Quiz) -> None:
+        """クイズ保存"""
+        pass
+
+    @abstractmethod
+    def get_quiz(self, quiz_id: str) -> Optional[Quiz]:
+        """クイズ取得（未登録・期限切れなら None）"""
+        pass
+
+    @abstractmethod
+    def save_attempt(self, attempt: Attempt) -> None:
+        """回答履歴保存とユーザー集計の更新"""
+        pass
+
+    @abstractmethod
+    def create_session(self, quiz_ids: List[str], user_id: Optional[str] = None) -> str:
+        """セッション作成（セッションIDを返す）"""
+        pass
+
+    def load_reviews(self, user_id: str) -> List[ReviewState]:
+        """ユーザーの復習状態（ReviewScheduler が初回に読み込む）"""
+        return []
+
+    def _schedule(self, attempt: "Attempt", quiz: Optional[Quiz]) -> Optional[ReviewState]:
+        """回答を復習・弱点キューに反映し、保存すべき復習状態を返す"""
+        if quiz is None:
+            return None
+        return self.scheduler.record(attempt.user_id, attempt.correct, quiz.phase, quiz.tags,
+                                     quiz.review_key, now=attempt.created_at.timestamp())
+
+    @abstractmethod
+    def get_session_quizzes(self, session_id: str) -> List[str]:
+        """セッションのクイズID一覧（期限切れ・未登録なら空）"""
+        pass
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        """期限切れのセッションとクイズを削除し、削除件数を返す"""
+        return 0
+
+    def flush(self) -> None:
+        """バッファ中の書き込みを確定する"""
+
+    def close(self) -> None:
+        self.flush()
+
+
+class InMemoryStorage(LearningStorage):
+    """インメモリストレージ（テスト・開発用）"""
     
-    def __init__(self):
+    def __init__(self, ttl_s: Optional[float] = None):
+        self.ttl_s = ttl_s
         self.users: Dict[str, UserProgress] = {}
         self.quizzes: Dict[str, Quiz] = {}
         self.attempts: Dict[str, Attempt] = {}
         self.sessions: Dict[str, List[str]] = {}  # session_id -> [quiz_ids]
+        self._session_created: Dict[str, float] = {}
+        self.reviews: Dict[str, Dict[str, ReviewState]] = {}  # user_id -> item_key -> state
+        self.scheduler = ReviewScheduler(self)
     
     def get_user(self, user_id: str) -> UserProgress:
         """ユーザー進捗取得"""
@@ -138,19 +228,35 @@ class InMemoryStorage:
         # ユーザー進捗更新
         user = self.get_user(attempt.user_id)
         quiz = self.get_quiz(attempt.quiz_id)
+        review = self._schedule(attempt, quiz)
+        if review is not None:
+            self.reviews.setdefault(review.user_id, {})[review.item_key] = review
         if quiz:
-            user.add_attempt(quiz.quiz_type, quiz.phase, attempt.correct, attempt.score)
+            user.add_attempt(quiz.quiz_type, quiz.phase, attempt.correct, attempt.score, quiz.tags)
     
-    def create_session(self, quiz_ids: List[str]) -> str:
+    def create_session(self, quiz_ids: List[str], user_id: Optional[str] = None) -> str:
         """セッション作成"""
         session_id = str(uuid.uuid4())
         self.sessions[session_id] = quiz_ids
+        self._session_created[session_id] = time.time()
         return session_id
     
     def get_session_quizzes(self, session_id: str) -> List[str]:
         """セッションのクイズID一覧取得"""
         return self.sessions.get(session_id, [])
 
+    def load_reviews(self, user_id: str) -> List[ReviewState]:
+        return list(self.reviews.get(user_id, {}).values())
 
-# グローバルストレージインスタンス（MVP用）
-storage = InMemoryStorage()
\ No newline at end of file
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        if not self.ttl_s:
+            return 0
+        cutoff = (now if now is not None else time.time()) - self.ttl_s
+        stale = [sid for sid, created in self._session_created.items() if created < cutoff]
+        for sid in stale:
+            self.sessions.pop(sid, None)
+            del self._session_created[sid]
+        old = [qid for qid, quiz in self.quizzes.items() if quiz.created_at.timestamp() < cutoff]
+        for qid in old:
+            del self.quizzes[qid]
+        return len(stale) + len(old)
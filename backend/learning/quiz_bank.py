@@ -0,0 +1,636 @@
+"""
+quiz_bank.py
+
+Offline quiz bank: best-move quizzes mined from annotated games and sampled
+at request time without any analysis.
+
+build_quiz_bank() replays every annotated game (JSON outputs, columnar
+corpus) and keeps the positions where the move played lost at least
+`min_loss_cp` against the engine's best move (the notes' bestmove/delta_cp).
+For each position:
+
+- the answer is the engine's best move
+- the distractors are all legal in the position (backend.ingest.movegen:
+  pins, checks, drop rules): the move actually played, engine MultiPV
+  alternatives (when an engine is given), other moves played from the same
+  position anywhere in the corpus, then piece moves landing near the answer
+- with an engine, positions whose second line is within `min_loss_cp` of the
+  best are dropped, so the answer is clearly best
+- phase comes from the ply; difficulty comes from the margin (the MultiPV gap,
+  else the loss of the move played). A bigger margin makes an easier quiz
+- tags describe the answer (capture, promotion, drop, check, mating line).
+  The mover's opening and castle come from the detectors
+
+The bank is one SQLite file (default data/quiz_bank.sqlite3). Next to the
+quizzes table it keeps posting lists, (key, pos) -> quiz id, for every filter
+value ("phase:中盤", "phase:中盤/difficulty:2", "tag:成り", "opening:四間飛車",
+...). Positions are dense (0..n-1) and the sizes are stored, so sampling k
+quizzes draws k random positions and does two primary-key lookups. The cost
+does not depend on the bank size.
+
+CLI:
+    python -m backend.learning.quiz_bank build data/out [--bank data/quiz_bank.sqlite3] [--engine]
+    python -m backend.learning.quiz_bank sample [--bank ...] [--phase 中盤] [--difficulty 3] [-k 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..ingest.board import WHITE, Board, IllegalMoveError, parse_usi_square
+from ..ingest.move_codec import DROP_BASE, PROMOTE_FLAG, decode_move
+from ..ingest.movegen import in_check, is_legal, legal_moves
+from ..ingest.zobrist import HashedBoard
+from ..services.corpus_analytics import PHASES, _labels_for_game, iter_annotated_games, phase_of_ply
+from ..services.corpus_store import MISSING
+from ..services.engine_pool import BLUNDER_DELTA_CP, MATE_CP, EngineResult
+from .models import Quiz
+from .scheduler import ReviewScheduler
+from .schemas import GamePhase, QuizType
+
+DEFAULT_BANK = "data/quiz_bank.sqlite3"
+MIN_LOSS_CP = -BLUNDER_DELTA_CP
+CHOICES = 4
+# 差（cp）→ 難易度: 1500 以上は 1（一目で分かる）、300 未満は 5
+DIFFICULTY_BANDS = (1500, 800, 500, 300)
+# 手番側から見てこれ以上なら詰み筋（analyze_game は詰みを MATE_CP 近くに換算する）
+MATE_LINE_CP = MATE_CP // 2
+# 絞り込みが複数あるときの試行上限（k の何倍まで位置を引くか）
+_OVERSAMPLE = 8
+
+_SCHEMA = """
+CREATE TABLE quizzes (
+    id            INTEGER PRIMARY KEY,
+    position_hash TEXT NOT NULL,
+    sfen          TEXT NOT NULL,
+    phase         TEXT NOT NULL,
+    difficulty    INTEGER NOT NULL,
+    best          TEXT NOT NULL,
+    distractors   TEXT NOT NULL,
+    played        TEXT NOT NULL,
+    loss_cp       INTEGER NOT NULL,
+    gap_cp        INTEGER,
+    tags          TEXT NOT NULL,
+    opening       TEXT,
+    castle        TEXT,
+    source        TEXT,
+    ply           INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX quizzes_position ON quizzes (position_hash);
+CREATE TABLE postings (
+    key     TEXT NOT NULL,
+    pos     INTEGER NOT NULL,
+    quiz_id INTEGER NOT NULL,
+    PRIMARY KEY (key, pos)
+) WITHOUT ROWID;
+CREATE TABLE posting_sizes (
+    key TEXT PRIMARY KEY,
+    n   INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def difficulty_for_margin(margin_cp: int) -> int:
+    """Margin between the answer and the alternative (cp) -> difficulty 1..5."""
+    for level, floor in enumerate(DIFFICULTY_BANDS, start=1):
+        if margin_cp >= floor:
+            return level
+    return len(DIFFICULTY_BANDS) + 1
+
+
+# ---------------------------------------------------------------------------
+# Moves (legality comes from backend.ingest.movegen; these pick and tag the
+# candidate choices)
+# ---------------------------------------------------------------------------
+
+def _piece_moves(board: Board) -> List[str]:
+    """Legal board moves (no drops), one per source and destination; promotes whenever it can."""
+    codes = sorted((c for c in legal_moves(board) if (c >> 7) & 0x7F < DROP_BASE),
+                   key=lambda c: (c & ~PROMOTE_FLAG, not c & PROMOTE_FLAG))
+    out: List[str] = []
+    last = -1
+    for code in codes:
+        if code & ~PROMOTE_FLAG != last:
+            out.append(decode_move(code))
+            last = code & ~PROMOTE_FLAG
+    return out
+
+
+def _distance(a: str, b: str) -> int:
+    sa, sb = parse_usi_square(a[2:4]), parse_usi_square(b[2:4])
+    return max(abs(sa % 9 - sb % 9), abs(sa // 9 - sb // 9))
+
+
+def _move_tags(board: Board, move: str, mating: bool) -> List[str]:
+    tags = []
+    if move[1:2] == "*":
+        tags.append("駒打ち")
+    elif board.squares[parse_usi_square(move[2:4])]:
+        tags.append("駒取り")
+    if move.endswith("+"):
+        tags.append("成り")
+    trial = board.copy()
+    trial.push_usi(move)
+    if in_check(trial, trial.turn):
+        tags.append("王手")
+    if mating:
+        tags.append("詰み筋")
+    return tags
+
+
+def _engine_cp(result: EngineResult) -> int:
+    if result.mate is not None:
+        return MATE_CP - abs(result.mate) if result.mate > 0 else -MATE_CP + abs(result.mate)
+    return result.score_cp if result.score_cp is not None else 0
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+@dataclass
+class QuizBankStats:
+    bank: str
+    games: int = 0
+    positions: int = 0      # plies replayed
+    candidates: int = 0     # losing moves with a playable best move (one per position)
+    quizzes: int = 0
+    not_clear: int = 0      # the engine's second line was too close to the best
+    few_choices: int = 0    # fewer than CHOICES - 1 playable distractors
+    build_s: float = 0.0
+
+
+@dataclass
+class _Candidate:
+    sfen: str
+    ply: int
+    best: str
+    played: str
+    loss_cp: int
+    mating: bool
+    opening: Optional[str]
+    castle: Optional[str]
+    source: Optional[str]
+    alternatives: List[str] = field(default_factory=list)
+    gap_cp: Optional[int] = None
+    others: Counter = field(default_factory=Counter)
+
+
+def _label(labels: Dict[str, Tuple[str, str]], kind: str, side: int) -> Optional[str]:
+    value = (labels.get(kind) or (None, None))[side]
+    return None if not value or value.startswith("不明") else value
+
+
+def _mine(corpus_path: str, min_loss_cp: int, stats: QuizBankStats) -> Dict[int, _Candidate]:
+    found: Dict[int, _Candidate] = {}
+    for game in iter_annotated_games(corpus_path):
+        stats.games += 1
+        if not any(game.bestmove):
+            continue
+        try:
+            hb = HashedBoard.from_sfen(game.start_sfen)
+        except ValueError:
+            continue
+        labels: Optional[Dict[str, Tuple[str, str]]] = None
+        moves = list(game.moves)
+        for i, move in enumerate(moves):
+            stats.positions += 1
+            best = game.bestmove[i] if i < len(game.bestmove) else ""
+            delta = int(game.delta_cp[i])
+            board = hb.board
+            if (best and best != move and delta != MISSING and -delta >= min_loss_cp
+                    and hb.hash not in found and is_legal(board, best)):
+                stats.candidates += 1
+                if labels is None:
+                    labels = _labels_for_game(game.start_sfen, moves)
+                side = 1 if board.turn == WHITE else 0
+                before = int(game.score_cp[i - 1]) if i else MISSING
+                mating = before != MISSING and (before if side == 0 else -before) >= MATE_LINE_CP
+                found[hb.hash] = _Candidate(
+                    sfen=board.sfen(), ply=int(game.ply[i]), best=best, played=move, loss_cp=-delta,
+                    mating=mating, opening=_label(labels, "opening", side),
+                    castle=_label(labels, "castle", side), source=game.source,
+                )
+            try:
+                hb.push_usi(move)
+            except IllegalMoveError:
+                break
+    return found
+
+
+def _collect_corpus_moves(corpus_path: str, found: Dict[int, _Candidate]) -> None:
+    """Every move played from a candidate position, over the whole corpus."""
+    for game in iter_annotated_games(corpus_path):
+        try:
+            hb = HashedBoard.from_sfen(game.start_sfen)
+        except ValueError:
+            continue
+        for move in game.moves:
+            cand = found.get(hb.hash)
+            if cand is not None:
+                cand.others[move] += 1
+            try:
+                hb.push_usi(move)
+            except IllegalMoveError:
+                break
+
+
+def legal_distractors(board: Board, best: str, k: int = CHOICES - 1,
+                      preferred: Sequence[str] = (), seed: int = 0) -> List[str]:
+    """
+    Up to k legal moves other than `best`: the `preferred` ones that are legal
+    first, then board moves landing nearest to best's destination.
+    """
+    picked: List[str] = []
+
+    def add(move: str) -> None:
+        if move and move != best and move not in picked and is_legal(board, move):
+            picked.append(move)
+
+    for move in preferred:
+        add(move)
+        if len(picked) == k:
+            return picked
+    pool = _piece_moves(board)
+    random.Random(seed).shuffle(pool)
+    pool.sort(key=lambda m: _distance(m, best))
+    for move in pool:
+        add(move)
+        if len(picked) == k:
+            break
+    return picked
+
+
+def _distractors(cand: _Candidate, seed: int) -> List[str]:
+    preferred = [cand.played, *cand.alternatives] + [m for m, _ in cand.others.most_common()]
+    return legal_distractors(Board.from_sfen(cand.sfen), cand.best, preferred=preferred, seed=seed)
+
+
+def _posting_keys(phase: str, difficulty: int, tags: Sequence[str],
+                  opening: Optional[str], castle: Optional[str]) -> List[str]:
+    keys = ["all", f"phase:{phase}", f"difficulty:{difficulty}", f"phase:{phase}/difficulty:{difficulty}"]
+    keys += [f"tag:{tag}" for tag in tags]
+    if opening:
+        keys.append(f"opening:{opening}")
+    if castle:
+        keys.append(f"castle:{castle}")
+    return keys
+
+
+def _write_bank(path: str, rows: List[Tuple[Any, ...]], meta: Dict[str, Any]) -> None:
+    target_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(target_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".quiz_bank-", suffix=".sqlite3", dir=target_dir)
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(_SCHEMA)
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO quizzes VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+            sizes: Counter = Counter()
+            postings = []
+            for row in rows:
+                quiz_id, phase, difficulty, tags, opening, castle = row[0], row[3], row[4], row[10], row[11], row[12]
+                for key in _posting_keys(phase, difficulty, json.loads(tags), opening, castle):
+                    postings.append((key, sizes[key], quiz_id))
+                    sizes[key] += 1
+            conn.executemany("INSERT INTO postings (key, pos, quiz_id) VALUES (?,?,?)", postings)
+            conn.executemany("INSERT INTO posting_sizes (key, n) VALUES (?,?)", sizes.items())
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?,?)",
+                             [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def build_quiz_bank(corpus_path: str, bank_path: str = DEFAULT_BANK,
+                    min_loss_cp: int = MIN_LOSS_CP, engine: Any = None,
+                    byoyomi_ms: Optional[int] = None, nodes: Optional[int] = None) -> QuizBankStats:
+    """
+    Mine quizzes from an annotated corpus and write a fresh bank file
+    (replaced atomically, so a running API keeps serving the old one until
+    it notices the new mtime).
+
+    `engine` is anything with UsiEngine.analyze_multipv(); it re-searches each
+    candidate for its alternatives and for the gap between the best two moves.
+    """
+    t0 = time.perf_counter()
+    stats = QuizBankStats(bank=bank_path)
+    found = _mine(corpus_path, min_loss_cp, stats)
+    if found:
+        _collect_corpus_moves(corpus_path, found)
+
+    rows: List[Tuple[Any, ...]] = []
+    for position_hash, cand in found.items():
+        if engine is not None:
+            lines = engine.analyze_multipv(f"position sfen {cand.sfen}", CHOICES, byoyomi_ms, nodes)
+            if lines:
+                board = Board.from_sfen(cand.sfen)
+                if lines[0].bestmove != cand.best and is_legal(board, lines[0].bestmove):
+                    cand.best = lines[0].bestmove
+                cand.alternatives = [line.bestmove for line in lines[1:]]
+                if len(lines) > 1:
+                    cand.gap_cp = _engine_cp(lines[0]) - _engine_cp(lines[1])
+                    if cand.gap_cp < min_loss_cp:
+                        stats.not_clear += 1
+                        continue
+        distractors = _distractors(cand, position_hash)
+        if len(distractors) < CHOICES - 1:
+            stats.few_choices += 1
+            continue
+        board = Board.from_sfen(cand.sfen)
+        tags = _move_tags(board, cand.best, cand.mating)
+        margin = cand.gap_cp if cand.gap_cp is not None else cand.loss_cp
+        rows.append((
+            len(rows) + 1, f"{position_hash:016x}", cand.sfen, PHASES[phase_of_ply(cand.ply)],
+            difficulty_for_margin(margin), cand.best, json.dumps(distractors), cand.played,
+            cand.loss_cp, cand.gap_cp, json.dumps(tags, ensure_ascii=False), cand.opening,
+            cand.castle, cand.source, cand.ply,
+        ))
+
+    stats.quizzes = len(rows)
+    _write_bank(bank_path, rows, {
+        "corpus": os.path.abspath(corpus_path), "min_loss_cp": min_loss_cp,
+        "engine": engine is not None, "quizzes": len(rows), "built_at": time.time(),
+    })
+    stats.build_s = round(time.perf_counter() - t0, 3)
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Serving
+# ---------------------------------------------------------------------------
+
+@dataclass
+class BankQuiz:
+    """One mined position: the answer and its playable distractors."""
+    id: int
+    position_hash: str      # stable across rebuilds (ids are not): the review key
+    sfen: str
+    phase: str
+    difficulty: int
+    best: str
+    distractors: List[str]
+    played: str
+    loss_cp: int
+    gap_cp: Optional[int]
+    tags: List[str]
+    opening: Optional[str]
+    castle: Optional[str]
+    source: Optional[str]
+    ply: int
+
+    def to_quiz(self, rng: Optional[random.Random] = None) -> Quiz:
+        """出題用の Quiz（選択肢はシャッフルして A-D を振る）"""
+        moves = [self.best] + self.distractors
+        (rng or random).shuffle(moves)
+        choices = [{"id": chr(65 + i), "move": move} for i, move in enumerate(moves)]
+        hint = None
+        if self.tags:
+            hint = f"ポイント: {'・'.join(self.tags)}"
+        elif self.opening:
+            hint = f"戦型: {self.opening}"
+        try:
+            phase = GamePhase(self.phase)
+        except ValueError:
+            phase = GamePhase.MIDDLE
+        return Quiz(
+            id=str(uuid.uuid4()),
+            question="この局面での最善手はどれですか？",
+            choices=choices,
+            correct_answer=choices[moves.index(self.best)]["id"],
+            hint=hint,
+            phase=phase,
+            quiz_type=QuizType.BEST_MOVE,
+            difficulty=self.difficulty,
+            source_move=self.played,
+            source_reasoning={
+                "bank_id": self.id, "position_hash": self.position_hash, "sfen": self.sfen, "tags": self.tags, "opening": self.opening,
+                "castle": self.castle, "loss_cp": self.loss_cp, "source": self.source,
+            },
+        )
+
+    def matches(self, phase: Optional[str] = None, difficulty: Optional[int] = None, tag: Optional[str] = None,
+                opening: Optional[str] = None, castle: Optional[str] = None) -> bool:
+        phase = getattr(phase, "value", phase)
+        return not ((phase and self.phase != phase) or (difficulty and self.difficulty != int(difficulty))
+                    or (tag and tag not in self.tags) or (opening and self.opening != opening)
+                    or (castle and self.castle != castle))
+
+
+_COLUMNS = ("id, position_hash, sfen, phase, difficulty, best, distractors, played, loss_cp, gap_cp, tags,"
+            " opening, castle, source, ply")
+
+
+def _bank_quiz(row: Tuple[Any, ...]) -> BankQuiz:
+    return BankQuiz(id=row[0], position_hash=row[1], sfen=row[2], phase=row[3], difficulty=row[4], best=row[5],
+                    distractors=json.loads(row[6]), played=row[7], loss_cp=row[8], gap_cp=row[9],
+                    tags=json.loads(row[10]), opening=row[11], castle=row[12], source=row[13], ply=row[14])
+
+
+class QuizBank:
+    """Read-only view of a bank file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        uri = Path(path).resolve().as_uri() + "?mode=ro"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.meta = {k: json.loads(v) for k, v in self._conn.execute("SELECT key, value FROM meta")}
+
+    def size(self, key: str = "all") -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT n FROM posting_sizes WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def __len__(self) -> int:
+        return self.size()
+
+    def sample(self, k: int, phase: Optional[str] = None, difficulty: Optional[int] = None,
+               tag: Optional[str] = None, opening: Optional[str] = None, castle: Optional[str] = None,
+               rng: Optional[random.Random] = None) -> List[BankQuiz]:
+        """
+        Up to k distinct quizzes matching every given filter, in random order.
+        Draws from the smallest matching posting list; other filters are
+        checked on the fetched rows (at most k * _OVERSAMPLE draws).
+        """
+        rng = rng or random.Random()
+        phase = getattr(phase, "value", phase)
+        keys = []
+        if phase and difficulty:
+            keys.append(f"phase:{phase}/difficulty:{int(difficulty)}")
+        elif phase:
+            keys.append(f"phase:{phase}")
+        elif difficulty:
+            keys.append(f"difficulty:{int(difficulty)}")
+        keys += [f"{kind}:{value}" for kind, value in (("tag", tag), ("opening", opening), ("castle", castle))
+                 if value]
+        keys = keys or ["all"]
+        sizes = [self.size(key) for key in keys]
+        if k <= 0 or not all(sizes):
+            return []
+        n, key = min(zip(sizes, keys))
+        budget = min(n, k if len(keys) == 1 else k * _OVERSAMPLE)
+        positions = rng.sample(range(n), budget)
+
+        out: List[BankQuiz] = []
+        step = max(k, 16)
+        for lo in range(0, budget, step):
+            chunk = positions[lo:lo + step]
+            marks = ",".join("?" * len(chunk))
+            with self._lock:
+                ids = [r[0] for r in self._conn.execute(
+                    f"SELECT quiz_id FROM postings WHERE key = ? AND pos IN ({marks})", (key, *chunk))]
+                if not ids:
+                    continue
+                rows = {r[0]: r for r in self._conn.execute(
+                    f"SELECT {_COLUMNS} FROM quizzes WHERE id IN ({','.join('?' * len(ids))})", ids)}
+            rng.shuffle(ids)
+            for quiz_id in ids:
+                quiz = _bank_quiz(rows[quiz_id])
+                if not quiz.matches(phase, difficulty, tag, opening, castle):
+                    continue
+                out.append(quiz)
+                if len(out) == k:
+                    return out
+        return out
+
+    def by_position(self, position_hashes: Sequence[str]) -> List[BankQuiz]:
+        """Quizzes for the given positions, in the given order (missing ones skipped)."""
+        if not position_hashes:
+            return []
+        with self._lock:
+            rows = {r[1]: r for r in self._conn.execute(
+                f"SELECT {_COLUMNS} FROM quizzes WHERE position_hash IN ({','.join('?' * len(position_hashes))})",
+                list(position_hashes))}
+        return [_bank_quiz(rows[h]) for h in position_hashes if h in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def draw_for_user(bank: QuizBank, scheduler: ReviewScheduler, user_id: str, k: int,
+                  rng: Optional[random.Random] = None, **filters: Any) -> List[BankQuiz]:
+    """
+    k quizzes for one user: due reviews first (most overdue first), then new
+    positions from the user's weakest categories (about half of the rest),
+    then anything new. Explicit filters (phase, difficulty, tag, opening,
+    castle) apply to all three and replace the weakness focus.
+    """
+    rng = rng or random.Random()
+    plan = scheduler.plan(user_id, k)
+    out = [q for q in bank.by_position(plan.due) if q.matches(**filters)]
+    seen = {q.position_hash for q in out}
+
+    def add_new(candidates: List[BankQuiz], limit: int) -> None:
+        for quiz in candidates:
+            if len(out) >= limit:
+                return
+            if quiz.position_hash not in seen and not scheduler.is_scheduled(user_id, quiz.position_hash):
+                out.append(quiz)
+                seen.add(quiz.position_hash)
+
+    if not any(filters.values()):
+        for category in plan.focus:
+            kind, value = category.split(":", 1)
+            add_new(bank.sample(2 * k, rng=rng, **{kind: value}), len(out) + max(1, (k - len(out)) // 2))
+    add_new(bank.sample(2 * k, rng=rng, **filters), k)
+    return out[:k]
+
+
+_CACHE: Dict[str, Tuple[int, QuizBank]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def get_quiz_bank() -> Optional[QuizBank]:
+    """
+    QUIZ_BANK_DB のバンク（既定 data/quiz_bank.sqlite3）。未構築または空文字なら None。
+    再構築されたファイルは mtime で検知して開き直す。
+    古いインスタンスは閉じない（処理中のリクエストが使い終えて参照が外れた時点で解放される）。
+    """
+    path = os.getenv("QUIZ_BANK_DB", DEFAULT_BANK)
+    if not path:
+        return None
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _CACHE_LOCK:
+        hit = _CACHE.get(path)
+        if hit is not None and hit[0] == stamp:
+            return hit[1]
+        try:
+            bank = QuizBank(path)
+        except sqlite3.Error:
+            return None
+        _CACHE[path] = (stamp, bank)
+    return bank
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Best-move quiz bank mined from annotated games")
+    sub = ap.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="mine quizzes (JSON outputs or columnar corpus)")
+    b.add_argument("corpus", nargs="?", default=os.getenv("KIFU_OUT", "data/out"))
+    b.add_argument("--bank", default=os.getenv("QUIZ_BANK_DB") or DEFAULT_BANK)
+    b.add_argument("--min-loss", type=int, default=MIN_LOSS_CP, help="cp lost by the move played")
+    b.add_argument("--engine", action="store_true", help="re-search candidates with MultiPV (USI_CMD)")
+    b.add_argument("--byoyomi", type=int, default=None)
+    b.add_argument("--nodes", type=int, default=None)
+    s = sub.add_parser("sample", help="draw quizzes from a bank")
+    s.add_argument("--bank", default=os.getenv("QUIZ_BANK_DB") or DEFAULT_BANK)
+    s.add_argument("-k", type=int, default=5)
+    s.add_argument("--phase")
+    s.add_argument("--difficulty", type=int)
+    s.add_argument("--tag")
+    s.add_argument("--opening")
+    s.add_argument("--castle")
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        engine = None
+        if args.engine:
+            from ..services.engine_pool import UsiEngine
+            engine = UsiEngine()
+        try:
+            stats = build_quiz_bank(args.corpus, args.bank, args.min_loss, engine, args.byoyomi, args.nodes)
+        finally:
+            if engine is not None:
+                engine.close()
+        print(json.dumps(asdict(stats), indent=2))
+        return 0
+    if not os.path.exists(args.bank):
+        print(f"error: no bank at {args.bank}", file=sys.stderr)
+        return 2
+    bank = QuizBank(args.bank)
+    quizzes = bank.sample(args.k, args.phase, args.difficulty, args.tag, args.opening, args.castle)
+    print(json.dumps([asdict(q) for q in quizzes], indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
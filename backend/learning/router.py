@@ -17,7 +17,7 @@ from .schemas import (
 )
 from .generator import QuizGenerator
 from .evaluator import AnswerEvaluator
-from .models import storage
+from .storage import get_storage
 
 router = APIRouter(prefix="/learning", tags=["learning"])
 
@@ -42,7 +42,9 @@ async def generate_quiz(request: GenerateQuizRequest):
         # 問題生成
         quizzes = quiz_generator.generate_quizzes(
             request.reasoning_notes, 
-            request.quiz_count
+            request.quiz_count,
+            user_id=request.user_id,
+            usi=request.usi,
         )
         
         if not quizzes:
@@ -83,7 +85,7 @@ async def submit_answer(request: SubmitAnswerRequest):
     """
     try:
         # セッション検証
-        session_quizzes = storage.get_session_quizzes(request.session_id)
+        session_quizzes = get_storage().get_session_quizzes(request.session_id)
         if not session_quizzes:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -133,7 +135,7 @@ async def get_progress(user_id: str):
         ProgressResponse: 学習進捗と統計情報
     """
     try:
-        user = storage.get_user(user_id)
+        user = get_storage().get_user(user_id)
         
         # 統計情報を構築
         stats = ProgressStats(
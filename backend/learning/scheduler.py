@@ -0,0 +1,206 @@
+"""
+Spaced-repetition scheduler for the learning API
+
+For each user it keeps two heaps in memory:
+
+- review state for every bank position the user has answered (interval,
+  ease, due time), in a min-heap keyed by due time
+- accuracy per category ("phase:中盤", "tag:成り"), in a heap keyed by
+  weakness (the smoothed error rate)
+
+Both are updated on every answer: storage.save_attempt() calls record().
+Updates use lazy invalidation: a changed entry is pushed again and the stale
+one is skipped when it reaches the top. Selecting the next k items pops at
+most k live entries and pushes them back, so it is O(k log n) however long
+the history is. A user's queues are loaded from storage on first use (one
+heapify) and kept in an LRU of `max_users`.
+
+Intervals follow a simplified SM-2. A miss brings the item back after
+RELEARN_S and lowers its ease. A correct answer multiplies the interval by
+the ease; the first correct answer sets it to FIRST_INTERVAL_S.
+"""
+
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+RELEARN_S = 10 * 60
+FIRST_INTERVAL_S = 24 * 3600
+MAX_INTERVAL_S = 180 * 24 * 3600
+START_EASE, MIN_EASE, MAX_EASE = 2.5, 1.3, 3.0
+# これ未満の回答数のカテゴリは弱点候補にしない
+MIN_FOCUS_ATTEMPTS = 3
+FOCUS_CATEGORIES = 2
+
+
+@dataclass
+class ReviewState:
+    """One position in a user's review queue."""
+    user_id: str
+    item_key: str
+    due_at: float
+    interval_s: float = 0.0
+    ease: float = START_EASE
+    reps: int = 0
+    lapses: int = 0
+
+    def answered(self, correct: bool, now: float) -> None:
+        if correct:
+            if self.interval_s < FIRST_INTERVAL_S:
+                self.interval_s = FIRST_INTERVAL_S
+            else:
+                self.interval_s = min(MAX_INTERVAL_S, self.interval_s * self.ease)
+            self.ease = min(MAX_EASE, self.ease + 0.1)
+            self.reps += 1
+        else:
+            self.interval_s = RELEARN_S
+            self.ease = max(MIN_EASE, self.ease - 0.2)
+            self.lapses += 1
+        self.due_at = now + self.interval_s
+
+
+@dataclass
+class ReviewPlan:
+    due: List[str]      # item keys that are due, most overdue first
+    focus: List[str]    # weakest categories first ("phase:中盤", "tag:成り")
+
+
+def weakness(attempts: int, correct: int) -> float:
+    """Error rate with add-one smoothing, so a few answers do not dominate."""
+    return (attempts - correct + 1) / (attempts + 2)
+
+
+def categories(phase: Optional[str], tags: Iterable[str]) -> List[str]:
+    out = [f"phase:{getattr(phase, 'value', phase)}"] if phase else []
+    return out + [f"tag:{tag}" for tag in tags]
+
+
+class _UserQueues:
+    __slots__ = ("items", "due_heap", "stats", "weak_heap")
+
+    def __init__(self, states: Sequence[ReviewState], stats: Dict[str, List[int]]):
+        self.items: Dict[str, ReviewState] = {s.item_key: s for s in states}
+        self.stats = stats                       # category -> [attempts, correct]
+        self.due_heap: List[Tuple[float, str]] = []
+        self.weak_heap: List[Tuple[float, str]] = []
+        self._rebuild_due()
+        self._rebuild_weak()
+
+    def _rebuild_due(self) -> None:
+        self.due_heap = [(s.due_at, key) for key, s in self.items.items()]
+        heapq.heapify(self.due_heap)
+
+    def _rebuild_weak(self) -> None:
+        self.weak_heap = [(-weakness(a, c), cat) for cat, (a, c) in self.stats.items()
+                          if a >= MIN_FOCUS_ATTEMPTS]
+        heapq.heapify(self.weak_heap)
+
+    def push_item(self, state: ReviewState) -> None:
+        self.items[state.item_key] = state
+        heapq.heappush(self.due_heap, (state.due_at, state.item_key))
+        if len(self.due_heap) > 2 * len(self.items) + 64:
+            self._rebuild_due()
+
+    def bump(self, category: str, correct: bool) -> None:
+        stat = self.stats.setdefault(category, [0, 0])
+        stat[0] += 1
+        stat[1] += int(correct)
+        if stat[0] >= MIN_FOCUS_ATTEMPTS:
+            heapq.heappush(self.weak_heap, (-weakness(*stat), category))
+            if len(self.weak_heap) > 2 * len(self.stats) + 64:
+                self._rebuild_weak()
+
+    @staticmethod
+    def _pop_live(heap: List[Tuple[float, str]], k: int, live: Callable[[Tuple[float, str]], bool],
+                  limit: Optional[float] = None) -> List[str]:
+        taken: List[Tuple[float, str]] = []
+        seen = set()
+        while heap and len(taken) < k and (limit is None or heap[0][0] <= limit):
+            entry = heapq.heappop(heap)
+            if entry[1] not in seen and live(entry):
+                taken.append(entry)
+                seen.add(entry[1])
+        for entry in taken:
+            heapq.heappush(heap, entry)
+        return [key for _, key in taken]
+
+    def due(self, k: int, now: float) -> List[str]:
+        def live(entry):
+            state = self.items.get(entry[1])
+            return state is not None and state.due_at == entry[0]
+        return self._pop_live(self.due_heap, k, live, limit=now)
+
+    def weakest(self, n: int) -> List[str]:
+        def live(entry):
+            a, c = self.stats.get(entry[1], (0, 0))
+            return a >= MIN_FOCUS_ATTEMPTS and -weakness(a, c) == entry[0]
+        return self._pop_live(self.weak_heap, n, live)
+
+
+class ReviewScheduler:
+    """Per-user review and weakness queues on top of a LearningStorage."""
+
+    def __init__(self, store: Any, max_users: int = 10_000, clock: Callable[[], float] = time.time):
+        self.store = store
+        self.max_users = max_users
+        self.clock = clock
+        self._users: "OrderedDict[str, _UserQueues]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _queues(self, user_id: str) -> _UserQueues:
+        queues = self._users.get(user_id)
+        if queues is not None:
+            self._users.move_to_end(user_id)
+            return queues
+        progress = self.store.get_user(user_id)
+        stats: Dict[str, List[int]] = {}
+        for prefix, table in (("phase", progress.phase_stats), ("tag", progress.tag_stats)):
+            for key, s in table.items():
+                stats[f"{prefix}:{getattr(key, 'value', key)}"] = [s["attempts"], s["correct"]]
+        queues = _UserQueues(self.store.load_reviews(user_id), stats)
+        self._users[user_id] = queues
+        if len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return queues
+
+    def record(self, user_id: str, correct: bool, phase: Optional[str] = None,
+               tags: Iterable[str] = (), item_key: Optional[str] = None,
+               now: Optional[float] = None) -> Optional[ReviewState]:
+        """
+        Fold one answer into the user's queues. Returns the item's new review
+        state (a copy, for the caller to persist), or None without an item.
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            queues = self._queues(user_id)
+            for category in categories(phase, tags):
+                queues.bump(category, correct)
+            if not item_key:
+                return None
+            old = queues.items.get(item_key)
+            state = replace(old) if old else ReviewState(user_id=user_id, item_key=item_key, due_at=now)
+            state.answered(correct, now)
+            queues.push_item(state)
+            return replace(state)
+
+    def plan(self, user_id: str, k: int, now: Optional[float] = None) -> ReviewPlan:
+        """Up to k due items and the user's weakest categories."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            queues = self._queues(user_id)
+            return ReviewPlan(due=queues.due(k, now), focus=queues.weakest(FOCUS_CATEGORIES))
+
+    def is_scheduled(self, user_id: str, item_key: str) -> bool:
+        with self._lock:
+            return item_key in self._queues(user_id).items
+
+    def forget(self, user_id: Optional[str] = None) -> None:
+        """Drop cached queues (all users by default); they reload from storage."""
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
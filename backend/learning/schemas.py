@@ -41,6 +41,7 @@ class GenerateQuizRequest(BaseModel):
     )
     quiz_count: int = Field(default=3, ge=1, le=5, description="生成する問題数")
     user_id: Optional[str] = Field(default="guest", description="ユーザーID")
+    usi: Optional[str] = Field(default=None, description="棋譜 (startpos moves ...)。注釈に sfen が無いときの局面の復元に使う")
 
 
 class QuizChoice(BaseModel):
@@ -0,0 +1,377 @@
+"""
+Persistent learning storage (SQLite, WAL)
+
+- users / user_stats hold the per-user aggregates (totals, level, recent
+  results, phase_stats / type_stats). They are updated incrementally when
+  attempts are written, so reading progress is a primary-key lookup instead
+  of a walk over the attempt history.
+- Attempts are buffered and written in batches: one transaction inserts the
+  rows and folds them into the aggregates. The buffer is flushed when it
+  reaches `batch_size`, by a timer once its oldest attempt is
+  `flush_interval_s` old (also on an idle server, so other workers see the
+  attempts and a crash loses at most that window), before any read that
+  depends on it, and on close().
+- reviews holds the spaced-repetition state of every bank position a user
+  has answered. It is written with the attempts; the in-memory queues live
+  in scheduler.ReviewScheduler and are loaded from here per user.
+- Sessions and quizzes expire `ttl_s` after creation and are deleted by
+  evict_expired() (also run automatically every `evict_every_s` on writes).
+  Attempts and aggregates are kept.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .models import Attempt, InMemoryStorage, LearningStorage, Quiz, UserProgress
+from .scheduler import ReviewScheduler, ReviewState
+from .schemas import GamePhase, QuizType
+
+DEFAULT_DB = "data/learning.sqlite3"
+DEFAULT_TTL_S = 7 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id         TEXT PRIMARY KEY,
+    total_score     INTEGER NOT NULL,
+    level           INTEGER NOT NULL,
+    total_attempts  INTEGER NOT NULL,
+    correct_answers INTEGER NOT NULL,
+    recent_results  TEXT NOT NULL,
+    created_at      REAL NOT NULL,
+    updated_at      REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id     TEXT NOT NULL,
+    kind        TEXT NOT NULL,          -- 'phase' | 'type'
+    key         TEXT NOT NULL,
+    attempts    INTEGER NOT NULL,
+    correct     INTEGER NOT NULL,
+    total_score INTEGER NOT NULL,
+    PRIMARY KEY (user_id, kind, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS quizzes (
+    id         TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    payload    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS quizzes_created ON quizzes (created_at);
+CREATE TABLE IF NOT EXISTS sessions (
+    id         TEXT PRIMARY KEY,
+    user_id    TEXT,
+    created_at REAL NOT NULL,
+    quiz_ids   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user_id);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created_at);
+CREATE TABLE IF NOT EXISTS attempts (
+    id            TEXT PRIMARY KEY,
+    user_id       TEXT NOT NULL,
+    quiz_id       TEXT NOT NULL,
+    session_id    TEXT NOT NULL,
+    answer        TEXT NOT NULL,
+    correct       INTEGER NOT NULL,
+    score         INTEGER NOT NULL,
+    time_taken_ms INTEGER,
+    created_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_user ON attempts (user_id, created_at);
+CREATE INDEX IF NOT EXISTS attempts_session ON attempts (session_id);
+CREATE INDEX IF NOT EXISTS attempts_created ON attempts (created_at);
+CREATE TABLE IF NOT EXISTS reviews (
+    user_id    TEXT NOT NULL,
+    item_key   TEXT NOT NULL,
+    due_at     REAL NOT NULL,
+    interval_s REAL NOT NULL,
+    ease       REAL NOT NULL,
+    reps       INTEGER NOT NULL,
+    lapses     INTEGER NOT NULL,
+    PRIMARY KEY (user_id, item_key)
+) WITHOUT ROWID;
+"""
+
+_STAT_KINDS = (("phase", "phase_stats", GamePhase), ("type", "type_stats", QuizType), ("tag", "tag_stats", str))
+
+
+def _enum(cls, value: str):
+    try:
+        return cls(value)
+    except ValueError:
+        return value
+
+
+def _quiz_payload(quiz: Quiz) -> str:
+    data = asdict(quiz)
+    data["created_at"] = quiz.created_at.timestamp()
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _quiz_from_payload(payload: str) -> Quiz:
+    data = json.loads(payload)
+    data["created_at"] = datetime.fromtimestamp(data["created_at"])
+    data["phase"] = _enum(GamePhase, data["phase"])
+    data["quiz_type"] = _enum(QuizType, data["quiz_type"])
+    return Quiz(**data)
+
+
+class SQLiteLearningStorage(LearningStorage):
+    """SQLite-backed learning storage (one connection, serialized by a lock)."""
+
+    def __init__(self, path: str = DEFAULT_DB, ttl_s: Optional[float] = DEFAULT_TTL_S,
+                 batch_size: int = 32, flush_interval_s: float = 1.0, evict_every_s: float = 300.0):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.evict_every_s = evict_every_s
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        # (attempt, quiz_type, phase, tags); quiz kind is resolved when the attempt arrives
+        self._pending: List[Tuple[Attempt, Optional[str], Optional[str], List[str]]] = []
+        self._pending_reviews: Dict[Tuple[str, str], ReviewState] = {}
+        self._pending_since = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+        self._last_evict = time.monotonic()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        self.scheduler = ReviewScheduler(self)
+
+    # ---- users -----------------------------------------------------------
+
+    def _load_user(self, user_id: str) -> UserProgress:
+        row = self._conn.execute(
+            "SELECT total_score, level, total_attempts, correct_answers, recent_results, created_at, updated_at"
+            " FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return UserProgress(user_id=user_id)
+        user = UserProgress(user_id=user_id, total_score=row[0], level=row[1], total_attempts=row[2],
+                            correct_answers=row[3], recent_results=[c == "1" for c in row[4]],
+                            created_at=datetime.fromtimestamp(row[5]),
+                            updated_at=datetime.fromtimestamp(row[6]))
+        for kind, key, attempts, correct, total in self._conn.execute(
+                "SELECT kind, key, attempts, correct, total_score FROM user_stats WHERE user_id = ?", (user_id,)):
+            for stat_kind, attr, cls in _STAT_KINDS:
+                if kind == stat_kind:
+                    getattr(user, attr)[_enum(cls, key)] = {
+                        "attempts": attempts, "correct": correct, "total_score": total}
+        return user
+
+    def _store_user(self, user: UserProgress) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO users (user_id, total_score, level, total_attempts, correct_answers,"
+            " recent_results, created_at, updated_at) VALUES (?,?,?,?,?,?,?,?)",
+            (user.user_id, user.total_score, user.level, user.total_attempts, user.correct_answers,
+             "".join("1" if r else "0" for r in user.recent_results),
+             user.created_at.timestamp(), user.updated_at.timestamp()))
+        rows = []
+        for kind, attr, _ in _STAT_KINDS:
+            for key, stats in getattr(user, attr).items():
+                rows.append((user.user_id, kind, getattr(key, "value", key),
+                             stats["attempts"], stats["correct"], stats["total_score"]))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO user_stats (user_id, kind, key, attempts, correct, total_score)"
+            " VALUES (?,?,?,?,?,?)", rows)
+
+    def get_user(self, user_id: str) -> UserProgress:
+        with self._lock:
+            if any(item[0].user_id == user_id for item in self._pending):
+                self.flush()
+            return self._load_user(user_id)
+
+    # ---- quizzes / sessions ---------------------------------------------
+
+    def save_quiz(self, quiz: Quiz) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO quizzes (id, created_at, payload) VALUES (?,?,?)",
+                               (quiz.id, quiz.created_at.timestamp(), _quiz_payload(quiz)))
+            self._maybe_evict()
+
+    def get_quiz(self, quiz_id: str) -> Optional[Quiz]:
+        with self._lock:
+            row = self._conn.execute("SELECT created_at, payload FROM quizzes WHERE id = ?",
+                                     (quiz_id,)).fetchone()
+        if row is None or self._expired(row[0]):
+            return None
+        return _quiz_from_payload(row[1])
+
+    def create_session(self, quiz_ids: List[str], user_id: Optional[str] = None) -> str:
+        session_id = str(uuid.uuid4())
+        with self._lock:
+            self._conn.execute("INSERT INTO sessions (id, user_id, created_at, quiz_ids) VALUES (?,?,?,?)",
+                               (session_id, user_id, time.time(), json.dumps(quiz_ids)))
+        return session_id
+
+    def get_session_quizzes(self, session_id: str) -> List[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT created_at, quiz_ids FROM sessions WHERE id = ?",
+                                     (session_id,)).fetchone()
+        if row is None or self._expired(row[0]):
+            return []
+        return json.loads(row[1])
+
+    def _expired(self, created_at: float) -> bool:
+        # evicted lazily; until then an expired row must still read as gone
+        return bool(self.ttl_s) and created_at < time.time() - self.ttl_s
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        if not self.ttl_s:
+            return 0
+        cutoff = (now if now is not None else time.time()) - self.ttl_s
+        with self._lock:
+            self._last_evict = time.monotonic()
+            self._conn.execute("BEGIN")
+            try:
+                n = self._conn.execute("DELETE FROM sessions WHERE created_at < ?", (cutoff,)).rowcount
+                n += self._conn.execute("DELETE FROM quizzes WHERE created_at < ?", (cutoff,)).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return n
+
+    def _maybe_evict(self) -> None:
+        if self.ttl_s and time.monotonic() - self._last_evict >= self.evict_every_s:
+            self.evict_expired()
+
+    # ---- attempts --------------------------------------------------------
+
+    def save_attempt(self, attempt: Attempt) -> None:
+        quiz = self.get_quiz(attempt.quiz_id)
+        kind = (quiz.quiz_type, quiz.phase, quiz.tags) if quiz else (None, None, [])
+        review = self._schedule(attempt, quiz)
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+                self._arm_timer()
+            self._pending.append((attempt, *kind))
+            if review is not None:
+                self._pending_reviews[(review.user_id, review.item_key)] = review
+            if (len(self._pending) >= self.batch_size
+                    or time.monotonic() - self._pending_since >= self.flush_interval_s):
+                self.flush()
+
+    def _arm_timer(self) -> None:
+        if self._timer is None and not self._closed:
+            self._timer = threading.Timer(self.flush_interval_s, self._flush_due)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_due(self) -> None:
+        with self._lock:
+            self._timer = None
+            if self._closed:
+                return
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"[learning] attempt flush failed, retrying: {e}")
+                self._arm_timer()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            reviews, self._pending_reviews = self._pending_reviews, {}
+            by_user: Dict[str, List[Tuple[Attempt, Any, Any, List[str]]]] = {}
+            for item in pending:
+                by_user.setdefault(item[0].user_id, []).append(item)
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO attempts (id, user_id, quiz_id, session_id, answer, correct,"
+                    " score, time_taken_ms, created_at) VALUES (?,?,?,?,?,?,?,?,?)",
+                    [(a.id, a.user_id, a.quiz_id, a.session_id, a.answer, int(a.correct), a.score,
+                      a.time_taken_ms, a.created_at.timestamp()) for a, _, _, _ in pending])
+                for user_id, items in by_user.items():
+                    user = self._load_user(user_id)
+                    for attempt, quiz_type, phase, tags in items:
+                        if quiz_type is not None:
+                            user.add_attempt(quiz_type, phase, attempt.correct, attempt.score, tags)
+                    self._store_user(user)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO reviews (user_id, item_key, due_at, interval_s, ease, reps, lapses)"
+                    " VALUES (?,?,?,?,?,?,?)",
+                    [(r.user_id, r.item_key, r.due_at, r.interval_s, r.ease, r.reps, r.lapses)
+                     for r in reviews.values()])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._pending = pending + self._pending
+                self._pending_reviews = {**reviews, **self._pending_reviews}
+                raise
+
+    def load_reviews(self, user_id: str) -> List[ReviewState]:
+        with self._lock:
+            if any(key[0] == user_id for key in self._pending_reviews):
+                self.flush()
+            rows = self._conn.execute(
+                "SELECT item_key, due_at, interval_s, ease, reps, lapses FROM reviews WHERE user_id = ?",
+                (user_id,)).fetchall()
+        return [ReviewState(user_id=user_id, item_key=r[0], due_at=r[1], interval_s=r[2], ease=r[3],
+                            reps=r[4], lapses=r[5]) for r in rows]
+
+    def recent_attempts(self, user_id: str, limit: int = 20) -> List[Attempt]:
+        """ユーザーの直近の回答（新しい順）"""
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute(
+                "SELECT id, user_id, quiz_id, session_id, answer, correct, score, time_taken_ms, created_at"
+                " FROM attempts WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (user_id, limit)).fetchall()
+        return [Attempt(id=r[0], user_id=r[1], quiz_id=r[2], session_id=r[3], answer=r[4], correct=bool(r[5]),
+                        score=r[6], time_taken_ms=r[7], created_at=datetime.fromtimestamp(r[8])) for r in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.flush()
+            self._closed = True
+            self._conn.close()
+
+
+_STORAGE: Optional[LearningStorage] = None
+_STORAGE_LOCK = threading.Lock()
+
+
+def get_storage() -> LearningStorage:
+    """
+    Process-wide storage, created on first use.
+    LEARNING_DB: SQLite path (default data/learning.sqlite3), ":memory:" for a
+    throwaway SQLite database, "memory" for the dict-based InMemoryStorage.
+    LEARNING_SESSION_TTL_S: session/quiz lifetime (default 7 days, 0 keeps them).
+    """
+    global _STORAGE
+    with _STORAGE_LOCK:
+        if _STORAGE is None:
+            path = os.getenv("LEARNING_DB", DEFAULT_DB) or DEFAULT_DB
+            try:
+                ttl = float(os.getenv("LEARNING_SESSION_TTL_S", str(DEFAULT_TTL_S)))
+            except ValueError:
+                ttl = float(DEFAULT_TTL_S)
+            if path == "memory":
+                _STORAGE = InMemoryStorage(ttl_s=ttl or None)
+            else:
+                _STORAGE = SQLiteLearningStorage(path, ttl_s=ttl or None)
+        return _STORAGE
+
+
+def close_storage() -> None:
+    """Flush and close the process-wide storage (API shutdown)."""
+    global _STORAGE
+    with _STORAGE_LOCK:
+        if _STORAGE is not None:
+            _STORAGE.close()
+            _STORAGE = None
@@ -3,17 +3,44 @@ annotate_batch.py
 
 Batch annotation service for processing multiple Kifu files.
 Orchestrates calls to existing annotation functionality.
+
+Files are annotated concurrently (bounded by `workers`), outputs are written
+atomically and every finished file is recorded in a checkpoint manifest in
+the output folder (size, mtime, content hash, analysis settings), so a rerun
+only processes new or changed files, or everything if the engine build, eval
+files or time budget changed.
+
+Output is one JSON file per game (output_format="json", the default) or a
+columnar corpus store under <out>/corpus (output_format="columnar", see
+corpus_store.py).
+
+With an EnginePool (BATCH_ENGINES>0, or the CLI below) each game is analysed
+on its own engine process and backend.api.main is never imported:
+
+    python -m backend.services.annotate_batch --dir data/kifu --out data/out --workers 4
 """
 
 import os
+import re
+import sys
 import json
-from typing import List, Dict, Any, Optional
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, List, Dict, Any, Optional, Set
 from pathlib import Path
 from dataclasses import dataclass, asdict
 from datetime import datetime
 
-from ..ingest.kifu_loader import load_kifu_file, scan_kifu_directory, validate_usi_moves
-from ..ingest.providers.base import LocalFolderProvider
+from ..ingest.kifu_loader import KifuData, KifuMetadata, iter_kifu_files, load_kifu_file, validate_usi_moves
+from ..ingest.providers.base import KifuContent, KifuProvider, LocalFolderProvider
+from ..ingest.providers.fetch_scheduler import FetchScheduler, iter_fetched
+from .corpus_store import DEFAULT_CHUNK_ROWS, CorpusWriter
+from .dedupe import DEDUPE_NAME, DedupeEntry, DedupeIndex, game_keys
+from .checkpoint import MANIFEST_NAME, CheckpointEntry, CheckpointManifest, atomic_write_json, file_digest, settings_key
+from .engine_pool import ANNOTATOR_VERSION, EnginePool, analyze_game
 
 
 @dataclass
@@ -35,6 +62,8 @@ class AnnotationResult:
     annotation_count: int = 0
     error_message: Optional[str] = None
     processing_time_ms: Optional[int] = None
+    skipped: bool = False  # already done according to the checkpoint manifest
+    duplicate_of: Optional[str] = None  # source of the already-annotated copy of this game
 
 
 @dataclass
@@ -48,16 +77,119 @@ class BatchAnnotationSummary:
     total_time_ms: int
     results: List[AnnotationResult]
     error_details: List[Dict[str, str]] = None
+    cancelled: bool = False  # stopped early by cancel_event; unprocessed files are not in results
+    duplicates: int = 0
+    duplicate_details: List[Dict[str, str]] = None
     
     def __post_init__(self):
         if self.error_details is None:
             self.error_details = []
+        if self.duplicate_details is None:
+            self.duplicate_details = []
 
     @property
     def success(self) -> bool:
         return self.errors == 0
 
 
+@dataclass
+class BulkProgress:
+    """Running counters reported after every finished file."""
+    total_files: int
+    done: int = 0
+    annotated: int = 0
+    skipped: int = 0
+    errors: int = 0
+    duplicates: int = 0
+    plies: int = 0
+    elapsed_s: float = 0.0
+
+    @property
+    def files_per_sec(self) -> float:
+        return (self.annotated + self.errors) / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    @property
+    def plies_per_sec(self) -> float:
+        return self.plies / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    def record(self, result: "AnnotationResult", elapsed_s: float) -> None:
+        self.done += 1
+        if result.skipped:
+            self.skipped += 1
+        elif result.duplicate_of:
+            self.duplicates += 1
+        elif result.success:
+            self.annotated += 1
+            self.plies += result.move_count
+        elif result.error_message:
+            self.errors += 1
+        else:
+            self.skipped += 1
+        self.elapsed_s = elapsed_s
+
+    def format(self) -> str:
+        return (f"[{self.done}/{self.total_files}] ok={self.annotated} skip={self.skipped} "
+                f"err={self.errors} dup={self.duplicates} {self.files_per_sec:.2f} files/s {self.plies_per_sec:.1f} plies/s")
+
+
+def provider_output_name(game_id: str) -> str:
+    """Stable, filesystem-safe JSON name for a provider game id (ids may be paths or URLs)."""
+    stem = os.path.splitext(os.path.basename(game_id.rstrip("/\\")))[0]
+    stem = re.sub(r"[^\w.-]+", "_", stem).strip("._")[:80] or "game"
+    digest = hashlib.blake2b(game_id.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{stem}-{digest}.json"
+
+
+def kifu_data_from_content(content: KifuContent) -> KifuData:
+    """Provider fetch result -> the loader's KifuData (what annotation consumes)."""
+    info = content.info
+    date = info.date.isoformat() if isinstance(info.date, datetime) else info.date
+    return KifuData(
+        usi_moves=list(content.usi_moves),
+        metadata=KifuMetadata(
+            title=info.title,
+            date=date,
+            sente=info.sente,
+            gote=info.gote,
+            result=info.result,
+            time_rules=info.time_rules,
+            source_format=(info.metadata or {}).get("format") or info.source,
+            source_path=info.id,
+        ),
+        start_sfen=content.start_sfen,
+    )
+
+
+def _summarize(total: int, done_results: List[AnnotationResult],
+               start_time: datetime) -> BatchAnnotationSummary:
+    duplicates = [r for r in done_results if r.duplicate_of and not r.skipped]
+    annotated_count = sum(1 for r in done_results if r.success and not r.skipped) - len(duplicates)
+    error_count = sum(1 for r in done_results if not r.success and r.error_message)
+    skipped_count = len(done_results) - annotated_count - error_count - len(duplicates)
+
+    end_time = datetime.now()
+    total_time_ms = int((end_time - start_time).total_seconds() * 1000)
+
+    return BatchAnnotationSummary(
+        total_files=total,
+        scanned=total,
+        annotated=annotated_count,
+        errors=error_count,
+        skipped=skipped_count,
+        total_time_ms=total_time_ms,
+        results=done_results,
+        error_details=[
+            {"file": r.file_path, "reason": r.error_message}
+            for r in done_results if r.error_message
+        ],
+        cancelled=len(done_results) < total,
+        duplicates=len(duplicates),
+        duplicate_details=[
+            {"file": r.file_path, "duplicate_of": r.duplicate_of} for r in duplicates
+        ],
+    )
+
+
 def annotate(payload: Dict[str, Any]):
     # テストが backend.services.annotate_batch.annotate を patch するための互換シンボル
     from backend.api.main import annotate as _annotate
@@ -68,10 +200,22 @@ def annotate(payload: Dict[str, Any]):
 class BatchAnnotationService:
     """Service for batch annotation of Kifu files"""
     
-    def __init__(self):
+    def __init__(self, engine_pool: Optional[EnginePool] = None):
         # Environment configuration
         self.kifu_dir = os.getenv("KIFU_DIR", "data/kifu")
         self.kifu_out = os.getenv("KIFU_OUT", "data/out")
+        # BATCH_ENGINES>0: use a pool of engine processes instead of backend.api.main.annotate
+        if engine_pool is None:
+            n_engines = _env_int("BATCH_ENGINES", 0)
+            engine_pool = EnginePool(n_engines) if n_engines > 0 else None
+        self.engine_pool = engine_pool
+        self.engine_nodes: Optional[int] = None  # fixed node budget instead of byoyomi
+        self.output_format = os.getenv("KIFU_OUT_FORMAT", "json")  # "json" / "columnar"
+        # the same game under another name/header is referenced, not re-analysed
+        self.dedupe = os.getenv("KIFU_DEDUPE", "1") != "0"
+        self.corpus_chunk_rows = DEFAULT_CHUNK_ROWS
+        default_workers = engine_pool.size if engine_pool is not None else 1
+        self.workers = max(1, _env_int("BATCH_WORKERS", default_workers))
         # テスト期待: デフォルトは 250（外部環境の極端に小さい値に引っ張られない）
         env_ms = os.getenv("ENGINE_PER_MOVE_MS")
         try:
@@ -84,7 +228,13 @@ class BatchAnnotationService:
                        folder_path: Optional[str] = None,
                        recursive: bool = True,
                        byoyomi_ms: Optional[int] = None,
-                       skip_validation: bool = False) -> BatchAnnotationSummary:
+                       skip_validation: bool = False,
+                       workers: Optional[int] = None,
+                       resume: bool = True,
+                       progress_callback: Optional[Callable[[BulkProgress], None]] = None,
+                       output_format: Optional[str] = None,
+                       cancel_event: Optional[threading.Event] = None,
+                       ) -> BatchAnnotationSummary:
         """
         Annotate all Kifu files in a folder.
         
@@ -93,11 +243,20 @@ class BatchAnnotationService:
             recursive: Scan subfolders
             byoyomi_ms: Engine time per move
             skip_validation: Skip USI validation
+            workers: Files processed concurrently (defaults to self.workers)
+            resume: Skip files the checkpoint manifest records as done with
+                the same content and analysis settings
+            progress_callback: Called with BulkProgress after every file
+            output_format: "json" (one file per game) or "columnar"
+                (defaults to self.output_format)
+            cancel_event: When set, no new files are started; files already
+                in flight finish and are checkpointed, so a later run resumes
             
         Returns:
-            BatchAnnotationSummary with results
+            BatchAnnotationSummary with results (in scan order)
         """
         start_time = datetime.now()
+        t0 = time.perf_counter()
         
         # Use default folder if not specified
         source_dir = folder_path or self.kifu_dir
@@ -105,62 +264,278 @@ class BatchAnnotationService:
         # Ensure output directory exists
         os.makedirs(self.kifu_out, exist_ok=True)
         
-        # Scan for files
-        kifu_files = scan_kifu_directory(source_dir, recursive=recursive)
-        
-        results = []
-        annotated_count = 0
-        error_count = 0
-        skipped_count = 0
+        # Scan for files (scandir: sizes/mtimes come with the listing)
+        entries = sorted(iter_kifu_files(source_dir, recursive), key=lambda e: e.path) \
+            if os.path.isdir(source_dir) else []
         
-        for file_path in kifu_files:
-            # Generate output path
-            rel_path = os.path.relpath(file_path, source_dir)
-            output_path = os.path.join(self.kifu_out, 
-                                     os.path.splitext(rel_path)[0] + ".json")
-            
-            # Create request
-            request = AnnotationRequest(
-                file_path=file_path,
-                output_path=output_path,
-                byoyomi_ms=byoyomi_ms or self.default_byoyomi,
-                skip_validation=skip_validation
+        manifest = CheckpointManifest(os.path.join(self.kifu_out, MANIFEST_NAME)).load()
+        byoyomi = byoyomi_ms or self.default_byoyomi
+        settings = self.analysis_settings(byoyomi)
+        settings_id = settings_key(settings)
+
+        results: List[Optional[AnnotationResult]] = [None] * len(entries)
+        progress = BulkProgress(total_files=len(entries))
+
+        fmt = output_format or self.output_format
+        if fmt not in ("json", "columnar"):
+            raise ValueError(f"unknown output format: {fmt}")
+        corpus_dir = os.path.join(self.kifu_out, "corpus")
+        writer = CorpusWriter(corpus_dir, self.corpus_chunk_rows) if fmt == "columnar" else None
+        dedupe = self._open_dedupe()
+        game_ids: Dict[int, int] = {}
+        # columnar: manifest entries wait until their chunk is on disk
+        not_durable: Dict[int, CheckpointEntry] = {}
+        flushed: Dict[int, str] = {}
+
+        def _report(result: AnnotationResult) -> None:
+            progress.record(result, time.perf_counter() - t0)
+            if progress_callback is not None:
+                progress_callback(progress)
+
+        def _requests():
+            for index, entry in enumerate(entries):
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                # Generate output path
+                rel_path = os.path.relpath(entry.path, source_dir)
+                output_path = os.path.join(self.kifu_out, 
+                                         os.path.splitext(rel_path)[0] + ".json")
+                done = manifest.is_done(rel_path, entry.size, entry.mtime_ns,
+                                        settings=settings_id, path=entry.path) if resume else None
+                if done is not None:
+                    results[index] = AnnotationResult(
+                        file_path=entry.path,
+                        success=True,
+                        output_path=done.output,
+                        move_count=done.moves,
+                        skipped=True,
+                    )
+                    _report(results[index])
+                    continue
+                yield index, AnnotationRequest(
+                    file_path=entry.path,
+                    output_path=output_path if writer is None else None,
+                    byoyomi_ms=byoyomi,
+                    skip_validation=skip_validation
+                )
+
+        def _process(index: int, request: AnnotationRequest):
+            try:
+                digest = file_digest(request.file_path)
+            except OSError:
+                digest = None
+            sink = None
+            if writer is not None:
+                def sink(data: Dict[str, Any]) -> None:
+                    game_ids[index] = writer.add_annotation(data)
+            return self.annotate_single_file(request, sink=sink, dedupe=dedupe,
+                                             settings_id=settings_id), digest
+
+        def _record_durable() -> None:
+            # a chunk may be flushed by another worker before this game's _finish runs
+            flushed.update(writer.take_flushed())
+            for game_id in [g for g in not_durable if g in flushed]:
+                checkpoint = not_durable.pop(game_id)
+                checkpoint.output = flushed.pop(game_id)
+                manifest.record(checkpoint)
+
+        def _finish(index: int, outcome) -> None:
+            result, digest = outcome
+            results[index] = result
+            entry = entries[index]
+            if result.success and settings_id not in manifest.settings:
+                manifest.register_settings(settings)
+            if writer is not None and result.success:
+                result.output_path = corpus_dir
+            checkpoint = CheckpointEntry(
+                source=os.path.relpath(entry.path, source_dir),
+                size=entry.size,
+                mtime_ns=entry.mtime_ns,
+                status="ok" if result.success else "error",
+                output=result.output_path if result.success else None,
+                moves=result.move_count,
+                error=result.error_message,
+                content_hash=digest,
+                settings=settings_id,
             )
-            
-            # Process file
-            result = self.annotate_single_file(request)
+            if writer is not None and index in game_ids:
+                not_durable[game_ids.pop(index)] = checkpoint
+                _record_durable()
+            else:
+                manifest.record(checkpoint)
+            _report(result)
+
+        n_workers = max(1, workers or self.workers)
+        try:
+            if n_workers == 1:
+                for index, request in _requests():
+                    _finish(index, _process(index, request))
+            else:
+                # bounded in-flight window: a 100k-file folder never becomes 100k futures
+                with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="annotate") as pool:
+                    pending: Dict[Future, int] = {}
+                    for index, request in _requests():
+                        pending[pool.submit(_process, index, request)] = index
+                        if len(pending) >= n_workers * 2:
+                            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            for fut in finished:
+                                _finish(pending.pop(fut), fut.result())
+                    for fut in list(pending):
+                        _finish(pending.pop(fut), fut.result())
+        finally:
+            if writer is not None:
+                writer.close()
+                _record_durable()
+            manifest.close()
+            if dedupe is not None:
+                dedupe.close()
+
+        return _summarize(len(entries), [r for r in results if r is not None], start_time)
+
+    def annotate_provider(self,
+                          provider: KifuProvider,
+                          game_ids: Iterable[str],
+                          byoyomi_ms: Optional[int] = None,
+                          skip_validation: bool = False,
+                          workers: Optional[int] = None,
+                          resume: bool = True,
+                          progress_callback: Optional[Callable[[BulkProgress], None]] = None,
+                          output_format: Optional[str] = None,
+                          scheduler: Optional[FetchScheduler] = None,
+                          cancel_event: Optional[threading.Event] = None,
+                          ) -> BatchAnnotationSummary:
+        """
+        Fetch games from a provider and annotate each one as soon as it arrives.
+
+        Fetching runs concurrently under the provider's get_rate_limits()
+        (see FetchScheduler) while the engines work, so a slow remote source
+        overlaps with analysis instead of being a separate download phase.
+
+        Args:
+            provider: Source of the games
+            game_ids: Ids as returned by provider.search()
+            byoyomi_ms, skip_validation, workers, progress_callback,
+            output_format, cancel_event: as for annotate_folder
+            resume: Skip ids whose JSON output already exists (json format
+                only; provider games have no size/mtime for the manifest)
+            scheduler: Custom FetchScheduler (defaults to the provider's limits)
+
+        Returns:
+            BatchAnnotationSummary with results in completion order;
+            fetch failures and unknown ids are reported as errors
+        """
+        start_time = datetime.now()
+        t0 = time.perf_counter()
+        ids = list(dict.fromkeys(game_ids))
+
+        fmt = output_format or self.output_format
+        if fmt not in ("json", "columnar"):
+            raise ValueError(f"unknown output format: {fmt}")
+        out_dir = os.path.join(self.kifu_out, provider.name)
+        os.makedirs(out_dir, exist_ok=True)
+        corpus_dir = os.path.join(self.kifu_out, "corpus")
+        writer = CorpusWriter(corpus_dir, self.corpus_chunk_rows) if fmt == "columnar" else None
+        byoyomi = byoyomi_ms or self.default_byoyomi
+        settings_id = settings_key(self.analysis_settings(byoyomi))
+        dedupe = self._open_dedupe()
+
+        results: List[AnnotationResult] = []
+        progress = BulkProgress(total_files=len(ids))
+
+        def _finish(result: AnnotationResult) -> None:
+            if writer is not None and result.success:
+                result.output_path = corpus_dir
             results.append(result)
-            
-            if result.success:
-                annotated_count += 1
-            elif result.error_message:
-                error_count += 1
+            progress.record(result, time.perf_counter() - t0)
+            if progress_callback is not None:
+                progress_callback(progress)
+
+        to_fetch = []
+        for game_id in ids:
+            output_path = os.path.join(out_dir, provider_output_name(game_id))
+            if resume and writer is None and os.path.exists(output_path):
+                _finish(AnnotationResult(file_path=game_id, success=True,
+                                         output_path=output_path, skipped=True))
             else:
-                skipped_count += 1
-        
-        end_time = datetime.now()
-        total_time_ms = int((end_time - start_time).total_seconds() * 1000)
-        
-        return BatchAnnotationSummary(
-            total_files=len(kifu_files),
-            scanned=len(kifu_files), 
-            annotated=annotated_count,
-            errors=error_count,
-            skipped=skipped_count,
-            total_time_ms=total_time_ms,
-            results=results,
-            error_details=[
-                {"file": r.file_path, "reason": r.error_message}
-                for r in results if r.error_message
-            ]
-        )
+                to_fetch.append(game_id)
+
+        def _process(content: KifuContent) -> AnnotationResult:
+            game_id = content.info.id
+            request = AnnotationRequest(
+                file_path=game_id,
+                output_path=None if writer is not None else
+                os.path.join(out_dir, provider_output_name(game_id)),
+                byoyomi_ms=byoyomi,
+                skip_validation=skip_validation,
+            )
+            sink = writer.add_annotation if writer is not None else None
+            return self.annotate_kifu_data(kifu_data_from_content(content), request, sink=sink,
+                                           dedupe=dedupe, settings_id=settings_id)
+
+        n_workers = max(1, workers or self.workers)
+        fetcher = scheduler or FetchScheduler(provider)
+        try:
+            with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="annotate") as pool:
+                pending: Set[Future] = set()
+                # the fetch buffer is the only backlog: a slow engine slows the fetching
+                for outcome in iter_fetched(fetcher, to_fetch, buffer=n_workers):
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    if not outcome.ok:
+                        _finish(AnnotationResult(
+                            file_path=outcome.game_id,
+                            success=False,
+                            error_message=outcome.error or "Game not found",
+                        ))
+                        continue
+                    outcome.content.info.id = outcome.game_id
+                    pending.add(pool.submit(_process, outcome.content))
+                    if len(pending) >= n_workers * 2:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for fut in finished:
+                            _finish(fut.result())
+                for fut in pending:
+                    _finish(fut.result())
+        finally:
+            if writer is not None:
+                writer.close()
+            if dedupe is not None:
+                dedupe.close()
+
+        return _summarize(len(ids), results, start_time)
     
-    def annotate_single_file(self, request: AnnotationRequest) -> AnnotationResult:
+    def _open_dedupe(self) -> Optional[DedupeIndex]:
+        return DedupeIndex(os.path.join(self.kifu_out, DEDUPE_NAME)) if self.dedupe else None
+
+    def analysis_settings(self, byoyomi_ms: Optional[int]) -> Dict[str, Any]:
+        """
+        Everything that changes the analysis of a file. When this differs from
+        what the manifest recorded, files are annotated again.
+        """
+        if self.engine_pool is not None:
+            engine = self.engine_pool.describe()
+        else:
+            engine = {"backend": "backend.api.main", "cmd": os.getenv("USI_CMD", "/usr/local/bin/yaneuraou")}
+        return {
+            "annotator": ANNOTATOR_VERSION,
+            "engine": engine,
+            "byoyomi_ms": None if self.engine_nodes else byoyomi_ms,
+            "nodes": self.engine_nodes,
+        }
+
+    def annotate_single_file(self, request: AnnotationRequest,
+                             sink: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                             dedupe: Optional[DedupeIndex] = None,
+                             settings_id: Optional[str] = None) -> AnnotationResult:
         """
         Annotate a single file.
         
         Args:
             request: AnnotationRequest with file details
+            sink: Receives the output dict instead of it being written to
+                request.output_path (e.g. CorpusWriter.add_annotation)
+            dedupe: Index consulted before analysis; a game already annotated
+                under `settings_id` is referenced instead of analysed again
             
         Returns:
             AnnotationResult with processing outcome
@@ -170,8 +545,83 @@ class BatchAnnotationService:
         try:
             # Load Kifu file
             kifu_data = load_kifu_file(request.file_path)
-            
-            # Validate moves if requested
+        except FileNotFoundError as e:
+            return AnnotationResult(
+                file_path=request.file_path,
+                success=False,
+                error_message=f"File not found: {str(e)}"
+            )
+        except Exception as e:
+            return AnnotationResult(
+                file_path=request.file_path,
+                success=False,
+                error_message=str(e)
+            )
+        return self.annotate_kifu_data(kifu_data, request, sink=sink, start_time=start_time,
+                                       dedupe=dedupe, settings_id=settings_id)
+
+    def annotate_kifu_data(self, kifu_data: KifuData, request: AnnotationRequest,
+                           sink: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                           start_time: Optional[datetime] = None,
+                           dedupe: Optional[DedupeIndex] = None,
+                           settings_id: Optional[str] = None) -> AnnotationResult:
+        """
+        Annotate an already-parsed game (a file, or a provider fetch).
+
+        request.file_path is only used as the source label of the output.
+        """
+        start_time = start_time or datetime.now()
+        keys = None
+        if dedupe is not None and kifu_data.usi_moves:
+            keys = game_keys(kifu_data.usi_moves, kifu_data.start_sfen)
+            original = dedupe.claim(keys, settings_id or "", request.file_path)
+            if original is not None:
+                return self._reference_duplicate(kifu_data, request, original, start_time)
+        result = None
+        try:
+            result = self._annotate_kifu_data(kifu_data, request, sink, start_time)
+            return result
+        finally:
+            if keys is not None:
+                # waiting copies annotate themselves if this one failed
+                dedupe.release(keys, settings_id or "", request.file_path,
+                               output=request.output_path if sink is None else None,
+                               success=result is not None and result.success)
+
+    def _reference_duplicate(self, kifu_data: KifuData, request: AnnotationRequest,
+                             original: DedupeEntry, start_time: datetime) -> AnnotationResult:
+        """Point this copy at the original's analysis instead of running the engine."""
+        try:
+            if request.output_path:
+                # no "annotation" key: corpus readers see the game once
+                atomic_write_json(request.output_path, {
+                    "metadata": asdict(kifu_data.metadata),
+                    "source_file": request.file_path,
+                    "start_sfen": kifu_data.start_sfen,
+                    "processing_time": datetime.now().isoformat(),
+                    "duplicate_of": {"source_file": original.source, "output": original.output},
+                })
+        except OSError as e:
+            return AnnotationResult(
+                file_path=request.file_path,
+                success=False,
+                error_message=str(e)
+            )
+        return AnnotationResult(
+            file_path=request.file_path,
+            success=True,
+            output_path=request.output_path or original.output,
+            move_count=len(kifu_data.usi_moves),
+            processing_time_ms=int((datetime.now() - start_time).total_seconds() * 1000),
+            duplicate_of=original.source,
+        )
+
+    def _annotate_kifu_data(self, kifu_data: KifuData, request: AnnotationRequest,
+                            sink: Optional[Callable[[Dict[str, Any]], Any]],
+                            start_time: datetime) -> AnnotationResult:
+
+        try:
+            # Validate moves if requested (format, then legality of the whole game)
             if not request.skip_validation:
                 if not kifu_data.usi_moves:
                     return AnnotationResult(
@@ -179,7 +629,7 @@ class BatchAnnotationService:
                         success=False,
                         error_message="Invalid USI moves: no moves"
                     )
-                valid, errors = validate_usi_moves(kifu_data.usi_moves)
+                valid, errors = validate_usi_moves(kifu_data.usi_moves, kifu_data.start_sfen, legal=True)
                 if not valid:
                     return AnnotationResult(
                         file_path=request.file_path,
@@ -207,15 +657,16 @@ class BatchAnnotationService:
             full_data = {
                 "metadata": asdict(kifu_data.metadata),
                 "source_file": request.file_path,
+                "start_sfen": kifu_data.start_sfen,
                 "processing_time": datetime.now().isoformat(),
                 "annotation": annotation_data
             }
             
-            # Save result
-            if request.output_path:
-                os.makedirs(os.path.dirname(request.output_path), exist_ok=True)
-                with open(request.output_path, 'w', encoding='utf-8') as f:
-                    json.dump(full_data, f, indent=2, ensure_ascii=False)
+            # Save result (temp file + rename: a crash never leaves a truncated JSON)
+            if sink is not None:
+                sink(full_data)
+            elif request.output_path:
+                atomic_write_json(request.output_path, full_data)
             
             end_time = datetime.now()
             processing_time = int((end_time - start_time).total_seconds() * 1000)
@@ -236,13 +687,6 @@ class BatchAnnotationService:
                 annotation_count=annotation_count,
                 processing_time_ms=processing_time
             )
-            
-        except FileNotFoundError as e:
-            return AnnotationResult(
-                file_path=request.file_path,
-                success=False,
-                error_message=f"File not found: {str(e)}"
-            )
 
         except Exception as e:
             return AnnotationResult(
@@ -267,6 +711,12 @@ class BatchAnnotationService:
         Returns:
             Annotation data compatible with AnnotateResponse
         """
+        if self.engine_pool is not None:
+            # Engine errors propagate so the file is reported as failed, not faked
+            with self.engine_pool.acquire() as engine:
+                return analyze_game(engine, usi_moves, start_sfen,
+                                    byoyomi_ms=byoyomi_ms, nodes=self.engine_nodes)
+
         from ..api.main import AnnotateRequest
 
         def _dump_model(obj: Any) -> Any:
@@ -290,50 +740,32 @@ class BatchAnnotationService:
 
             return obj
         
-        # Import the annotate function directly to avoid HTTP overhead
-        try:
-            # Try to import the core annotation logic
-            from ..api.main import annotate
-            
-            # Create request object
-            if start_sfen:
-                usi_string = f"position sfen {start_sfen} moves {' '.join(usi_moves)}"
-            else:
-                usi_string = f"startpos moves {' '.join(usi_moves)}"
-            
-            req = AnnotateRequest(
-                usi=usi_string,
-                byoyomi_ms=byoyomi_ms
-            )
-            
-            # Call annotation function
-            response = annotate(req)
-            
-            # Convert response to dict
-            dumped = _dump_model(response)
-            if isinstance(dumped, dict):
-                return dumped
+        # Import the annotate function directly to avoid HTTP overhead.
+        # Errors propagate like the pool path: the file is reported as failed, not faked
+        from ..api.main import annotate
+
+        if start_sfen:
+            usi_string = f"position sfen {start_sfen} moves {' '.join(usi_moves)}"
+        else:
+            usi_string = f"startpos moves {' '.join(usi_moves)}"
+
+        req = AnnotateRequest(
+            usi=usi_string,
+            byoyomi_ms=byoyomi_ms
+        )
+
+        response = annotate(req)
+
+        # Convert response to dict
+        dumped = _dump_model(response)
+        if isinstance(dumped, dict):
+            return dumped
+
+        return {
+            "summary": getattr(response, "summary", ""),
+            "notes": [_dump_model(note) for note in getattr(response, "notes", [])],
+        }
 
-            return {
-                "summary": getattr(response, "summary", ""),
-                "notes": [_dump_model(note) for note in getattr(response, "notes", [])],
-            }
-                
-        except Exception as e:
-            # Fallback: minimal annotation structure
-            return {
-                "summary": f"Batch annotation completed. Error: {str(e)}",
-                "notes": [
-                    {
-                        "ply": i + 1,
-                        "move": move,
-                        "comment": "Batch processed",
-                        "reasoning": None
-                    }
-                    for i, move in enumerate(usi_moves)
-                ]
-            }
-    
     def get_folder_stats(self, folder_path: Optional[str] = None) -> Dict[str, Any]:
         """
         Get statistics about a folder without processing.
@@ -354,18 +786,17 @@ class BatchAnnotationService:
                 "total_size_mb": 0
             }
         
-        files = scan_kifu_directory(source_dir, recursive=True)
-        
+        files = []
         by_extension = {}
         total_size = 0
         
-        for file_path in files:
-            path_obj = Path(file_path)
-            ext = path_obj.suffix.lower()
-            size = path_obj.stat().st_size
-            
+        # One scandir pass: no second stat per file
+        for entry in iter_kifu_files(source_dir, recursive=True):
+            ext = Path(entry.path).suffix.lower()
+            files.append(entry.path)
             by_extension[ext] = by_extension.get(ext, 0) + 1
-            total_size += size
+            total_size += entry.size
+        files.sort()
         
         total_size_mb = total_size / (1024 * 1024)
         # 小さいファイル群で round により 0.0 になるのを防ぐ
@@ -382,6 +813,63 @@ class BatchAnnotationService:
         }
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
 def create_batch_service() -> BatchAnnotationService:
     """Factory function to create batch annotation service"""
-    return BatchAnnotationService()
\ No newline at end of file
+    return BatchAnnotationService()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Annotate a Kifu folder with a pool of USI engines")
+    ap.add_argument("--dir", default=None, help="Kifu directory (default: $KIFU_DIR)")
+    ap.add_argument("--out", default=None, help="Output directory (default: $KIFU_OUT)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="engine processes / files annotated concurrently")
+    ap.add_argument("--byoyomi-ms", type=int, default=None, help="engine time per position")
+    ap.add_argument("--nodes", type=int, default=None, help="fixed node budget per position")
+    ap.add_argument("--no-recursive", action="store_true")
+    ap.add_argument("--skip-validation", action="store_true")
+    ap.add_argument("--no-resume", action="store_true", help="ignore the checkpoint manifest")
+    ap.add_argument("--format", choices=["json", "columnar"], default=None,
+                    help="one JSON per game, or a columnar corpus under <out>/corpus")
+    ap.add_argument("--no-dedupe", action="store_true",
+                    help="analyse every copy of a game, even when already annotated")
+    args = ap.parse_args(argv)
+
+    with EnginePool(max(1, args.workers)) as pool:
+        service = BatchAnnotationService(engine_pool=pool)
+        if args.out:
+            service.kifu_out = args.out
+        service.engine_nodes = args.nodes
+        if args.no_dedupe:
+            service.dedupe = False
+
+        def _progress(p: BulkProgress) -> None:
+            print(p.format(), file=sys.stderr, flush=True)
+
+        summary = service.annotate_folder(
+            folder_path=args.dir,
+            recursive=not args.no_recursive,
+            byoyomi_ms=args.byoyomi_ms,
+            skip_validation=args.skip_validation,
+            workers=pool.size,
+            resume=not args.no_resume,
+            progress_callback=_progress,
+            output_format=args.format,
+        )
+
+    report = asdict(summary)
+    report.pop("results")
+    report["success"] = summary.success
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if summary.success else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,186 @@
+"""
+checkpoint.py
+
+Crash-safe bookkeeping for bulk annotation runs.
+
+- atomic_write_json(): write to a temp file in the target directory, fsync,
+  then os.replace() so readers never see a half-written output.
+- CheckpointManifest: append-only JSON-lines log of finished files kept next
+  to the outputs. Each record holds the source's relative path, size, mtime,
+  content hash and the key of the analysis settings (engine build, eval
+  files, time/node budget) it was produced with; the settings themselves are
+  stored once as separate "settings" records. A rerun skips a file when the
+  settings are unchanged, its output still exists and either size+mtime
+  match or (mtime only changed) the content hash matches. A torn last line
+  (crash while appending) is ignored.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import asdict, dataclass, fields, replace
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+MANIFEST_NAME = ".annotate_manifest.jsonl"
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = 2) -> None:
+    """Write JSON to `path` atomically (temp file + fsync + rename)."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """BLAKE2b-128 of a file's bytes."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def settings_key(settings: Dict[str, Any]) -> str:
+    """Stable short key for an analysis-settings dict."""
+    raw = json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+@dataclass
+class CheckpointEntry:
+    """One finished (or failed) source file."""
+    source: str                    # path relative to the scanned folder
+    size: int
+    mtime_ns: int
+    status: str                    # "ok" / "error"
+    output: Optional[str] = None
+    moves: int = 0
+    error: Optional[str] = None
+    finished_at: Optional[str] = None
+    content_hash: Optional[str] = None
+    settings: Optional[str] = None    # settings_key() of the analysis settings
+
+
+class CheckpointManifest:
+    """Append-only manifest; the last record for a source wins."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, CheckpointEntry] = {}
+        self.settings: Dict[str, Dict[str, Any]] = {}
+        self._lines = 0
+        self._fh = None
+
+    def load(self) -> "CheckpointManifest":
+        self.entries.clear()
+        self.settings.clear()
+        self._lines = 0
+        if not os.path.exists(self.path):
+            return self
+        known = {f.name for f in fields(CheckpointEntry)}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    raw = json.loads(line)
+                    if raw.get("kind") == "settings":
+                        self.settings[raw["key"]] = raw["settings"]
+                        continue
+                    entry = CheckpointEntry(**{k: v for k, v in raw.items() if k in known})
+                except (ValueError, TypeError, KeyError, AttributeError):
+                    continue  # torn write from an interrupted run
+                self.entries[entry.source] = entry
+                self._lines += 1
+        return self
+
+    def register_settings(self, settings: Dict[str, Any]) -> str:
+        """Store a settings dict once and return its key for CheckpointEntry.settings."""
+        key = settings_key(settings)
+        if key not in self.settings:
+            self._append({"kind": "settings", "key": key, "settings": settings})
+            self.settings[key] = settings
+        return key
+
+    def is_done(self, source: str, size: int, mtime_ns: int,
+                settings: Optional[str] = None,
+                path: Optional[str] = None) -> Optional[CheckpointEntry]:
+        """
+        The successful entry for an unchanged source whose output still exists.
+
+        When only the mtime differs (copied / touched file) and `path` is given,
+        the content hash decides; a match refreshes the stored mtime.
+        """
+        entry = self.entries.get(source)
+        if entry is None or entry.status != "ok":
+            return None
+        if settings is not None and entry.settings != settings:
+            return None
+        if entry.size != size:
+            return None
+        if entry.output and not os.path.exists(entry.output):
+            return None
+        if entry.mtime_ns != mtime_ns:
+            if path is None or entry.content_hash is None:
+                return None
+            try:
+                if file_digest(path) != entry.content_hash:
+                    return None
+            except OSError:
+                return None
+            entry = replace(entry, mtime_ns=mtime_ns)
+            self.record(entry)
+        return entry
+
+    def record(self, entry: CheckpointEntry) -> None:
+        """Append one record and flush it to disk before returning."""
+        if entry.finished_at is None:
+            entry.finished_at = datetime.now().isoformat(timespec="seconds")
+        self._append(asdict(entry))
+        self.entries[entry.source] = entry
+        self._lines += 1
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        # superseded records pile up across reruns; rewrite once they dominate
+        if self._lines > 2 * len(self.entries) + 100:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the manifest with only the latest record per source."""
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".jsonl", dir=directory)
+        used = {e.settings for e in self.entries.values()}
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for key, settings in self.settings.items():
+                if key in used:
+                    f.write(json.dumps({"kind": "settings", "key": key, "settings": settings},
+                                       ensure_ascii=False) + "\n")
+            for entry in self.entries.values():
+                f.write(json.dumps(asdict(entry), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._lines = len(self.entries)
@@ -0,0 +1,476 @@
+"""
+corpus_analytics.py
+
+Corpus-wide statistics over annotated games (batch JSON output and/or a
+columnar corpus store, see corpus_store.py).
+
+The corpus is loaded once into flat NumPy arrays (one row per ply, one row
+per game), then every report is a handful of vectorized grouped aggregates
+(np.bincount over group codes):
+
+- blunder rate by phase (序盤 / 中盤 / 終盤, same ply thresholds as the API)
+- average eval loss per move and blunder rate per player
+- opening / style / castle frequencies and win rates, labelled with
+  detect_opening_bundle / detect_castle_bundle on the position reached at a
+  fixed ply
+
+CLI:
+    python -m backend.services.corpus_analytics data/out [--player NAME] [--top 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:  # pragma: no cover - numpy は requirements に含まれる
+    np = None  # type: ignore[assignment]
+    HAS_NUMPY = False
+
+from ..ingest.board import KIND_MASK, KIND_TO_SFEN, WHITE, WHITE_FLAG, Board, IllegalMoveError
+from ..ingest.game_store import GameStoreReader, is_game_store
+from ..ingest.move_codec import decode_moves
+from .corpus_store import CHUNK_PREFIX, MISSING, CorpusReader
+from .engine_pool import BLUNDER_DELTA_CP
+
+PHASES = ("序盤", "中盤", "終盤")
+OPENING_LABEL_PLY = 24   # 序盤の終わり: 戦型・戦法はこの局面で判定
+CASTLE_LABEL_PLY = 40    # 囲いは組み上がるのが遅いので少し後の局面で判定
+
+_RESULT_CODES = {"sente_win": 1, "gote_win": -1, "draw": 0}
+_NO_RESULT = 2
+
+
+def phase_of_ply(ply):
+    """0=序盤 (ply < 24), 1=中盤, 2=終盤 (ply > 100); works on scalars and arrays."""
+    if HAS_NUMPY and isinstance(ply, np.ndarray):
+        return np.where(ply < 24, 0, np.where(ply > 100, 2, 1)).astype(np.int8)
+    return 0 if ply < 24 else 2 if ply > 100 else 1
+
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+@dataclass
+class GameRecord:
+    """One game as read from either output format."""
+    source: Optional[str]
+    sente: Optional[str]
+    gote: Optional[str]
+    result: Optional[str]
+    start_sfen: Optional[str]
+    moves: List[str]
+    ply: List[int]
+    delta_cp: List[int]
+    score_cp: List[int]
+    bestmove: List[str] = field(default_factory=list)   # engine best move before each ply, "" if unknown
+
+
+def _int(value: Any) -> int:
+    return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else MISSING
+
+
+def _iter_json_games(root: str) -> Iterator[GameRecord]:
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = sorted(os.scandir(current), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name != "corpus" and not entry.name.startswith("."):
+                    stack.append(entry.path)
+                continue
+            if not entry.name.endswith(".json") or entry.name.startswith("."):
+                continue
+            try:
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(data, dict) or "annotation" not in data:
+                continue
+            meta = data.get("metadata") or {}
+            notes = [n for n in (data.get("annotation") or {}).get("notes") or [] if n.get("move")]
+            yield GameRecord(
+                source=data.get("source_file"),
+                sente=meta.get("sente"),
+                gote=meta.get("gote"),
+                result=meta.get("result"),
+                start_sfen=data.get("start_sfen"),
+                moves=[n["move"] for n in notes],
+                ply=[_int(n.get("ply")) for n in notes],
+                delta_cp=[_int(n.get("delta_cp")) for n in notes],
+                score_cp=[_int(n.get("score_after_cp")) for n in notes],
+                bestmove=[n.get("bestmove") or "" for n in notes],
+            )
+
+
+def _is_corpus_store(path: str) -> bool:
+    try:
+        return any(name.startswith(CHUNK_PREFIX) for name in os.listdir(path))
+    except OSError:
+        return False
+
+
+@dataclass
+class CorpusFrame:
+    """Flat arrays for the whole corpus: per-ply rows and per-game rows."""
+    # per ply
+    game: Any
+    ply: Any
+    delta_cp: Any
+    score_cp: Any
+    mover_white: Any
+    # per game
+    result: Any           # 1 sente win, -1 gote win, 0 draw, 2 unknown
+    sente_id: Any         # index into players, -1 unknown
+    gote_id: Any
+    players: List[str]
+    labels: Dict[str, Tuple[Any, Any, List[str]]] = field(default_factory=dict)  # kind -> (b codes, w codes, names)
+
+    @property
+    def n_games(self) -> int:
+        return len(self.result)
+
+    @property
+    def n_plies(self) -> int:
+        return len(self.ply)
+
+
+def _labels_for_game(start_sfen: Optional[str], moves: List[str]) -> Dict[str, Tuple[str, str]]:
+    """{"style"/"opening"/"castle": (sente label, gote label)} from the detectors."""
+    from backend.ai.castle_detector import detect_castle_bundle
+    from backend.ai.opening_detector import detect_opening_bundle
+
+    def snapshot(board: Board) -> List[List[Optional[str]]]:
+        grid: List[List[Optional[str]]] = [[None] * 9 for _ in range(9)]
+        for sq, piece in enumerate(board.squares):
+            if piece:
+                name = KIND_TO_SFEN[piece & KIND_MASK]
+                grid[sq // 9][sq % 9] = name.lower() if piece & WHITE_FLAG else name
+        return grid
+
+    try:
+        board = Board.from_sfen(start_sfen or "startpos")
+    except ValueError:
+        return {}
+    boards: Dict[int, List[List[Optional[str]]]] = {}
+    last = min(len(moves), CASTLE_LABEL_PLY)
+    for i in range(last + 1):
+        if i == min(len(moves), OPENING_LABEL_PLY):
+            boards[OPENING_LABEL_PLY] = snapshot(board)
+        if i == last:
+            boards[CASTLE_LABEL_PLY] = snapshot(board)
+            break
+        try:
+            board.push_usi(moves[i])
+        except IllegalMoveError:
+            boards.setdefault(OPENING_LABEL_PLY, snapshot(board))
+            boards[CASTLE_LABEL_PLY] = snapshot(board)
+            break
+
+    opening_moves = moves[:OPENING_LABEL_PLY]
+    out: Dict[str, Tuple[str, str]] = {}
+    per_side = {side: detect_opening_bundle(boards[OPENING_LABEL_PLY], opening_moves, side) for side in "bw"}
+    for kind in ("style", "opening"):
+        out[kind] = (per_side["b"][kind]["nameJa"], per_side["w"][kind]["nameJa"])
+    castles = {side: detect_castle_bundle(boards[CASTLE_LABEL_PLY], side)["castle"]["nameJa"] for side in "bw"}
+    out["castle"] = (castles["b"], castles["w"])
+    return out
+
+
+def _iter_store_games(path: str) -> Iterator[GameRecord]:
+    reader = CorpusReader(path)
+    for chunk in reader.chunks:
+        cols = {name: chunk.column(name) for name in ("move", "ply", "delta_cp", "score_cp", "bestmove")}
+        for row in chunk.games:
+            if row["game_id"] in reader.superseded:
+                continue
+            lo, hi = row["offset"], row["offset"] + row["plies"]
+            yield GameRecord(
+                source=row.get("source"),
+                sente=row.get("sente"),
+                gote=row.get("gote"),
+                result=row.get("result"),
+                start_sfen=row.get("start_sfen"),
+                moves=decode_moves(cols["move"][lo:hi]),
+                ply=cols["ply"][lo:hi],
+                delta_cp=cols["delta_cp"][lo:hi],
+                score_cp=cols["score_cp"][lo:hi],
+                bestmove=decode_moves(cols["bestmove"][lo:hi]),
+            )
+
+
+def _iter_game_store_games(path: str) -> Iterator[GameRecord]:
+    # moves and headers only: phase/player eval stats stay empty, labels work
+    with GameStoreReader(path) as reader:
+        for game in reader:
+            n = len(game.codes)
+            yield GameRecord(
+                source=game.meta.get("source_path"),
+                sente=game.meta.get("sente"),
+                gote=game.meta.get("gote"),
+                result=game.meta.get("result"),
+                start_sfen=game.start_sfen,
+                moves=game.moves,
+                ply=list(range(1, n + 1)),
+                delta_cp=[MISSING] * n,
+                score_cp=[MISSING] * n,
+            )
+
+
+def iter_annotated_games(path: str) -> Iterator[GameRecord]:
+    """
+    Games from a columnar store, a folder of JSON outputs, or both
+    (<out>/corpus); a game store file (game_store.py) gives unannotated games.
+    """
+    if is_game_store(path):
+        yield from _iter_game_store_games(path)
+        return
+    if _is_corpus_store(path):
+        yield from _iter_store_games(path)
+        return
+    yield from _iter_json_games(path)
+    corpus = os.path.join(path, "corpus")
+    if _is_corpus_store(corpus):
+        yield from _iter_store_games(corpus)
+
+
+def _white_to_move(start_sfen: Optional[str]) -> bool:
+    if not start_sfen or start_sfen.strip() == "startpos":
+        return False
+    try:
+        return Board.from_sfen(start_sfen).turn == WHITE
+    except ValueError:
+        return False
+
+
+def build_frame(games: Iterable[GameRecord], with_labels: bool = True) -> CorpusFrame:
+    """Concatenate per-game lists into flat arrays (the only per-game Python loop)."""
+    if not HAS_NUMPY:
+        raise RuntimeError("numpy is required for corpus analytics")
+    ply_parts, delta_parts, score_parts, game_parts, white_parts = [], [], [], [], []
+    results: List[int] = []
+    sente_ids: List[int] = []
+    gote_ids: List[int] = []
+    player_index: Dict[str, int] = {}
+    label_names: Dict[str, Dict[str, int]] = {"style": {}, "opening": {}, "castle": {}}
+    label_codes: Dict[str, Tuple[List[int], List[int]]] = {k: ([], []) for k in label_names}
+
+    def pid(name: Optional[str]) -> int:
+        if not name:
+            return -1
+        return player_index.setdefault(name, len(player_index))
+
+    for g in games:
+        gi = len(results)
+        n = len(g.moves)
+        ply = np.asarray(g.ply, dtype=np.int32)
+        white_first = _white_to_move(g.start_sfen)
+        ply_parts.append(ply)
+        delta_parts.append(np.asarray(g.delta_cp, dtype=np.int64))
+        score_parts.append(np.asarray(g.score_cp, dtype=np.int64))
+        game_parts.append(np.full(n, gi, dtype=np.int32))
+        white_parts.append(((ply - 1 + int(white_first)) % 2).astype(bool))
+        results.append(_RESULT_CODES.get(g.result or "", _NO_RESULT))
+        sente_ids.append(pid(g.sente))
+        gote_ids.append(pid(g.gote))
+        if with_labels:
+            labels = _labels_for_game(g.start_sfen, g.moves)
+            for kind, names in label_names.items():
+                b, w = labels.get(kind, ("不明", "不明"))
+                label_codes[kind][0].append(names.setdefault(b, len(names)))
+                label_codes[kind][1].append(names.setdefault(w, len(names)))
+
+    def cat(parts, dtype):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    frame = CorpusFrame(
+        game=cat(game_parts, np.int32),
+        ply=cat(ply_parts, np.int32),
+        delta_cp=cat(delta_parts, np.int64),
+        score_cp=cat(score_parts, np.int64),
+        mover_white=cat(white_parts, bool),
+        result=np.asarray(results, dtype=np.int8),
+        sente_id=np.asarray(sente_ids, dtype=np.int32),
+        gote_id=np.asarray(gote_ids, dtype=np.int32),
+        players=list(player_index),
+    )
+    if with_labels:
+        for kind, names in label_names.items():
+            b, w = label_codes[kind]
+            frame.labels[kind] = (np.asarray(b, dtype=np.int32), np.asarray(w, dtype=np.int32), list(names))
+    return frame
+
+
+def load_corpus(path: str, with_labels: bool = True) -> CorpusFrame:
+    return build_frame(iter_annotated_games(path), with_labels=with_labels)
+
+
+# ---------------------------------------------------------------------------
+# Aggregates
+# ---------------------------------------------------------------------------
+
+def _rate(num, den):
+    return np.divide(num, den, out=np.zeros(len(den), dtype=np.float64), where=den > 0)
+
+
+def blunder_rate_by_phase(frame: CorpusFrame, threshold_cp: int = BLUNDER_DELTA_CP) -> Dict[str, Dict[str, Any]]:
+    valid = frame.delta_cp != MISSING
+    phase = phase_of_ply(frame.ply[valid])
+    blunder = frame.delta_cp[valid] <= threshold_cp
+    moves = np.bincount(phase, minlength=3)
+    blunders = np.bincount(phase, weights=blunder, minlength=3).astype(np.int64)
+    rates = _rate(blunders, moves)
+    return {name: {"moves": int(moves[i]), "blunders": int(blunders[i]), "rate": round(float(rates[i]), 4)}
+            for i, name in enumerate(PHASES)}
+
+
+def _row_player(frame: CorpusFrame):
+    return np.where(frame.mover_white, frame.gote_id[frame.game], frame.sente_id[frame.game])
+
+
+def eval_loss_by_player(frame: CorpusFrame,
+                        player: Optional[str] = None,
+                        min_moves: int = 1,
+                        top: Optional[int] = 20,
+                        threshold_cp: int = BLUNDER_DELTA_CP) -> List[Dict[str, Any]]:
+    """Average eval loss (cp lost by the mover, gains count as 0) per player."""
+    if not frame.players:
+        return []
+    valid = frame.delta_cp != MISSING
+    who = _row_player(frame)
+    valid &= who >= 0
+    who = who[valid]
+    delta = frame.delta_cp[valid]
+    n_players = len(frame.players)
+    moves = np.bincount(who, minlength=n_players)
+    loss = np.bincount(who, weights=np.maximum(0, -delta), minlength=n_players)
+    blunders = np.bincount(who, weights=delta <= threshold_cp, minlength=n_players)
+    avg = _rate(loss, moves)
+    brate = _rate(blunders, moves)
+
+    if player is not None:
+        ids = [frame.players.index(player)] if player in frame.players else []
+    else:
+        ids = [int(i) for i in np.argsort(-moves, kind="stable") if moves[i] >= max(1, min_moves)]
+        if top is not None:
+            ids = ids[:top]
+    return [{"player": frame.players[i], "moves": int(moves[i]),
+             "avg_loss_cp": round(float(avg[i]), 1), "blunder_rate": round(float(brate[i]), 4)}
+            for i in ids]
+
+
+def label_win_rates(frame: CorpusFrame, kind: str, top: Optional[int] = 20) -> List[Dict[str, Any]]:
+    """Per label (opening / style / castle): how often each side adopted it and how it scored."""
+    if kind not in frame.labels:
+        return []
+    b, w, names = frame.labels[kind]
+    codes = np.concatenate([b, w])
+    # outcome from the labelled side's point of view
+    res = frame.result.astype(np.int16)
+    side_res = np.concatenate([res, np.where(res == _NO_RESULT, _NO_RESULT, -res)])
+    n = len(names)
+    games = np.bincount(codes, minlength=n)
+    wins = np.bincount(codes, weights=side_res == 1, minlength=n)
+    losses = np.bincount(codes, weights=side_res == -1, minlength=n)
+    draws = np.bincount(codes, weights=side_res == 0, minlength=n)
+    decided = wins + losses + draws
+    win_rate = _rate(wins + 0.5 * draws, decided)
+    order = [int(i) for i in np.argsort(-games, kind="stable") if games[i] > 0]
+    if top is not None:
+        order = order[:top]
+    return [{"label": names[i], "games": int(games[i]), "wins": int(wins[i]), "losses": int(losses[i]),
+             "draws": int(draws[i]), "win_rate": round(float(win_rate[i]), 4)} for i in order]
+
+
+def corpus_report(frame: CorpusFrame, player: Optional[str] = None,
+                  top: int = 20, min_moves: int = 1) -> Dict[str, Any]:
+    evaluated = int((frame.delta_cp != MISSING).sum())
+    return {
+        "games": frame.n_games,
+        "plies": frame.n_plies,
+        "evaluated_plies": evaluated,
+        "blunder_threshold_cp": BLUNDER_DELTA_CP,
+        "blunder_rate_by_phase": blunder_rate_by_phase(frame),
+        "eval_loss_by_player": eval_loss_by_player(frame, player=player, min_moves=min_moves, top=top),
+        "styles": label_win_rates(frame, "style", top),
+        "openings": label_win_rates(frame, "opening", top),
+        "castles": label_win_rates(frame, "castle", top),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Cached loading for the API
+# ---------------------------------------------------------------------------
+
+_FRAME_CACHE: Dict[str, Tuple[Tuple[int, int], CorpusFrame]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _corpus_signature(path: str) -> Tuple[int, int]:
+    """(entry count, newest mtime) of output files and corpus chunks; changes when outputs do."""
+    count, newest = 0, 0
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            it = os.scandir(current)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name.startswith(CHUNK_PREFIX):
+                        count += 1
+                        newest = max(newest, entry.stat().st_mtime_ns)
+                    elif not entry.name.startswith("."):
+                        stack.append(entry.path)
+                elif entry.name.endswith(".json") and not entry.name.startswith("."):
+                    count += 1
+                    newest = max(newest, entry.stat().st_mtime_ns)
+    return count, newest
+
+
+def cached_frame(path: str) -> CorpusFrame:
+    """load_corpus() memoized on the output folder's signature."""
+    signature = _corpus_signature(path)
+    with _CACHE_LOCK:
+        hit = _FRAME_CACHE.get(path)
+        if hit is not None and hit[0] == signature:
+            return hit[1]
+    frame = load_corpus(path)
+    with _CACHE_LOCK:
+        _FRAME_CACHE[path] = (signature, frame)
+    return frame
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Corpus-wide statistics over annotated games")
+    ap.add_argument("path", nargs="?", default=os.getenv("KIFU_OUT", "data/out"),
+                    help="annotation output folder or columnar corpus (default: $KIFU_OUT)")
+    ap.add_argument("--player", default=None, help="eval loss for this player only")
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--min-moves", type=int, default=1, help="hide players with fewer evaluated moves")
+    ap.add_argument("--no-labels", action="store_true", help="skip opening/castle detection")
+    args = ap.parse_args(argv)
+
+    frame = load_corpus(args.path, with_labels=not args.no_labels)
+    report = corpus_report(frame, player=args.player, top=args.top, min_moves=args.min_moves)
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
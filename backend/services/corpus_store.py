@@ -0,0 +1,320 @@
+"""
+corpus_store.py
+
+Columnar, append-only storage for annotated corpora.
+
+One JSON file per game repeats every key for every ply; this store keeps the
+per-ply values as fixed-width NumPy columns instead:
+
+    <root>/
+      chunk-000000/
+        game.npy  ply.npy  move.npy  score_cp.npy  mate.npy
+        delta_cp.npy  bestmove.npy  depth.npy
+        games.jsonl      # side table: one metadata row per game in the chunk
+        meta.json        # row / game counts and column dtypes
+      chunk-000001/
+      ...
+
+- Moves are 16-bit codes (backend.ingest.move_codec).
+- Scores are from sente's point of view and delta_cp from the mover's, as in
+  the annotation notes. Missing integers are MISSING; mate 0 means "no mate".
+- A chunk is written to a temp directory and renamed into place, so readers
+  only ever see complete chunks, and existing chunks are never modified.
+- Columns are opened with np.load(mmap_mode="r"): a corpus-wide query touches
+  one column at a time, chunk by chunk, without loading everything into RAM.
+- Re-annotating a source appends a new game; readers hide the older copy.
+"""
+
+import json
+import os
+import shutil
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:  # pragma: no cover - numpy は requirements に含まれる
+    np = None  # type: ignore[assignment]
+    HAS_NUMPY = False
+
+from ..ingest.move_codec import decode_moves, encode_move
+
+COLUMNS: Dict[str, str] = {
+    "game": "<u4",
+    "ply": "<u2",
+    "move": "<u2",
+    "score_cp": "<i4",
+    "mate": "<i2",
+    "delta_cp": "<i4",
+    "bestmove": "<u2",
+    "depth": "<u2",
+}
+MISSING = -(2 ** 31)
+DEFAULT_CHUNK_ROWS = 1 << 18
+
+CHUNK_PREFIX = "chunk-"
+GAMES_FILE = "games.jsonl"
+META_FILE = "meta.json"
+
+_INT32 = (-(2 ** 31) + 1, 2 ** 31 - 1)
+_INT16 = (-(2 ** 15), 2 ** 15 - 1)
+
+
+def _require_numpy() -> None:
+    if not HAS_NUMPY:
+        raise RuntimeError("numpy is required for the columnar corpus store")
+
+
+def _int_or(value: Any, missing: int, lo: int, hi: int) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return missing
+    return max(lo, min(hi, int(value)))
+
+
+def _chunk_dirs(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if name.startswith(CHUNK_PREFIX) and os.path.isdir(os.path.join(root, name)))
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class CorpusWriter:
+    """
+    Buffers games and appends them to the store one chunk at a time.
+
+    add_game() is thread-safe. take_flushed() reports which games have become
+    durable since the last call, so callers can checkpoint only what is on disk.
+    """
+
+    def __init__(self, root: str, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        _require_numpy()
+        self.root = root
+        self.chunk_rows = max(1, chunk_rows)
+        os.makedirs(root, exist_ok=True)
+        existing = _chunk_dirs(root)
+        self._next_chunk = int(existing[-1][len(CHUNK_PREFIX):]) + 1 if existing else 0
+        self._next_game = 0
+        if existing:
+            with open(os.path.join(root, existing[-1], META_FILE), "r", encoding="utf-8") as f:
+                self._next_game = json.load(f)["next_game"]
+        self._lock = threading.Lock()
+        self._reset_buffer()
+        self._flushed: List[Tuple[int, str]] = []
+
+    def _reset_buffer(self) -> None:
+        self._cols: Dict[str, List[int]] = {name: [] for name in COLUMNS}
+        self._games: List[Dict[str, Any]] = []
+
+    @property
+    def pending_rows(self) -> int:
+        return len(self._cols["ply"])
+
+    def add_game(self, notes: List[Dict[str, Any]],
+                 metadata: Optional[Dict[str, Any]] = None,
+                 source: Optional[str] = None,
+                 start_sfen: Optional[str] = None) -> int:
+        """Append one annotated game (its notes list); returns the game id."""
+        with self._lock:
+            game_id = self._next_game
+            self._next_game += 1
+            offset = self.pending_rows
+            cols = self._cols
+            n = 0
+            for note in notes:
+                move = note.get("move") or ""
+                if not move:
+                    continue  # placeholder note of an empty game
+                cols["game"].append(game_id)
+                cols["ply"].append(_int_or(note.get("ply"), n + 1, 0, 65535))
+                cols["move"].append(encode_move(move))
+                cols["score_cp"].append(_int_or(note.get("score_after_cp"), MISSING, *_INT32))
+                cols["mate"].append(_int_or(note.get("mate_after"), 0, *_INT16))
+                cols["delta_cp"].append(_int_or(note.get("delta_cp"), MISSING, *_INT32))
+                cols["bestmove"].append(encode_move(note.get("bestmove")))
+                depth = (note.get("evidence") or {}).get("depth")
+                cols["depth"].append(_int_or(depth, 0, 0, 65535))
+                n += 1
+            row = {"game_id": game_id, "offset": offset, "plies": n,
+                   "source": source, "start_sfen": start_sfen}
+            for key, value in (metadata or {}).items():
+                row.setdefault(key, value)
+            self._games.append(row)
+            if self.pending_rows >= self.chunk_rows:
+                self._flush_locked()
+            return game_id
+
+    def add_annotation(self, data: Dict[str, Any]) -> int:
+        """Append the dict annotate_single_file would write as JSON."""
+        annotation = data.get("annotation") or {}
+        return self.add_game(
+            annotation.get("notes") or [],
+            metadata=data.get("metadata"),
+            source=data.get("source_file"),
+            start_sfen=data.get("start_sfen"),
+        )
+
+    def flush(self) -> Optional[str]:
+        """Write buffered games as a new chunk; returns its path (None if empty)."""
+        with self._lock:
+            return self._flush_locked()
+
+    def _flush_locked(self) -> Optional[str]:
+        if not self._games:
+            return None
+        name = f"{CHUNK_PREFIX}{self._next_chunk:06d}"
+        final = os.path.join(self.root, name)
+        tmp = os.path.join(self.root, f".tmp-{name}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            for col, dtype in COLUMNS.items():
+                path = os.path.join(tmp, f"{col}.npy")
+                with open(path, "wb") as f:
+                    np.save(f, np.asarray(self._cols[col], dtype=dtype))
+                    f.flush()
+                    os.fsync(f.fileno())
+            with open(os.path.join(tmp, GAMES_FILE), "w", encoding="utf-8") as f:
+                for row in self._games:
+                    f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            meta = {"rows": self.pending_rows, "games": len(self._games),
+                    "next_game": self._next_game, "columns": COLUMNS}
+            with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, final)
+            _fsync_dir(self.root)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self._flushed.extend((row["game_id"], final) for row in self._games)
+        self._next_chunk += 1
+        self._reset_buffer()
+        return final
+
+    def take_flushed(self) -> List[Tuple[int, str]]:
+        """(game_id, chunk path) for games written since the last call."""
+        with self._lock:
+            flushed, self._flushed = self._flushed, []
+            return flushed
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "CorpusWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+@dataclass
+class CorpusChunk:
+    """One chunk: side table in memory, columns memory-mapped on demand."""
+    path: str
+    rows: int
+    games: List[Dict[str, Any]]
+    _cache: Dict[str, Any] = field(default_factory=dict, repr=False)
+    live: Optional[Any] = field(default=None, repr=False)   # bool mask; None = all rows live
+
+    def column(self, name: str):
+        if name not in COLUMNS:
+            raise KeyError(f"unknown column: {name}")
+        arr = self._cache.get(name)
+        if arr is None:
+            arr = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+            self._cache[name] = arr
+        return arr
+
+
+class CorpusReader:
+    """
+    Read-only view of a store. Only the side tables are loaded eagerly;
+    per-ply columns stay on disk until a chunk's column is touched.
+    """
+
+    def __init__(self, root: str):
+        _require_numpy()
+        self.root = root
+        self.chunks: List[CorpusChunk] = []
+        self._index: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+        latest: Dict[str, int] = {}
+        for name in _chunk_dirs(root):
+            path = os.path.join(root, name)
+            with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(os.path.join(path, GAMES_FILE), "r", encoding="utf-8") as f:
+                games = [json.loads(line) for line in f if line.strip()]
+            chunk_no = len(self.chunks)
+            self.chunks.append(CorpusChunk(path, meta["rows"], games))
+            for row in games:
+                self._index[row["game_id"]] = (chunk_no, row)
+                if row.get("source"):
+                    latest[row["source"]] = row["game_id"]
+
+        # an older copy of a re-annotated source is hidden from every query
+        live_ids = set(latest.values())
+        self.superseded = {gid for gid, (_, row) in self._index.items()
+                           if row.get("source") and gid not in live_ids}
+        if self.superseded:
+            dead = np.fromiter(self.superseded, dtype="<u4")
+            for chunk in self.chunks:
+                if any(row["game_id"] in self.superseded for row in chunk.games):
+                    chunk.live = ~np.isin(chunk.column("game"), dead)
+
+    def __len__(self) -> int:
+        """Number of live plies."""
+        return sum(c.rows if c.live is None else int(c.live.sum()) for c in self.chunks)
+
+    @property
+    def n_games(self) -> int:
+        return len(self._index) - len(self.superseded)
+
+    def games(self) -> Iterator[Dict[str, Any]]:
+        """Side-table rows of live games, in game id order."""
+        for chunk in self.chunks:
+            for row in chunk.games:
+                if row["game_id"] not in self.superseded:
+                    yield row
+
+    def iter_column(self, name: str) -> Iterator[Any]:
+        """One array per chunk (memory-mapped unless rows had to be filtered)."""
+        for chunk in self.chunks:
+            arr = chunk.column(name)
+            yield arr if chunk.live is None else arr[chunk.live]
+
+    def column(self, name: str):
+        """Whole column as one in-memory array."""
+        parts = list(self.iter_column(name))
+        if not parts:
+            return np.empty(0, dtype=COLUMNS[name])
+        return np.concatenate(parts)
+
+    def game(self, game_id: int) -> Dict[str, Any]:
+        """Per-ply arrays (memory-mapped slices) and the side-table row of one game."""
+        chunk_no, row = self._index[game_id]
+        chunk = self.chunks[chunk_no]
+        lo, hi = row["offset"], row["offset"] + row["plies"]
+        out: Dict[str, Any] = {name: chunk.column(name)[lo:hi] for name in COLUMNS}
+        out["info"] = row
+        return out
+
+    def game_moves(self, game_id: int) -> List[str]:
+        return decode_moves(self.game(game_id)["move"])
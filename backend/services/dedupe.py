@@ -0,0 +1,202 @@
+"""
+dedupe.py
+
+Duplicate-game index for bulk annotation.
+
+The same game arrives many times: re-uploads, overlapping Shogi Wars
+exports, a KIF and a CSA copy of one game. Headers (titles, player name
+spelling, dates) differ between copies, so the index keys on the game
+itself:
+
+- moves_hash: BLAKE2b-128 of the normalised start position ("startpos",
+  an explicit initial SFEN and no SFEN all hash the same) and the moves as
+  16-bit codes (move_codec), so games read from a game store hash without
+  being decoded to strings
+- final_hash: BLAKE2b-128 of the position after the last legal move
+
+A copy is a duplicate when both hashes match a game already annotated with
+the same analysis settings; the final position guards against a moves_hash
+collision and is indexed for "which games ended here" lookups. It is not a
+duplicate signal on its own: different games transpose into the same
+position.
+
+The index is a SQLite table next to the outputs (DEDUPE_NAME). Copies of one
+game that are annotated concurrently are serialised through claim(): the
+first copy annotates, the others wait and then reference its output.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+from array import array
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from ..ingest.board import Board, IllegalMoveError
+from ..ingest.game_store import encode_game
+from ..ingest.move_codec import decode_move
+
+DEDUPE_NAME = ".dedupe.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    moves_hash TEXT NOT NULL,
+    settings   TEXT NOT NULL,
+    final_hash TEXT NOT NULL,
+    plies      INTEGER NOT NULL,
+    source     TEXT NOT NULL,
+    output     TEXT,
+    added_at   TEXT NOT NULL,
+    PRIMARY KEY (moves_hash, settings)
+);
+CREATE INDEX IF NOT EXISTS games_final ON games(final_hash);
+"""
+
+
+@dataclass(frozen=True)
+class GameKeys:
+    moves_hash: str
+    final_hash: str
+    plies: int          # moves applied to reach final_hash (stops at an illegal move)
+
+
+@dataclass
+class DedupeEntry:
+    """The first annotated copy of a game."""
+    moves_hash: str
+    settings: str
+    final_hash: str
+    plies: int
+    source: str
+    output: Optional[str]
+    added_at: str
+
+
+def _as_codes(moves: Sequence[Union[str, int]]) -> Optional[array]:
+    if len(moves) and isinstance(moves[0], str):
+        try:
+            return encode_game(moves)
+        except ValueError:
+            return None     # unvalidated tokens: hashed as text below
+    return array("H", moves)
+
+
+def game_keys(moves: Sequence[Union[str, int]], start_sfen: Optional[str] = None) -> GameKeys:
+    """
+    Header-independent identity of a game. `moves` are USI strings or 16-bit
+    codes (e.g. GameStoreReader.codes(i)); both give the same keys.
+    """
+    try:
+        board = Board.from_sfen(start_sfen)
+        start = board.sfen(with_ply=False)
+    except (ValueError, IndexError, KeyError):
+        board, start = None, (start_sfen or "startpos").strip()
+    h = hashlib.blake2b(start.encode("utf-8"), digest_size=16)
+    codes = _as_codes(moves)
+    if codes is not None:
+        usi = [decode_move(c) for c in codes]
+        if sys.byteorder == "big":
+            codes = array("H", codes)
+            codes.byteswap()
+        h.update(b"\0")
+        h.update(codes.tobytes())
+    else:
+        usi = list(moves)
+        h.update(b"\1")
+        h.update(" ".join(usi).encode("utf-8"))
+
+    plies = 0
+    if board is not None:
+        for move in usi:
+            try:
+                board.push_usi(move)
+            except IllegalMoveError:
+                break
+            plies += 1
+        final = board.sfen(with_ply=False)
+    else:
+        final = start + " " + " ".join(usi)
+    final_hash = hashlib.blake2b(final.encode("utf-8"), digest_size=16).hexdigest()
+    return GameKeys(h.hexdigest(), final_hash, plies)
+
+
+class DedupeIndex:
+    """SQLite index of annotated games, shared by the annotation worker threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._claims: Dict[Tuple[str, str], threading.Event] = {}
+
+    def lookup(self, keys: GameKeys, settings: str) -> Optional[DedupeEntry]:
+        """The annotated original of this game, if its output still exists."""
+        with self._lock:
+            return self._lookup(keys, settings)
+
+    def _lookup(self, keys: GameKeys, settings: str) -> Optional[DedupeEntry]:
+        row = self._conn.execute(
+            "SELECT moves_hash, settings, final_hash, plies, source, output, added_at"
+            " FROM games WHERE moves_hash = ? AND settings = ?",
+            (keys.moves_hash, settings)).fetchone()
+        if row is None:
+            return None
+        entry = DedupeEntry(*row)
+        if entry.final_hash != keys.final_hash or entry.plies != keys.plies:
+            return None
+        if entry.output and not os.path.exists(entry.output):
+            return None
+        return entry
+
+    def claim(self, keys: GameKeys, settings: str, source: str) -> Optional[DedupeEntry]:
+        """
+        Return the original when this game is a duplicate of another source.
+        Otherwise the caller now owns the game and must call release() once
+        it is annotated (or failed); other copies wait for that.
+        """
+        key = (keys.moves_hash, settings)
+        while True:
+            with self._lock:
+                entry = self._lookup(keys, settings)
+                if entry is not None and entry.source != source:
+                    return entry
+                waiter = self._claims.get(key)
+                if waiter is None:
+                    self._claims[key] = threading.Event()
+                    return None
+            waiter.wait()
+
+    def release(self, keys: GameKeys, settings: str, source: str,
+                output: Optional[str] = None, success: bool = False) -> None:
+        """Record the annotated original (on success) and wake waiting copies."""
+        with self._lock:
+            if success:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (keys.moves_hash, settings, keys.final_hash, keys.plies, source, output,
+                     datetime.now().isoformat(timespec="seconds")))
+            waiter = self._claims.pop((keys.moves_hash, settings), None)
+        if waiter is not None:
+            waiter.set()
+
+    def games_ending_at(self, final_hash: str) -> List[DedupeEntry]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT moves_hash, settings, final_hash, plies, source, output, added_at"
+                " FROM games WHERE final_hash = ? ORDER BY added_at", (final_hash,)).fetchall()
+        return [DedupeEntry(*row) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,453 @@
+"""
+engine_pool.py
+
+Synchronous USI engine client and a fixed-size pool of engine processes for
+bulk annotation.
+
+Unlike backend.api.main (one resident asyncio engine shared by every request),
+this module has no FastAPI dependency: each worker thread checks an engine
+process out of the pool, analyses a whole game on it and hands it back. An
+engine that dies or times out is discarded and transparently restarted on the
+next checkout.
+"""
+
+import hashlib
+import os
+import queue
+import re
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+USI_BOOT_TIMEOUT = 10.0
+USI_GO_TIMEOUT = 20.0
+# go mate が自分の制限時間を過ぎても答えないときに stop 後に待つ時間（秒）
+MATE_GRACE_S = 2.0
+
+# analyze_game の出力形式が変わったら上げる（マニフェストの再解析判定に使う）
+ANNOTATOR_VERSION = 1
+
+# 詰みスコアを差分計算するときの換算値（cp）
+MATE_CP = 10000
+# backend.api.main._tag_from_delta と同じ閾値
+BLUNDER_DELTA_CP = -150
+
+_SCORE_RE = re.compile(r"score\s+(cp|mate)\s+(?:lowerbound\s+|upperbound\s+)?([+-]?\d+)")
+_DEPTH_RE = re.compile(r"\bdepth\s+(\d+)")
+_PV_RE = re.compile(r"\bpv\s+(.*)$")
+_MULTIPV_RE = re.compile(r"\bmultipv\s+(\d+)")
+
+
+class EngineError(RuntimeError):
+    """The engine process died, failed to boot or did not answer in time."""
+
+
+@dataclass
+class EngineResult:
+    """Final search result for one position (score from the side to move)."""
+    bestmove: Optional[str]
+    score_cp: Optional[int] = None
+    mate: Optional[int] = None
+    depth: Optional[int] = None
+    pv: List[str] = field(default_factory=list)
+
+
+@dataclass
+class MateResult:
+    """Answer to one `go mate` search, moves from the side to move."""
+    status: str                     # "mate" / "nomate" / "timeout" / "unsupported"
+    moves: List[str] = field(default_factory=list)
+
+
+def default_engine_command() -> List[str]:
+    return shlex.split(os.getenv("USI_CMD", "/usr/local/bin/yaneuraou"))
+
+
+def default_engine_options() -> Dict[str, str]:
+    options = {
+        "Threads": "1",
+        "USI_Hash": os.getenv("ENGINE_HASH_MB", "64"),
+        "OwnBook": "false",
+        "MultiPV": "1",
+    }
+    eval_dir = os.getenv("EVAL_DIR", "/usr/local/bin/eval")
+    if os.path.exists(eval_dir):
+        options["EvalDir"] = eval_dir
+    return options
+
+
+def _file_signature(path: str) -> Optional[str]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _eval_signature(eval_dir: str) -> Optional[str]:
+    """Cheap fingerprint of an eval directory (names, sizes and mtimes of its files)."""
+    if not os.path.isdir(eval_dir):
+        return None
+    h = hashlib.blake2b(digest_size=8)
+    for root, dirs, files in os.walk(eval_dir):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            h.update(f"{os.path.relpath(full, eval_dir)}={_file_signature(full)};".encode())
+    return h.hexdigest()
+
+
+class UsiEngine:
+    """One USI engine process driven over stdin/stdout from a worker thread."""
+
+    def __init__(self,
+                 cmd: Optional[Sequence[str]] = None,
+                 cwd: Optional[str] = None,
+                 options: Optional[Dict[str, str]] = None,
+                 boot_timeout: float = USI_BOOT_TIMEOUT,
+                 go_timeout: float = USI_GO_TIMEOUT):
+        self.cmd = list(cmd) if cmd else default_engine_command()
+        self.cwd = cwd if cwd is not None else os.getenv("ENGINE_WORK_DIR") or None
+        if self.cwd and not os.path.isdir(self.cwd):
+            self.cwd = None
+        self.options = default_engine_options() if options is None else dict(options)
+        self.boot_timeout = boot_timeout
+        self.go_timeout = go_timeout
+        self.name: Optional[str] = None
+        self.proc: Optional[subprocess.Popen] = None
+        self._multipv = 0
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        Identify the engine build and eval files without starting the process:
+        size/mtime of the binary (and of any file arguments, e.g. a script),
+        and a fingerprint of EvalDir. Used to decide whether earlier analyses
+        are still current.
+        """
+        binary = shutil.which(self.cmd[0]) or self.cmd[0]
+        eval_dir = self.options.get("EvalDir")
+        return {
+            "cmd": " ".join(self.cmd),
+            "binary": _file_signature(binary),
+            "args": [_file_signature(a) for a in self.cmd[1:] if os.path.isfile(a)],
+            "eval": _eval_signature(eval_dir) if eval_dir else None,
+            "options": {k: v for k, v in sorted(self.options.items()) if k != "EvalDir"},
+        }
+
+    # -- process lifecycle -------------------------------------------------
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self) -> "UsiEngine":
+        if self.alive:
+            return self
+        try:
+            self.proc = subprocess.Popen(
+                self.cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                cwd=self.cwd,
+                text=True,
+                encoding="utf-8",
+                errors="ignore",
+                bufsize=1,
+            )
+        except OSError as e:
+            raise EngineError(f"cannot start engine {self.cmd!r}: {e}") from e
+        self._lines = queue.Queue()
+        threading.Thread(target=self._pump, args=(self.proc, self._lines), daemon=True).start()
+
+        self._send("usi")
+        for line in self._read_until("usiok", self.boot_timeout):
+            if line.startswith("id name "):
+                self.name = line[len("id name "):].strip()
+        for key, value in self.options.items():
+            self._send(f"setoption name {key} value {value}")
+        try:
+            self._multipv = int(self.options.get("MultiPV", 1))
+        except ValueError:
+            self._multipv = 0
+        self._send("isready")
+        self._read_until("readyok", self.boot_timeout)
+        self._send("usinewgame")
+        return self
+
+    def close(self) -> None:
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            if proc.poll() is None:
+                proc.stdin.write("quit\n")
+                proc.stdin.flush()
+                proc.wait(timeout=2.0)
+        except Exception:
+            pass
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+    @staticmethod
+    def _pump(proc: subprocess.Popen, lines: "queue.Queue[Optional[str]]") -> None:
+        for line in proc.stdout:
+            lines.put(line.strip())
+        lines.put(None)  # EOF
+
+    def _send(self, line: str) -> None:
+        if not self.alive:
+            raise EngineError("engine is not running")
+        try:
+            self.proc.stdin.write(line + "\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise EngineError(f"engine pipe closed: {e}") from e
+
+    def _read_until(self, token: str, timeout: float) -> List[str]:
+        """Collect lines until one starts with `token`; raise EngineError on EOF/timeout."""
+        deadline = time.monotonic() + timeout
+        seen: List[str] = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise EngineError(f"timed out waiting for {token!r}")
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                raise EngineError(f"timed out waiting for {token!r}")
+            if line is None:
+                raise EngineError(f"engine exited while waiting for {token!r}")
+            seen.append(line)
+            if line.startswith(token):
+                return seen
+
+    # -- search ------------------------------------------------------------
+
+    def _set_multipv(self, n: int) -> None:
+        if self._multipv != n:
+            self._send(f"setoption name MultiPV value {n}")
+            self._multipv = n
+
+    def _go(self, position_cmd: str, byoyomi_ms: Optional[int], nodes: Optional[int]) -> List[str]:
+        self._send(position_cmd if position_cmd.startswith("position") else f"position {position_cmd}")
+        if nodes:
+            self._send(f"go nodes {int(nodes)}")
+        else:
+            self._send(f"go btime 0 wtime 0 byoyomi {int(byoyomi_ms or 250)}")
+        return self._read_until("bestmove", self.go_timeout + (byoyomi_ms or 0) / 1000.0)
+
+    @staticmethod
+    def _apply_info(result: EngineResult, line: str) -> bool:
+        sc = _SCORE_RE.search(line)
+        if sc is None:
+            return False
+        if sc.group(1) == "cp":
+            result.score_cp, result.mate = int(sc.group(2)), None
+        else:
+            result.score_cp, result.mate = None, int(sc.group(2))
+        dp = _DEPTH_RE.search(line)
+        if dp:
+            result.depth = int(dp.group(1))
+        pv = _PV_RE.search(line)
+        result.pv = pv.group(1).split() if pv else []
+        return True
+
+    def analyze(self, position_cmd: str,
+                byoyomi_ms: Optional[int] = None,
+                nodes: Optional[int] = None) -> EngineResult:
+        """Search one position ("position startpos moves ...") and return the final info."""
+        self.start()
+        self._set_multipv(1)
+        result = EngineResult(bestmove=None)
+        for line in self._go(position_cmd, byoyomi_ms, nodes):
+            if line.startswith("bestmove"):
+                parts = line.split()
+                result.bestmove = parts[1] if len(parts) > 1 else None
+            elif line.startswith("info") and "score" in line:
+                self._apply_info(result, line)
+        return result
+
+    def analyze_multipv(self, position_cmd: str, multipv: int = 4,
+                        byoyomi_ms: Optional[int] = None,
+                        nodes: Optional[int] = None) -> List[EngineResult]:
+        """
+        Search with MultiPV and return one result per line, best first. Each
+        result's bestmove is the first move of its PV; lines without a PV are
+        dropped. analyze() switches the engine back to a single PV.
+        """
+        self.start()
+        self._set_multipv(max(1, int(multipv)))
+        lines: Dict[int, EngineResult] = {}
+        for line in self._go(position_cmd, byoyomi_ms, nodes):
+            if not line.startswith("info") or "score" not in line:
+                continue
+            mp = _MULTIPV_RE.search(line)
+            index = int(mp.group(1)) if mp else 1
+            result = EngineResult(bestmove=None)
+            if self._apply_info(result, line) and result.pv:
+                result.bestmove = result.pv[0]
+                lines[index] = result
+        return [lines[i] for i in sorted(lines)]
+
+    def search_mate(self, position_cmd: str, timeout_ms: int) -> MateResult:
+        """
+        `go mate <ms>`: the checkmate sequence for the side to move, "nomate"
+        when the engine proved there is none, or "timeout". An engine that
+        overruns its own limit is sent `stop` and given MATE_GRACE_S more.
+        """
+        self.start()
+        self._send(position_cmd if position_cmd.startswith("position") else f"position {position_cmd}")
+        self._send(f"go mate {max(1, int(timeout_ms))}")
+        try:
+            lines = self._read_until("checkmate", timeout_ms / 1000.0 + MATE_GRACE_S)
+        except EngineError:
+            self._send("stop")
+            lines = self._read_until("checkmate", MATE_GRACE_S)
+        words = lines[-1].split()[1:]
+        if not words or words[0] == "notimplemented":
+            return MateResult("unsupported")
+        if words[0] in ("nomate", "timeout"):
+            return MateResult(words[0])
+        return MateResult("mate", words)
+
+
+class EnginePool:
+    """
+    Fixed number of engine processes shared by worker threads.
+
+    Engines are started lazily on first checkout. If the caller raises while
+    holding an engine (crash, timeout, bad output) the process is closed and
+    replaced by a fresh one on the next checkout.
+    """
+
+    def __init__(self, size: int = 1, factory: Optional[Callable[[], UsiEngine]] = None):
+        if size < 1:
+            raise ValueError("pool size must be >= 1")
+        self.size = size
+        self.factory = factory or UsiEngine
+        self._slots: "queue.Queue[Optional[UsiEngine]]" = queue.Queue()
+        for _ in range(size):
+            self._slots.put(None)
+        self._all: List[UsiEngine] = []
+        self._lock = threading.Lock()
+        self.restarts = 0
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None) -> Iterator[UsiEngine]:
+        try:
+            engine = self._slots.get(timeout=timeout)
+        except queue.Empty:
+            raise EngineError("no engine available")
+        try:
+            if engine is None or not engine.alive:
+                if engine is not None:
+                    self.restarts += 1
+                    engine.close()
+                engine = self.factory()
+                with self._lock:
+                    self._all.append(engine)
+                engine.start()
+            yield engine
+        except BaseException:
+            if engine is not None:
+                engine.close()
+            self._slots.put(None)
+            raise
+        else:
+            self._slots.put(engine)
+
+    def describe(self) -> Dict[str, Any]:
+        """Engine/eval description of the engines this pool starts (see UsiEngine.describe)."""
+        return self.factory().describe()
+
+    def close(self) -> None:
+        with self._lock:
+            engines, self._all = self._all, []
+        for engine in engines:
+            engine.close()
+
+    def __enter__(self) -> "EnginePool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ---------------------------------------------------------------------------
+# Whole-game annotation
+# ---------------------------------------------------------------------------
+
+def _sente_score(res: EngineResult, white_to_move: bool) -> Optional[int]:
+    """Score in centipawns from sente's point of view (mate folded to ±MATE_CP)."""
+    if res.mate is not None:
+        value = MATE_CP if res.mate > 0 else -MATE_CP
+    elif res.score_cp is not None:
+        value = res.score_cp
+    else:
+        return None
+    return -value if white_to_move else value
+
+
+def _position_cmd(start_sfen: Optional[str], moves: Sequence[str]) -> str:
+    base = f"position sfen {start_sfen}" if start_sfen else "position startpos"
+    return f"{base} moves {' '.join(moves)}" if moves else base
+
+
+def analyze_game(engine: UsiEngine,
+                 usi_moves: Sequence[str],
+                 start_sfen: Optional[str] = None,
+                 byoyomi_ms: Optional[int] = None,
+                 nodes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Search every position of a game once and build an annotation dict in the
+    same shape as /annotate (summary, bestmove, notes).
+
+    Scores are from sente's point of view; delta_cp is from the mover's point
+    of view, so a negative delta is a loss for whoever played the move.
+    """
+    white_first = bool(start_sfen) and start_sfen.split()[1:2] == ["w"]
+    results: List[EngineResult] = []
+    for i in range(len(usi_moves) + 1):
+        results.append(engine.analyze(_position_cmd(start_sfen, usi_moves[:i]), byoyomi_ms, nodes))
+
+    notes: List[Dict[str, Any]] = []
+    for i, mv in enumerate(usi_moves):
+        before, after = results[i], results[i + 1]
+        mover_is_white = white_first != (i % 2 == 1)
+        score_before = _sente_score(before, mover_is_white)
+        score_after = _sente_score(after, not mover_is_white)
+        delta_cp: Optional[int] = None
+        if score_before is not None and score_after is not None:
+            delta_cp = score_after - score_before
+            if mover_is_white:
+                delta_cp = -delta_cp
+        mate_after = after.mate
+        if mate_after is not None and not mover_is_white:
+            mate_after = -mate_after  # sente's point of view, like the cp scores
+        notes.append({
+            "ply": i + 1,
+            "move": mv,
+            "bestmove": before.bestmove,
+            "score_before_cp": score_before,
+            "score_after_cp": score_after,
+            "mate_after": mate_after,
+            "delta_cp": delta_cp,
+            "pv": " ".join(after.pv),
+            "tags": ["悪手"] if delta_cp is not None and delta_cp <= BLUNDER_DELTA_CP else [],
+            "evidence": {"depth": after.depth or 0},
+        })
+
+    final = results[-1]
+    return {
+        "summary": f"{len(usi_moves)} plies analyzed" + (f" by {engine.name}" if engine.name else ""),
+        "bestmove": final.bestmove,
+        "notes": notes,
+    }
@@ -0,0 +1,448 @@
+"""
+ingest_jobs.py
+
+Background jobs for folder annotation, used by the /ingest API router.
+
+- JobStore: job history in a local SQLite table (INGEST_JOBS_DB). Every
+  state change and, at most once per second, the progress counters are
+  written, so the history survives API restarts.
+- JobManager: a bounded FIFO of submitted jobs and a fixed number of worker
+  threads running BatchAnnotationService.annotate_folder(). Submitting to a
+  full queue raises JobQueueFull (the API answers 429) instead of piling up
+  work. Jobs writing to the same output folder never run at the same time
+  (they would share its checkpoint manifest).
+- Cancellation is cooperative: a queued job is dropped, a running job stops
+  starting new files and finishes the ones in flight. The request is stored
+  with the job, so a restart in between does not resume a cancelled job.
+- Jobs that were queued or running when the process stopped are queued again
+  on start(); annotate_folder's checkpoint manifest makes the rerun skip
+  every file that was already finished.
+
+Job statuses: queued -> running -> succeeded / failed / cancelled.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from .annotate_batch import BatchAnnotationService, BulkProgress
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TERMINAL_STATUSES = frozenset((SUCCEEDED, FAILED, CANCELLED))
+
+PROGRESS_SAVE_INTERVAL_S = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id          TEXT PRIMARY KEY,
+    status      TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    created_at  TEXT NOT NULL,
+    started_at  TEXT,
+    finished_at TEXT,
+    progress    TEXT,
+    summary     TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ingest_jobs_created ON ingest_jobs (created_at);
+CREATE INDEX IF NOT EXISTS ingest_jobs_status ON ingest_jobs (status);
+"""
+
+
+class JobQueueFull(RuntimeError):
+    """The job queue is at capacity; retry later."""
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+@dataclass
+class JobProgress:
+    total_files: int = 0
+    done: int = 0
+    annotated: int = 0
+    skipped: int = 0
+    errors: int = 0
+    duplicates: int = 0
+    plies: int = 0
+    elapsed_s: float = 0.0
+    files_per_sec: float = 0.0
+    plies_per_sec: float = 0.0
+    eta_s: Optional[float] = None
+
+    @classmethod
+    def from_bulk(cls, p: BulkProgress) -> "JobProgress":
+        remaining = p.total_files - p.done
+        rate = p.files_per_sec
+        eta = round(remaining / rate, 1) if rate > 0 else (0.0 if remaining == 0 else None)
+        return cls(total_files=p.total_files, done=p.done, annotated=p.annotated,
+                   skipped=p.skipped, errors=p.errors, duplicates=p.duplicates, plies=p.plies,
+                   elapsed_s=round(p.elapsed_s, 2), files_per_sec=round(rate, 3),
+                   plies_per_sec=round(p.plies_per_sec, 1), eta_s=eta)
+
+
+@dataclass
+class Job:
+    id: str
+    status: str
+    params: Dict[str, Any]
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    progress: JobProgress = field(default_factory=JobProgress)
+    summary: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    cancel_requested: bool = False
+    version: int = 0    # bumped on every change; SSE streams compare it
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.pop("version")
+        return data
+
+
+class JobStore:
+    """SQLite-backed job history (one connection, serialized by a lock)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(ingest_jobs)")}
+            if "cancel_requested" not in columns:
+                self._conn.execute(
+                    "ALTER TABLE ingest_jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+
+    def save(self, job: Job) -> None:
+        row = (job.id, job.status, json.dumps(job.params, ensure_ascii=False), job.created_at,
+               job.started_at, job.finished_at, json.dumps(asdict(job.progress)),
+               json.dumps(job.summary, ensure_ascii=False) if job.summary is not None else None,
+               job.error, job.attempts, int(job.cancel_requested))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ingest_jobs (id, status, params, created_at, started_at, "
+                "finished_at, progress, summary, error, attempts, cancel_requested) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?,?)", row)
+
+    @staticmethod
+    def _from_row(row) -> Job:
+        progress = json.loads(row[6]) if row[6] else {}
+        return Job(id=row[0], status=row[1], params=json.loads(row[2]), created_at=row[3],
+                   started_at=row[4], finished_at=row[5], progress=JobProgress(**progress),
+                   summary=json.loads(row[7]) if row[7] else None, error=row[8], attempts=row[9],
+                   cancel_requested=bool(row[10]))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._from_row(row) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Job]:
+        sql, args = "SELECT * FROM ingest_jobs", []
+        if status:
+            sql += " WHERE status = ?"
+            args.append(status)
+        sql += " ORDER BY created_at DESC, rowid DESC LIMIT ? OFFSET ?"
+        args += [limit, offset]
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [self._from_row(r) for r in rows]
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM ingest_jobs WHERE status IN (?, ?) ORDER BY created_at, rowid",
+                (QUEUED, RUNNING)).fetchall()
+        return [self._from_row(r) for r in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _summary_dict(summary) -> Dict[str, Any]:
+    """BatchAnnotationSummary without the per-file results (kept small for the table)."""
+    return {
+        "total_files": summary.total_files,
+        "annotated": summary.annotated,
+        "skipped": summary.skipped,
+        "errors": summary.errors,
+        "duplicates": summary.duplicates,
+        "total_time_ms": summary.total_time_ms,
+        "cancelled": summary.cancelled,
+        "error_details": summary.error_details[:50],
+    }
+
+
+class JobManager:
+    """
+    Bounded job queue + worker threads.
+
+    `service_factory(out_dir)` returns the BatchAnnotationService a job runs
+    on; the default shares one engine pool (BATCH_ENGINES) across jobs.
+    """
+
+    def __init__(self, store: JobStore,
+                 max_queue: int = 16,
+                 workers: int = 1,
+                 service_factory: Optional[Callable[[str], BatchAnnotationService]] = None):
+        self.store = store
+        self.max_queue = max(1, max_queue)
+        self.n_workers = max(1, workers)
+        self._service_factory = service_factory or self._default_service
+        self._shared_pool = None
+        self._pool_lock = threading.Lock()
+
+        self._cond = threading.Condition()
+        self._queue: Deque[str] = deque()
+        self._jobs: Dict[str, Job] = {}           # queued and running jobs
+        self._cancel: Dict[str, threading.Event] = {}
+        self._busy_outputs: set = set()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+    # ---- lifecycle -------------------------------------------------------
+
+    def start(self) -> "JobManager":
+        if self._threads:
+            return self
+        with self._cond:
+            self._stopping = False
+            # the store is the source of truth: rebuild the queue from it, so a
+            # start() after stop() does not queue the same job twice
+            self._queue.clear()
+            self._jobs.clear()
+            self._cancel.clear()
+            self._busy_outputs.clear()
+            for job in self.store.unfinished():
+                if job.cancel_requested:
+                    # cancelled before the previous process got to stop it
+                    self._finish_locked(job, CANCELLED)
+                    continue
+                # interrupted by a restart: rerun; finished files are skipped via the manifest
+                job.status = QUEUED
+                job.started_at = None
+                self.store.save(job)
+                self._jobs[job.id] = job
+                self._cancel[job.id] = threading.Event()
+                self._queue.append(job.id)
+        for i in range(self.n_workers):
+            t = threading.Thread(target=self._worker, name=f"ingest-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Stop workers; running jobs stop early and stay queued for the next start()."""
+        with self._cond:
+            self._stopping = True
+            for job_id, event in self._cancel.items():
+                if self._jobs[job_id].status == RUNNING:
+                    event.set()
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self._threads.clear()
+        if self._shared_pool is not None:
+            self._shared_pool.close()
+            self._shared_pool = None
+
+    # ---- API -------------------------------------------------------------
+
+    def submit(self, params: Dict[str, Any]) -> Job:
+        """Queue a folder annotation job; raises JobQueueFull when at capacity."""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise JobQueueFull(f"job queue is full ({self.max_queue} waiting)")
+            job = Job(id=uuid.uuid4().hex[:12], status=QUEUED, params=dict(params), created_at=_now())
+            self.store.save(job)
+            self._jobs[job.id] = job
+            self._cancel[job.id] = threading.Event()
+            self._queue.append(job.id)
+            self._cond.notify()
+            return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job
+        return self.store.get(job_id)
+
+    def snapshot(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Consistent dict copy of a job (with its change counter as "version")."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job.to_dict(), version=job.version)
+        job = self.store.get(job_id)
+        return dict(job.to_dict(), version=job.version) if job is not None else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Job]:
+        return self.store.list(status=status, limit=limit, offset=offset)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job; finished jobs are returned unchanged."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self.store.get(job_id)
+            self._cancel[job_id].set()
+            job.cancel_requested = True
+            job.version += 1
+            if job.status == QUEUED:
+                self._queue.remove(job_id)
+                self._finish_locked(job, CANCELLED)
+            else:
+                self.store.save(job)
+            return job
+
+    @property
+    def queued(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    # ---- worker ----------------------------------------------------------
+
+    def _take(self) -> Optional[Job]:
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                for job_id in self._queue:
+                    job = self._jobs[job_id]
+                    if job.params.get("out_dir") not in self._busy_outputs:
+                        self._queue.remove(job_id)
+                        self._busy_outputs.add(job.params.get("out_dir"))
+                        job.status = RUNNING
+                        job.started_at = _now()
+                        job.attempts += 1
+                        job.version += 1
+                        self.store.save(job)
+                        return job
+                self._cond.wait()
+
+    def _worker(self) -> None:
+        while True:
+            job = self._take()
+            if job is None:
+                return
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._busy_outputs.discard(job.params.get("out_dir"))
+                    self._cond.notify_all()
+
+    def _run(self, job: Job) -> None:
+        cancel = self._cancel[job.id]
+        params = job.params
+        last_save = [0.0]
+
+        def on_progress(p: BulkProgress) -> None:
+            with self._cond:
+                job.progress = JobProgress.from_bulk(p)
+                job.version += 1
+            now = time.monotonic()
+            if now - last_save[0] >= PROGRESS_SAVE_INTERVAL_S:
+                last_save[0] = now
+                self.store.save(job)
+
+        try:
+            service = self._service_factory(params["out_dir"])
+            summary = service.annotate_folder(
+                params["dir"],
+                recursive=params.get("recursive", True),
+                byoyomi_ms=params.get("byoyomi_ms"),
+                skip_validation=params.get("skip_validation", False),
+                workers=params.get("workers"),
+                output_format=params.get("output_format"),
+                progress_callback=on_progress,
+                cancel_event=cancel,
+            )
+        except Exception as e:
+            with self._cond:
+                job.error = f"{type(e).__name__}: {e}"
+                self._finish_locked(job, FAILED)
+            return
+
+        with self._cond:
+            job.summary = _summary_dict(summary)
+            if summary.cancelled and not job.cancel_requested:
+                # shutdown, not a user cancel: resume on the next start()
+                job.status = QUEUED
+                job.version += 1
+                self.store.save(job)
+                return
+            self._finish_locked(job, CANCELLED if summary.cancelled else SUCCEEDED)
+
+    def _finish_locked(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = _now()
+        job.version += 1
+        self.store.save(job)
+        self._jobs.pop(job.id, None)
+        self._cancel.pop(job.id, None)
+
+    def _default_service(self, out_dir: str) -> BatchAnnotationService:
+        with self._pool_lock:
+            if self._shared_pool is None:
+                service = BatchAnnotationService()
+                self._shared_pool = service.engine_pool
+            else:
+                service = BatchAnnotationService(engine_pool=self._shared_pool)
+        service.kifu_out = out_dir
+        return service
+
+
+_MANAGER: Optional[JobManager] = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def get_job_manager() -> JobManager:
+    """Process-wide manager, created and started on first use."""
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            store = JobStore(os.getenv("INGEST_JOBS_DB", "data/ingest_jobs.sqlite3"))
+            _MANAGER = JobManager(store,
+                                  max_queue=_env_int("INGEST_JOB_QUEUE", 16),
+                                  workers=_env_int("INGEST_JOB_WORKERS", 1)).start()
+        return _MANAGER
+
+
+def shutdown_job_manager(timeout: float = 30.0) -> None:
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is not None:
+            _MANAGER.stop(timeout)
+            _MANAGER.store.close()
+            _MANAGER = None
@@ -0,0 +1,185 @@
+"""
+mate_search.py
+
+Checkmate search on its own engine pool.
+
+MateSearchService sends USI `go mate <ms>` to a small pool of engine processes
+(MATE_POOL_SIZE, default 1). The pool is separate from the resident analysis
+engine in backend.api.main, so a long mate search never holds up interactive
+analysis. MATE_USI_CMD can point at a dedicated mate engine; it defaults to
+USI_CMD.
+
+Verdicts are cached by the Zobrist hash of the position, in an LRU of
+MATE_CACHE_SIZE entries:
+
+- "mate" (with the sequence) and "nomate" are final
+- "timeout" is stored with the time limit it had. A repeat with the same or
+  a smaller limit is answered from the cache; a larger limit searches again.
+
+Every search has a time limit, covering the wait for a free engine too.
+Running out of time is not an error: the answer is status "timeout" ("no
+mate found within X ms").
+
+Short mates never reach the engine: the in-process df-pn solver
+(mate_solver.py) is tried first, and its "mate" / "nomate" answers are
+final. Only positions it cannot settle within its ply limit and node budget
+go to `go mate`.
+"""
+
+import os
+import shlex
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import List, Optional, Sequence
+
+from .engine_pool import EngineError, EnginePool, UsiEngine, default_engine_command, default_engine_options
+from .mate_solver import DfPnSolver, get_mate_solver
+from .position_index import parse_position
+
+DEFAULT_TIMEOUT_MS = 3000
+MIN_TIMEOUT_MS = 50
+MAX_TIMEOUT_MS = 60_000
+DEFAULT_CACHE_SIZE = 20_000
+
+
+@dataclass
+class MateSearchResult:
+    status: str                     # "mate" / "nomate" / "timeout" / "unsupported"
+    sfen: str
+    moves: List[str] = field(default_factory=list)
+    timeout_ms: int = DEFAULT_TIMEOUT_MS
+    elapsed_ms: int = 0
+    cached: bool = False
+    solver: str = "engine"          # "dfpn" when the in-process solver answered
+
+    @property
+    def mate_in(self) -> Optional[int]:
+        return len(self.moves) if self.status == "mate" else None
+
+    @property
+    def message(self) -> str:
+        if self.status == "mate":
+            return f"{len(self.moves)}手詰"
+        if self.status == "nomate":
+            return "詰みはありません"
+        if self.status == "timeout":
+            return f"{self.timeout_ms}ms 以内に詰みは見つかりませんでした"
+        return "エンジンが詰み探索（go mate）に対応していません"
+
+    def to_dict(self) -> dict:
+        return {"status": self.status, "sfen": self.sfen, "moves": self.moves, "mate_in": self.mate_in,
+                "timeout_ms": self.timeout_ms, "elapsed_ms": self.elapsed_ms, "cached": self.cached,
+                "solver": self.solver, "message": self.message}
+
+
+def mate_engine() -> UsiEngine:
+    """One process for the mate pool (MATE_USI_CMD, MATE_HASH_MB)."""
+    cmd = os.getenv("MATE_USI_CMD")
+    options = default_engine_options()
+    options["USI_Hash"] = os.getenv("MATE_HASH_MB", options["USI_Hash"])
+    return UsiEngine(cmd=shlex.split(cmd) if cmd else default_engine_command(), options=options)
+
+
+class MateSearchService:
+    """`go mate` searches on a dedicated EnginePool, with a verdict cache."""
+
+    def __init__(self, pool: Optional[EnginePool] = None, cache_size: int = DEFAULT_CACHE_SIZE,
+                 max_timeout_ms: int = MAX_TIMEOUT_MS, solver: Optional[DfPnSolver] = None):
+        self.pool = pool or EnginePool(int(os.getenv("MATE_POOL_SIZE", "1")), factory=mate_engine)
+        self.solver = solver
+        self.cache_size = cache_size
+        self.max_timeout_ms = max_timeout_ms
+        self._cache: "OrderedDict[int, MateSearchResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.hits = 0
+
+    def _cached(self, key: int, timeout_ms: int) -> Optional[MateSearchResult]:
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is None or (hit.status == "timeout" and hit.timeout_ms < timeout_ms):
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return replace(hit, moves=list(hit.moves), cached=True)
+
+    def _store(self, key: int, result: MateSearchResult) -> None:
+        with self._lock:
+            self._cache[key] = replace(result, moves=list(result.moves))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def solve(self, position: str, moves: Sequence[str] = (),
+              timeout_ms: int = DEFAULT_TIMEOUT_MS) -> MateSearchResult:
+        """
+        Mate for the side to move in `position` (SFEN / "startpos", optionally
+        with "moves ...") after `moves`. ValueError for a bad position or an
+        illegal move; EngineError when the engine fails.
+        """
+        if moves:
+            position += (" " if " moves" in position else " moves ") + " ".join(moves)
+        key, sfen = parse_position(position)
+        timeout_ms = max(MIN_TIMEOUT_MS, min(self.max_timeout_ms, int(timeout_ms)))
+        hit = self._cached(key, timeout_ms)
+        if hit is not None:
+            return hit
+
+        t0 = time.monotonic()
+        if self.solver is not None:
+            quick = self.solver.solve(sfen)
+            if quick.status != "unknown":
+                result = MateSearchResult(quick.status, sfen, quick.moves, timeout_ms,
+                                          int((time.monotonic() - t0) * 1000), solver="dfpn")
+                self._store(key, result)
+                return result
+        try:
+            with self.pool.acquire(timeout=max(0.0, timeout_ms / 1000.0 - (time.monotonic() - t0))) as engine:
+                left_ms = timeout_ms - int((time.monotonic() - t0) * 1000)
+                if left_ms < MIN_TIMEOUT_MS:
+                    found = None
+                else:
+                    self.searches += 1
+                    found = engine.search_mate(f"position sfen {sfen}", left_ms)
+        except EngineError:
+            if time.monotonic() - t0 < timeout_ms / 1000.0:
+                raise
+            found = None                               # every engine stayed busy
+        elapsed_ms = int((time.monotonic() - t0) * 1000)
+        if found is None:
+            return MateSearchResult("timeout", sfen, timeout_ms=timeout_ms, elapsed_ms=elapsed_ms)
+        result = MateSearchResult(found.status, sfen, list(found.moves), timeout_ms, elapsed_ms)
+        if result.status != "unsupported":
+            self._store(key, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached": len(self._cache), "searches": self.searches, "hits": self.hits,
+                    "engines": self.pool.size}
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+_SERVICE: Optional[MateSearchService] = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_mate_service() -> MateSearchService:
+    global _SERVICE
+    with _SERVICE_LOCK:
+        if _SERVICE is None:
+            _SERVICE = MateSearchService(cache_size=int(os.getenv("MATE_CACHE_SIZE", str(DEFAULT_CACHE_SIZE))),
+                                         solver=get_mate_solver())
+        return _SERVICE
+
+
+def shutdown_mate_service() -> None:
+    global _SERVICE
+    with _SERVICE_LOCK:
+        service, _SERVICE = _SERVICE, None
+    if service is not None:
+        service.close()
@@ -0,0 +1,325 @@
+"""
+mate_solver.py
+
+In-process df-pn checkmate solver for short tsume.
+
+Most tsume problems are 1-7 plies. For those, a USI engine round trip over
+pipes (and the wait for the shared engine's lock) costs far more than the
+search. DfPnSolver proves or disproves short mates in Python, on the ingest
+Board, with backend.ingest.movegen's check and evasion generators:
+
+- OR nodes (attacker to move) try every legal check; no check disproves
+- AND nodes (defender to move) try every legal evasion; no evasion proves
+- the search is depth-first proof-number search (df-pn) with thresholds,
+  limited to `max_plies`, over a transposition table keyed by
+  (Zobrist hash, plies left)
+
+Mate lengths are found by iterative deepening (1, 3, 5... plies), so a line
+is a shortest mate and the defender's reply is the evasion that holds out
+longest. A disproof is only reported as "no mate" when no branch was cut at
+the ply limit; otherwise the answer is "unknown" and callers fall back to
+the engine. Every call has a node budget.
+
+The table is kept across calls (positions repeat as users step through a
+problem). When it outgrows `tt_size` it is cut back to the half of the
+entries that took the most work, between searches.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+from ..ingest.board import KIND_MASK, PROMOTED, WHITE_FLAG, Board, unpromote
+from ..ingest.move_codec import DROP_BASE, PROMOTE_FLAG, decode_move
+from ..ingest.movegen import (attacked, check_moves, evasions, king_square, make_move, unmake_move)
+from ..ingest.zobrist import ZOBRIST_HAND, ZOBRIST_PIECE, ZOBRIST_WHITE_TO_MOVE, position_hash
+
+INF = 1 << 30
+DEFAULT_MAX_PLIES = 7
+DEFAULT_MAX_NODES = 20_000
+DEFAULT_TT_SIZE = 500_000
+
+
+class _OutOfNodes(Exception):
+    pass
+
+
+@dataclass
+class MateSolution:
+    status: str                          # "mate" / "nomate" / "unknown"
+    moves: List[str] = field(default_factory=list)
+    nodes: int = 0
+    elapsed_ms: float = 0.0
+
+
+def child_hash(h: int, board: Board, code: int) -> int:
+    """Zobrist hash after `code`, computed before it is played."""
+    squares = board.squares
+    color = board.turn
+    to = code & 0x7F
+    src = (code >> 7) & 0x7F
+    h ^= ZOBRIST_WHITE_TO_MOVE
+    if src >= DROP_BASE:
+        kind = src - DROP_BASE + 1
+        n = board.hands[color][kind]
+        return h ^ ZOBRIST_HAND[color][kind][n] ^ ZOBRIST_HAND[color][kind][n - 1] \
+            ^ ZOBRIST_PIECE[to][kind | (WHITE_FLAG if color else 0)]
+    piece = squares[src]
+    captured = squares[to]
+    h ^= ZOBRIST_PIECE[src][piece] ^ ZOBRIST_PIECE[to][piece + PROMOTED if code & PROMOTE_FLAG else piece]
+    if captured:
+        kind = unpromote(captured & KIND_MASK)
+        n = board.hands[color][kind]
+        h ^= ZOBRIST_PIECE[to][captured] ^ ZOBRIST_HAND[color][kind][n] ^ ZOBRIST_HAND[color][kind][n + 1]
+    return h
+
+
+class DfPnSolver:
+    """Short-mate prover; thread-safe (one search at a time)."""
+
+    def __init__(self, max_plies: int = DEFAULT_MAX_PLIES, max_nodes: int = DEFAULT_MAX_NODES,
+                 tt_size: int = DEFAULT_TT_SIZE):
+        self.max_plies = max_plies
+        self.max_nodes = max_nodes
+        self.tt_size = tt_size
+        # (hash, plies left) -> [pn, dn, work, cut]; cut: a disproof that relied on the ply limit
+        self.tt: Dict[Tuple[int, int], List[int]] = {}
+        # (hash, is_or) -> [(move, child hash)]: the checks or evasions, generated once per
+        # position; a position is an OR node in one search and an AND node in another
+        self._children: Dict[Tuple[int, bool], List[Tuple[int, int]]] = {}
+        self.nodes = 0
+        self.evictions = 0
+        self._limit = 0
+        self._cut = False
+        self._lock = threading.Lock()
+
+    # ---- search ----------------------------------------------------------
+
+    def _mid(self, board: Board, h: int, depth: int, is_or: bool, th_pn: int, th_dn: int) -> None:
+        self.nodes += 1
+        if self.nodes > self._limit:
+            raise _OutOfNodes()
+        tt = self.tt
+        key = (h, depth)
+        if is_or and depth < 1:
+            self._cut = True
+            tt[key] = [INF, 0, 1, 1]
+            return
+        children = self._children.get((h, is_or))
+        if children is None:
+            moves = check_moves(board) if is_or else evasions(board)
+            children = self._children[(h, is_or)] = [(code, child_hash(h, board, code)) for code in moves]
+        if not children:
+            tt[key] = [INF, 0, 1, 0] if is_or else [0, INF, 1, 0]
+            return
+        if not is_or and depth < 2:
+            self._cut = True
+            tt[key] = [INF, 0, 1, 1]
+            return
+
+        outer_cut, self._cut = self._cut, False
+        start = self.nodes
+        child_depth = depth - 1
+        while True:
+            best = 0
+            best_pn = best_dn = second = INF
+            total = 0
+            for i, (_, ch) in enumerate(children):
+                e = tt.get((ch, child_depth))
+                cpn, cdn = (e[0], e[1]) if e else (1, 1)
+                if e and e[3] and cdn == 0:
+                    self._cut = True
+                if is_or:
+                    total += cdn
+                    if cpn < best_pn:
+                        best, best_pn, best_dn, second = i, cpn, cdn, best_pn
+                    elif cpn < second:
+                        second = cpn
+                else:
+                    total += cpn
+                    if cdn < best_dn:
+                        best, best_pn, best_dn, second = i, cpn, cdn, best_dn
+                    elif cdn < second:
+                        second = cdn
+            total = min(total, INF)
+            pn, dn = (best_pn, total) if is_or else (total, best_dn)
+            if pn >= th_pn or dn >= th_dn or pn == 0 or dn == 0:
+                break
+            if is_or:
+                c_pn, c_dn = min(th_pn, second + 1), min(INF, th_dn - dn + best_dn)
+            else:
+                c_pn, c_dn = min(INF, th_pn - pn + best_pn), min(th_dn, second + 1)
+            code, ch = children[best]
+            captured = make_move(board, code)
+            try:
+                self._mid(board, ch, child_depth, not is_or, c_pn, c_dn)
+            finally:
+                unmake_move(board, code, captured)
+        cut = self._cut
+        self._cut = outer_cut or cut
+        tt[key] = [pn, dn, self.nodes - start + 1, int(cut and dn == 0)]
+
+    def _proven(self, board: Board, h: int, depth: int, is_or: bool) -> bool:
+        e = self.tt.get((h, depth))
+        if e is None or (e[0] and e[1]):
+            self._mid(board, h, depth, is_or, INF, INF)
+            e = self.tt[(h, depth)]
+        elif e[1] == 0 and e[3]:
+            self._cut = True
+        return e[0] == 0
+
+    def _shortest(self, board: Board, h: int, limit: int, is_or: bool) -> Optional[int]:
+        """Fewest plies (<= limit) that mate from here, or None. Leaves _cut for the last depth tried."""
+        for depth in range(1 if is_or else 0, limit + 1, 2):
+            self._cut = False
+            if self._proven(board, h, depth, is_or):
+                return depth
+        return None
+
+    def _line(self, board: Board, h: int, depth: int) -> List[str]:
+        """
+        A shortest mate from an OR node proven at `depth`, the defender holding
+        out longest. The mate is already proven, so running out of nodes here
+        only shortens the line.
+        """
+        line = []
+        is_or = True
+        try:
+            while True:
+                if is_or:
+                    choice = None
+                    for code in check_moves(board):
+                        ch = child_hash(h, board, code)
+                        captured = make_move(board, code)
+                        d = self._shortest(board, ch, depth - 1, False)
+                        unmake_move(board, code, captured)
+                        if d is not None and (choice is None or d < choice[0]):
+                            choice = (d, code, ch)
+                else:
+                    choice = None
+                    for code in evasions(board):
+                        ch = child_hash(h, board, code)
+                        captured = make_move(board, code)
+                        d = self._shortest(board, ch, depth - 1, True)
+                        unmake_move(board, code, captured)
+                        if d is None:
+                            choice = None
+                            break
+                        if choice is None or d > choice[0]:
+                            choice = (d, code, ch)
+                if choice is None:
+                    return line
+                depth, code, h = choice
+                line.append(decode_move(code))
+                make_move(board, code)
+                is_or = not is_or
+        except _OutOfNodes:
+            pass
+        return line
+
+    def _begin(self) -> None:
+        if len(self.tt) > self.tt_size:
+            keep = sorted(self.tt.items(), key=lambda kv: kv[1][2], reverse=True)[:self.tt_size // 2]
+            self.tt = dict(keep)
+            self.evictions += 1
+        if len(self._children) > self.tt_size:
+            self._children.clear()
+        self.nodes = 0
+        self._limit = self.max_nodes
+
+    # ---- API -------------------------------------------------------------
+
+    def solve(self, position: Union[str, Board], max_plies: Optional[int] = None) -> MateSolution:
+        """
+        Mate for the side to move within max_plies (default self.max_plies).
+        ValueError when the SFEN does not parse.
+        """
+        board = Board.from_sfen(position) if isinstance(position, str) else position.copy()
+        limit = self.max_plies if max_plies is None else min(max_plies, self.max_plies)
+        t0 = time.perf_counter()
+        if king_square(board.squares, board.turn ^ 1) < 0:
+            return MateSolution("unknown")
+        with self._lock:
+            self._begin()
+            h = position_hash(board)
+            try:
+                depth = self._shortest(board, h, limit, True)
+                if depth is not None:
+                    status, moves = "mate", self._line(board, h, depth)
+                else:
+                    status, moves = ("unknown" if self._cut else "nomate"), []
+            except _OutOfNodes:
+                status, moves = "unknown", []
+            nodes = self.nodes
+        return MateSolution(status, moves, nodes, round((time.perf_counter() - t0) * 1000, 3))
+
+    def respond(self, position: Union[str, Board],
+                plies_left: Optional[int] = None) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        The defender's answer to the attacker's last move (defender to move),
+        as (status, move) for tsume_response():
+
+        - ("win", "resign") when the move mates
+        - ("continue", reply) when every reply is mated within the plies left,
+          with the reply that holds out longest
+        - ("incorrect", reply) when the move does not check, or a reply escapes
+
+        `plies_left` is what is left of the problem (defender's reply
+        included); when it is known and within max_plies, "no mate within it"
+        is final. None when the solver cannot tell: unknown length with
+        branches cut at the ply limit, an exhausted node budget, or no king.
+        """
+        board = Board.from_sfen(position) if isinstance(position, str) else position.copy()
+        color = board.turn
+        ksq = king_square(board.squares, color)
+        if ksq < 0:
+            return None
+        exact = plies_left is not None and plies_left <= self.max_plies
+        limit = self.max_plies if plies_left is None else min(plies_left, self.max_plies)
+        replies = evasions(board)
+        if not attacked(board.squares, ksq, color ^ 1):
+            return ("incorrect", decode_move(replies[0])) if replies else None
+        if not replies:
+            return "win", "resign"
+        with self._lock:
+            self._begin()
+            h = position_hash(board)
+            longest = None
+            try:
+                for code in replies:
+                    ch = child_hash(h, board, code)
+                    captured = make_move(board, code)
+                    try:
+                        d = self._shortest(board, ch, limit - 1, True)
+                    finally:
+                        unmake_move(board, code, captured)
+                    if d is None:
+                        return ("incorrect", decode_move(code)) if exact or not self._cut else None
+                    if longest is None or d > longest[0]:
+                        longest = (d, code)
+            except _OutOfNodes:
+                return None
+        return "continue", decode_move(longest[1])
+
+    def stats(self) -> dict:
+        return {"tt_entries": len(self.tt), "evictions": self.evictions, "max_plies": self.max_plies,
+                "max_nodes": self.max_nodes}
+
+
+_SOLVERS: Dict[Tuple[int, int], DfPnSolver] = {}
+_SOLVERS_LOCK = threading.Lock()
+
+
+def get_mate_solver() -> Optional[DfPnSolver]:
+    """Shared solver (TSUME_SOLVER_MAX_PLIES, TSUME_SOLVER_MAX_NODES); None when max plies is 0."""
+    max_plies = int(os.getenv("TSUME_SOLVER_MAX_PLIES", str(DEFAULT_MAX_PLIES)))
+    max_nodes = int(os.getenv("TSUME_SOLVER_MAX_NODES", str(DEFAULT_MAX_NODES)))
+    if max_plies < 1:
+        return None
+    with _SOLVERS_LOCK:
+        solver = _SOLVERS.get((max_plies, max_nodes))
+        if solver is None:
+            solver = _SOLVERS[(max_plies, max_nodes)] = DfPnSolver(max_plies, max_nodes)
+        return solver
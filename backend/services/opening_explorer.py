@@ -0,0 +1,305 @@
+"""
+opening_explorer.py
+
+Opening explorer: move frequencies and outcomes over the first plies of every
+corpus game.
+
+build_opening_tree() replays the first `max_plies` plies of each game on a
+HashedBoard. Nodes are positions (Zobrist hash, so transpositions merge into
+one node) and edges are (position, move) pairs. Both count:
+
+- games that passed through them (a game counts once per node/edge)
+- sente wins / gote wins / draws, from the game result
+- the sum and count of the engine eval after the move (sente's view), when
+  the game was annotated
+
+Files in the tree directory (default <out>/.openings):
+
+    node_keys.npy   uint64      sorted position hashes
+    nodes.npy       NODE_DTYPE  stats per position, same order
+    edge_keys.npy   uint64      sorted parent hashes, one entry per move played there
+    edges.npy       EDGE_DTYPE  move code, child hash, stats; most played first per parent
+    meta.json                   max_plies, min_games, counts, build time
+
+OpeningTree opens them memory-mapped; a lookup is three binary searches over
+the key columns (kept apart from the stats so the search runs on contiguous
+uint64 arrays), so it stays well under a millisecond at any corpus size.
+Moves played in fewer than `min_games` games are pruned at build time, which
+drops the long tail of one-off deviations that dominates the size.
+
+CLI:
+    python -m backend.services.opening_explorer build data/out [--max-plies 30] [--min-games 2]
+    python -m backend.services.opening_explorer show data/out/.openings "startpos moves 7g7f"
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:  # pragma: no cover - numpy は requirements に含まれる
+    np = None  # type: ignore[assignment]
+    HAS_NUMPY = False
+
+from ..ingest.board import IllegalMoveError
+from ..ingest.move_codec import decode_move, encode_move
+from ..ingest.zobrist import HashedBoard
+from .corpus_analytics import iter_annotated_games
+from .corpus_store import MISSING
+
+TREE_DIRNAME = ".openings"
+DEFAULT_MAX_PLIES = 30
+
+_STATS = [("games", "<u4"), ("sente_wins", "<u4"), ("gote_wins", "<u4"), ("draws", "<u4"),
+          ("eval_n", "<u4"), ("eval_sum", "<i8")]
+NODE_DTYPE = _STATS
+EDGE_DTYPE = [("child", "<u8"), ("move", "<u2")] + _STATS
+
+_OUTCOME = {"sente_win": 1, "gote_win": 2, "draw": 3}   # index into a stats list
+
+
+def _require_numpy() -> None:
+    if not HAS_NUMPY:
+        raise RuntimeError("numpy is required for the opening explorer")
+
+
+def default_tree_dir(corpus_path: str) -> str:
+    if os.path.isfile(corpus_path):
+        return os.path.splitext(corpus_path)[0] + TREE_DIRNAME
+    return os.path.join(corpus_path, TREE_DIRNAME)
+
+
+@dataclass
+class TreeBuildStats:
+    games: int = 0
+    nodes: int = 0
+    edges: int = 0
+    pruned_edges: int = 0
+    elapsed_s: float = 0.0
+
+
+@dataclass
+class BranchStats:
+    games: int
+    sente_wins: int
+    gote_wins: int
+    draws: int
+    avg_eval_cp: Optional[float]     # sente's view; None without annotations
+
+
+@dataclass
+class ExplorerMove(BranchStats):
+    move: str = ""
+    share: float = 0.0               # of the games continuing from this position
+
+
+@dataclass
+class ExplorerNode:
+    hash: str
+    position: Optional[BranchStats]  # None: no corpus game reached it (within max_plies)
+    moves: List[ExplorerMove] = field(default_factory=list)
+
+
+def _bump(stats: List[int], outcome: int, score: Optional[int]) -> None:
+    # stats: [games, sente_wins, gote_wins, draws, eval_n, eval_sum]
+    stats[0] += 1
+    if outcome:
+        stats[outcome] += 1
+    if score is not None:
+        stats[4] += 1
+        stats[5] += score
+
+
+def _score(record, i: int) -> Optional[int]:
+    if i >= len(record.score_cp):
+        return None
+    value = int(record.score_cp[i])
+    return None if value == MISSING else value
+
+
+def build_opening_tree(corpus_path: str, tree_dir: Optional[str] = None,
+                       max_plies: int = DEFAULT_MAX_PLIES, min_games: int = 1) -> TreeBuildStats:
+    """Count the first `max_plies` plies of every game; edges below `min_games` are dropped."""
+    _require_numpy()
+    t0 = time.perf_counter()
+    tree_dir = tree_dir or default_tree_dir(corpus_path)
+    nodes: Dict[int, List[int]] = {}
+    edges: Dict[Tuple[int, int], List[int]] = {}    # (parent, move code) -> [*stats, child]
+    stats = TreeBuildStats()
+
+    for record in iter_annotated_games(corpus_path):
+        try:
+            board = HashedBoard.from_sfen(record.start_sfen)
+        except (ValueError, IndexError):
+            continue
+        stats.games += 1
+        outcome = _OUTCOME.get(record.result or "", 0)
+        seen = {board.hash}
+        _bump(nodes.setdefault(board.hash, [0] * 6), outcome, None)
+        for i, move in enumerate(record.moves[:max_plies]):
+            parent = board.hash
+            code = encode_move(move)
+            try:
+                board.push_usi(move)
+            except (IllegalMoveError, IndexError):
+                break
+            if board.hash in seen:          # repetition: count the game once
+                continue
+            seen.add(board.hash)
+            score = _score(record, i)
+            edge = edges.get((parent, code))
+            if edge is None:
+                edge = edges[(parent, code)] = [0, 0, 0, 0, 0, 0, board.hash]
+            _bump(edge, outcome, score)
+            _bump(nodes.setdefault(board.hash, [0] * 6), outcome, score)
+
+    kept = [(key, value) for key, value in edges.items() if value[0] >= min_games]
+    stats.pruned_edges = len(edges) - len(kept)
+    kept_nodes = [(h, v) for h, v in nodes.items() if v[0] >= min_games]
+
+    node_keys = np.array([h for h, _ in kept_nodes], dtype=np.uint64)
+    node_rows = np.array([tuple(v) for _, v in kept_nodes], dtype=NODE_DTYPE)
+    order = np.argsort(node_keys, kind="stable")
+    node_keys, node_rows = node_keys[order], node_rows[order]
+
+    edge_keys = np.array([parent for (parent, _), _ in kept], dtype=np.uint64)
+    edge_rows = np.array([(v[6], code, *v[:6]) for (_, code), v in kept], dtype=EDGE_DTYPE)
+    # by position, then most played first (move code breaks ties deterministically)
+    order = np.lexsort((edge_rows["move"], -edge_rows["games"].astype(np.int64), edge_keys))
+    edge_keys, edge_rows = edge_keys[order], edge_rows[order]
+
+    stats.nodes, stats.edges = len(node_keys), len(edge_keys)
+    stats.elapsed_s = round(time.perf_counter() - t0, 3)
+
+    parent_dir = os.path.dirname(os.path.abspath(tree_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-openings-", dir=parent_dir)
+    try:
+        for name, array in (("node_keys", node_keys), ("nodes", node_rows),
+                            ("edge_keys", edge_keys), ("edges", edge_rows)):
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"corpus": os.path.abspath(corpus_path), "max_plies": max_plies,
+                       "min_games": min_games, **asdict(stats),
+                       "built_at": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, ensure_ascii=False)
+        if os.path.isdir(tree_dir):
+            old = tree_dir + ".old"
+            shutil.rmtree(old, ignore_errors=True)
+            os.replace(tree_dir, old)
+            os.replace(tmp, tree_dir)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.replace(tmp, tree_dir)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return stats
+
+
+def _load(path: str):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:   # an empty column cannot be mapped
+        return np.load(path)
+
+
+def _branch(row) -> Dict[str, Any]:
+    n = int(row["eval_n"])
+    return {"games": int(row["games"]), "sente_wins": int(row["sente_wins"]),
+            "gote_wins": int(row["gote_wins"]), "draws": int(row["draws"]),
+            "avg_eval_cp": round(int(row["eval_sum"]) / n, 1) if n else None}
+
+
+class OpeningTree:
+    """Read side of a built tree (memory-mapped)."""
+
+    def __init__(self, tree_dir: str):
+        _require_numpy()
+        self.tree_dir = tree_dir
+        with open(os.path.join(tree_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        self.node_keys = _load(os.path.join(tree_dir, "node_keys.npy"))
+        self.nodes = _load(os.path.join(tree_dir, "nodes.npy"))
+        self.edge_keys = _load(os.path.join(tree_dir, "edge_keys.npy"))
+        self.edges = _load(os.path.join(tree_dir, "edges.npy"))
+
+    @property
+    def max_plies(self) -> int:
+        return int(self.meta.get("max_plies", DEFAULT_MAX_PLIES))
+
+    def lookup(self, position_hash: int, limit: Optional[int] = None) -> ExplorerNode:
+        key = np.uint64(position_hash)
+        i = int(np.searchsorted(self.node_keys, key))
+        position = None
+        if i < len(self.node_keys) and int(self.node_keys[i]) == position_hash:
+            position = BranchStats(**_branch(self.nodes[i]))
+        lo = int(np.searchsorted(self.edge_keys, key, side="left"))
+        hi = int(np.searchsorted(self.edge_keys, key, side="right"))
+        rows = self.edges[lo:hi]
+        continuing = int(rows["games"].sum()) if hi > lo else 0
+        if limit is not None:
+            rows = rows[:limit]
+        moves = [ExplorerMove(move=decode_move(int(row["move"])),
+                              share=round(int(row["games"]) / continuing, 4) if continuing else 0.0,
+                              **_branch(row))
+                 for row in rows]
+        return ExplorerNode(hash=f"{position_hash:016x}", position=position, moves=moves)
+
+
+_CACHE: Dict[str, Tuple[int, OpeningTree]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def cached_tree(tree_dir: str) -> OpeningTree:
+    """OpeningTree reopened when a rebuild replaced meta.json."""
+    stamp = os.stat(os.path.join(tree_dir, "meta.json")).st_mtime_ns
+    with _CACHE_LOCK:
+        hit = _CACHE.get(tree_dir)
+        if hit is not None and hit[0] == stamp:
+            return hit[1]
+        tree = OpeningTree(tree_dir)
+        _CACHE[tree_dir] = (stamp, tree)
+    return tree
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .position_index import parse_position
+
+    ap = argparse.ArgumentParser(description="Opening explorer tree over a kifu corpus")
+    sub = ap.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="build the tree (JSON outputs, columnar corpus or .kgs)")
+    b.add_argument("corpus", nargs="?", default=os.getenv("KIFU_OUT", "data/out"))
+    b.add_argument("--tree", default=None, help="tree directory (default: <corpus>/.openings)")
+    b.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES)
+    b.add_argument("--min-games", type=int, default=1, help="drop rarer moves")
+    s = sub.add_parser("show", help="continuations from a position")
+    s.add_argument("tree")
+    s.add_argument("position", nargs="?", default="startpos")
+    s.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        stats = build_opening_tree(args.corpus, args.tree, args.max_plies, args.min_games)
+        print(json.dumps(asdict(stats), indent=2))
+        return 0
+    try:
+        position_hash, _ = parse_position(args.position)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    node = OpeningTree(args.tree).lookup(position_hash, args.limit)
+    print(json.dumps(asdict(node), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
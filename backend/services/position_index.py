@@ -0,0 +1,310 @@
+"""
+position_index.py
+
+Inverted index from positions to the games that reached them.
+
+build_position_index() makes a single streaming pass over a corpus (JSON
+outputs, a columnar corpus store or a .kgs game store; anything
+corpus_analytics.iter_annotated_games reads), replays each game on a
+HashedBoard and emits one posting (zobrist hash, game id, ply) per position,
+ply 0 being the start position. The postings are sorted by hash and saved as
+.npy columns, which PositionIndex opens memory-mapped: a lookup is a binary
+search (np.searchsorted) over the hash column, so queries stay in the
+millisecond range however large the corpus is.
+
+Files in the index directory:
+
+    hashes.npy        uint64  sorted position hashes
+    games.npy         uint32  game id per posting (sorted within a hash)
+    plies.npy         uint16  ply per posting
+    games.jsonl               one line per game: source, players, result
+    game_offsets.npy  uint64  byte offset of each games.jsonl line
+    meta.json                 counts, corpus path, build time
+
+CLI:
+    python -m backend.services.position_index build data/out
+    python -m backend.services.position_index query data/out/.positions "startpos moves 7g7f 3c3d"
+"""
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:  # pragma: no cover - numpy は requirements に含まれる
+    np = None  # type: ignore[assignment]
+    HAS_NUMPY = False
+
+from ..ingest.board import IllegalMoveError
+from ..ingest.zobrist import HashedBoard
+from .corpus_analytics import iter_annotated_games
+
+INDEX_DIRNAME = ".positions"
+_COLUMNS = ("hashes", "games", "plies")
+_MAX_PLY = (1 << 16) - 1
+
+
+def _require_numpy() -> None:
+    if not HAS_NUMPY:
+        raise RuntimeError("numpy is required for the position index")
+
+
+def default_index_dir(corpus_path: str) -> str:
+    """<out>/.positions for an output folder, <file>.positions next to a .kgs store."""
+    if os.path.isfile(corpus_path):
+        return os.path.splitext(corpus_path)[0] + INDEX_DIRNAME
+    return os.path.join(corpus_path, INDEX_DIRNAME)
+
+
+def parse_position(text: str) -> Tuple[int, str]:
+    """
+    Hash of the position given as an SFEN, "startpos", or either followed by
+    "moves ..." (the position after those moves). Returns (hash, sfen).
+    ValueError when it does not parse or a move is illegal.
+    """
+    text = text.strip()
+    if text.startswith("position "):
+        text = text[len("position "):].lstrip()
+    base, _, moves = text.partition(" moves")
+    board = HashedBoard.from_sfen(base)
+    for move in moves.split():
+        try:
+            board.push_usi(move)
+        except IllegalMoveError as e:
+            raise ValueError(f"illegal move {move}: {e}") from None
+    return board.hash, board.board.sfen()
+
+
+@dataclass
+class IndexBuildStats:
+    games: int = 0
+    postings: int = 0
+    skipped: int = 0            # games whose start position does not parse
+    truncated: int = 0          # games indexed up to an illegal move
+    elapsed_s: float = 0.0
+
+
+@dataclass
+class PositionMatch:
+    game_id: int
+    ply: int                    # first ply at which the game reached the position
+    source: Optional[str] = None
+    sente: Optional[str] = None
+    gote: Optional[str] = None
+    result: Optional[str] = None
+
+
+@dataclass
+class PositionPage:
+    hash: str
+    total_games: int
+    occurrences: int
+    offset: int
+    limit: int
+    items: List[PositionMatch] = field(default_factory=list)
+
+    @property
+    def has_more(self) -> bool:
+        return self.offset + len(self.items) < self.total_games
+
+
+def build_position_index(corpus_path: str, index_dir: Optional[str] = None) -> IndexBuildStats:
+    """Index every position of every game under `corpus_path`; replaces `index_dir`."""
+    _require_numpy()
+    t0 = time.perf_counter()
+    index_dir = index_dir or default_index_dir(corpus_path)
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-positions-", dir=parent)
+    stats = IndexBuildStats()
+    hashes, games, plies = array("Q"), array("I"), array("H")
+    offsets = array("Q")
+    try:
+        with open(os.path.join(tmp, "games.jsonl"), "wb") as gf:
+            for record in iter_annotated_games(corpus_path):
+                try:
+                    board = HashedBoard.from_sfen(record.start_sfen)
+                except (ValueError, IndexError):
+                    stats.skipped += 1
+                    continue
+                game_id = stats.games
+                stats.games += 1
+                offsets.append(gf.tell())
+                line = {"source": record.source, "sente": record.sente,
+                        "gote": record.gote, "result": record.result}
+                gf.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+                hashes.append(board.hash)
+                games.append(game_id)
+                plies.append(0)
+                for ply, move in enumerate(record.moves[:_MAX_PLY], 1):
+                    try:
+                        board.push_usi(move)
+                    except (IllegalMoveError, IndexError):
+                        stats.truncated += 1
+                        break
+                    hashes.append(board.hash)
+                    games.append(game_id)
+                    plies.append(ply)
+
+        h = np.frombuffer(hashes, dtype=np.uint64)
+        g = np.frombuffer(games, dtype=np.uint32)
+        p = np.frombuffer(plies, dtype=np.uint16)
+        order = np.lexsort((p, g, h))
+        for name, column in zip(_COLUMNS, (h, g, p)):
+            np.save(os.path.join(tmp, f"{name}.npy"), column[order])
+        np.save(os.path.join(tmp, "game_offsets.npy"), np.frombuffer(offsets, dtype=np.uint64))
+        stats.postings = len(h)
+        stats.elapsed_s = round(time.perf_counter() - t0, 3)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"corpus": os.path.abspath(corpus_path), **asdict(stats),
+                       "built_at": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, ensure_ascii=False)
+
+        # swap in the new index; readers holding the old maps keep their (unlinked) files
+        if os.path.isdir(index_dir):
+            old = index_dir + ".old"
+            shutil.rmtree(old, ignore_errors=True)
+            os.replace(index_dir, old)
+            os.replace(tmp, index_dir)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.replace(tmp, index_dir)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return stats
+
+
+def _load_column(path: str):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:   # an empty column cannot be mapped
+        return np.load(path)
+
+
+class PositionIndex:
+    """Read side: memory-mapped postings, binary-searched per query."""
+
+    def __init__(self, index_dir: str):
+        _require_numpy()
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        columns = {name: _load_column(os.path.join(index_dir, f"{name}.npy"))
+                   for name in _COLUMNS + ("game_offsets",)}
+        self.hashes = columns["hashes"]
+        self.games = columns["games"]
+        self.plies = columns["plies"]
+        self.game_offsets = columns["game_offsets"]
+        self._games_file = open(os.path.join(index_dir, "games.jsonl"), "rb")
+        size = os.fstat(self._games_file.fileno()).st_size
+        self._games_map = mmap.mmap(self._games_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @property
+    def n_games(self) -> int:
+        return len(self.game_offsets)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def game_info(self, game_id: int) -> Dict[str, Any]:
+        lo = int(self.game_offsets[game_id])
+        hi = int(self.game_offsets[game_id + 1]) if game_id + 1 < self.n_games else len(self._games_map)
+        return json.loads(self._games_map[lo:hi])
+
+    def _range(self, position_hash: int) -> Tuple[int, int]:
+        key = np.uint64(position_hash)
+        return (int(np.searchsorted(self.hashes, key, side="left")),
+                int(np.searchsorted(self.hashes, key, side="right")))
+
+    def occurrences(self, position_hash: int) -> int:
+        lo, hi = self._range(position_hash)
+        return hi - lo
+
+    def find(self, position_hash: int, offset: int = 0, limit: int = 50) -> PositionPage:
+        """Games that reached the position, by game id, each with its first ply there."""
+        lo, hi = self._range(position_hash)
+        games = self.games[lo:hi]
+        # postings are sorted by (game, ply): the first of each run is the earliest ply
+        first = np.flatnonzero(np.r_[True, games[1:] != games[:-1]]) if hi > lo else np.zeros(0, dtype=np.int64)
+        page = first[offset:offset + limit]
+        items = []
+        for i in page:
+            game_id = int(games[i])
+            items.append(PositionMatch(game_id=game_id, ply=int(self.plies[lo + i]),
+                                       **self.game_info(game_id)))
+        return PositionPage(hash=f"{position_hash:016x}", total_games=len(first),
+                            occurrences=hi - lo, offset=offset, limit=limit, items=items)
+
+    def close(self) -> None:
+        if isinstance(self._games_map, mmap.mmap):
+            self._games_map.close()
+        self._games_file.close()
+
+    def __enter__(self) -> "PositionIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_CACHE: Dict[str, Tuple[float, PositionIndex]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def cached_index(index_dir: str) -> PositionIndex:
+    """PositionIndex reopened when a rebuild replaced meta.json.
+
+    The replaced index is not closed: requests may still be reading it, and its
+    files are released once the last of them drops the reference.
+    """
+    stamp = os.stat(os.path.join(index_dir, "meta.json")).st_mtime_ns
+    with _CACHE_LOCK:
+        hit = _CACHE.get(index_dir)
+        if hit is not None and hit[0] == stamp:
+            return hit[1]
+        index = PositionIndex(index_dir)
+        _CACHE[index_dir] = (stamp, index)
+    return index
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Position -> games inverted index")
+    sub = ap.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="index a corpus (JSON outputs, columnar corpus or .kgs)")
+    b.add_argument("corpus", nargs="?", default=os.getenv("KIFU_OUT", "data/out"))
+    b.add_argument("--index", default=None, help="index directory (default: <corpus>/.positions)")
+    q = sub.add_parser("query", help="games that reached a position")
+    q.add_argument("index")
+    q.add_argument("position", help='SFEN or "startpos", optionally followed by "moves ..."')
+    q.add_argument("--offset", type=int, default=0)
+    q.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        stats = build_position_index(args.corpus, args.index)
+        print(json.dumps(asdict(stats), indent=2))
+        return 0
+    try:
+        position_hash, _ = parse_position(args.position)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    with PositionIndex(args.index) as index:
+        page = index.find(position_hash, args.offset, args.limit)
+    print(json.dumps({**asdict(page), "has_more": page.has_more}, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,266 @@
+"""
+tsume_table.py
+
+Precomputed defender replies for /api/tsume/play.
+
+build_tsume_table() walks every tsume problem offline with a USI engine. At
+each attacker-to-move position on a correct line, one MultiPV search over all
+moves gives every attacker move with its score and PV:
+
+- mate in 1: the defender has no reply                         -> "win"
+- mate within the moves left: a correct move, and the PV's second move is
+  the defender's best reply                                    -> "continue"
+- anything else: the move does not mate, and the PV's second move refutes it
+                                                               -> "incorrect"
+
+The walk continues from the position after each correct move and its reply,
+up to the problem's length. Entries are keyed by the Zobrist hash of the
+position after the attacker's move (defender to move, move number ignored),
+which is the position the client posts, and by the plies left after that
+move: a transposition reached with another number of moves left can have
+another status. The engine search of a position is shared by all its depths.
+
+A lookup with the plies left (from TsumePlayRequest.plies_played or the SFEN
+move number) hits that entry. Without it, a position answers only when all
+its depths agree.
+
+The table is one JSON file (default data/tsume_table.json, env TSUME_TABLE).
+It is loaded into a dict once. A lookup is one SFEN parse and one dict hit,
+so the endpoint answers in microseconds. Only positions off the table go to
+the engine.
+
+CLI:
+    python -m backend.services.tsume_table build [--out data/tsume_table.json] [--nodes 200000]
+    python -m backend.services.tsume_table show "sfen 4k4/4G4/4P4/9/9/9/9/9/K8 w - 2"
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ..ingest.board import IllegalMoveError
+from ..ingest.zobrist import HashedBoard, sfen_hash
+
+DEFAULT_TABLE = "data/tsume_table.json"
+TABLE_VERSION = 1
+# 全合法手を列挙できる MultiPV（将棋の合法手は最大 593）
+ALL_MOVES_MULTIPV = 600
+DEFAULT_NODES = 200_000
+
+# solve_tsume_hand と同じ応答文言
+MESSAGES = {
+    "win": "正解！詰みました！",
+    "continue": "正解！",
+    "incorrect": "その手では詰みません",
+    "lose": "不正解：入玉されてしまいました",
+}
+
+
+def tsume_response(status: str, bestmove: Optional[str]) -> Dict[str, Any]:
+    """/api/tsume/play の応答（エンジン経由と同じ形）"""
+    return {"status": status, "bestmove": bestmove, "message": MESSAGES[status]}
+
+
+@dataclass
+class TsumeTableStats:
+    out: str
+    problems: int = 0
+    searches: int = 0
+    entries: int = 0
+    per_problem: Dict[str, int] = field(default_factory=dict)
+    build_s: float = 0.0
+
+
+def _problem_sfen(sfen: str) -> str:
+    sfen = sfen.strip()
+    return sfen[len("sfen "):] if sfen.startswith("sfen ") else sfen
+
+
+def _entry_key(position_hash: int, plies_left: int) -> str:
+    return f"{position_hash:016x}:{plies_left}"
+
+
+def _walk(engine: Any, board: HashedBoard, plies_left: int, entries: Dict[str, Dict[str, Any]],
+          visited: set, searched: Dict[int, List[Any]], stats: TsumeTableStats, problem_id: Any,
+          nodes: Optional[int], byoyomi_ms: Optional[int]) -> None:
+    if plies_left < 1 or (board.hash, plies_left) in visited:
+        return
+    visited.add((board.hash, plies_left))
+    lines = searched.get(board.hash)
+    if lines is None:
+        stats.searches += 1
+        lines = engine.analyze_multipv(f"position sfen {board.board.sfen()}", ALL_MOVES_MULTIPV, byoyomi_ms, nodes)
+        searched[board.hash] = lines
+    follow: List[Tuple[str, str]] = []
+    for line in lines:
+        if not line.pv:
+            continue
+        move, reply = line.pv[0], (line.pv[1] if len(line.pv) > 1 else None)
+        mates = line.mate is not None and line.mate > 0
+        if mates and line.mate == 1:
+            status, reply = "win", "resign"
+        elif mates and line.mate <= plies_left:
+            status = "continue"
+        else:
+            status = "incorrect"        # no mate, or a longer one than the problem allows
+        if reply is None:
+            continue
+        after = HashedBoard(board.board.copy())
+        try:
+            after.push_usi(move)
+        except IllegalMoveError:
+            continue
+        key = _entry_key(after.hash, plies_left - 1)
+        if key not in entries:
+            entries[key] = {"status": status, "bestmove": reply, "problem": problem_id}
+        if status == "continue":
+            follow.append((move, reply))
+
+    for move, reply in follow:
+        nxt = HashedBoard(board.board.copy())
+        try:
+            nxt.push_usi(move)
+            nxt.push_usi(reply)
+        except IllegalMoveError:
+            continue
+        _walk(engine, nxt, plies_left - 2, entries, visited, searched, stats, problem_id, nodes, byoyomi_ms)
+
+
+def build_tsume_table(engine: Any, problems: Optional[Sequence[Dict[str, Any]]] = None,
+                      out_path: str = DEFAULT_TABLE, nodes: Optional[int] = DEFAULT_NODES,
+                      byoyomi_ms: Optional[int] = None) -> TsumeTableStats:
+    """
+    Walk every problem (default TSUME_PROBLEMS) with `engine` (anything with
+    UsiEngine.analyze_multipv()) and write the table atomically.
+    """
+    if problems is None:
+        from ..api.tsume_data import TSUME_PROBLEMS
+        problems = TSUME_PROBLEMS
+    t0 = time.perf_counter()
+    stats = TsumeTableStats(out=out_path)
+    entries: Dict[str, Dict[str, Any]] = {}
+    searched: Dict[int, List[Any]] = {}
+    for problem in problems:
+        stats.problems += 1
+        before = len(entries)
+        try:
+            board = HashedBoard.from_sfen(_problem_sfen(problem["sfen"]))
+        except ValueError:
+            continue
+        _walk(engine, board, int(problem.get("steps") or 1), entries, set(), searched, stats,
+              problem.get("id"), nodes, byoyomi_ms)
+        stats.per_problem[str(problem.get("id"))] = len(entries) - before
+    stats.entries = len(entries)
+
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tsume_table-", suffix=".json", dir=out_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"version": TABLE_VERSION, "built_at": time.time(), "per_problem": stats.per_problem,
+                   "entries": entries}, f, ensure_ascii=False)
+    os.replace(tmp, out_path)
+    stats.build_s = round(time.perf_counter() - t0, 3)
+    return stats
+
+
+class TsumeTable:
+    """In-memory view of a table file: position hash -> plies left -> (status, bestmove)."""
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != TABLE_VERSION:
+            raise ValueError(f"unsupported tsume table version {data.get('version')!r}")
+        self.path = path
+        self._entries: Dict[int, Dict[int, Tuple[str, Optional[str]]]] = {}
+        for key, e in (data.get("entries") or {}).items():
+            position, plies_left = key.split(":")
+            self._entries.setdefault(int(position, 16), {})[int(plies_left)] = (e["status"], e.get("bestmove"))
+
+    def __len__(self) -> int:
+        return sum(len(depths) for depths in self._entries.values())
+
+    def lookup(self, sfen: str, plies_left: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Reply for the position the client posted with `plies_left` moves left
+        after the attacker's move, or None when it is off the table. Without
+        `plies_left` the position answers only if every depth has the same reply.
+        """
+        try:
+            key = sfen_hash(sfen)
+        except ValueError:
+            return None
+        depths = self._entries.get(key)
+        if not depths:
+            return None
+        if plies_left is not None:
+            hit = depths.get(plies_left)
+        else:
+            replies = set(depths.values())
+            hit = replies.pop() if len(replies) == 1 else None
+        return tsume_response(*hit) if hit else None
+
+
+_CACHE: Dict[str, Tuple[int, TsumeTable]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def get_tsume_table() -> Optional[TsumeTable]:
+    """TSUME_TABLE (default data/tsume_table.json), reloaded when the file changes; None if absent."""
+    path = os.getenv("TSUME_TABLE", DEFAULT_TABLE)
+    if not path:
+        return None
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _CACHE_LOCK:
+        hit = _CACHE.get(path)
+        if hit is not None and hit[0] == stamp:
+            return hit[1]
+        try:
+            table = TsumeTable(path)
+        except (OSError, ValueError):
+            return None
+        _CACHE[path] = (stamp, table)
+    return table
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Precomputed tsume replies for /api/tsume/play")
+    sub = ap.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="walk every problem with the engine (USI_CMD)")
+    b.add_argument("--out", default=os.getenv("TSUME_TABLE") or DEFAULT_TABLE)
+    b.add_argument("--nodes", type=int, default=DEFAULT_NODES)
+    b.add_argument("--byoyomi", type=int, default=None, help="per search, instead of --nodes")
+    s = sub.add_parser("show", help="look up the reply for a position (defender to move)")
+    s.add_argument("sfen")
+    s.add_argument("--plies-left", type=int, default=None, help="moves left after the attacker's move")
+    s.add_argument("--table", default=os.getenv("TSUME_TABLE") or DEFAULT_TABLE)
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        from .engine_pool import UsiEngine
+        engine = UsiEngine()
+        try:
+            stats = build_tsume_table(engine, out_path=args.out,
+                                      nodes=None if args.byoyomi else args.nodes, byoyomi_ms=args.byoyomi)
+        finally:
+            engine.close()
+        print(json.dumps(asdict(stats), indent=2))
+        return 0
+    if not os.path.exists(args.table):
+        print(f"error: no table at {args.table}", file=sys.stderr)
+        return 2
+    print(json.dumps(TsumeTable(args.table).lookup(args.sfen, args.plies_left), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -65,3 +65,17 @@ def runner():
     from test_reasoning_v2_standalone import TestRunner
 
     return TestRunner()
+
+
+@pytest.fixture(autouse=True)
+def _isolate_learning_storage(monkeypatch: pytest.MonkeyPatch):
+    """学習データ（LEARNING_DB）はテスト中インメモリ SQLite に置き、data/ に残さない。"""
+    if not os.getenv("LEARNING_DB"):
+        monkeypatch.setenv("LEARNING_DB", ":memory:")
+    # data/ にクイズバンクがあってもテストでは使わない（必要なテストは QUIZ_BANK_DB を指定する）
+    monkeypatch.setenv("QUIZ_BANK_DB", "")
+    yield
+    # get_storage() のシングルトンを次のテストに持ち越さない（バッファもここで書き出して閉じる）
+    from backend.learning.storage import close_storage
+
+    close_storage()
@@ -0,0 +1,28 @@
+"""
+PV reasoning fallback (no python-shogi): events read off the position by
+the legal move generator, and PVs cut at the first illegal move.
+"""
+
+from backend.ai.pv_reason import build_pv_reason_fallback
+
+
+def _events(position_cmd, pv, **options):
+    reason = build_pv_reason_fallback(position_cmd, pv, options)
+    return reason and [(ev["type"], ev["move"]) for ev in reason["events"]]
+
+
+def test_events_from_the_position():
+    assert _events("position startpos moves 7g7f 3c3d", "8h2b+ 3a2b") == [
+        ("capture", "8h2b+"), ("promotion", "8h2b+")]
+    # a real check, not a "+" in the move string
+    assert _events("position sfen 4k4/9/9/9/9/9/9/9/4K4 b R 1", "R*5e 5a4a") == [
+        ("drop", "R*5e"), ("check", "R*5e")]
+    quiet = build_pv_reason_fallback("position startpos", "2g2f 8c8d 2f2e", {"explain_horizon": 2})
+    assert quiet["events"] == [] and quiet["threat_line"] == ["2g2f", "8c8d"]
+
+
+def test_illegal_moves_cut_the_line():
+    reason = build_pv_reason_fallback("position startpos", "7g7f 5e5d 2g2f", {})
+    assert reason["threat_line"] == ["7g7f"]
+    # history that does not replay
+    assert build_pv_reason_fallback("position startpos moves 7g7f 7f7d", "3c3d", {}) is None
@@ -27,9 +27,9 @@ class TestBatchAnnotationService:
     """Test cases for BatchAnnotationService"""
 
     @pytest.fixture
-    def service(self):
-        """Create a test batch annotation service"""
-        with patch.dict(os.environ, {"KIFU_DIR": "test_kifu", "KIFU_OUT": "test_out"}):
+    def service(self, tmp_path):
+        """Create a test batch annotation service (output under tmp_path, never the repo)"""
+        with patch.dict(os.environ, {"KIFU_DIR": "test_kifu", "KIFU_OUT": str(tmp_path / "test_out")}):
             return BatchAnnotationService()
 
     @pytest.fixture
@@ -72,10 +72,10 @@ $GOTE:Player2
             "files": test_files
         }
 
-    def test_service_initialization(self, service):
+    def test_service_initialization(self, service, tmp_path):
         """Test service initialization with environment variables"""
         assert service.kifu_dir == "test_kifu"
-        assert service.kifu_out == "test_out"
+        assert service.kifu_out == str(tmp_path / "test_out")
         assert service.default_byoyomi == 250
 
     def test_get_folder_stats_nonexistent(self, service):
@@ -304,18 +304,22 @@ $GOTE:Player2
         assert "notes" in result
         assert result["summary"] == "Test summary"
 
-    def test_call_annotation_service_fallback(self, service):
-        """Test annotation service fallback on error"""
-        # Test with import error scenario
-        with patch('backend.services.annotate_batch.annotate', side_effect=ImportError):
-            result = service._call_annotation_service(
-                usi_moves=["7g7f", "3c3d"],
-                byoyomi_ms=250
-            )
-        
-        assert "summary" in result
-        assert "notes" in result
-        assert len(result["notes"]) == 2  # Should create basic notes for each move
+    def test_call_annotation_service_error_fails_the_file(self, service, temp_structure):
+        """Test annotation errors fail the file instead of writing placeholder notes"""
+        with patch('backend.api.main.annotate', side_effect=RuntimeError("engine down")):
+            with pytest.raises(RuntimeError):
+                service._call_annotation_service(usi_moves=["7g7f", "3c3d"], byoyomi_ms=250)
+
+            service.kifu_out = temp_structure["out_dir"]
+            first = service.annotate_folder(folder_path=temp_structure["kifu_dir"], recursive=True)
+        assert first.annotated == 0 and first.errors == 4
+        assert not os.path.exists(os.path.join(temp_structure["out_dir"], "game1.json"))
+
+        # nothing was checkpointed as done: a resume annotates the games again
+        with patch('backend.services.annotate_batch.BatchAnnotationService._call_annotation_service',
+                   return_value={"summary": "ok", "notes": []}):
+            again = service.annotate_folder(folder_path=temp_structure["kifu_dir"], recursive=True)
+        assert (again.annotated, again.duplicates) == (2, 1)   # game3.csa repeats game2.kif
 
     def test_environment_variable_override(self):
         """Test service configuration with different environment variables"""
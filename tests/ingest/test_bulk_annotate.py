@@ -0,0 +1,232 @@
+"""
+test_bulk_annotate.py
+
+Tests for the engine-pool batch runner: a tiny fake USI engine (a Python
+script speaking the protocol over stdin/stdout) stands in for YaneuraOu.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+from backend.services.annotate_batch import BatchAnnotationService, BulkProgress
+from backend.services.checkpoint import MANIFEST_NAME, CheckpointEntry, CheckpointManifest, atomic_write_json
+from backend.services.engine_pool import EngineError, EnginePool, UsiEngine, analyze_game
+
+ROOT = Path(__file__).resolve().parents[2]
+
+# Score from the side to move: sente is +30, or +300 once gote has played 8c8d.
+FAKE_ENGINE = textwrap.dedent("""
+    import os, sys
+    crash_marker = os.environ.get("FAKE_USI_CRASH_MARKER")
+    moves = []
+    for line in sys.stdin:
+        cmd = line.strip()
+        if cmd == "usi":
+            print("id name FakeUSI"); print("usiok")
+        elif cmd == "isready":
+            print("readyok")
+        elif cmd.startswith("position"):
+            moves = cmd.split(" moves ", 1)[1].split() if " moves " in cmd else []
+        elif cmd.startswith("go"):
+            if crash_marker and len(moves) == 2 and not os.path.exists(crash_marker):
+                open(crash_marker, "w").close()
+                sys.exit(3)
+            sente = 300 if "8c8d" in moves else 30
+            cp = sente if len(moves) % 2 == 0 else -sente
+            print(f"info depth 7 score cp {cp} pv 7g7f 3c3d")
+            print("bestmove 7g7f")
+        elif cmd == "quit":
+            break
+        sys.stdout.flush()
+""")
+
+
+@pytest.fixture
+def fake_engine_cmd(tmp_path):
+    script = tmp_path / "fake_usi.py"
+    script.write_text(FAKE_ENGINE, encoding="utf-8")
+    return [sys.executable, str(script)]
+
+
+def _pool(cmd, size=2):
+    return EnginePool(size, factory=lambda: UsiEngine(cmd, options={}, boot_timeout=5, go_timeout=5))
+
+
+def test_analyze_game_scores_from_sente_and_delta_from_mover(fake_engine_cmd):
+    with _pool(fake_engine_cmd, 1) as pool, pool.acquire() as engine:
+        result = analyze_game(engine, ["7g7f", "3c3d", "2g2f", "8c8d"], byoyomi_ms=10)
+
+    notes = result["notes"]
+    assert [n["ply"] for n in notes] == [1, 2, 3, 4]
+    assert all(n["bestmove"] == "7g7f" for n in notes)
+    assert notes[0]["score_before_cp"] == 30 and notes[0]["score_after_cp"] == 30
+    assert notes[0]["delta_cp"] == 0 and notes[0]["tags"] == []
+    # gote's 8c8d hands sente +270: a loss of 270 for the mover
+    assert notes[3]["score_after_cp"] == 300
+    assert notes[3]["delta_cp"] == -270
+    assert notes[3]["tags"] == ["悪手"]
+    assert notes[3]["evidence"]["depth"] == 7
+    assert "FakeUSI" in result["summary"]
+
+
+def test_pool_replaces_crashed_engine(fake_engine_cmd, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_USI_CRASH_MARKER", str(tmp_path / "crashed"))
+    pool = _pool(fake_engine_cmd, 1)
+    try:
+        with pytest.raises(EngineError):
+            with pool.acquire() as engine:
+                analyze_game(engine, ["7g7f", "3c3d"], byoyomi_ms=10)
+        with pool.acquire() as engine:
+            result = analyze_game(engine, ["7g7f", "3c3d"], byoyomi_ms=10)
+        assert len(result["notes"]) == 2
+    finally:
+        pool.close()
+
+
+# distinct third moves: every file is a different game (no dedupe between them)
+THIRD_MOVES = ["2g2f", "1g1f", "3g3f", "4g4f", "5g5f", "6g6f", "8g8f", "9g9f", "7f7e",
+               "2h3h", "2h4h", "2h5h", "2h6h", "2h7h", "5i4h", "5i5h", "5i6h", "6i5h",
+               "6i6h", "6i7h", "4i3h", "4i4h", "4i5h", "3i3h", "3i4h", "7i6h", "7i7h"]
+
+
+def _make_folder(root: Path, n: int) -> Path:
+    kifu = root / "kifu"
+    (kifu / "sub").mkdir(parents=True)
+    for i in range(n):
+        target = kifu / ("sub" if i % 2 else "") / f"game{i}.usi"
+        target.write_text(f"startpos moves 7g7f 3c3d {THIRD_MOVES[i]}", encoding="utf-8")
+    return kifu
+
+
+def test_annotate_folder_parallel_and_resumable(fake_engine_cmd, tmp_path):
+    kifu = _make_folder(tmp_path, 6)
+    out = tmp_path / "out"
+    updates = []
+
+    with _pool(fake_engine_cmd, 3) as pool:
+        service = BatchAnnotationService(engine_pool=pool)
+        service.kifu_out = str(out)
+        summary = service.annotate_folder(str(kifu), byoyomi_ms=10, workers=3,
+                                          progress_callback=lambda p: updates.append(p.format()))
+        assert summary.annotated == 6 and summary.errors == 0
+        assert [Path(r.file_path).name for r in summary.results] == \
+            [Path(p).name for p in sorted(map(str, kifu.rglob("*.usi")))]
+        data = json.loads((out / "sub" / "game1.json").read_text(encoding="utf-8"))
+        assert len(data["annotation"]["notes"]) == 3
+        assert len(updates) == 6 and "plies/s" in updates[-1]
+        assert not list(out.rglob(".tmp-*"))
+
+        # rerun: everything is already done
+        again = service.annotate_folder(str(kifu), byoyomi_ms=10, workers=3)
+        assert again.annotated == 0 and again.skipped == 6
+        assert all(r.skipped for r in again.results)
+
+        # a changed file and a deleted output are redone
+        changed = kifu / "game0.usi"
+        changed.write_text("startpos moves 7g7f 3c3d 2g2f 8c8d", encoding="utf-8")
+        (out / "game2.json").unlink()
+        third = service.annotate_folder(str(kifu), byoyomi_ms=10, workers=3)
+        redone = sorted(Path(r.file_path).name for r in third.results if not r.skipped)
+        assert redone == ["game0.usi", "game2.usi"]
+        assert third.annotated == 2 and third.skipped == 4
+
+
+def test_touched_file_is_skipped_but_new_settings_redo_everything(fake_engine_cmd, tmp_path):
+    kifu = _make_folder(tmp_path, 3)
+    with _pool(fake_engine_cmd, 2) as pool:
+        service = BatchAnnotationService(engine_pool=pool)
+        service.kifu_out = str(tmp_path / "out")
+        assert service.annotate_folder(str(kifu), byoyomi_ms=10).annotated == 3
+
+        # same bytes, new mtime: the content hash says nothing changed
+        touched = kifu / "game0.usi"
+        st = touched.stat()
+        os.utime(touched, ns=(st.st_atime_ns, st.st_mtime_ns + 5_000_000_000))
+        again = service.annotate_folder(str(kifu), byoyomi_ms=10)
+        assert again.annotated == 0 and again.skipped == 3
+        manifest = CheckpointManifest(str(tmp_path / "out" / MANIFEST_NAME)).load()
+        assert manifest.entries["game0.usi"].mtime_ns == touched.stat().st_mtime_ns
+
+        # a different time budget invalidates every earlier analysis
+        redo = service.annotate_folder(str(kifu), byoyomi_ms=20)
+        assert redo.annotated == 3 and redo.skipped == 0
+
+    manifest = CheckpointManifest(str(tmp_path / "out" / MANIFEST_NAME)).load()
+    assert len(manifest.settings) == 2
+    entry = manifest.entries["sub/game1.usi"]
+    assert entry.content_hash and manifest.settings[entry.settings]["byoyomi_ms"] == 20
+
+
+def test_engine_change_is_detected_without_starting_it(fake_engine_cmd):
+    engine = UsiEngine(fake_engine_cmd, options={})
+    before = engine.describe()
+    script = Path(fake_engine_cmd[1])
+    script.write_text(script.read_text(encoding="utf-8") + "\n# v2\n", encoding="utf-8")
+    assert UsiEngine(fake_engine_cmd, options={}).describe() != before
+    assert engine.proc is None
+
+
+def test_engine_errors_are_reported_not_faked(tmp_path):
+    kifu = _make_folder(tmp_path, 2)
+    pool = EnginePool(1, factory=lambda: UsiEngine(["/nonexistent/usi-engine"], options={}))
+    service = BatchAnnotationService(engine_pool=pool)
+    service.kifu_out = str(tmp_path / "out")
+    summary = service.annotate_folder(str(kifu), byoyomi_ms=10)
+    assert summary.errors == 2 and summary.annotated == 0
+    assert "cannot start engine" in summary.error_details[0]["reason"]
+
+    manifest = CheckpointManifest(str(tmp_path / "out" / MANIFEST_NAME)).load()
+    assert {e.status for e in manifest.entries.values()} == {"error"}
+
+
+def test_manifest_ignores_torn_last_line(tmp_path):
+    path = tmp_path / MANIFEST_NAME
+    manifest = CheckpointManifest(str(path))
+    manifest.record(CheckpointEntry(source="a.kif", size=10, mtime_ns=1, status="ok"))
+    manifest.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"source": "b.kif", "size": 2')
+
+    loaded = CheckpointManifest(str(path)).load()
+    assert loaded.is_done("a.kif", 10, 1) is not None
+    assert loaded.is_done("a.kif", 11, 1) is None
+    assert "b.kif" not in loaded.entries
+
+
+def test_atomic_write_json_replaces_existing(tmp_path):
+    target = tmp_path / "deep" / "x.json"
+    atomic_write_json(str(target), {"v": 1})
+    atomic_write_json(str(target), {"v": 2})
+    assert json.loads(target.read_text(encoding="utf-8")) == {"v": 2}
+    assert os.listdir(target.parent) == ["x.json"]
+
+
+def test_bulk_progress_rates():
+    p = BulkProgress(total_files=10, done=4, annotated=3, errors=1, plies=300, elapsed_s=2.0)
+    assert p.files_per_sec == 2.0
+    assert p.plies_per_sec == 150.0
+
+
+def test_cli_runs_without_importing_fastapi_app(fake_engine_cmd, tmp_path):
+    kifu = _make_folder(tmp_path, 2)
+    code = textwrap.dedent(f"""
+        import sys
+        from backend.services import annotate_batch
+        rc = annotate_batch.main(["--dir", {str(kifu)!r}, "--out", {str(tmp_path / 'out')!r},
+                                  "--workers", "2", "--byoyomi-ms", "10"])
+        assert "backend.api.main" not in sys.modules
+        assert "fastapi" not in sys.modules
+        sys.exit(rc)
+    """)
+    env = dict(os.environ, USI_CMD=" ".join(fake_engine_cmd), ENGINE_WORK_DIR="")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    assert json.loads(proc.stdout)["annotated"] == 2
+    assert "files/s" in proc.stderr
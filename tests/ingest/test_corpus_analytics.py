@@ -0,0 +1,127 @@
+"""
+test_corpus_analytics.py
+
+Corpus statistics over hand-made annotation outputs, in both the per-game
+JSON layout and the columnar store.
+"""
+
+import json
+
+import pytest
+
+from backend.services.corpus_analytics import (
+    blunder_rate_by_phase,
+    cached_frame,
+    corpus_report,
+    eval_loss_by_player,
+    label_win_rates,
+    load_corpus,
+    main,
+)
+from backend.services.corpus_store import CorpusWriter
+
+SHIKENBISHA = "7g7f 3c3d 6g6f 8c8d 2h6h 8d8e 8h7g 7a6b 5i4h 5a4b 4h3h 4b3b 3h2h 6a5b".split()
+
+
+def _notes(moves, deltas, first_ply=1):
+    return [{"ply": first_ply + i, "move": m, "delta_cp": d, "score_after_cp": 0}
+            for i, (m, d) in enumerate(zip(moves, deltas))]
+
+
+def _game(sente, gote, result, deltas, moves=SHIKENBISHA, start_sfen=None):
+    return {
+        "source_file": f"{sente}-{gote}-{result}.kif",
+        "start_sfen": start_sfen,
+        "metadata": {"sente": sente, "gote": gote, "result": result},
+        "annotation": {"notes": _notes(moves, deltas)},
+    }
+
+
+def _games():
+    quiet = [0] * len(SHIKENBISHA)
+    # Alice (sente) blunders twice at plies 1 and 3; Bob (gote) loses 40 at ply 2
+    noisy = [-200, -40, -300] + [0] * (len(SHIKENBISHA) - 3)
+    return [
+        _game("Alice", "Bob", "sente_win", quiet),
+        _game("Alice", "Bob", "gote_win", noisy),
+        _game("Carol", "Alice", "draw", quiet),
+    ]
+
+
+def _write_json(root, games):
+    for i, data in enumerate(games):
+        path = root / f"sub{i % 2}" / f"g{i}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def _write_store(root, games):
+    with CorpusWriter(str(root), chunk_rows=20) as writer:
+        for data in games:
+            writer.add_annotation(data)
+
+
+@pytest.mark.parametrize("layout", ["json", "columnar"])
+def test_report_is_the_same_for_both_layouts(tmp_path, layout):
+    if layout == "json":
+        _write_json(tmp_path, _games())
+    else:
+        _write_store(tmp_path / "corpus", _games())
+    frame = load_corpus(str(tmp_path))
+    assert frame.n_games == 3 and frame.n_plies == 3 * len(SHIKENBISHA)
+
+    phases = blunder_rate_by_phase(frame)
+    assert phases["序盤"] == {"moves": 3 * len(SHIKENBISHA), "blunders": 2,
+                             "rate": round(2 / (3 * len(SHIKENBISHA)), 4)}
+    assert phases["終盤"]["moves"] == 0 and phases["終盤"]["rate"] == 0.0
+
+    players = {row["player"]: row for row in eval_loss_by_player(frame)}
+    alice_moves = 7 * 3  # sente twice, gote once
+    assert players["Alice"]["moves"] == alice_moves
+    assert players["Alice"]["avg_loss_cp"] == round(500 / alice_moves, 1)
+    assert players["Bob"]["avg_loss_cp"] == round(40 / 14, 1)
+    assert players["Carol"]["blunder_rate"] == 0.0
+    assert [r["player"] for r in eval_loss_by_player(frame, player="Bob")] == ["Bob"]
+
+    openings = {row["label"]: row for row in label_win_rates(frame, "opening")}
+    assert openings["四間飛車"]["games"] == 3
+    assert (openings["四間飛車"]["wins"], openings["四間飛車"]["losses"], openings["四間飛車"]["draws"]) == (1, 1, 1)
+    assert openings["四間飛車"]["win_rate"] == 0.5
+    styles = {row["label"]: row["games"] for row in label_win_rates(frame, "style")}
+    assert sum(styles.values()) == 6
+
+
+def test_gote_to_move_start_flips_the_mover(tmp_path):
+    sfen = "lnsgkgsnl/1r5b1/ppppppppp/9/9/2P6/PP1PPPPPP/1B5R1/LNSGKGSNL w - 2"
+    game = _game("Alice", "Bob", "gote_win", [-500, 0], moves=["3c3d", "2g2f"], start_sfen=sfen)
+    _write_json(tmp_path, [game])
+    rows = {r["player"]: r for r in eval_loss_by_player(load_corpus(str(tmp_path), with_labels=False))}
+    assert rows["Bob"]["avg_loss_cp"] == 500.0 and rows["Alice"]["avg_loss_cp"] == 0.0
+
+
+def test_missing_scores_are_excluded(tmp_path):
+    game = _game("Alice", "Bob", None, [None, -300])
+    game["annotation"]["notes"] = game["annotation"]["notes"][:2]
+    _write_json(tmp_path, [game])
+    report = corpus_report(load_corpus(str(tmp_path)))
+    assert report["plies"] == 2 and report["evaluated_plies"] == 1
+    assert report["blunder_rate_by_phase"]["序盤"]["rate"] == 1.0
+    # an unknown result counts the game but not towards W/L/D
+    assert report["openings"][0]["games"] >= 1 and report["openings"][0]["win_rate"] == 0.0
+
+
+def test_cached_frame_reloads_when_outputs_change(tmp_path):
+    _write_json(tmp_path, _games()[:1])
+    first = cached_frame(str(tmp_path))
+    assert cached_frame(str(tmp_path)) is first
+    _write_json(tmp_path, _games())
+    assert cached_frame(str(tmp_path)).n_games == 3
+
+
+def test_cli_prints_report(tmp_path, capsys):
+    _write_store(tmp_path, _games())
+    assert main([str(tmp_path), "--player", "Carol", "--no-labels"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["games"] == 3
+    assert [r["player"] for r in report["eval_loss_by_player"]] == ["Carol"]
+    assert report["openings"] == []
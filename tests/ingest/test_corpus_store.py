@@ -0,0 +1,105 @@
+"""
+test_corpus_store.py
+
+Tests for the 16-bit move codec and the columnar corpus store.
+"""
+
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from backend.ingest.board import USI_SQUARES
+from backend.ingest.move_codec import NO_MOVE, decode_move, encode_move
+from backend.services.annotate_batch import BatchAnnotationService
+from backend.services.corpus_store import MISSING, CorpusReader, CorpusWriter
+
+
+def _notes(moves, base=0):
+    return [
+        {"ply": i + 1, "move": mv, "bestmove": "7g7f", "score_after_cp": base + i * 10,
+         "delta_cp": None if i == 0 else -5, "evidence": {"depth": 12}}
+        for i, mv in enumerate(moves)
+    ]
+
+
+def test_move_codec_round_trips_every_move_shape():
+    moves = [f"{a}{b}{p}" for a in USI_SQUARES for b in USI_SQUARES[::7] if a != b for p in ("", "+")]
+    moves += [f"{k}*{sq}" for k in "PLNSGBR" for sq in USI_SQUARES]
+    codes = [encode_move(m) for m in moves]
+    assert all(0 < c < 1 << 15 for c in codes)
+    assert len(set(codes)) == len(moves)
+    assert [decode_move(c) for c in codes] == moves
+    for bad in ("", "resign", "K*5e", "7g7", "0a1b", None):
+        assert encode_move(bad) == NO_MOVE
+    assert decode_move(NO_MOVE) == ""
+
+
+def test_writer_appends_chunks_and_reader_memory_maps(tmp_path):
+    root = str(tmp_path / "corpus")
+    with CorpusWriter(root, chunk_rows=4) as w:
+        g0 = w.add_game(_notes(["7g7f", "3c3d", "8h2b+"]), {"sente": "A", "result": "sente_win"}, source="a.kif")
+        g1 = w.add_game(_notes(["2g2f", "8c8d"]), {"sente": "B"}, source="b.kif")
+        assert w.pending_rows == 0  # 5 rows >= 4: first chunk already written
+        assert [gid for gid, _ in w.take_flushed()] == [g0, g1]
+        g2 = w.add_game(_notes(["P*5e"], base=100), source="c.kif")
+    assert (g0, g1, g2) == (0, 1, 2)
+    assert sorted(os.listdir(root)) == ["chunk-000000", "chunk-000001"]
+
+    r = CorpusReader(root)
+    assert len(r) == 6 and r.n_games == 3
+    assert isinstance(r.chunks[0].column("score_cp"), np.memmap)
+    assert r.column("ply").tolist() == [1, 2, 3, 1, 2, 1]
+    assert r.column("delta_cp")[0] == MISSING
+    assert r.game_moves(0) == ["7g7f", "3c3d", "8h2b+"]
+    assert r.game_moves(2) == ["P*5e"]
+    game = r.game(1)
+    assert game["score_cp"].tolist() == [0, 10]
+    assert game["info"]["sente"] == "B" and game["info"]["source"] == "b.kif"
+    assert [row["game_id"] for row in r.games()] == [0, 1, 2]
+
+    # reopening continues ids and chunk numbers; re-annotated sources hide the old copy
+    with CorpusWriter(root, chunk_rows=100) as w:
+        assert w.add_game(_notes(["7g7f"], base=500), source="a.kif") == 3
+    r = CorpusReader(root)
+    assert r.n_games == 3 and len(r) == 4
+    assert [row["game_id"] for row in r.games()] == [1, 2, 3]
+    assert 500 in r.column("score_cp").tolist() and 20 not in r.column("score_cp").tolist()
+
+
+def test_unflushed_games_are_invisible(tmp_path):
+    root = str(tmp_path / "corpus")
+    w = CorpusWriter(root, chunk_rows=1000)
+    w.add_game(_notes(["7g7f"]), source="a.kif")
+    assert len(CorpusReader(root)) == 0
+    assert w.take_flushed() == []
+    w.close()
+    assert len(CorpusReader(root)) == 1
+
+
+@patch('backend.services.annotate_batch.BatchAnnotationService._call_annotation_service')
+def test_annotate_folder_columnar_output(mock_annotate, tmp_path):
+    mock_annotate.side_effect = lambda moves, *a, **k: {"summary": "s", "notes": _notes(moves)}
+    kifu = tmp_path / "kifu"
+    kifu.mkdir()
+    for i in range(3):
+        (kifu / f"g{i}.usi").write_text("startpos moves 7g7f 3c3d 2g2f", encoding="utf-8")
+
+    service = BatchAnnotationService()
+    service.kifu_out = str(tmp_path / "out")
+    service.corpus_chunk_rows = 4
+    service.dedupe = False   # three copies of one game, stored as three
+    summary = service.annotate_folder(str(kifu), output_format="columnar", workers=2)
+    assert summary.annotated == 3
+    assert not list(Path(service.kifu_out).glob("*.json"))
+
+    r = CorpusReader(os.path.join(service.kifu_out, "corpus"))
+    assert r.n_games == 3 and len(r) == 9
+    assert sorted(Path(row["source"]).name for row in r.games()) == ["g0.usi", "g1.usi", "g2.usi"]
+    assert all(r.game_moves(row["game_id"]) == ["7g7f", "3c3d", "2g2f"] for row in r.games())
+
+    again = service.annotate_folder(str(kifu), output_format="columnar")
+    assert again.skipped == 3 and again.annotated == 0
@@ -0,0 +1,86 @@
+"""
+test_csa_parser.py
+
+Tests for the board-tracking CSA -> USI parser.
+"""
+
+from backend.ingest.csa_parser import parse_csa
+from backend.ingest.kif_parser import SENTE_WIN, GOTE_WIN, DRAW
+
+
+class TestParseCsa:
+    """Test cases for parse_csa"""
+
+    def test_promotion_capture_and_drop(self):
+        game = parse_csa("""V2.2
+N+Alice
+N-Bob
+$EVENT:Test Cup
+PI
++
++7776FU
+T3
+-3334FU
+T5
++8822UM
+-3122GI
++0045KA
+%TORYO
+""")
+        assert game.moves == ["7g7f", "3c3d", "8h2b+", "3a2b", "B*4e"]
+        assert game.headers["N+"] == "Alice"
+        assert game.headers["EVENT"] == "Test Cup"
+        assert game.start_sfen is None
+        assert game.result == SENTE_WIN  # gote to move resigned
+        assert game.end_reason == "%TORYO"
+        assert game.error is None
+
+    def test_comma_separated_statements_and_inline_time(self):
+        game = parse_csa("PI\n+\n+7776FU,T1\n-3334FU,T2\n%SENNICHITE\n")
+        assert game.moves == ["7g7f", "3c3d"]
+        assert game.result == DRAW
+
+    def test_side_to_move_line_is_not_a_move(self):
+        game = parse_csa("PI\n-\n-3334FU\n")
+        assert game.moves == ["3c3d"]
+        assert game.start_sfen.split()[1] == "w"
+
+    def test_pi_with_removed_pieces(self):
+        # 飛角落ち: gote's rook (82) and bishop (22) removed, gote moves first
+        game = parse_csa("PI82HI22KA\n-\n-3334FU\n")
+        assert game.start_sfen == "lnsgkgsnl/9/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL w - 1"
+        assert game.moves == ["3c3d"]
+
+    def test_board_rows_and_hand_placement(self):
+        game = parse_csa("""P1 *  *  *  *  * -KI * -KE-KY
+P2 *  *  *  *  *  *  * -OU *
+P3 *  *  *  *  *  * -FU-FU *
+P4 *  *  *  *  *  *  *  *  *
+P5 *  *  *  *  *  *  *  *  *
+P6 *  *  *  *  *  *  *  *  *
+P7 *  *  *  *  *  *  *  *  *
+P8 *  *  *  *  *  *  *  *  *
+P9 *  *  *  * +OU *  *  *  *
+P+00KI00GI
+P-00AL
++
++0032GI
+%TSUMI
+""")
+        assert game.start_sfen == "5g1nl/7k1/6pp1/9/9/9/9/9/4K4 b GS2r2b2g3s3n3l16p 1"
+        assert game.moves == ["S*3b"]
+        assert game.result == SENTE_WIN  # gote to move is mated
+
+    def test_illegal_action_names_the_loser(self):
+        game = parse_csa("PI\n+\n+7776FU\n%-ILLEGAL_ACTION\n")
+        assert game.result == SENTE_WIN
+        game = parse_csa("PI\n+\n%+ILLEGAL_ACTION\n")
+        assert game.result == GOTE_WIN
+
+    def test_piece_mismatch_stops_with_error(self):
+        game = parse_csa("PI\n+\n+7776FU\n-3334KA\n-3334FU\n")
+        assert game.moves == ["7g7f"]
+        assert game.error and "ply 2" in game.error
+
+    def test_no_position_defaults_to_hirate(self):
+        assert parse_csa("+2726FU\n-8384FU\n").moves == ["2g2f", "8c8d"]
@@ -0,0 +1,96 @@
+"""
+test_dedupe.py
+
+Duplicate-game detection: header-independent game keys, the SQLite index
+and BatchAnnotationService referencing copies instead of re-analysing them.
+"""
+
+import json
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+from backend.ingest.board import STARTPOS_SFEN
+from backend.services.annotate_batch import BatchAnnotationService
+from backend.services.corpus_analytics import iter_annotated_games
+from backend.services.dedupe import DEDUPE_NAME, DedupeIndex, game_keys
+
+MOVES = ["7g7f", "3c3d", "2g2f"]
+KIF = "\n".join(["先手：Alice", "後手：Bob", "手数----指手---------消費時間--",
+                 "   1 ７六歩(77)", "   2 ３四歩(33)", "   3 ２六歩(27)", "   4 投了", ""])
+
+
+def _notes(moves):
+    return [{"ply": i + 1, "move": mv, "bestmove": "7g7f", "score_after_cp": 10 * i,
+             "delta_cp": 0} for i, mv in enumerate(moves)]
+
+
+def test_game_keys_ignore_how_the_start_is_written():
+    a = game_keys(MOVES)
+    assert a == game_keys(MOVES, "startpos") == game_keys(MOVES, f"sfen {STARTPOS_SFEN}")
+    assert a.plies == 3
+    assert game_keys(MOVES[:2]).moves_hash != a.moves_hash
+    # a transposition reaches the same position through a different game
+    other = game_keys(["2g2f", "3c3d", "7g7f"])
+    assert other.final_hash == a.final_hash and other.moves_hash != a.moves_hash
+
+
+def test_claim_serialises_concurrent_copies(tmp_path):
+    index = DedupeIndex(str(tmp_path / DEDUPE_NAME))
+    keys = game_keys(MOVES)
+    assert index.claim(keys, "s1", "a.kif") is None
+
+    seen = []
+    waiter = threading.Thread(target=lambda: seen.append(index.claim(keys, "s1", "b.kif")))
+    waiter.start()
+    waiter.join(0.05)
+    assert waiter.is_alive()          # b.kif waits for a.kif's analysis
+    index.release(keys, "s1", "a.kif", output=None, success=True)
+    waiter.join(2)
+    assert seen[0].source == "a.kif"
+
+    assert index.claim(keys, "s2", "b.kif") is None     # other settings: not a duplicate
+    index.release(keys, "s2", "b.kif")                   # failed: nothing recorded
+    assert index.lookup(keys, "s2") is None
+    assert [e.source for e in index.games_ending_at(keys.final_hash)] == ["a.kif"]
+
+
+@patch('backend.services.annotate_batch.BatchAnnotationService._call_annotation_service')
+def test_copies_are_referenced_not_reanalysed(mock_annotate, tmp_path):
+    mock_annotate.side_effect = lambda moves, *a, **k: {"summary": "s", "notes": _notes(moves)}
+    kifu = tmp_path / "kifu"
+    (kifu / "export").mkdir(parents=True)
+    (kifu / "a.kif").write_text(KIF, encoding="utf-8")
+    (kifu / "b.usi").write_text("startpos moves " + " ".join(MOVES), encoding="utf-8")
+    (kifu / "export" / "c.kif").write_text(KIF.replace("Alice", "alice_2024"), encoding="utf-8")
+    (kifu / "other.usi").write_text("startpos moves 7g7f 3c3d", encoding="utf-8")
+
+    service = BatchAnnotationService()
+    service.kifu_out = str(tmp_path / "out")
+    summary = service.annotate_folder(str(kifu), workers=3)
+
+    assert mock_annotate.call_count == 2
+    assert (summary.annotated, summary.duplicates, summary.errors) == (2, 2, 0)
+    original = next(r for r in summary.results if r.success and not r.duplicate_of
+                    and r.move_count == 3)
+    assert sorted(Path(d["file"]).name for d in summary.duplicate_details) == \
+        sorted({"a.kif", "b.usi", "c.kif"} - {Path(original.file_path).name})
+    assert all(d["duplicate_of"] == original.file_path for d in summary.duplicate_details)
+
+    out = Path(service.kifu_out)
+    dup = Path(summary.duplicate_details[0]["file"]).relative_to(kifu).with_suffix(".json")
+    dup_json = json.loads((out / dup).read_text(encoding="utf-8"))
+    assert dup_json["duplicate_of"]["source_file"] == original.file_path
+    assert "annotation" not in dup_json
+    assert len(list(iter_annotated_games(str(out)))) == 2     # analytics count the game once
+
+    # rerun: the manifest skips everything; a lost original is analysed again
+    Path(original.output_path).unlink()
+    again = service.annotate_folder(str(kifu), workers=3)
+    assert mock_annotate.call_count == 3
+    assert (again.annotated, again.skipped, again.duplicates) == (1, 3, 0)
+
+    service.dedupe = False
+    (kifu / "d.usi").write_text("startpos moves " + " ".join(MOVES), encoding="utf-8")
+    third = service.annotate_folder(str(kifu))
+    assert (third.annotated, third.duplicates) == (1, 0)
@@ -0,0 +1,161 @@
+"""
+test_fetch_scheduler.py
+
+Rate-limited concurrent fetching from providers and the streaming
+provider -> annotation path, against the simulated-latency provider and the
+fake USI engine from test_bulk_annotate.
+"""
+
+import asyncio
+import json
+import sys
+
+import pytest
+
+from backend.ingest.providers.fetch_scheduler import (
+    FetchScheduler, RetryPolicy, TokenBucket, iter_fetched,
+)
+from backend.ingest.providers.simulated import SimulatedLatencyProvider
+from backend.services.annotate_batch import BatchAnnotationService, provider_output_name
+from tests.ingest.test_bulk_annotate import FAKE_ENGINE, _make_folder, _pool
+
+NO_WAIT = RetryPolicy(max_attempts=3, base_delay_s=0.001, max_delay_s=0.001, jitter=0.0)
+
+
+@pytest.fixture
+def fake_engine_cmd(tmp_path):
+    script = tmp_path / "fake_usi.py"
+    script.write_text(FAKE_ENGINE, encoding="utf-8")
+    return [sys.executable, str(script)]
+
+
+def _ids(kifu):
+    return sorted(str(p) for p in kifu.rglob("*.usi"))
+
+
+def test_concurrency_is_capped_by_provider_limits(tmp_path):
+    kifu = _make_folder(tmp_path, 12)
+    provider = SimulatedLatencyProvider(str(kifu), latency_s=0.02, concurrent_requests=3,
+                                        requests_per_minute=0)
+    scheduler = FetchScheduler(provider)
+    outcomes = list(iter_fetched(scheduler, _ids(kifu)))
+
+    assert sorted(o.game_id for o in outcomes) == _ids(kifu)
+    assert all(o.ok and o.content.usi_moves[:2] == ["7g7f", "3c3d"] for o in outcomes)
+    assert provider.max_in_flight == 3 and scheduler.stats.max_in_flight == 3
+    assert scheduler.stats.succeeded == 12 and scheduler.stats.requests == 12
+
+
+def test_token_bucket_paces_requests(tmp_path):
+    kifu = _make_folder(tmp_path, 6)
+    # 600/min = one request every 0.1s after a burst of 2
+    provider = SimulatedLatencyProvider(str(kifu), latency_s=0.0, concurrent_requests=2,
+                                        requests_per_minute=600)
+    list(iter_fetched(FetchScheduler(provider), _ids(kifu)))
+
+    times = provider.call_times
+    assert len(times) == 6
+    assert times[-1] - times[0] >= 0.35      # 4 paced tokens after the burst
+    assert times[1] - times[0] < 0.05
+
+
+def test_token_bucket_with_fake_clock():
+    now = [0.0]
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(round(seconds, 3))
+        now[0] += seconds
+
+    bucket = TokenBucket(60, burst=2, clock=lambda: now[0], sleep=fake_sleep)
+
+    async def take(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    asyncio.run(take(4))
+    assert slept == [1.0, 1.0]
+
+
+def test_transient_errors_are_retried_and_give_up(tmp_path):
+    kifu = _make_folder(tmp_path, 4)
+    flaky = SimulatedLatencyProvider(str(kifu), latency_s=0.0, failure_rate=0.5,
+                                     requests_per_minute=0, seed=3)
+    scheduler = FetchScheduler(flaky, retry=RetryPolicy(max_attempts=50, base_delay_s=0.001,
+                                                        max_delay_s=0.001), seed=1)
+    outcomes = list(iter_fetched(scheduler, _ids(kifu)))
+    assert all(o.ok for o in outcomes)
+    assert scheduler.stats.retries > 0
+    assert scheduler.stats.requests == 4 + scheduler.stats.retries
+
+    broken = SimulatedLatencyProvider(str(kifu), latency_s=0.0, failure_rate=1.0,
+                                      requests_per_minute=0)
+    scheduler = FetchScheduler(broken, retry=NO_WAIT)
+    outcomes = list(iter_fetched(scheduler, _ids(kifu)[:2] + [str(tmp_path / "missing.usi")]))
+    assert [o.attempts for o in outcomes] == [3, 3, 3]
+    assert all("TransientFetchError" in o.error for o in outcomes)
+    assert scheduler.stats.failed == 3
+
+
+def test_missing_games_and_non_retryable_errors_are_final(tmp_path):
+    kifu = _make_folder(tmp_path, 1)
+
+    class Provider(SimulatedLatencyProvider):
+        async def afetch(self, game_id):
+            if game_id == "boom":
+                raise ValueError("bad id")
+            return await super().afetch(game_id)
+
+    provider = Provider(str(kifu), latency_s=0.0, requests_per_minute=0)
+    scheduler = FetchScheduler(provider, retry=NO_WAIT)
+    outcomes = {o.game_id: o for o in iter_fetched(scheduler, ["boom", "nope.usi"])}
+    assert outcomes["boom"].error == "ValueError: bad id" and outcomes["boom"].attempts == 1
+    assert outcomes["nope.usi"].content is None and outcomes["nope.usi"].error is None
+    assert scheduler.stats.not_found == 1 and scheduler.stats.failed == 1
+
+
+def test_closing_the_stream_stops_fetching(tmp_path):
+    kifu = _make_folder(tmp_path, 20)
+    provider = SimulatedLatencyProvider(str(kifu), latency_s=0.01, concurrent_requests=2,
+                                        requests_per_minute=0)
+    stream = iter_fetched(FetchScheduler(provider), _ids(kifu), buffer=1)
+    next(stream)
+    stream.close()
+    assert provider.calls < 20
+
+
+def test_annotate_provider_streams_into_engines(fake_engine_cmd, tmp_path):
+    kifu = _make_folder(tmp_path, 6)
+    out = tmp_path / "out"
+    ids = _ids(kifu) + [str(tmp_path / "missing.usi")]
+    provider = SimulatedLatencyProvider(str(kifu), latency_s=0.01, concurrent_requests=3,
+                                        requests_per_minute=0)
+    updates = []
+
+    with _pool(fake_engine_cmd, 2) as pool:
+        service = BatchAnnotationService(engine_pool=pool)
+        service.kifu_out = str(out)
+        summary = service.annotate_provider(provider, ids, byoyomi_ms=10, workers=2,
+                                            progress_callback=lambda p: updates.append(p.done))
+        assert (summary.annotated, summary.errors, summary.total_files) == (6, 1, 7)
+        assert summary.error_details == [{"file": ids[-1], "reason": "Game not found"}]
+        assert updates == list(range(1, 8))
+
+        data = json.loads((out / "simulated" / provider_output_name(ids[0])).read_text(encoding="utf-8"))
+        assert data["source_file"] == ids[0]
+        assert data["metadata"]["source_format"] == "usi"
+        assert len(data["annotation"]["notes"]) == 3
+
+        # rerun: finished games are skipped before anything is fetched
+        calls = provider.calls
+        again = service.annotate_provider(provider, ids, byoyomi_ms=10, workers=2)
+        assert (again.annotated, again.skipped, again.errors) == (0, 6, 1)
+        assert provider.calls == calls + 1
+
+
+def test_provider_output_name_is_safe_and_unique():
+    a = provider_output_name("/x/y/alice vs bob.kif")
+    b = provider_output_name("/z/alice vs bob.kif")
+    assert a.startswith("alice_vs_bob-") and a.endswith(".json") and a != b
+    assert provider_output_name("https://example.com/games/").startswith("games-")
+    assert provider_output_name("???").startswith("game-")
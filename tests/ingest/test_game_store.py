@@ -0,0 +1,122 @@
+"""
+test_game_store.py
+
+Compact 16-bit game store: lossless round trips, zero-copy per-game views
+and the loader / dedupe / analytics paths reading it through mmap.
+"""
+
+import json
+import zipfile
+
+import pytest
+
+from backend.ingest.board import USI_SQUARES
+from backend.ingest.game_store import (
+    GameStoreReader, GameStoreWriter, encode_game, is_game_store, main, pack_games,
+)
+from backend.ingest.kifu_loader import KifuData, KifuMetadata
+from backend.services.corpus_analytics import iter_annotated_games
+from backend.services.corpus_store import MISSING
+from backend.services.dedupe import game_keys
+
+SFEN = "lnsgkgsnl/1r5b1/ppppppppp/9/9/2P6/PP1PPPPPP/1B5R1/LNSGKGSNL w - 2"
+KIF = "\n".join(["先手：Alice", "後手：Bob", "手数----指手---------消費時間--",
+                 "   1 ７六歩(77)", "   2 ３四歩(33)", "   3 ２六歩(27)", "   4 投了", ""])
+
+
+def test_round_trip_is_lossless(tmp_path):
+    every_shape = [f"{a}{b}" for a in USI_SQUARES[::5] for b in USI_SQUARES[::3] if a != b]
+    every_shape += [f"{a}{b}+" for a in USI_SQUARES[::11] for b in USI_SQUARES[::7] if a != b]
+    every_shape += [f"{p}*{s}" for p in "PLNSGBR" for s in USI_SQUARES[::4]]
+    path = tmp_path / "g.kgs"
+    with GameStoreWriter(str(path)) as w:
+        assert w.add(every_shape, meta={"sente": "先手さん"}) == 0
+        w.add([], start_sfen=SFEN)
+        w.add(["3c3d", "2g2f"], start_sfen=SFEN, meta={"result": "draw", "unused": None})
+
+    assert is_game_store(str(path)) and not is_game_store(str(tmp_path))
+    with GameStoreReader(str(path)) as r:
+        assert len(r) == 3 and r.n_moves == len(every_shape) + 2
+        assert r.moves(0) == every_shape and r.meta(0) == {"sente": "先手さん"}
+        assert r.moves(1) == [] and r.meta(1) == {"start_sfen": SFEN}
+        assert r.meta(2) == {"start_sfen": SFEN, "result": "draw"}
+        view = r.codes(2)
+        assert isinstance(view, memoryview) and view.obj is not None   # no copy
+        assert list(view) == list(encode_game(["3c3d", "2g2f"]))
+        with pytest.raises(IndexError):
+            r.codes(3)
+    assert path.stat().st_size < 2 * len(every_shape) + 400   # 2 bytes a move + header/index/meta
+
+
+def test_bad_tokens_and_files_are_rejected(tmp_path):
+    for bad in (["resign"], ["7g7f", ""], ["7g7f+x"]):
+        with pytest.raises(ValueError):
+            encode_game(bad)
+    junk = tmp_path / "junk.kgs"
+    junk.write_bytes(b"not a store at all, just text")
+    with pytest.raises(ValueError):
+        GameStoreReader(str(junk))
+
+    # an exception inside the writer leaves no partial file behind
+    with pytest.raises(ValueError):
+        with GameStoreWriter(str(tmp_path / "half.kgs")) as w:
+            w.add(["7g7f"])
+            w.add(["nope"])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["junk.kgs"]
+
+
+def test_pack_folder_and_archive_then_read_as_kifu(tmp_path):
+    src = tmp_path / "kifu"
+    src.mkdir()
+    (src / "a.kif").write_text(KIF, encoding="utf-8")
+    (src / "b.usi").write_text("startpos moves 7g7f 3c3d 8h2b+ 3a2b B*4e", encoding="utf-8")
+    with zipfile.ZipFile(src / "more.zip", "w") as z:
+        z.writestr("c.csa", "N+Carol\nN-Dave\n+7776FU\n-3334FU\n%TORYO\n")
+
+    out = tmp_path / "games.kgs"
+    stats = pack_games(str(src), str(out))
+    assert (stats.games, stats.moves, stats.skipped) == (3, 10, 0)
+
+    with GameStoreReader(str(out)) as r:
+        games = {d.metadata.source_path.rsplit("/", 1)[-1]: d for d in r.iter_kifu_data()}
+    assert isinstance(games["a.kif"], KifuData)
+    assert games["a.kif"].metadata == KifuMetadata(
+        sente="Alice", gote="Bob", result="sente_win", source_format="kif",
+        source_path=str(src / "a.kif"))
+    assert games["b.usi"].usi_moves == ["7g7f", "3c3d", "8h2b+", "3a2b", "B*4e"]
+    assert games["more.zip!c.csa"].metadata.sente == "Carol"
+
+    records = {r.source.rsplit("/", 1)[-1]: r for r in iter_annotated_games(str(out))}
+    assert records["b.usi"].moves[2] == "8h2b+" and records["a.kif"].result == "sente_win"
+    assert records["a.kif"].ply == [1, 2, 3] and set(records["a.kif"].delta_cp) == {MISSING}
+
+
+def test_pack_skips_illegal_games(tmp_path):
+    src = tmp_path / "kifu"
+    src.mkdir()
+    (src / "ok.usi").write_text("startpos moves 7g7f 3c3d", encoding="utf-8")
+    (src / "bad.usi").write_text("startpos moves 7g7f 3c3d 7f7d", encoding="utf-8")
+    stats = pack_games(str(src), str(tmp_path / "games.kgs"))
+    assert (stats.games, stats.skipped) == (1, 1)
+    assert "move 3 7f7d" in stats.errors[0]
+
+
+def test_dedupe_keys_from_codes_match_strings(tmp_path):
+    path = tmp_path / "g.kgs"
+    with GameStoreWriter(str(path)) as w:
+        w.add(["7g7f", "3c3d", "2g2f"])
+        w.add(["3c3d", "2g2f"], start_sfen=SFEN)
+    with GameStoreReader(str(path)) as r:
+        assert game_keys(r.codes(0)) == game_keys(["7g7f", "3c3d", "2g2f"], "startpos")
+        assert game_keys(r.codes(1), r.game(1).start_sfen) == game_keys(["3c3d", "2g2f"], SFEN)
+
+
+def test_cli_pack_and_info(tmp_path, capsys):
+    src = tmp_path / "kifu"
+    src.mkdir()
+    (src / "a.kif").write_text(KIF, encoding="utf-8")
+    out = tmp_path / "games.kgs"
+    assert main(["pack", str(src), str(out)]) == 0
+    assert json.loads(capsys.readouterr().out)["games"] == 1
+    assert main(["info", str(out)]) == 0
+    assert json.loads(capsys.readouterr().out)["moves"] == 3
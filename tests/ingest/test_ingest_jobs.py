@@ -0,0 +1,188 @@
+"""
+test_ingest_jobs.py
+
+Background annotation jobs: queue bounds, cancellation, SQLite history and
+restart recovery, plus the /ingest router on top. Jobs run on the fake USI
+engine from test_bulk_annotate.
+"""
+
+import json
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.services import ingest_jobs
+from backend.services.annotate_batch import BatchAnnotationService
+from backend.services.ingest_jobs import (
+    CANCELLED, QUEUED, RUNNING, SUCCEEDED, Job, JobManager, JobQueueFull, JobStore,
+)
+from tests.ingest.test_bulk_annotate import FAKE_ENGINE, _make_folder, _pool
+
+SLOW_ENGINE = FAKE_ENGINE.replace('elif cmd.startswith("go"):',
+                                  'elif cmd.startswith("go"):\n        import time; time.sleep(0.03)')
+
+
+@pytest.fixture
+def slow_engine_cmd(tmp_path):
+    script = tmp_path / "slow_usi.py"
+    script.write_text(SLOW_ENGINE, encoding="utf-8")
+    return [sys.executable, str(script)]
+
+
+@pytest.fixture
+def fake_engine_cmd(tmp_path):
+    script = tmp_path / "fake_usi.py"
+    script.write_text(FAKE_ENGINE, encoding="utf-8")
+    return [sys.executable, str(script)]
+
+
+def _factory(pool):
+    def make(out_dir):
+        service = BatchAnnotationService(engine_pool=pool)
+        service.kifu_out = out_dir
+        return service
+    return make
+
+
+def _wait(manager, job_id, statuses, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job.status in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} still {manager.get(job_id).status}")
+
+
+def _params(kifu, out, **extra):
+    return dict({"dir": str(kifu), "out_dir": str(out), "workers": 2}, **extra)
+
+
+def test_job_runs_and_history_survives_restart(slow_engine_cmd, tmp_path):
+    kifu = _make_folder(tmp_path, 4)
+    db = tmp_path / "jobs.sqlite3"
+    with _pool(slow_engine_cmd, 2) as pool:
+        manager = JobManager(JobStore(str(db)), service_factory=_factory(pool)).start()
+        job = manager.submit(_params(kifu, tmp_path / "out"))
+        done = _wait(manager, job.id, {SUCCEEDED})
+        manager.stop()
+    assert done.summary["annotated"] == 4 and done.progress.done == 4
+    assert done.progress.eta_s == 0.0 and done.progress.plies_per_sec > 0
+
+    reopened = JobStore(str(db))
+    stored = reopened.get(job.id)
+    assert stored.status == SUCCEEDED and stored.attempts == 1
+    assert stored.progress.annotated == 4
+    assert [j.id for j in reopened.list(status=SUCCEEDED)] == [job.id]
+
+
+def test_full_queue_is_rejected_and_queued_job_can_be_cancelled(tmp_path):
+    manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite3")), max_queue=2)  # not started
+    first = manager.submit(_params(tmp_path, tmp_path / "out"))
+    manager.submit(_params(tmp_path, tmp_path / "out"))
+    with pytest.raises(JobQueueFull):
+        manager.submit(_params(tmp_path, tmp_path / "out"))
+
+    assert manager.cancel(first.id).status == CANCELLED
+    assert manager.queued == 1
+    assert manager.store.get(first.id).status == CANCELLED
+    manager.submit(_params(tmp_path, tmp_path / "out"))  # room again
+
+
+def test_running_job_stops_after_cancel_and_keeps_checkpoints(slow_engine_cmd, tmp_path):
+    kifu = _make_folder(tmp_path, 12)
+    out = tmp_path / "out"
+    with _pool(slow_engine_cmd, 1) as pool:
+        manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite3")), service_factory=_factory(pool)).start()
+        job = manager.submit(_params(kifu, out, workers=1))
+        deadline = time.monotonic() + 20
+        while manager.get(job.id).progress.done < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        manager.cancel(job.id)
+        assert manager.store.get(job.id).cancel_requested
+        stopped = _wait(manager, job.id, {CANCELLED})
+        assert stopped.summary["cancelled"] and 1 <= stopped.progress.done < 12
+
+        # a new job over the same folder only does what is left
+        rest = manager.submit(_params(kifu, out))
+        finished = _wait(manager, rest.id, {SUCCEEDED})
+        manager.stop()
+    assert finished.summary["skipped"] == stopped.summary["annotated"]
+    assert finished.summary["annotated"] + finished.summary["skipped"] == 12
+
+
+def test_unfinished_jobs_are_resumed_on_start(fake_engine_cmd, tmp_path):
+    kifu = _make_folder(tmp_path, 2)
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    # left behind by a process that died mid-run
+    store.save(Job(id="crashed", status=RUNNING, params=_params(kifu, tmp_path / "out"),
+                   created_at="2024-01-01T00:00:00", attempts=1))
+    store.save(Job(id="waiting", status=QUEUED, params=_params(kifu, tmp_path / "out2"),
+                   created_at="2024-01-01T00:00:01"))
+    with _pool(fake_engine_cmd, 2) as pool:
+        manager = JobManager(store, workers=2, service_factory=_factory(pool)).start()
+        crashed = _wait(manager, "crashed", {SUCCEEDED})
+        waiting = _wait(manager, "waiting", {SUCCEEDED})
+        manager.stop()
+    assert crashed.attempts == 2 and waiting.attempts == 1
+    assert crashed.summary["annotated"] == 2
+
+
+def test_restart_rebuilds_the_queue_and_keeps_cancels(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    store.save(Job(id="waiting", status=QUEUED, params=_params(tmp_path, tmp_path / "out"),
+                   created_at="2024-01-01T00:00:00"))
+    # cancelled while running, then the process died before the job stopped
+    store.save(Job(id="cancelled", status=RUNNING, params=_params(tmp_path, tmp_path / "out2"),
+                   created_at="2024-01-01T00:00:01", attempts=1, cancel_requested=True))
+    manager = JobManager(store)
+    manager._worker = lambda: None      # no workers: only the queue is under test
+    manager.start()
+    manager.stop()
+    manager.start()
+    assert manager.queued == 1
+    assert store.get("cancelled").status == CANCELLED and manager.get("waiting").status == QUEUED
+    manager.stop()
+
+
+def test_router_submit_poll_and_events(fake_engine_cmd, tmp_path, monkeypatch):
+    from backend.api.main import app
+
+    kifu = _make_folder(tmp_path, 3)
+    monkeypatch.setenv("KIFU_DIR", str(tmp_path / "inbox"))
+    monkeypatch.setenv("INGEST_ALLOWED_DIRS", str(kifu))
+    monkeypatch.setenv("KIFU_OUT", str(tmp_path / "out"))
+    with _pool(fake_engine_cmd, 2) as pool:
+        manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite3")), service_factory=_factory(pool)).start()
+        monkeypatch.setattr(ingest_jobs, "_MANAGER", manager)
+        client = TestClient(app)
+
+        bad = client.post("/ingest/annotate/folder", json={"dir": str(kifu), "out": "../elsewhere"})
+        assert bad.status_code == 400
+        assert client.post("/ingest/annotate/folder", json={"dir": str(kifu / "nope")}).status_code == 400
+        # folders outside KIFU_DIR / INGEST_ALLOWED_DIRS are refused, with or without ".."
+        for outside in (str(tmp_path), "../", str(kifu) + "/../out"):
+            assert client.post("/ingest/annotate/folder", json={"dir": outside}).status_code == 400
+        assert client.get("/ingest/folder/stats", params={"dir": "/etc"}).status_code == 400
+
+        res = client.post("/ingest/annotate/folder", json={"dir": str(kifu), "out": "run1"})
+        assert res.status_code == 202
+        job_id = res.json()["id"]
+        assert res.json()["params"]["out_dir"] == str(tmp_path / "out" / "run1")
+
+        with client.stream("GET", f"/ingest/jobs/{job_id}/events") as stream:
+            body = "".join(stream.iter_text())
+        events = [block for block in body.split("\n\n") if block.startswith("event:")]
+        assert events[-1].startswith("event: end")
+        final = json.loads(events[-1].split("data: ", 1)[1])
+        assert final["status"] == SUCCEEDED and final["progress"]["done"] == 3
+        assert final["progress"]["duplicates"] == 0 and final["summary"]["duplicates"] == 0
+
+        assert client.get(f"/ingest/jobs/{job_id}").json()["summary"]["annotated"] == 3
+        listing = client.get("/ingest/jobs").json()
+        assert [j["id"] for j in listing["jobs"]] == [job_id] and listing["queued"] == 0
+        assert client.get("/ingest/jobs/unknown").status_code == 404
+        assert client.post(f"/ingest/jobs/{job_id}/cancel").json()["status"] == SUCCEEDED
+        manager.stop()
@@ -0,0 +1,136 @@
+"""
+test_kif_parser.py
+
+Tests for the board-tracking KIF -> USI parser.
+"""
+
+import pytest
+
+from backend.ingest.board import Board, IllegalMoveError, STARTPOS_SFEN
+from backend.ingest.kif_parser import (
+    parse_kif,
+    SENTE_WIN,
+    GOTE_WIN,
+    DRAW,
+    HANDICAP_SFENS,
+)
+
+
+def _kif(*moves: str, header: str = "") -> str:
+    body = "\n".join(f"{i:>4} {m}" for i, m in enumerate(moves, 1))
+    return f"{header}手数----指手---------消費時間--\n{body}\n"
+
+
+class TestBoard:
+    """Test cases for the compact board"""
+
+    def test_sfen_round_trip(self):
+        sfen = "ln1gk2nl/6g2/p2pppspp/2p3p2/7P1/1rP6/P2PPPP1P/2G3SR1/LN2KG1NL b BSPbsp 1"
+        assert Board.from_sfen(sfen).sfen() == sfen
+        assert Board.from_sfen("startpos").sfen() == STARTPOS_SFEN
+
+    def test_push_usi_capture_goes_to_hand(self):
+        board = Board.from_sfen("startpos")
+        for move in ["7g7f", "3c3d", "8h2b+"]:
+            board.push_usi(move)
+        assert board.sfen() == "lnsgkgsnl/1r5+B1/pppppp1pp/6p2/9/2P6/PP1PPPPPP/7R1/LNSGKGSNL w B 4"
+
+    def test_push_usi_rejects_wrong_color(self):
+        board = Board.from_sfen("startpos")
+        with pytest.raises(IllegalMoveError):
+            board.push_usi("3c3d")
+
+    def test_push_usi_rejects_drop_without_hand(self):
+        with pytest.raises(IllegalMoveError):
+            Board.from_sfen("startpos").push_usi("P*5e")
+
+
+class TestParseKif:
+    """Test cases for parse_kif"""
+
+    def test_same_square_drop_and_promotion(self):
+        game = parse_kif(_kif(
+            "７六歩(77)", "３四歩(33)", "２二角成(88)", "同　銀(31)", "４五角打", "投了",
+        ))
+        assert game.moves == ["7g7f", "3c3d", "8h2b+", "3a2b", "B*4e"]
+        assert game.result == SENTE_WIN
+        assert game.end_reason == "投了"
+        assert game.error is None
+
+    def test_non_promotion_and_omitted_drop(self):
+        game = parse_kif(_kif(
+            "７六歩(77)", "３四歩(33)", "２二角不成(88)", "同　銀(31)", "５五角",
+        ))
+        assert game.moves == ["7g7f", "3c3d", "8h2b", "3a2b", "B*5e"]
+
+    def test_relative_disambiguation_without_suffix(self):
+        # 後手の金は 6a / 4a の 2 枚とも 5b に利く。後手から見た「右」は 6a
+        game = parse_kif(_kif("７六歩", "５二金右", "２六歩", "４二金寄"))
+        assert game.moves == ["7g7f", "6a5b", "2g2f", "5b4b"]
+
+    def test_relative_up_and_straight(self):
+        sfen_header = (
+            "後手の持駒：なし\n"
+            "+---------------------------+\n"
+            "| ・ ・ ・ ・v玉 ・ ・ ・ ・|一\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|二\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|三\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|四\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|五\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|六\n"
+            "| ・ ・ ・ 金 ・ 金 ・ ・ ・|七\n"
+            "| ・ ・ ・ ・ 金 ・ ・ ・ ・|八\n"
+            "| ・ ・ ・ ・ 玉 ・ ・ ・ ・|九\n"
+            "+---------------------------+\n"
+            "先手の持駒：なし\n"
+        )
+        assert parse_kif(_kif("５七金直", header=sfen_header)).moves == ["5h5g"]
+        assert parse_kif(_kif("５七金右", header=sfen_header)).moves == ["4g5g"]
+        assert parse_kif(_kif("５七金左", header=sfen_header)).moves == ["6g5g"]
+
+    def test_handicap_preset_starts_with_gote(self):
+        game = parse_kif(_kif("３四歩(33)", "７六歩(77)", header="手合割：香落ち\n"))
+        assert game.start_sfen == HANDICAP_SFENS["香落ち"]
+        assert game.moves == ["3c3d", "7g7f"]
+
+    def test_bod_start_position(self):
+        header = (
+            "後手の持駒：なし\n"
+            "  ９ ８ ７ ６ ５ ４ ３ ２ １\n"
+            "+---------------------------+\n"
+            "| ・ ・ ・ ・ ・ ・ ・v桂v香|一\n"
+            "| ・ ・ ・ ・ ・ ・ ・v玉 ・|二\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|三\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|四\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|五\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|六\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|七\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|八\n"
+            "| ・ ・ ・ ・ ・ ・ ・ ・ ・|九\n"
+            "+---------------------------+\n"
+            "先手の持駒：金　銀二\n"
+        )
+        game = parse_kif(_kif("２三金打", "詰み", header=header))
+        assert game.start_sfen == "7nl/7k1/9/9/9/9/9/9/9 b G2S 1"
+        assert game.moves == ["G*2c"]
+        assert game.result == SENTE_WIN  # 詰み is a loss for the side to move (gote)
+
+    def test_variation_block_is_ignored(self):
+        text = _kif("７六歩(77)", "３四歩(33)") + "\n変化：2手\n   2 ８四歩(83)\n"
+        assert parse_kif(text).moves == ["7g7f", "3c3d"]
+
+    def test_summary_line_sets_draw(self):
+        game = parse_kif(_kif("７六歩(77)") + "まで1手で千日手\n")
+        assert game.result == DRAW
+        game = parse_kif(_kif("７六歩(77)") + "まで1手で後手の勝ち\n")
+        assert game.result == GOTE_WIN
+
+    def test_illegal_move_stops_with_error(self):
+        game = parse_kif(_kif("７六歩(77)", "７五歩(76)", "３四歩(33)"))
+        assert game.moves == ["7g7f"]
+        assert game.error and "ply 2" in game.error
+
+    def test_same_without_previous_move(self):
+        game = parse_kif(_kif("同　歩(77)"))
+        assert game.moves == []
+        assert game.error is not None
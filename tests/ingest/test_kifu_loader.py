@@ -13,10 +13,12 @@ from unittest.mock import patch, mock_open
 import sys
 sys.path.insert(0, '/home/jimjace/Shogi_AI_Learning')
 
+from backend.ingest.board import Board
 from backend.ingest.kifu_loader import (
     KifuLoader, 
     load_kifu_file, 
     scan_kifu_directory, 
+    iter_kifu_files,
     validate_usi_moves,
     KifuData,
     KifuMetadata
@@ -92,10 +94,19 @@ class TestKifuLoader:
         assert result == "P*5e"
 
     def test_csa_to_usi_promotion(self):
-        """Test CSA to USI conversion with promotion"""
-        # This is a simplified test - real CSA promotion is more complex
-        result = KifuLoader._csa_to_usi("+7776FUTO")
-        assert result == "7g7f+"  # Basic promotion detection
+        """Test CSA to USI conversion with promotion decided from the board"""
+        board = Board.from_sfen("startpos")
+        assert KifuLoader._csa_to_usi("+7776FU", board) == "7g7f"
+        assert KifuLoader._csa_to_usi("-3334FU", board) == "3c3d"
+        # CSA only names the piece after the move: KA on 88 becoming UM is a promotion
+        assert KifuLoader._csa_to_usi("+8822UM", board) == "8h2b+"
+        # ... while a piece whose code does not change is not
+        assert KifuLoader._csa_to_usi("-3122GI", board) == "3a2b"
+        assert KifuLoader._csa_to_usi("+0045KA", board) == "B*4e"
+
+    def test_csa_to_usi_promoted_code_without_board(self):
+        """Without a board a promoted piece code is ambiguous"""
+        assert KifuLoader._csa_to_usi("+8822UM") is None
 
     @patch("builtins.open", new_callable=mock_open, read_data="startpos moves 7g7f 3c3d")
     def test_parse_usi_file(self, mock_file):
@@ -127,7 +138,7 @@ $GOTE:Player2
         assert result.metadata.sente == "Player1"
         assert result.metadata.gote == "Player2"
         assert result.metadata.source_format == "csa"
-        assert len(result.usi_moves) == 3
+        assert result.usi_moves == ["7g7f", "3c3d", "2g2f"]
 
     @patch("builtins.open", new_callable=mock_open, read_data="""\
 先手：テスト太郎
@@ -144,8 +155,17 @@ $GOTE:Player2
         assert result.metadata.sente == "テスト太郎"
         assert result.metadata.gote == "将棋花子"
         assert result.metadata.source_format == "kif"
-        # Note: KIF parsing is simplified and returns placeholder moves
-        assert isinstance(result.usi_moves, list)
+        assert result.usi_moves == ["7g7f", "3c3d"]
+        assert result.start_sfen is None
+
+    def test_load_sample_kif_file(self):
+        """Test the bundled sample KIF converts to real USI with result"""
+        sample = Path(__file__).resolve().parents[2] / "data" / "kifu" / "sample_game.kif"
+        result = load_kifu_file(str(sample))
+        assert result.usi_moves == ["7g7f", "3c3d", "2g2f", "8c8d", "2f2e", "8d8e"]
+        assert result.metadata.result == "gote_win"
+        valid, errors = validate_usi_moves(result.usi_moves)
+        assert valid, errors
 
 
 class TestUtilityFunctions:
@@ -165,6 +185,16 @@ class TestUtilityFunctions:
         assert valid is False
         assert len(errors) == 3  # invalid, empty, xyz
 
+    def test_validate_usi_moves_legal(self):
+        """Test legality validation replays the game"""
+        assert validate_usi_moves(["7g7f", "3c3d", "8h2b+", "3a2b", "B*4e"], legal=True) == (True, [])
+        valid, errors = validate_usi_moves(["7g7f", "3c3d", "2h2c"], legal=True)
+        assert valid is False
+        assert errors == ["Move 3 2h2c: R on 2h cannot move to 2c"]
+        # format-valid moves that would be illegal from startpos pass without legal=True
+        assert validate_usi_moves(["P*5e"])[0] is True
+        assert validate_usi_moves(["P*5e"], start_sfen="sfen 4k4/9/9/9/9/9/9/9/4K4 b P 1", legal=True)[0] is True
+
     def test_validate_usi_moves_empty(self):
         """Test USI move validation with empty list"""
         moves = []
@@ -208,6 +238,22 @@ class TestUtilityFunctions:
             result_no_recursive = scan_kifu_directory(temp_dir, recursive=False)
             assert len(result_no_recursive) == 1
 
+    def test_iter_kifu_files_reports_size_and_mtime(self):
+        """scandir-based walk returns stat data with each Kifu file"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            nested = Path(temp_dir, "a", "b")
+            nested.mkdir(parents=True)
+            Path(nested, "deep.KIF").write_text("abc", encoding="utf-8")
+            Path(temp_dir, "top.usi").write_text("startpos", encoding="utf-8")
+            Path(temp_dir, "notes.txt").write_text("x", encoding="utf-8")
+            Path(temp_dir, "dir.kif").mkdir()  # a directory named like a kifu file
+
+            entries = {Path(e.path).name: e for e in iter_kifu_files(temp_dir)}
+            assert set(entries) == {"deep.KIF", "top.usi"}
+            assert entries["deep.KIF"].size == 3
+            assert entries["top.usi"].mtime_ns == os.stat(Path(temp_dir, "top.usi")).st_mtime_ns
+            assert [Path(e.path).name for e in iter_kifu_files(temp_dir, recursive=False)] == ["top.usi"]
+
 
 class TestIntegration:
     """Integration tests for file loading"""
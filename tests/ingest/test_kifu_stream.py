@@ -0,0 +1,146 @@
+"""
+test_kifu_stream.py
+
+Tests for the streaming multi-game / archive kifu reader.
+"""
+
+import gzip
+import io
+import tarfile
+import zipfile
+from pathlib import Path
+
+from backend.ingest.kifu_stream import (
+    iter_games,
+    iter_text_lines,
+    sniff_encoding,
+    split_games,
+)
+
+KIF_GAME = """先手：テスト太郎
+後手：将棋花子
+手数----指手---------消費時間--
+   1 ７六歩(77)   ( 0:01/00:00:01)
+   2 ３四歩(33)   ( 0:01/00:00:02)
+   3 投了
+まで2手で後手の勝ち
+"""
+
+CSA_TWO_GAMES = """V2.2
+N+Alice
+N-Bob
+PI
++
++7776FU
+-3334FU
+%TORYO
+/
+V2.2
+N+Carol
+N-Dave
+PI
++
++2726FU
+%TORYO
+"""
+
+
+class TestEncoding:
+    """Test cases for encoding sniffing"""
+
+    def test_sniff_utf8_and_bom(self):
+        assert sniff_encoding("先手：a".encode("utf-8")) == "utf-8"
+        assert sniff_encoding(b"\xef\xbb\xbf" + "先手".encode("utf-8")) == "utf-8-sig"
+
+    def test_sniff_shift_jis(self):
+        assert sniff_encoding(KIF_GAME.encode("cp932")) == "cp932"
+
+    def test_sniff_directive(self):
+        assert sniff_encoding(b"#KIF version=2.0 encoding=Shift_JIS\n") == "cp932"
+
+    def test_iter_text_lines_handles_chunk_boundaries(self):
+        # > 64KB of Shift_JIS so multibyte characters straddle read chunks
+        text = "".join(f"{i} 先手：棋士{i}\n" for i in range(20000))
+        lines = list(iter_text_lines(io.BytesIO(text.encode("cp932"))))
+        assert len(lines) == 20000
+        assert lines[12345] == "12345 先手：棋士12345"
+
+
+class TestSplitGames:
+    """Test cases for game splitting"""
+
+    def test_csa_slash_separator(self):
+        chunks = list(split_games(CSA_TWO_GAMES.splitlines(), "csa"))
+        assert len(chunks) == 2
+        assert "N+Carol" in chunks[1]
+
+    def test_concatenated_kif(self):
+        chunks = list(split_games((KIF_GAME + KIF_GAME).splitlines(), "kif"))
+        assert len(chunks) == 2
+        assert chunks[1][0].startswith("先手")
+
+
+class TestIterGames:
+    """Test cases for iter_games over files and archives"""
+
+    def test_shift_jis_kif_file(self, tmp_path: Path):
+        path = tmp_path / "game.kif"
+        path.write_bytes(KIF_GAME.encode("cp932"))
+        games = list(iter_games(str(path)))
+        assert len(games) == 1
+        assert games[0].data.usi_moves == ["7g7f", "3c3d"]
+        assert games[0].data.metadata.sente == "テスト太郎"
+        assert games[0].data.metadata.result == "gote_win"
+
+    def test_multi_game_csa_file(self, tmp_path: Path):
+        path = tmp_path / "games.csa"
+        path.write_text(CSA_TWO_GAMES, encoding="utf-8")
+        games = list(iter_games(str(path)))
+        assert [g.index for g in games] == [0, 1]
+        assert games[0].data.usi_moves == ["7g7f", "3c3d"]
+        assert games[1].data.usi_moves == ["2g2f"]
+
+    def test_usi_one_game_per_line(self, tmp_path: Path):
+        path = tmp_path / "games.usi"
+        path.write_text("startpos moves 7g7f 3c3d\nstartpos moves 2g2f\n", encoding="utf-8")
+        assert [g.data.usi_moves for g in iter_games(str(path))] == [["7g7f", "3c3d"], ["2g2f"]]
+
+    def test_zip_archive(self, tmp_path: Path):
+        path = tmp_path / "bundle.zip"
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.writestr("a/game1.kif", KIF_GAME.encode("cp932"))
+            zf.writestr("a/games.csa", CSA_TWO_GAMES)
+            zf.writestr("README.txt", "not a kifu")
+        games = list(iter_games(str(path)))
+        assert len(games) == 3
+        assert games[0].source.endswith("bundle.zip!a/game1.kif")
+        assert all(g.error is None for g in games)
+
+    def test_tar_gz_archive(self, tmp_path: Path):
+        path = tmp_path / "bundle.tar.gz"
+        with tarfile.open(path, "w:gz") as tf:
+            for name, payload in (("g1.kif", KIF_GAME.encode("utf-8")),
+                                  ("g2.kif", KIF_GAME.encode("cp932"))):
+                info = tarfile.TarInfo(name)
+                info.size = len(payload)
+                tf.addfile(info, io.BytesIO(payload))
+        games = list(iter_games(str(path)))
+        assert [g.data.usi_moves for g in games] == [["7g7f", "3c3d"]] * 2
+
+    def test_gzip_single_file_and_directory(self, tmp_path: Path):
+        with gzip.open(tmp_path / "game.kif.gz", "wb") as f:
+            f.write(KIF_GAME.encode("utf-8"))
+        (tmp_path / "other.csa").write_text(CSA_TWO_GAMES, encoding="utf-8")
+        (tmp_path / "notes.txt").write_text("ignored", encoding="utf-8")
+        games = list(iter_games(str(tmp_path)))
+        assert len(games) == 3
+
+    def test_broken_game_does_not_stop_stream(self, tmp_path: Path):
+        broken = KIF_GAME.replace("３四歩(33)", "３四歩(99)")
+        path = tmp_path / "two.kif"
+        path.write_text(broken + KIF_GAME, encoding="utf-8")
+        games = list(iter_games(str(path)))
+        assert len(games) == 2
+        assert games[0].error is not None
+        assert games[0].data.usi_moves == ["7g7f"]
+        assert games[1].error is None
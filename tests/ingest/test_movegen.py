@@ -0,0 +1,101 @@
+"""
+Move generation: perft counts against published references, check /
+evasion generation (drop rules, forced promotion, pins and discovered
+checks), single-move legality with reasons, whole-game validation, and
+make/unmake round trips.
+"""
+
+import pytest
+
+from backend.ingest.board import Board, IllegalMoveError
+from backend.ingest.move_codec import decode_moves
+from backend.ingest.movegen import (BENCH_POSITIONS, check_move, check_moves, evasions, is_legal, legal_moves,
+                                    make_move, perft, unmake_move, validate_game)
+
+
+def _checks(sfen):
+    return sorted(decode_moves(check_moves(Board.from_sfen(sfen))))
+
+
+def _evasions(sfen):
+    return sorted(decode_moves(evasions(Board.from_sfen(sfen))))
+
+
+def test_drop_rules():
+    # nifu: a sente pawn already stands on file 5
+    assert "P*5b" not in _checks("sfen 4k4/9/9/9/9/9/4P4/9/K8 b P 1")
+    assert _checks("sfen 4k4/9/9/9/9/9/9/9/K8 b P 1") == ["P*5b"]
+    # no knight drop on the last two ranks, no lance drop on the last
+    assert _checks("sfen 9/4k4/9/9/9/9/9/9/K8 b N 1") == ["N*4d", "N*6d"]
+    assert _checks("sfen 9/4k4/9/9/9/9/9/9/K8 b L 1") == ["L*5c", "L*5d", "L*5e", "L*5f", "L*5g", "L*5h", "L*5i"]
+    # uchifuzume is illegal, the same drop without mate is not
+    assert "P*1b" not in _checks("sfen 7lk/7p1/8L/9/9/9/9/9/K8 b P 1")
+    assert "P*1b" in _checks("sfen 8k/7p1/8L/9/9/9/9/9/K8 b P 1")
+
+
+def test_promotion_and_discovered_checks():
+    # a knight landing on the second rank must promote
+    assert _checks("sfen 4k4/9/9/5N3/9/9/9/9/K8 b - 1") == ["4d5b+"]
+    # moving off the rook's line discovers check, sliding along it does not
+    assert _checks("sfen 4k4/9/9/9/4S4/9/9/9/K3R4 b - 1") == ["5e4d", "5e4f", "5e6d", "5e6f"]
+
+
+def test_evasions():
+    # the gold could block the bishop on 4b, but it is pinned by the rook
+    assert _evasions("sfen 4k4/4g4/9/9/8B/9/9/9/K3R4 w - 1") == ["5a4a", "5a6a", "5a6b"]
+    interpose = _evasions("sfen 4k4/9/9/9/9/9/9/9/K3R4 w g 1")
+    assert interpose == ["5a4a", "5a4b", "5a6a", "5a6b"] + [f"G*5{r}" for r in "bcdefgh"]
+    # double check: only king moves
+    assert _evasions("sfen 4k4/9/9/9/8B/9/9/9/K3R4 w g 1") == ["5a4a", "5a6a", "5a6b"]
+
+
+def test_make_unmake_round_trip():
+    board = Board.from_sfen("sfen 3sks3/9/4S4/9/9/9/9/9/K8 b 2G 1")
+    before = board.sfen()
+    for code in check_moves(board):
+        captured = make_move(board, code)
+        for reply in evasions(board):
+            taken = make_move(board, reply)
+            unmake_move(board, reply, taken)
+        unmake_move(board, code, captured)
+        assert board.sfen() == before
+
+
+def test_perft_reference_counts():
+    assert [perft(Board.from_sfen(), d) for d in (1, 2, 3)] == [30, 900, 25470]
+    assert perft(Board.from_sfen(BENCH_POSITIONS["middlegame"]), 2) == 28684
+    assert len(legal_moves(Board.from_sfen(BENCH_POSITIONS["middlegame"]))) == 207
+    assert len(legal_moves(Board.from_sfen(BENCH_POSITIONS["max_moves"]))) == 593
+
+
+def test_pinned_pieces_and_drops():
+    # the gold on 5h is pinned by the rook on 5a: it may only slide along the file
+    moves = sorted(decode_moves(legal_moves(Board.from_sfen("sfen 4r4/9/9/9/9/9/9/4G4/4K4 b P 1"))))
+    assert [m for m in moves if m.startswith("5h")] == ["5h5g"]
+    # no pawn drop on the last rank
+    assert "P*5a" not in moves and "P*4a" not in moves and "P*4b" in moves
+
+
+@pytest.mark.parametrize("sfen,move,reason", [
+    ("startpos", "5e5d", "no sente piece"),
+    ("startpos", "7g7e", "cannot move"),
+    ("startpos", "P*5e", "no P in hand"),
+    ("sfen 4k4/9/9/9/9/9/4P4/9/4K4 b P 1", "P*5c", "nifu"),
+    ("sfen 4k4/9/9/9/9/9/9/9/4K4 b N 1", "N*5b", "could never move"),
+    ("sfen 4k4/9/9/9/9/9/9/9/P3K4 b - 1", "9i9h+", "cannot promote"),
+    ("sfen 4k4/9/9/9/9/9/9/9/4KP2r b - 1", "4i4h", "leaves the king in check"),
+    ("sfen 7lk/7p1/8L/9/9/9/9/9/K8 b P 1", "P*1b", "uchifuzume"),
+    ("sfen 3k5/4P4/9/9/9/9/9/9/4K4 b - 1", "5b5a", "must promote"),
+])
+def test_check_move_reasons(sfen, move, reason):
+    with pytest.raises(IllegalMoveError, match=reason):
+        check_move(Board.from_sfen(sfen), move)
+    assert not is_legal(Board.from_sfen(sfen), move)
+
+
+def test_validate_game():
+    assert validate_game(["7g7f", "3c3d", "8h2b+", "3a2b", "B*4e"]) == (5, None)
+    n, error = validate_game(["7g7f", "3c3d", "2h2c"])
+    assert n == 2 and error.startswith("move 3 2h2c")
+    # from a given position; the 5h gold is pinned
+    assert validate_game(["5h4h"], "sfen 4r4/9/9/9/9/9/9/4G4/4K4 b - 1")[0] == 0
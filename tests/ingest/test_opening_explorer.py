@@ -0,0 +1,114 @@
+"""
+test_opening_explorer.py
+
+Opening tree build (transpositions, outcomes, evals, pruning), lookups and the
+/api/openings/{sfen} endpoint.
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from fastapi.testclient import TestClient
+
+from backend.ingest.zobrist import sfen_hash
+from backend.services.opening_explorer import (
+    OpeningTree, build_opening_tree, default_tree_dir, main,
+)
+from backend.services.position_index import parse_position
+
+# A and B reach the same position after four plies in different move orders
+GAME_A = ["7g7f", "3c3d", "2g2f", "8c8d", "2f2e"]
+GAME_B = ["2g2f", "8c8d", "7g7f", "3c3d", "2f2e", "8d8e"]
+GAME_C = ["7g7f", "8c8d", "2g2f"]
+
+
+def _output(path, moves, result, scores=None):
+    notes = []
+    for i, move in enumerate(moves):
+        note = {"ply": i + 1, "move": move}
+        if scores is not None:
+            note["score_after_cp"] = scores[i]
+        notes.append(note)
+    data = {"source_file": path.name, "start_sfen": None, "metadata": {"result": result},
+            "annotation": {"notes": notes}}
+    path.write_text(json.dumps(data), encoding="utf-8")
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    _output(out / "a.json", GAME_A, "sente_win", [40, 30, 60, 50, 90])
+    _output(out / "b.json", GAME_B, "gote_win")
+    _output(out / "c.json", GAME_C, "draw", [20, -10, 10])
+    return out
+
+
+def _moves(node):
+    return {m.move: m for m in node.moves}
+
+
+def test_build_and_lookup(corpus):
+    stats = build_opening_tree(str(corpus))
+    assert stats.games == 3 and stats.pruned_edges == 0
+    tree = OpeningTree(default_tree_dir(str(corpus)))
+
+    root = tree.lookup(sfen_hash("startpos"))
+    assert (root.position.games, root.position.sente_wins,
+            root.position.gote_wins, root.position.draws) == (3, 1, 1, 1)
+    assert [m.move for m in root.moves] == ["7g7f", "2g2f"]        # most played first
+    first = root.moves[0]
+    assert (first.games, first.share, first.avg_eval_cp) == (2, pytest.approx(2 / 3, abs=1e-4), 30.0)
+    assert _moves(root)["2g2f"].avg_eval_cp is None                 # B is not annotated
+
+    # transposition: both move orders land on one node, which continues with 2f2e twice
+    h, _ = parse_position("startpos moves 7g7f 3c3d 2g2f 8c8d")
+    assert h == parse_position("startpos moves 2g2f 8c8d 7g7f 3c3d")[0]
+    node = tree.lookup(h)
+    assert node.position.games == 2 and node.position.avg_eval_cp == 50.0
+    assert [(m.move, m.games, m.sente_wins, m.gote_wins) for m in node.moves] == [("2f2e", 2, 1, 1)]
+
+    unknown = tree.lookup(sfen_hash("9/9/9/9/4k4/9/9/9/4K4 b - 1"))
+    assert unknown.position is None and unknown.moves == []
+    assert len(tree.lookup(sfen_hash("startpos"), limit=1).moves) == 1
+
+
+def test_max_plies_and_min_games(corpus, tmp_path):
+    stats = build_opening_tree(str(corpus), str(tmp_path / "t"), max_plies=2, min_games=2)
+    tree = OpeningTree(str(tmp_path / "t"))
+    assert tree.max_plies == 2 and stats.pruned_edges > 0
+    root = tree.lookup(sfen_hash("startpos"))
+    assert [m.move for m in root.moves] == ["7g7f"]
+    assert tree.lookup(parse_position("startpos moves 7g7f")[0]).moves == []  # 3c3d/8c8d once each
+
+    # a rebuild replaces the tree in place
+    build_opening_tree(str(corpus), str(tmp_path / "t"))
+    assert len(OpeningTree(str(tmp_path / "t")).lookup(sfen_hash("startpos")).moves) == 2
+
+
+def test_cli(corpus, capsys):
+    assert main(["build", str(corpus), "--max-plies", "4"]) == 0
+    capsys.readouterr()
+    assert main(["show", default_tree_dir(str(corpus)), "startpos moves 7g7f"]) == 0
+    moves = json.loads(capsys.readouterr().out)["moves"]
+    assert {m["move"] for m in moves} == {"3c3d", "8c8d"}
+    assert main(["show", default_tree_dir(str(corpus)), "startpos moves 7g7f 7g7f"]) == 2
+
+
+def test_endpoint(corpus, monkeypatch):
+    from backend.api.main import app
+
+    monkeypatch.setenv("KIFU_OUT", str(corpus))
+    monkeypatch.delenv("OPENING_TREE_DIR", raising=False)
+    client = TestClient(app)
+    assert client.get("/api/openings/startpos").status_code == 404
+
+    build_opening_tree(str(corpus))
+    body = client.get("/api/openings/startpos moves 7g7f").json()
+    assert body["position"]["games"] == 2 and body["max_plies"] == 30
+    assert {m["move"]: m["games"] for m in body["moves"]} == {"3c3d": 1, "8c8d": 1}
+    assert client.get("/api/openings/startpos", params={"limit": 1}).json()["moves"][0]["move"] == "7g7f"
+    assert client.get("/api/openings/xyz").status_code == 400
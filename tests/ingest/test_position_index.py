@@ -0,0 +1,155 @@
+"""
+test_position_index.py
+
+Zobrist hashing (incremental vs. from scratch) and the position -> games
+inverted index, including the /api/positions/{sfen}/games endpoint.
+"""
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from fastapi.testclient import TestClient
+
+from backend.ingest.board import Board
+from backend.ingest.game_store import GameStoreWriter
+from backend.ingest.zobrist import HashedBoard, position_hash, sfen_hash
+from backend.services.position_index import (
+    PositionIndex, build_position_index, cached_index, default_index_dir, main, parse_position,
+)
+
+# captures, a promotion and a drop
+BISHOP_TRADE = ["7g7f", "3c3d", "8h2b+", "3a2b", "B*4e", "8b7b", "4e3d"]
+# the same position after four plies, reached in two move orders; the second
+# game also shuffles the rook back and forth and revisits it
+GAME_A = ["7g7f", "3c3d", "2g2f", "8c8d", "2f2e"]
+GAME_B = ["2g2f", "8c8d", "7g7f", "3c3d", "2h3h", "8b7b", "3h2h", "7b8b", "1g1f"]
+
+
+def _output(path, moves, sente, gote, result):
+    data = {"source_file": f"{sente}-{gote}.kif", "start_sfen": None,
+            "metadata": {"sente": sente, "gote": gote, "result": result},
+            "annotation": {"notes": [{"ply": i + 1, "move": m} for i, m in enumerate(moves)]}}
+    path.write_text(json.dumps(data), encoding="utf-8")
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    _output(out / "a.json", GAME_A, "Alice", "Bob", "sente_win")
+    _output(out / "b.json", GAME_B, "Carol", "Dave", "gote_win")
+    _output(out / "c.json", BISHOP_TRADE, "Eve", "Frank", "draw")
+    return out
+
+
+def test_incremental_hash_matches_full_hash():
+    board = HashedBoard()
+    assert board.hash == sfen_hash("startpos")
+    for move in BISHOP_TRADE:
+        board.push_usi(move)
+        assert board.hash == position_hash(board.board)
+    assert board.hash == sfen_hash(board.board.sfen())
+
+    # side to move is part of the position, the move number is not
+    b = Board.from_sfen("startpos")
+    w = Board.from_sfen("startpos")
+    w.turn = 1
+    assert position_hash(b) != position_hash(w)
+    assert sfen_hash(b.sfen().rsplit(" ", 1)[0] + " 99") == position_hash(b)
+
+
+def test_build_and_query(corpus):
+    stats = build_position_index(str(corpus))
+    assert (stats.games, stats.postings) == (3, 3 + len(GAME_A) + len(GAME_B) + len(BISHOP_TRADE))
+
+    with PositionIndex(default_index_dir(str(corpus))) as index:
+        start = index.find(sfen_hash("startpos"))
+        assert start.total_games == 3 and {m.ply for m in start.items} == {0}
+
+        h, _ = parse_position("startpos moves 7g7f 3c3d 2g2f 8c8d")
+        page = index.find(h)
+        assert page.total_games == 2 and page.occurrences == 3       # game B twice
+        assert [(m.sente, m.ply) for m in page.items] == [("Alice", 4), ("Carol", 4)]
+        assert page.items[1].result == "gote_win" and page.items[1].source == "Carol-Dave.kif"
+
+        first = index.find(h, offset=0, limit=1)
+        assert first.has_more and [m.sente for m in first.items] == ["Alice"]
+        assert not index.find(h, offset=1, limit=1).has_more
+
+        drop, _ = parse_position("startpos moves " + " ".join(BISHOP_TRADE[:5]))
+        assert [m.sente for m in index.find(drop).items] == ["Eve"]
+        assert index.find(sfen_hash("9/9/9/9/4k4/9/9/9/4K4 b - 1")).total_games == 0
+
+
+def test_game_store_corpus_and_rebuild(tmp_path):
+    store = tmp_path / "games.kgs"
+    with GameStoreWriter(str(store)) as w:
+        w.add(GAME_A, meta={"sente": "Alice", "source_path": "a.kif"})
+    build_position_index(str(store))
+    index_dir = default_index_dir(str(store))
+    assert index_dir == str(tmp_path / "games.positions")
+    with PositionIndex(index_dir) as index:
+        assert index.find(sfen_hash("startpos")).items[0].source == "a.kif"
+
+    with GameStoreWriter(str(store)) as w:
+        w.add(GAME_A)
+        w.add(GAME_B)
+    assert build_position_index(str(store)).games == 2
+    with PositionIndex(index_dir) as index:
+        assert index.n_games == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["games.kgs", "games.positions"]
+
+
+def test_cached_index_swap_keeps_the_old_index_usable(corpus):
+    build_position_index(str(corpus))
+    index_dir = default_index_dir(str(corpus))
+    old = cached_index(index_dir)
+    assert cached_index(index_dir) is old
+
+    build_position_index(str(corpus))
+    meta = os.path.join(index_dir, "meta.json")
+    os.utime(meta, ns=(0, os.stat(meta).st_mtime_ns + 1))
+    new = cached_index(index_dir)
+    assert new is not old
+    # a request still holding the replaced index finishes its lookup
+    assert old.find(sfen_hash("startpos")).total_games == new.find(sfen_hash("startpos")).total_games == 3
+
+
+def test_parse_position_rejects_garbage():
+    for bad in ("not an sfen", "startpos moves 7g7f 7g7f"):
+        with pytest.raises(ValueError):
+            parse_position(bad)
+    h, sfen = parse_position("position startpos moves 7g7f")
+    assert sfen.startswith("lnsgkgsnl/1r5b1/ppppppppp/9/9/2P6/PP1PPPPPP/1B5R1/LNSGKGSNL w - 2")
+    assert h == sfen_hash(sfen)
+
+
+def test_cli(corpus, capsys):
+    assert main(["build", str(corpus)]) == 0
+    capsys.readouterr()
+    assert main(["query", default_index_dir(str(corpus)), "startpos moves 7g7f", "--limit", "5"]) == 0
+    assert json.loads(capsys.readouterr().out)["total_games"] == 2    # A and C open 7g7f
+
+
+def test_endpoint(corpus, monkeypatch):
+    from backend.api.main import app
+
+    monkeypatch.setenv("KIFU_OUT", str(corpus))
+    monkeypatch.delenv("POSITION_INDEX_DIR", raising=False)
+    client = TestClient(app)
+    assert client.get("/api/positions/startpos/games").status_code == 404
+
+    build_position_index(str(corpus))
+    res = client.get("/api/positions/startpos moves 7g7f 3c3d 2g2f 8c8d/games", params={"limit": 1})
+    assert res.status_code == 200
+    body = res.json()
+    assert (body["total_games"], body["has_more"], len(body["items"])) == (2, True, 1)
+    assert body["items"][0]["sente"] == "Alice"
+
+    sfen = Board.from_sfen("startpos").sfen()
+    assert client.get(f"/api/positions/{sfen}/games").json()["total_games"] == 3
+    assert client.get("/api/positions/xyz/games").status_code == 400
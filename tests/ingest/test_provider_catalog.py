@@ -0,0 +1,118 @@
+"""
+test_provider_catalog.py
+
+SQLite game catalog: incremental scans, indexed queries and the providers'
+catalog-backed search.
+"""
+
+import os
+from datetime import datetime
+
+import pytest
+
+from backend.ingest.providers.base import LocalFolderProvider
+from backend.ingest.providers.catalog import KifuCatalog, main, parse_game_date
+from backend.ingest.providers.shogi_wars import ShogiWarsProvider
+
+
+def _kif(sente, gote, date, moves=2):
+    body = ["   1 ７六歩(77)   ( 0:01/00:00:01)", "   2 ３四歩(33)   ( 0:01/00:00:02)",
+            "   3 ２六歩(27)   ( 0:01/00:00:03)"][:moves]
+    return "\n".join([f"開始日時：{date}", f"先手：{sente}", f"後手：{gote}",
+                      "手数----指手---------消費時間--", *body,
+                      f"   {moves + 1} 投了", ""])
+
+
+@pytest.fixture
+def folder(tmp_path):
+    root = tmp_path / "kifu"
+    (root / "2024").mkdir(parents=True)
+    (root / "a.kif").write_text(_kif("Alice", "Bob", "2024/01/05(金) 10:00:00"), encoding="utf-8")
+    (root / "b.kif").write_text(_kif("bob", "Carol", "2024/02/10 09:30:00", 3), encoding="utf-8")
+    (root / "2024" / "c.kif").write_text(_kif("Carol", "Alice", "2023/12/31"), encoding="utf-8")
+    (root / "undated_20240301_120000.usi").write_text("startpos moves 7g7f", encoding="utf-8")
+    return root
+
+
+def test_parse_game_date():
+    assert parse_game_date("2024/01/05(金) 10:00:00") == "2024-01-05T10:00:00"
+    assert parse_game_date("2024年1月2日") == "2024-01-02T00:00:00"
+    assert parse_game_date(None, "alice_vs_bob_20240102_101500.kif") == "2024-01-02T10:15:00"
+    assert parse_game_date("unknown", "game_12345.kif") is None
+
+
+def test_scan_and_query(folder, tmp_path):
+    catalog = KifuCatalog(str(tmp_path / "catalog.sqlite3"))
+    stats = catalog.scan("local", str(folder))
+    assert (stats.added, stats.errors) == (4, 0)
+
+    page = catalog.query("local")
+    assert [os.path.basename(e.path) for e in page.items] == \
+        ["undated_20240301_120000.usi", "b.kif", "a.kif", "c.kif"]
+    b = page.items[1]
+    assert (b.sente, b.gote, b.result, b.format, b.moves) == ("bob", "Carol", "sente_win", "kif", 3)
+    assert b.date == "2024-02-10T09:30:00" and len(b.hash) == 32
+
+    # player matches either side, case-insensitively
+    assert {os.path.basename(e.path) for e in catalog.query("local", player="BOB").items} == {"a.kif", "b.kif"}
+    in_2024 = catalog.query("local", player="alice", date_from="2024-01-01", date_to="2024-01-31")
+    assert [os.path.basename(e.path) for e in in_2024.items] == ["a.kif"]
+    assert [os.path.basename(e.path) for e in catalog.query("local", date_to="2023-12-31").items] == ["c.kif"]
+    assert {os.path.basename(e.path) for e in catalog.query("local", result="gote_win").items} == {"a.kif", "c.kif"}
+
+    first = catalog.query("local", limit=3)
+    rest = catalog.query("local", limit=3, offset=3)
+    assert first.has_more and not rest.has_more
+    assert len({e.id for e in first.items + rest.items}) == 4
+
+
+def test_rescan_is_incremental(folder, tmp_path):
+    catalog = KifuCatalog(str(tmp_path / "catalog.sqlite3"))
+    catalog.scan("local", str(folder))
+
+    again = catalog.scan("local", str(folder))
+    assert (again.unchanged, again.added, again.updated) == (4, 0, 0)
+
+    a = folder / "a.kif"
+    st = a.stat()
+    os.utime(a, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))          # touched only
+    (folder / "b.kif").write_text(_kif("Dave", "Carol", "2024/02/10"), encoding="utf-8")
+    (folder / "2024" / "c.kif").unlink()
+    (folder / "d.csa").write_text("N+Eve\nN-Frank\n+7776FU\n%TORYO\n", encoding="utf-8")
+
+    third = catalog.scan("local", str(folder))
+    assert (third.touched, third.updated, third.removed, third.added, third.unchanged) == (1, 1, 1, 1, 1)
+    assert catalog.count("local") == 4
+    assert catalog.query("local", player="dave").items[0].sente == "Dave"
+    assert catalog.query("local", player="eve").items[0].result == "sente_win"
+    assert catalog.get("local", str(a)).mtime_ns == a.stat().st_mtime_ns
+
+
+def test_providers_search_through_catalog(folder, tmp_path):
+    catalog = KifuCatalog(str(tmp_path / "catalog.sqlite3"))
+    local = LocalFolderProvider(str(folder), catalog=catalog)
+    results = local.search({"player": "carol", "limit": 1})
+    assert len(results) == 1 and results[0].date == datetime(2024, 2, 10, 9, 30)
+    assert results[0].metadata["move_count"] == 3
+    assert "offset" in local.get_supported_query_params()
+
+    # new files show up after an explicit refresh, not on every search
+    (folder / "e.kif").write_text(_kif("Carol", "Zed", "2024/03/01"), encoding="utf-8")
+    assert len(local.search({"player": "carol"})) == 2
+    local.refresh_catalog()
+    assert len(local.search({"player": "carol"})) == 3
+
+    wars_dir = tmp_path / "wars"
+    wars_dir.mkdir()
+    (wars_dir / "kingA_vs_kingB_20240105.kif").write_text(_kif("x", "y", "2024/01/05"), encoding="utf-8")
+    wars = ShogiWarsProvider(str(wars_dir), catalog=catalog)
+    found = wars.search({"player": "kingb"})
+    assert [(r.sente, r.gote) for r in found] == [("kingA", "kingB")]
+    assert local.search({"player": "kinga"}) == []   # rows are per provider
+
+
+def test_cli_scan(folder, tmp_path, capsys):
+    db = tmp_path / "c.sqlite3"
+    assert main(["--db", str(db), "--root", str(folder)]) == 0
+    assert '"added": 4' in capsys.readouterr().out
+    assert KifuCatalog(str(db)).count("local_folder") == 4
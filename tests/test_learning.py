@@ -259,6 +259,41 @@ class TestLearningFlow:
             assert 1 <= quiz["difficulty"] <= 5
             assert len(quiz["choices"]) == 4
 
+    def test_choices_are_legal_in_the_quiz_position(self):
+        """選択肢はすべて注釈の局面で指せる手"""
+        from backend.ingest.board import Board
+        from backend.ingest.movegen import is_legal
+        from backend.learning.generator import QuizGenerator, note_position
+        from backend.learning.schemas import GamePhase
+
+        usi = "startpos moves 7g7f 3c3d 8h2b+"
+        notes = [
+            {"ply": 3, "move": "8h2b+", "bestmove": "8h2b+", "reasoning": {"summary": "角交換"}},
+            {"ply": 4, "move": "3a2b", "bestmove": "3a2b", "reasoning": {"summary": "取り返す"}},
+            # 局面が分からない注釈からは作らない
+            {"ply": 40, "move": "7g7f", "reasoning": {}},
+        ]
+        response = client.post("/learning/generate", json={"reasoning_notes": notes, "quiz_count": 2, "usi": usi})
+        quizzes = response.json()["quizzes"]
+        assert len(quizzes) == 2
+        for quiz, note in zip(quizzes, notes):
+            board = note_position(note, usi)
+            assert len(quiz["choices"]) == 4
+            assert all(is_legal(board, c["move"]) for c in quiz["choices"])
+        assert client.post("/learning/generate", json={"reasoning_notes": notes[2:], "quiz_count": 1}
+                           ).json()["quizzes"][0]["choices"][0]["move"] == "7g7f"    # フォールバック
+
+        generator = QuizGenerator()
+        sfen_note = {"move": "2b3c", "sfen": "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL w - 2",
+                     "reasoning": {}}
+        quiz = generator._generate_best_move_quiz(sfen_note, GamePhase.OPENING)
+        assert quiz is None                                      # 2b3c は角道が開いていないので指せない
+        sfen_note["move"] = "3c3d"
+        quiz = generator._generate_best_move_quiz(sfen_note, GamePhase.OPENING)
+        board = Board.from_sfen(sfen_note["sfen"])
+        assert all(is_legal(board, c["move"]) for c in quiz.choices)
+        assert generator._generate_best_move_quiz(notes[2], GamePhase.OPENING) is None
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Learning storage tests
+
+SQLite storage: incremental aggregates, batched attempt writes (flushed by
+a timer when idle), persistence across reopen and TTL eviction of sessions /
+quizzes.
+"""
+
+import sqlite3
+import time
+import uuid
+
+import pytest
+
+from backend.learning import storage as storage_module
+from backend.learning.evaluator import AnswerEvaluator
+from backend.learning.generator import QuizGenerator
+from backend.learning.models import Attempt, InMemoryStorage, LearningStorage, Quiz
+from backend.learning.schemas import GamePhase, QuizType
+from backend.learning.storage import SQLiteLearningStorage
+
+
+def _quiz(phase=GamePhase.OPENING, quiz_type=QuizType.BEST_MOVE) -> Quiz:
+    return Quiz(
+        id=str(uuid.uuid4()),
+        question="最善手は？",
+        choices=[{"id": "A", "move": "7g7f"}, {"id": "B", "move": "2g2f"}],
+        correct_answer="A",
+        hint=None,
+        phase=phase,
+        quiz_type=quiz_type,
+        difficulty=2,
+        source_move="7g7f",
+        source_reasoning={"summary": "テスト"},
+    )
+
+
+def _attempt(quiz: Quiz, session_id: str, user_id: str, correct: bool) -> Attempt:
+    return Attempt(id=str(uuid.uuid4()), user_id=user_id, quiz_id=quiz.id, session_id=session_id,
+                   answer="A" if correct else "B", correct=correct, score=60 if correct else 0,
+                   time_taken_ms=1000)
+
+
+def _count(store: SQLiteLearningStorage, table: str) -> int:
+    return store._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_aggregates_and_batched_writes(tmp_path):
+    path = str(tmp_path / "learning.sqlite3")
+    store = SQLiteLearningStorage(path, batch_size=4, flush_interval_s=3600)
+    opening, endgame = _quiz(), _quiz(GamePhase.ENDGAME, QuizType.EVALUATION)
+    for quiz in (opening, endgame):
+        store.save_quiz(quiz)
+    session = store.create_session([opening.id, endgame.id], user_id="u1")
+    assert store.get_session_quizzes(session) == [opening.id, endgame.id]
+    assert store.get_quiz(endgame.id).phase is GamePhase.ENDGAME
+
+    store.save_attempt(_attempt(opening, session, "u1", True))
+    store.save_attempt(_attempt(endgame, session, "u1", False))
+    store.save_attempt(_attempt(opening, session, "u2", True))
+    assert _count(store, "attempts") == 0            # still buffered
+
+    user = store.get_user("u1")                      # reading u1 flushes first
+    assert _count(store, "attempts") == 3
+    assert (user.total_attempts, user.correct_answers, user.total_score) == (2, 1, 60)
+    assert user.phase_stats[GamePhase.OPENING] == {"attempts": 1, "correct": 1, "total_score": 60}
+    assert user.type_stats[QuizType.EVALUATION]["attempts"] == 1
+    assert user.recent_results == [True, False]
+
+    for _ in range(4):                               # a full batch is written without a read
+        store.save_attempt(_attempt(opening, session, "u3", True))
+    assert _count(store, "attempts") == 7
+    store.close()
+
+    reopened = SQLiteLearningStorage(path)
+    u1 = reopened.get_user("u1")
+    assert (u1.total_attempts, u1.level, u1.recent_results) == (2, 1, [True, False])
+    assert reopened.get_user("u3").total_score == 240
+    assert [a.correct for a in reopened.recent_attempts("u1")] == [False, True]
+    assert reopened.get_user("nobody").total_attempts == 0
+    reopened.close()
+
+
+def test_idle_buffer_is_flushed_by_the_timer(tmp_path):
+    path = str(tmp_path / "learning.sqlite3")
+    store = SQLiteLearningStorage(path, batch_size=100, flush_interval_s=0.05)
+    quiz = _quiz()
+    store.save_quiz(quiz)
+    session = store.create_session([quiz.id], user_id="u1")
+    store.save_attempt(_attempt(quiz, session, "u1", True))
+
+    # no further writes or reads on this storage: another worker still sees the attempt
+    other = sqlite3.connect(path)
+    deadline = time.monotonic() + 5
+    while other.execute("SELECT COUNT(*) FROM attempts").fetchone()[0] == 0:
+        assert time.monotonic() < deadline, "buffered attempt never flushed"
+        time.sleep(0.02)
+    assert other.execute("SELECT total_attempts FROM users WHERE user_id = 'u1'").fetchone() == (1,)
+    other.close()
+    store.close()
+    assert store._timer is None
+
+
+def test_ttl_eviction_keeps_progress(tmp_path):
+    store = SQLiteLearningStorage(str(tmp_path / "l.sqlite3"), ttl_s=60, batch_size=1)
+    quiz = _quiz()
+    store.save_quiz(quiz)
+    session = store.create_session([quiz.id])
+    store.save_attempt(_attempt(quiz, session, "u", True))
+
+    assert store.evict_expired(now=time.time() + 30) == 0
+    assert store.evict_expired(now=time.time() + 61) == 2
+    assert store.get_session_quizzes(session) == [] and store.get_quiz(quiz.id) is None
+    assert store.get_user("u").correct_answers == 1
+    assert _count(store, "attempts") == 1
+
+    memory = InMemoryStorage(ttl_s=60)
+    memory.save_quiz(quiz)
+    sid = memory.create_session([quiz.id])
+    assert memory.evict_expired(now=time.time() + 61) == 2
+    assert memory.get_session_quizzes(sid) == []
+
+
+def test_incomplete_backend_fails_at_construction():
+    class NoSessions(InMemoryStorage):
+        get_session_quizzes = LearningStorage.get_session_quizzes
+
+    with pytest.raises(TypeError, match="get_session_quizzes"):
+        NoSessions()
+    with pytest.raises(TypeError):
+        LearningStorage()
+
+
+def test_generator_and_evaluator_use_the_shared_storage(tmp_path, monkeypatch):
+    store = SQLiteLearningStorage(str(tmp_path / "shared.sqlite3"))
+    monkeypatch.setattr(storage_module, "_STORAGE", store)
+
+    generator = QuizGenerator()
+    quizzes = generator._generate_fallback_quizzes(2)
+    session = generator.save_and_create_session(quizzes)
+    result = AnswerEvaluator().evaluate_answer(session, quizzes[0].id, "A", user_id="learner")
+    assert result.correct and result.correct_answer == "7g7f"
+
+    progress = store.get_user("learner")
+    assert progress.total_attempts == 1 and progress.total_score == result.score
+    assert progress.phase_stats[GamePhase.OPENING]["correct"] == 1
+    store.close()
@@ -0,0 +1,125 @@
+"""
+Mate search tests
+
+`go mate` on a dedicated pool of fake USI engines (a Python script answering
+`checkmate ...`): sequences, verdict cache by position hash, time limits
+(engine-side timeout, an engine that needs `stop`, a busy pool) and the
+/api/solve/mate and /api/tsume/play endpoints.
+"""
+
+import sys
+import textwrap
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.services import engine_pool
+from backend.services.engine_pool import EnginePool, UsiEngine
+from backend.services.mate_search import MateSearchService
+
+MATE = "sfen 4k4/9/4P4/9/9/9/9/9/K8 b G 1"
+NOMATE = "sfen 4k4/9/9/9/9/9/9/9/K8 b - 1"
+SLOW = "sfen 4k4/9/9/9/9/9/9/9/K8 b P 1"          # stops at its own limit
+STUBBORN = "sfen 4k4/9/9/9/9/9/9/9/K8 b L 1"      # answers only after `stop`
+
+FAKE_MATE_ENGINE = textwrap.dedent("""
+    import sys, time
+    answers = {"4k4/9/4P4/9/9/9/9/9/K8": "G*5b", "5k3/9/4P4/9/9/9/9/9/K8": "G*4b 4a3a G*3b"}
+    board, hand, pending = "", "", False
+    for line in sys.stdin:
+        cmd = line.strip()
+        if cmd == "usi":
+            print("id name FakeMate"); print("usiok")
+        elif cmd == "isready":
+            print("readyok")
+        elif cmd.startswith("position sfen"):
+            board, hand = cmd.split()[2], cmd.split()[4]
+        elif cmd.startswith("go mate"):
+            if hand == "P":
+                time.sleep(int(cmd.split()[2]) / 1000.0)
+                print("checkmate timeout")
+            elif hand == "L":
+                pending = True
+            else:
+                print("checkmate " + answers.get(board, "nomate"))
+        elif cmd == "stop" and pending:
+            pending = False
+            print("checkmate timeout")
+        elif cmd == "quit":
+            break
+        sys.stdout.flush()
+""")
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    script = tmp_path / "fake_mate.py"
+    script.write_text(FAKE_MATE_ENGINE, encoding="utf-8")
+    monkeypatch.setattr(engine_pool, "MATE_GRACE_S", 0.3)
+    pool = EnginePool(1, factory=lambda: UsiEngine([sys.executable, str(script)], options={},
+                                                   boot_timeout=5, go_timeout=5))
+    svc = MateSearchService(pool)
+    yield svc
+    svc.close()
+
+
+def test_sequence_and_cache_by_position(service):
+    found = service.solve(MATE)
+    assert (found.status, found.moves, found.mate_in, found.cached) == ("mate", ["G*5b"], 1, False)
+    assert found.to_dict()["message"] == "1手詰"
+    # the same position reached through moves is answered from the cache
+    again = service.solve(MATE, moves=["9i9h", "5a4a", "9h9i", "4a5a"])
+    assert again.cached and again.moves == ["G*5b"]
+    three = service.solve("sfen 4k4/9/4P4/9/9/9/9/9/K8 w G 2", moves=["5a4a"])
+    assert three.mate_in == 3
+    assert service.solve(NOMATE).status == "nomate"
+    assert service.solve(NOMATE).cached
+    assert service.stats()["searches"] == 3
+
+
+def test_time_limits(service):
+    with service.pool.acquire():                                 # boot first: start-up counts against the limit
+        pass
+    slow = service.solve(SLOW, timeout_ms=100)
+    assert slow.status == "timeout" and slow.elapsed_ms >= 100
+    assert slow.message == "100ms 以内に詰みは見つかりませんでした"
+    assert service.solve(SLOW, timeout_ms=80).cached
+    assert not service.solve(SLOW, timeout_ms=200).cached       # a longer limit searches again
+
+    t0 = time.monotonic()
+    stubborn = service.solve(STUBBORN, timeout_ms=100)
+    assert stubborn.status == "timeout" and time.monotonic() - t0 < 2.0
+    assert service.solve(MATE).status == "mate"                  # the engine is still in step
+
+    with service.pool.acquire():                                 # no free engine
+        busy = service.solve(NOMATE, timeout_ms=100)
+    assert busy.status == "timeout" and not busy.cached
+    assert service.solve(NOMATE).status == "nomate"
+
+
+def test_bad_positions_raise(service):
+    with pytest.raises(ValueError):
+        service.solve("sfen garbage")
+    with pytest.raises(ValueError):
+        service.solve(MATE, moves=["1a1b"])
+
+
+def test_endpoints(service, monkeypatch):
+    from backend.api import main
+
+    monkeypatch.setattr(main, "get_mate_service", lambda: service)
+    monkeypatch.setenv("TSUME_TABLE", "")
+    monkeypatch.setenv("TSUME_SOLVER_MAX_PLIES", "0")       # straight to the engine fallback
+    client = TestClient(main.app)
+    body = client.post("/api/solve/mate", json={"sfen": MATE, "timeout": 1000}).json()
+    assert body["status"] == "mate" and body["moves"] == ["G*5b"] and body["mate_in"] == 1
+    assert client.post("/api/solve/mate", json={"sfen": "sfen garbage"}).status_code == 400
+
+    async def misjudged(sfen):
+        return {"status": "incorrect", "bestmove": "5a4a", "message": "その手では詰みません"}
+
+    # the analysis engine's verdict is replaced by the mate search
+    monkeypatch.setattr(main.stream_engine, "solve_tsume_hand", misjudged)
+    reply = client.post("/api/tsume/play", json={"sfen": "sfen 4k4/9/4P4/9/9/9/9/9/K8 w G 2"}).json()
+    assert reply == {"status": "continue", "bestmove": "5a4a", "message": "正解！"}
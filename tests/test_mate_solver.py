@@ -0,0 +1,139 @@
+"""
+df-pn mate solver tests
+
+Shortest mates and longest defences on small problems, drop rules inside the
+search, "unknown" when the solver cannot tell, transposition-table eviction,
+and tsume play / mate search answering without an engine.
+"""
+
+import sys
+
+from fastapi.testclient import TestClient
+
+from backend.api.tsume_data import TSUME_PROBLEMS
+from backend.ingest.board import Board
+from backend.ingest.movegen import check_moves, evasions, in_check
+from backend.ingest.zobrist import position_hash
+from backend.services.engine_pool import EnginePool, UsiEngine
+from backend.services.mate_search import MateSearchService
+from backend.services.mate_solver import DfPnSolver
+
+THREE = "sfen 3sks3/9/4S4/9/9/9/9/9/K8 b 2G 1"
+
+
+def _after(sfen, *moves):
+    board = Board.from_sfen(sfen)
+    for move in moves:
+        board.push_usi(move)
+    return board
+
+
+def test_short_mates():
+    solver = DfPnSolver()
+    for problem in TSUME_PROBLEMS[:3]:
+        found = solver.solve(problem["sfen"])
+        assert found.status == "mate" and len(found.moves) == 1
+    found = solver.solve(THREE)
+    assert found.moves == ["G*5b", "6a5b", "G*6b"] and found.nodes < 1000
+    final = _after(THREE, *found.moves)
+    assert in_check(final, 1) and evasions(final) == []
+
+    # P*1b would mate, which is illegal (uchifuzume); a silver drop is fine
+    assert solver.solve("sfen 7lk/7p1/8L/9/9/9/9/9/K8 b P 1").status == "nomate"
+    assert solver.solve("sfen 7lk/7p1/8L/9/9/9/9/9/K8 b S 1").moves == ["S*1b"]
+
+
+def test_unknown_when_the_solver_cannot_tell():
+    assert DfPnSolver().solve(TSUME_PROBLEMS[3]["sfen"]).status == "unknown"      # no defending king
+    assert DfPnSolver(max_plies=1).solve(THREE).status == "unknown"               # longer than the limit
+    assert DfPnSolver(max_nodes=20).solve(THREE).status == "unknown"              # out of budget
+
+
+def test_responses():
+    solver = DfPnSolver()
+    start = "sfen 4k4/9/4P4/9/9/9/9/9/K8 b 2G 1"
+    assert solver.respond(_after(start, "G*5b")) == ("win", "resign")
+    assert solver.respond(_after(THREE, "G*5b"), plies_left=2) == ("continue", "6a5b")
+    # a reply escapes: final when the problem's length is known, unknown otherwise
+    assert solver.respond(_after(THREE, "G*4b"), plies_left=2) == ("incorrect", "4a4b")
+    assert solver.respond(_after(THREE, "G*4b")) is None
+    # not a check at all
+    assert solver.respond(_after(start, "9i9h"))[0] == "incorrect"
+
+
+def test_move_lists_are_kept_per_node_type():
+    # 8h9i answers the rook's check and checks back: the same position is an
+    # AND node when black attacks (solve) and an OR node when white does (respond)
+    position = "sfen 9/9/9/9/9/9/9/kS5PP/r7K b - 1"
+    solver = DfPnSolver()
+    solver.solve(position)
+    solver.respond(position, plies_left=2)
+    after = _after(position, "8h9i")
+    h = position_hash(after)
+    assert solver._children[(h, False)] != solver._children[(h, True)]
+    assert [code for code, _ in solver._children[(h, False)]] == evasions(after)
+    assert [code for code, _ in solver._children[(h, True)]] == check_moves(after)
+
+
+def test_line_is_kept_when_the_budget_runs_out_after_the_proof():
+    full = DfPnSolver().solve(THREE).moves
+    found = [DfPnSolver(max_nodes=n).solve(THREE) for n in range(1, 100)]
+    mates = [f.moves for f in found if f.status != "unknown"]
+    assert all(f.status in ("mate", "unknown") for f in found)
+    # a proven mate stays proven; a tight budget only shortens the line
+    assert all(moves == full[:len(moves)] for moves in mates)
+    assert any(len(moves) < len(full) for moves in mates) and mates[-1] == full
+
+
+def test_table_is_cut_back_between_searches():
+    solver = DfPnSolver(tt_size=40)
+    solver.solve(THREE)
+    assert len(solver.tt) > 40
+    solver.solve(TSUME_PROBLEMS[0]["sfen"])
+    assert solver.evictions == 1 and len(solver.tt) < 40 + 20
+
+
+def test_endpoints_skip_the_engine(monkeypatch):
+    from backend.api import main
+
+    async def no_engine(sfen):
+        raise AssertionError("engine search for a short problem")
+
+    monkeypatch.setenv("TSUME_TABLE", "")
+    monkeypatch.setattr(main.stream_engine, "solve_tsume_hand", no_engine)
+    client = TestClient(main.app)
+    sfen = "sfen " + _after(TSUME_PROBLEMS[0]["sfen"], "G*5b").sfen()
+    assert client.post("/api/tsume/play", json={"sfen": sfen, "problem_id": 1}).json()["status"] == "win"
+    sfen = "sfen " + _after(TSUME_PROBLEMS[0]["sfen"], "G*4b").sfen()
+    assert client.post("/api/tsume/play", json={"sfen": sfen, "problem_id": 1}).json()["status"] == "incorrect"
+
+    # the engine pool is never started for a position the solver settles
+    service = MateSearchService(EnginePool(1, factory=lambda: UsiEngine([sys.executable, "-c", "raise SystemExit(1)"])),
+                                solver=DfPnSolver())
+    monkeypatch.setattr(main, "get_mate_service", lambda: service)
+    body = client.post("/api/solve/mate", json={"sfen": THREE}).json()
+    assert body["moves"] == ["G*5b", "6a5b", "G*6b"] and body["solver"] == "dfpn"
+
+
+def test_tsume_play_passes_the_plies_left(monkeypatch):
+    from backend.api import main
+
+    seen = []
+
+    class Recorder:
+        def respond(self, sfen, plies_left=None):
+            seen.append(plies_left)
+            return "continue", "5a4b"
+
+    monkeypatch.setenv("TSUME_TABLE", "")
+    monkeypatch.setattr(main, "get_mate_solver", lambda: Recorder())
+    client = TestClient(main.app)
+    problem = next(p for p in TSUME_PROBLEMS if p["steps"] == 3)
+    start = Board.from_sfen(problem["sfen"])
+    sfen = "sfen " + start.sfen(with_ply=False)
+    for body in ({"plies_played": 1}, {"plies_played": 3}, {}):
+        client.post("/api/tsume/play", json={"sfen": sfen + " 1", "problem_id": problem["id"], **body})
+    # without a count the move number tells how far the problem has gone
+    client.post("/api/tsume/play", json={"sfen": f"{sfen} {start.ply + 3}", "problem_id": problem["id"]})
+    assert seen == [2, 0, None, 0]
+
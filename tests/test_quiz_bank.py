@@ -0,0 +1,181 @@
+"""
+Quiz bank tests
+
+Mining best-move quizzes from annotated outputs (playable distractors, phase /
+difficulty / tags), MultiPV re-search, indexed sampling and /learning/generate.
+"""
+
+import json
+import os
+import random
+import sys
+import textwrap
+
+from fastapi.testclient import TestClient
+
+from backend.ingest.board import Board
+from backend.ingest.movegen import is_legal
+from backend.learning.quiz_bank import (
+    QuizBank, build_quiz_bank, difficulty_for_margin, get_quiz_bank,
+)
+from backend.services.engine_pool import EngineResult, UsiEngine
+
+MID_SFEN = "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 61"
+
+
+def _output(path, moves, notes, start_sfen=None, first_ply=1):
+    rows = []
+    for i, move in enumerate(moves):
+        row = {"ply": first_ply + i, "move": move}
+        row.update(notes.get(i, {}))
+        rows.append(row)
+    data = {"source_file": path.name, "start_sfen": start_sfen, "metadata": {},
+            "annotation": {"notes": rows}}
+    path.write_text(json.dumps(data), encoding="utf-8")
+
+
+def _corpus(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    # ply 3: 8h2b+ wins the bishop, 2g2f loses 300
+    _output(out / "a.json", ["7g7f", "3c3d", "2g2f", "8c8d"],
+            {2: {"bestmove": "8h2b+", "delta_cp": -300}})
+    # same position, another move played: a corpus distractor
+    _output(out / "b.json", ["7g7f", "3c3d", "6i7h"], {})
+    # middlegame numbering, loses 900
+    _output(out / "c.json", ["9g9f"], {0: {"bestmove": "7g7f", "delta_cp": -900}},
+            start_sfen=MID_SFEN, first_ply=61)
+    # too small a loss / unplayable best move: no quiz
+    _output(out / "d.json", ["2g2f", "8c8d"],
+            {0: {"bestmove": "7g7f", "delta_cp": -100}, 1: {"bestmove": "5e5d", "delta_cp": -500}})
+    return out
+
+
+def test_mine_and_sample(tmp_path):
+    bank_path = str(tmp_path / "bank.sqlite3")
+    stats = build_quiz_bank(str(_corpus(tmp_path)), bank_path)
+    assert (stats.games, stats.candidates, stats.quizzes, stats.few_choices) == (4, 2, 2, 0)
+
+    bank = QuizBank(bank_path)
+    assert len(bank) == 2
+    (opening,) = bank.sample(5, phase="序盤")
+    assert (opening.best, opening.played, opening.difficulty, opening.ply) == ("8h2b+", "2g2f", 4, 3)
+    assert opening.tags == ["駒取り", "成り"]
+    assert opening.distractors[:2] == ["2g2f", "6i7h"] and len(opening.distractors) == 3
+
+    (middle,) = bank.sample(5, phase="中盤", difficulty=2)
+    assert (middle.best, middle.phase) == ("7g7f", "中盤")
+    for quiz in (opening, middle):
+        board = Board.from_sfen(quiz.sfen)
+        assert quiz.best not in quiz.distractors and len(set(quiz.distractors)) == 3
+        assert all(is_legal(board, move) for move in [quiz.best, *quiz.distractors])
+
+    assert [q.id for q in bank.sample(5, tag="成り")] == [opening.id]
+    assert bank.sample(5, phase="終盤") == [] and bank.sample(5, phase="中盤", tag="成り") == []
+    assert len(bank.sample(1)) == 1
+
+    learning_quiz = opening.to_quiz(random.Random(1))
+    answer = next(c for c in learning_quiz.choices if c["id"] == learning_quiz.correct_answer)
+    assert answer["move"] == "8h2b+" and learning_quiz.source_reasoning["sfen"] == opening.sfen
+    assert [difficulty_for_margin(cp) for cp in (2000, 900, 500, 300, 150)] == [1, 2, 3, 4, 5]
+    bank.close()
+
+
+class MultiPVEngine:
+    """analyze_multipv() stand-in: a close second line for the opening position."""
+
+    def __init__(self):
+        self.calls = []
+
+    def analyze_multipv(self, position_cmd, multipv, byoyomi_ms=None, nodes=None):
+        self.calls.append((position_cmd, multipv))
+        if position_cmd.endswith(" 3"):
+            return [EngineResult("8h2b+", 400, pv=["8h2b+"]), EngineResult("2g2f", 350, pv=["2g2f"])]
+        return [EngineResult("7g7f", 200, pv=["7g7f"]), EngineResult("2g2f", -700, pv=["2g2f"]),
+                EngineResult("5i5h", None, mate=-3, pv=["5i5h"])]
+
+
+def test_engine_gap_and_alternatives(tmp_path):
+    engine = MultiPVEngine()
+    stats = build_quiz_bank(str(_corpus(tmp_path)), str(tmp_path / "bank.sqlite3"), engine=engine)
+    assert (stats.quizzes, stats.not_clear) == (1, 1)
+    assert all(multipv == 4 for _, multipv in engine.calls)
+
+    (quiz,) = QuizBank(str(tmp_path / "bank.sqlite3")).sample(3)
+    assert quiz.gap_cp == 900 and quiz.difficulty == 2
+    assert quiz.distractors == ["9g9f", "2g2f", "5i5h"]
+
+
+FAKE_MULTIPV_ENGINE = textwrap.dedent("""
+    import sys
+    multipv = 1
+    for line in sys.stdin:
+        cmd = line.strip()
+        if cmd == "usi":
+            print("id name FakeMultiPV"); print("usiok")
+        elif cmd == "isready":
+            print("readyok")
+        elif cmd.startswith("setoption name MultiPV value"):
+            multipv = int(cmd.split()[-1])
+        elif cmd.startswith("go"):
+            for depth in (1, 2):
+                for i in range(1, multipv + 1):
+                    print(f"info depth {depth} multipv {i} score cp {100 * depth - 50 * i} pv m{i} x{i}")
+            print("bestmove m1")
+        elif cmd == "quit":
+            break
+        sys.stdout.flush()
+""")
+
+
+def test_usi_engine_multipv(tmp_path):
+    script = tmp_path / "fake_multipv.py"
+    script.write_text(FAKE_MULTIPV_ENGINE, encoding="utf-8")
+    engine = UsiEngine([sys.executable, str(script)], options={}, boot_timeout=5, go_timeout=5)
+    try:
+        lines = engine.analyze_multipv("position startpos", multipv=3)
+        assert [(r.bestmove, r.score_cp, r.depth) for r in lines] == [
+            ("m1", 150, 2), ("m2", 100, 2), ("m3", 50, 2)]
+        single = engine.analyze("position startpos")     # back to one line
+        assert (single.bestmove, single.score_cp, single.pv) == ("m1", 150, ["m1", "x1"])
+    finally:
+        engine.close()
+
+
+def test_rebuilt_bank_is_reopened_while_the_old_one_stays_usable(tmp_path, monkeypatch):
+    bank_path = str(tmp_path / "bank.sqlite3")
+    corpus = str(_corpus(tmp_path))
+    build_quiz_bank(corpus, bank_path)
+    monkeypatch.setenv("QUIZ_BANK_DB", bank_path)
+    old = get_quiz_bank()
+    build_quiz_bank(corpus, bank_path)
+    os.utime(bank_path, ns=(0, os.stat(bank_path).st_mtime_ns + 1))
+    new = get_quiz_bank()
+    assert new is not old and len(new.sample(1)) == 1
+    # a request that drew the old bank before the swap can still finish
+    assert len(old.sample(1)) == 1 and old.by_position([new.sample(1)[0].position_hash])
+
+
+def test_generate_endpoint_samples_the_bank(tmp_path, monkeypatch):
+    from backend.api.main import app
+
+    bank_path = str(tmp_path / "bank.sqlite3")
+    build_quiz_bank(str(_corpus(tmp_path)), bank_path)
+    monkeypatch.setenv("QUIZ_BANK_DB", bank_path)
+    assert get_quiz_bank() is get_quiz_bank()
+
+    client = TestClient(app)
+    res = client.post("/learning/generate", json={"reasoning_notes": [], "quiz_count": 3, "phase": "中盤"})
+    assert res.status_code == 201
+    body = res.json()
+    (quiz,) = body["quizzes"]
+    assert quiz["sfen"].startswith("lnsgkgsnl/1r5b1") and quiz["phase"] == "中盤"
+    assert {"7g7f", "9g9f"} <= {c["move"] for c in quiz["choices"]}
+
+    res = client.post("/learning/submit", json={"session_id": body["session_id"], "quiz_id": quiz["id"],
+                                                "answer": quiz["correct_answer"], "user_id": "bank-user"})
+    assert res.status_code == 200 and res.json()["correct"] is True
+
+    monkeypatch.setenv("QUIZ_BANK_DB", "")
+    res = client.post("/learning/generate", json={"reasoning_notes": [], "quiz_count": 1})
+    assert res.json()["quizzes"][0]["difficulty"] == 1 and "sfen" not in res.json()["quizzes"][0]
@@ -0,0 +1,122 @@
+"""
+Tsume table tests
+
+Offline walk of a problem's correct lines (win / continue / incorrect entries,
+recursion into the defender's reply, one entry per depth for transpositions)
+and /api/tsume/play answering from the table without touching the engine.
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.ingest.zobrist import HashedBoard
+from backend.services.engine_pool import EngineResult
+from backend.services.tsume_table import TsumeTable, build_tsume_table, get_tsume_table
+
+# The scripted engine treats G*5b as mate in 1, G*4b 5a6a G*6b as mate in 3
+# and 9i9h as a wasted move. After G*4b 5a6a, G*5b mates in 3 more: too long
+# for the one ply left.
+PROBLEM = {"id": 99, "sfen": "sfen 4k4/9/4P4/9/9/9/9/9/K8 b 2G 1", "steps": 3}
+
+
+def _after(*moves):
+    board = HashedBoard.from_sfen(PROBLEM["sfen"])
+    for move in moves:
+        board.push_usi(move)
+    return board
+
+
+class ScriptedEngine:
+    """analyze_multipv() answering from a per-position script."""
+
+    def __init__(self):
+        start, second = _after(), _after("G*4b", "5a6a")
+        self.script = {
+            start.hash: [EngineResult("G*5b", mate=1, pv=["G*5b"]),
+                         EngineResult("G*4b", mate=3, pv=["G*4b", "5a6a", "G*6b"]),
+                         EngineResult("9i9h", score_cp=-200, pv=["9i9h", "5a4b"])],
+            second.hash: [EngineResult("G*6b", mate=1, pv=["G*6b"]),
+                          EngineResult("G*5b", mate=3, pv=["G*5b", "6a7a", "G*6a"]),
+                          EngineResult("G*7b", score_cp=300, pv=["G*7b", "6a5b"])],
+        }
+        self.calls = []
+
+    def analyze_multipv(self, position_cmd, multipv, byoyomi_ms=None, nodes=None):
+        board = HashedBoard.from_sfen(position_cmd[len("position "):])
+        self.calls.append((board.hash, multipv))
+        return self.script.get(board.hash, [])
+
+
+def test_walks_correct_lines(tmp_path):
+    engine = ScriptedEngine()
+    out = str(tmp_path / "tsume_table.json")
+    stats = build_tsume_table(engine, [PROBLEM], out_path=out)
+    assert (stats.problems, stats.searches, stats.entries) == (1, 2, 6)
+    assert all(multipv >= 593 for _, multipv in engine.calls)
+
+    table = TsumeTable(out)
+    sfen = lambda *moves: _after(*moves).board.sfen()
+    assert table.lookup(sfen("G*5b")) == {"status": "win", "bestmove": "resign", "message": "正解！詰みました！"}
+    assert table.lookup(sfen("G*4b"))["status"] == "continue"
+    assert table.lookup(sfen("G*4b"))["bestmove"] == "5a6a"
+    assert table.lookup(sfen("9i9h"))["status"] == "incorrect"
+    assert table.lookup(sfen("G*4b", "5a6a", "G*6b"))["status"] == "win"
+    assert table.lookup(sfen("G*4b", "5a6a", "G*7b"))["bestmove"] == "6a5b"
+    assert table.lookup(sfen("G*4b", "5a6a", "G*5b")) == {"status": "incorrect", "bestmove": "6a7a",
+                                                         "message": "その手では詰みません"}
+    # the move number does not matter, unknown and unparsable positions are misses
+    assert table.lookup("sfen " + sfen("G*5b").rsplit(" ", 1)[0] + " 99")["status"] == "win"
+    assert table.lookup(sfen("G*6b")) is None and table.lookup("garbage") is None
+
+
+def test_transpositions_keep_an_entry_per_depth(tmp_path):
+    engine = ScriptedEngine()
+    out = str(tmp_path / "tsume_table.json")
+    longer = dict(PROBLEM, id=100, steps=5)
+    stats = build_tsume_table(engine, [PROBLEM, longer], out_path=out)
+    # the two shared positions are searched once; the longer problem also follows G*5b 6a7a
+    assert (stats.searches, stats.entries) == (3, 12)
+
+    table = TsumeTable(out)
+    sfen = lambda *moves: _after(*moves).board.sfen()
+    # G*5b after G*4b 5a6a mates in 3: too long with no moves left, correct with two left
+    assert table.lookup(sfen("G*4b", "5a6a", "G*5b"), 0)["status"] == "incorrect"
+    assert table.lookup(sfen("G*4b", "5a6a", "G*5b"), 2)["status"] == "continue"
+    assert table.lookup(sfen("G*4b", "5a6a", "G*5b")) is None
+    assert table.lookup(sfen("G*4b", "5a6a", "G*5b"), 4) is None
+    assert table.lookup(sfen("G*5b"))["status"] == "win"          # every depth agrees
+
+
+def test_play_endpoint_uses_the_table(tmp_path, monkeypatch):
+    from backend.api import main
+
+    out = str(tmp_path / "tsume_table.json")
+    build_tsume_table(ScriptedEngine(), [PROBLEM], out_path=out)
+    monkeypatch.setenv("TSUME_TABLE", out)
+    assert get_tsume_table() is get_tsume_table()
+
+    async def no_engine(sfen):
+        raise AssertionError("engine search for a tabled position")
+
+    monkeypatch.setattr(main.stream_engine, "solve_tsume_hand", no_engine)
+    client = TestClient(main.app)
+    res = client.post("/api/tsume/play", json={"sfen": "sfen " + _after("G*4b").board.sfen()})
+    assert res.status_code == 200 and res.json()["bestmove"] == "5a6a"
+
+    fallbacks = []
+
+    async def engine(sfen):
+        fallbacks.append(sfen)
+        return {"status": "incorrect", "bestmove": "5a4b", "message": "その手では詰みません"}
+
+    monkeypatch.setattr(main.stream_engine, "solve_tsume_hand", engine)
+    monkeypatch.setenv("TSUME_SOLVER_MAX_PLIES", "0")
+    off_table = "sfen " + _after("G*6b").board.sfen()
+    assert client.post("/api/tsume/play", json={"sfen": off_table}).json()["bestmove"] == "5a4b"
+    assert fallbacks == [off_table]
+
+
+@pytest.mark.parametrize("value", ["", "/nonexistent/tsume_table.json"])
+def test_missing_table_falls_back(monkeypatch, value):
+    monkeypatch.setenv("TSUME_TABLE", value)
+    assert get_tsume_table() is None
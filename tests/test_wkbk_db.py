@@ -6,6 +6,7 @@ Tests:
 - lookup_by_sfen: ヒット/未ヒット
 - 著作権保護: title 等の長文を返さないこと
 - 落ちない設計: 空文字/None 入力で例外しないこと
+- lookup: 左右反転 / 盤面のみ一致 / 類似局面 top-k と一致度スコア
 """
 import os
 import sys
@@ -15,7 +16,16 @@ if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
 
-from backend.api.db.wkbk_db import normalize_sfen, lookup_by_sfen, WkbkDbResult, db_stats
+from backend.api.db.wkbk_db import (
+    normalize_sfen,
+    lookup_by_sfen,
+    lookup,
+    mirror_sfen,
+    WkbkDbResult,
+    db_stats,
+)
+
+KNOWN_SFEN = "ln1gk2nl/6g2/p2pppspp/2p3p2/7P1/1rP6/P2PPPP1P/2G3SR1/LN2KG1NL b BSPbsp"
 
 
 # ---------------------------------------------------------------------------
@@ -146,7 +156,7 @@ def test_to_dict_hit_contains_expected_keys():
     assert result.hit is True
     d = result.to_dict()
     for key in ("hit", "key", "lineage_key", "tags", "difficulty", "category_hint",
-                "goal_summary", "author", "short_note"):
+                "goal_summary", "author", "short_note", "match", "score"):
         assert key in d, f"missing key in to_dict(): {key}"
 
 
@@ -164,3 +174,63 @@ def test_db_stats_loads_articles():
     stats = db_stats()
     assert "articles_loaded" in stats
     assert stats["articles_loaded"] >= 0  # ファイルがない環境でも 0 で返る
+
+
+# ---------------------------------------------------------------------------
+# lookup — 反転 / 盤面のみ / 類似局面
+# ---------------------------------------------------------------------------
+
+def test_mirror_sfen_reverses_ranks_keeps_hands():
+    m = mirror_sfen(KNOWN_SFEN)
+    assert m.split()[0].split("/")[0] == "ln2kg1nl"
+    assert m.split()[1:] == ["b", "BSPbsp"]
+    assert mirror_sfen(m) == KNOWN_SFEN
+
+
+def test_lookup_exact_has_top_score():
+    results = lookup("position sfen " + KNOWN_SFEN + " 1")
+    assert results[0].match == "exact"
+    assert results[0].score == 1.0
+    assert lookup_by_sfen(KNOWN_SFEN).match == "exact"
+
+
+def test_lookup_mirror_hits_same_article():
+    exact = lookup_by_sfen(KNOWN_SFEN)
+    results = lookup(mirror_sfen(KNOWN_SFEN))
+    assert results[0].key == exact.key
+    assert results[0].match == "mirror"
+    assert 0.9 <= results[0].score < 1.0
+
+
+def test_lookup_board_only_ignores_hands_and_turn():
+    exact = lookup_by_sfen(KNOWN_SFEN)
+    board_only = KNOWN_SFEN.split()[0] + " w -"
+    assert lookup_by_sfen(board_only).hit is False
+    results = lookup(board_only)
+    assert results[0].key == exact.key
+    assert results[0].match == "board"
+
+
+def test_lookup_similar_returns_ranked_top_k():
+    exact = lookup_by_sfen(KNOWN_SFEN)
+    # 7筋の歩を 1 つ進めただけの近い局面
+    near = "ln1gk2nl/6g2/p2pppspp/2p3p2/2P4P1/1r7/P2PPPP1P/2G3SR1/LN2KG1NL b BSPbsp"
+    results = lookup(near, k=3)
+    assert len(results) == 3
+    assert results[0].key == exact.key
+    assert results[0].match == "similar"
+    scores = [r.score for r in results]
+    assert scores == sorted(scores, reverse=True)
+    assert all(0.0 < sc < 0.85 for sc in scores)
+    assert len({r.key for r in results}) == 3
+
+
+def test_lookup_min_score_filters_similar():
+    near = "ln1gk2nl/6g2/p2pppspp/2p3p2/2P4P1/1r7/P2PPPP1P/2G3SR1/LN2KG1NL b BSPbsp"
+    assert lookup(near, k=3, min_score=0.85) == []
+
+
+def test_lookup_empty_board_no_hit():
+    assert lookup("9/9/9/9/9/9/9/9/9 b -") == []
+    assert lookup("") == []
+    assert lookup("not a sfen") == []
@@ -0,0 +1,54 @@
+"""
+tools/generate_wkbk_explanations_gemini.py: DB migration and JSONL export.
+"""
+import json
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("tenacity")
+pytest.importorskip("tqdm")
+pytest.importorskip("google.genai")
+pytest.importorskip("google.api_core")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "tools"))
+import generate_wkbk_explanations_gemini as tool  # noqa: E402
+
+
+def _legacy_db(path: Path) -> sqlite3.Connection:
+    """Schema from before export_state existed, with two rows already exported."""
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE explanations (key TEXT PRIMARY KEY, status TEXT NOT NULL,"
+        " explanation_json TEXT, error_type TEXT, error_message TEXT, raw_text TEXT,"
+        " created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+    )
+    for i, status in enumerate(["ok", "ok", "error"]):
+        payload = json.dumps({"key": f"k{i}"}) if status == "ok" else None
+        conn.execute(
+            "INSERT INTO explanations(key, status, explanation_json, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (f"k{i}", status, payload, f"2025-01-0{i + 1}", f"2025-01-0{i + 1}"),
+        )
+    conn.commit()
+    return conn
+
+
+def test_incremental_export_after_migration_does_not_duplicate(tmp_path):
+    conn = _legacy_db(tmp_path / "expl.sqlite")
+    out = tmp_path / "expl.jsonl"
+    out.write_text('{"key": "k0"}\n{"key": "k1"}\n', encoding="utf-8")
+
+    tool.ensure_db(conn)
+    assert tool.rebuild_output(conn, out, incremental=True) == 2
+    assert [json.loads(line)["key"] for line in out.read_text().splitlines()] == ["k0", "k1"]
+
+    # once migrated, a new ok row is appended on its own
+    writer = tool.BatchWriter(conn)
+    writer.add(tool._ok_row("k3", {"key": "k3"}, "openai", "m", None, None, None, None))
+    writer.flush()
+    assert tool.rebuild_output(conn, out, incremental=True) == 1
+    assert [json.loads(line)["key"] for line in out.read_text().splitlines()] == ["k0", "k1", "k3"]
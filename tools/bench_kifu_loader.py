@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark KIF/CSA -> USI conversion throughput (games/sec, moves/sec).
+
+Usage:
+  # synthetic games (random pseudo-legal playouts rendered as KIF or CSA)
+  python3 tools/bench_kifu_loader.py --games 2000 --plies 120
+  python3 tools/bench_kifu_loader.py --games 2000 --format csa
+
+  # real files: every .kif/.kifu/.csa under a directory
+  python3 tools/bench_kifu_loader.py --dir data/kifu
+
+Synthetic games exercise the board tracker (captures, drops, promotions, 同)
+with the "(77)" source suffix that Shogi Wars / 81Dojo exports carry.
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.ingest.board import (  # noqa: E402
+    GOLD,
+    KING,
+    KIND_MASK,
+    PROMOTABLE,
+    SLIDES,
+    STEPS,
+    Board,
+    in_promotion_zone,
+    square_file,
+    square_rank,
+)
+from backend.ingest.csa_parser import parse_csa  # noqa: E402
+from backend.ingest.kif_parser import parse_kif  # noqa: E402
+from backend.ingest.kifu_loader import KifuLoader, scan_kifu_directory  # noqa: E402
+
+_FILES = "０１２３４５６７８９"
+_RANKS = "〇一二三四五六七八九"
+_NAMES = {1: "歩", 2: "香", 3: "桂", 4: "銀", 5: "金", 6: "角", 7: "飛", 8: "玉",
+          9: "と", 10: "成香", 11: "成桂", 12: "成銀", 14: "馬", 15: "龍"}
+_CSA = {1: "FU", 2: "KY", 3: "KE", 4: "GI", 5: "KI", 6: "KA", 7: "HI", 8: "OU",
+        9: "TO", 10: "NY", 11: "NK", 12: "NG", 14: "UM", 15: "RY"}
+
+
+def _pseudo_moves(board: Board) -> list[tuple[int | None, int, bool, int]]:
+    color = board.turn
+    squares = board.squares
+    moves: list[tuple[int | None, int, bool, int]] = []
+    for sq, piece in enumerate(squares):
+        if not piece or (piece >> 4) != color:
+            continue
+        kind = piece & KIND_MASK
+        c, r = sq % 9, sq // 9
+        sign = -1 if color else 1
+        targets = []
+        for dc, dr in STEPS.get(kind, ()):
+            tc, tr = c + dc * sign, r + dr * sign
+            if 0 <= tc < 9 and 0 <= tr < 9:
+                targets.append(tr * 9 + tc)
+        for dc, dr in SLIDES.get(kind, ()):
+            tc, tr = c + dc * sign, r + dr * sign
+            while 0 <= tc < 9 and 0 <= tr < 9:
+                targets.append(tr * 9 + tc)
+                if squares[tr * 9 + tc]:
+                    break
+                tc, tr = tc + dc * sign, tr + dr * sign
+        for to in targets:
+            target = squares[to]
+            if target and ((target >> 4) == color or target & KIND_MASK == KING):
+                continue
+            can_promote = kind in PROMOTABLE and (
+                in_promotion_zone(sq, color) or in_promotion_zone(to, color))
+            moves.append((sq, to, can_promote, 0))
+    hand = board.hands[color]
+    for kind in PROMOTABLE | {GOLD}:
+        if hand[kind]:
+            moves.extend((None, to, False, kind) for to in range(81) if not squares[to])
+    return moves
+
+
+def synth_game(rng: random.Random, plies: int) -> tuple[str, str]:
+    """One random playout rendered as (KIF text, CSA text)."""
+    board = Board.from_sfen("startpos")
+    kif = ["手合割：平手", "先手：bench", "後手：bench", "手数----指手---------消費時間--"]
+    csa = ["V2.2", "N+bench", "N-bench", "PI", "+"]
+    last_to = None
+    for n in range(1, plies + 1):
+        moves = _pseudo_moves(board)
+        if not moves:
+            break
+        frm, to, can_promote, drop = rng.choice(moves)
+        promote = can_promote and rng.random() < 0.7
+        dest = "同　" if to == last_to else f"{_FILES[square_file(to)]}{_RANKS[square_rank(to)]}"
+        sign = "-" if board.turn else "+"
+        if frm is None:
+            text = f"{dest}{_NAMES[drop]}打"
+            csa.append(f"{sign}00{square_file(to)}{square_rank(to)}{_CSA[drop]}")
+        else:
+            kind = board.squares[frm] & KIND_MASK
+            text = f"{dest}{_NAMES[kind]}{'成' if promote else ''}({square_file(frm)}{square_rank(frm)})"
+            after = _CSA[kind + 8 if promote else kind]
+            csa.append(f"{sign}{square_file(frm)}{square_rank(frm)}{square_file(to)}{square_rank(to)}{after}")
+        board.push(frm, to, promote, drop_kind=drop)
+        last_to = to
+        kif.append(f"{n:>4} {text}   ( 0:01/00:00:01)")
+        csa.append("T1")
+    kif.append(f"{board.ply:>4} 投了")
+    csa.append("%TORYO")
+    return "\n".join(kif) + "\n", "\n".join(csa) + "\n"
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dir", type=str, default=None, help="benchmark real .kif/.csa files under this directory")
+    ap.add_argument("--games", type=int, default=2000)
+    ap.add_argument("--plies", type=int, default=120)
+    ap.add_argument("--unique", type=int, default=50, help="distinct synthetic games (reused round-robin)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--format", choices=["kif", "csa"], default="kif", help="synthetic format")
+    args = ap.parse_args()
+
+    if args.dir:
+        paths = [p for p in scan_kifu_directory(args.dir) if KifuLoader.detect_format(p) in ("kif", "csa")]
+        t0 = time.perf_counter()
+        n_moves = 0
+        for p in paths:
+            n_moves += len(KifuLoader.load_file(p).usi_moves)
+        elapsed = time.perf_counter() - t0
+        n_games, errors = len(paths), 0
+    else:
+        rng = random.Random(args.seed)
+        pick = 0 if args.format == "kif" else 1
+        corpus = [synth_game(rng, args.plies)[pick] for _ in range(max(1, args.unique))]
+        parse = parse_kif if args.format == "kif" else parse_csa
+        t0 = time.perf_counter()
+        n_moves = 0
+        errors = 0
+        for i in range(args.games):
+            game = parse(corpus[i % len(corpus)])
+            n_moves += len(game.moves)
+            errors += game.error is not None
+        elapsed = time.perf_counter() - t0
+        n_games = args.games
+
+    elapsed = max(elapsed, 1e-9)
+    print(f"games:      {n_games}")
+    print(f"moves:      {n_moves}")
+    print(f"errors:     {errors}")
+    print(f"elapsed:    {elapsed:.3f}s")
+    print(f"games/sec:  {n_games / elapsed:,.0f}")
+    print(f"moves/sec:  {n_moves / elapsed:,.0f}")
+    if n_games:
+        print(f"100k games: ~{100_000 / (n_games / elapsed) / 60:.1f} min")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -16,10 +16,21 @@ Cache DB:
 Output (rebuilt from DB; only status=ok):
   tools/datasets/wkbk/wkbk_explanations.jsonl
 
+Throughput:
+  # 8 concurrent requests, at most 300 requests/min, commit every 25 results
+  python3 tools/generate_wkbk_explanations_gemini.py --concurrency 8 --max-rpm 300 --batch-size 25
+
 Notes:
 - .env is loaded ONLY from repo root (.env) to avoid dotenv find_dotenv() issues.
 - Provider defaults to OpenAI; use --provider=gemini to switch.
 - GOOGLE_API_KEY is removed from env to avoid accidental Gemini SDK override.
+- Requests run on a worker pool (--concurrency, default per provider) behind a
+  token-bucket limiter (--max-rpm). Only the main thread touches SQLite; results
+  are committed in batches, one transaction per batch.
+- Runs resume from the DB: keys whose status is 'ok' are skipped unless --force
+  (add --skip-errors to also skip keys that previously failed).
+- The JSONL is rebuilt incrementally: new ok rows are appended; a full rewrite
+  only happens when an already-exported row changed (or the file is missing).
 """
 
 from __future__ import annotations
@@ -29,12 +40,15 @@ import json
 import os
 import sqlite3
 import sys
+import threading
 import time
 import urllib.request
 import urllib.error
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Iterable, Tuple
+from typing import Any, Iterable, Iterator, Tuple
 
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field, ValidationError
@@ -53,6 +67,9 @@ DEFAULT_OUT = ROOT / "tools" / "datasets" / "wkbk" / "wkbk_explanations.jsonl"
 DEFAULT_PROVIDER = "openai"
 DEFAULT_OPENAI_MODEL = "gpt-4o-mini"
 DEFAULT_GEMINI_MODEL = "gemini-2.0-flash-exp"
+# concurrent in-flight requests per provider (override: --concurrency or <PROVIDER>_CONCURRENCY)
+DEFAULT_CONCURRENCY = {"openai": 8, "gemini": 4}
+DEFAULT_BATCH_SIZE = 20
 
 
 class MoveExplain(BaseModel):
@@ -143,19 +160,48 @@ def db_ensure_columns(conn: sqlite3.Connection) -> None:
         "completion_tokens": "INTEGER",
         "total_tokens": "INTEGER",
         "estimated_cost_usd": "REAL",
+        # JSONL export bookkeeping: NULL = never exported, 'clean' = exported as-is,
+        # 'dirty' = changed after export (forces a full rewrite)
+        "export_state": "TEXT",
     }
     for name, col_type in columns.items():
         if name not in existing:
             conn.execute(f"ALTER TABLE explanations ADD COLUMN {name} {col_type}")
+    if "export_state" not in existing:
+        # rows from before export tracking may or may not be in the JSONL already:
+        # mark them dirty so the next sync rewrites the file once instead of appending
+        conn.execute("UPDATE explanations SET export_state='dirty' WHERE status='ok'")
+
 
+def db_load_statuses(conn: sqlite3.Connection) -> dict[str, str]:
+    """key -> status for every cached row (one query instead of one per record)."""
+    return {k: st for k, st in conn.execute("SELECT key, status FROM explanations")}
 
-def db_get_status(conn: sqlite3.Connection, key: str) -> str | None:
-    row = conn.execute("SELECT status FROM explanations WHERE key=?", (key,)).fetchone()
-    return row[0] if row else None
 
+_UPSERT_SQL = """
+    INSERT INTO explanations(
+      key,status,explanation_json,provider,model,prompt_tokens,completion_tokens,total_tokens,estimated_cost_usd,
+      error_type,error_message,raw_text,created_at,updated_at
+    )
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(key) DO UPDATE SET
+      status=excluded.status,
+      explanation_json=excluded.explanation_json,
+      provider=excluded.provider,
+      model=excluded.model,
+      prompt_tokens=excluded.prompt_tokens,
+      completion_tokens=excluded.completion_tokens,
+      total_tokens=excluded.total_tokens,
+      estimated_cost_usd=excluded.estimated_cost_usd,
+      error_type=excluded.error_type,
+      error_message=excluded.error_message,
+      raw_text=excluded.raw_text,
+      export_state=CASE WHEN explanations.export_state IS NULL THEN NULL ELSE 'dirty' END,
+      updated_at=excluded.updated_at;
+"""
 
-def db_upsert_ok(
-    conn: sqlite3.Connection,
+
+def _ok_row(
     key: str,
     explanation: dict[str, Any],
     provider: str,
@@ -164,52 +210,17 @@ def db_upsert_ok(
     completion_tokens: int | None,
     total_tokens: int | None,
     estimated_cost_usd: float | None,
-) -> None:
+) -> tuple[Any, ...]:
     ts = now_iso()
     payload = json.dumps(explanation, ensure_ascii=False)
-    conn.execute(
-        """
-        INSERT INTO explanations(
-          key,status,explanation_json,provider,model,prompt_tokens,completion_tokens,total_tokens,estimated_cost_usd,
-          error_type,error_message,raw_text,created_at,updated_at
-        )
-        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        ON CONFLICT(key) DO UPDATE SET
-          status=excluded.status,
-          explanation_json=excluded.explanation_json,
-          provider=excluded.provider,
-          model=excluded.model,
-          prompt_tokens=excluded.prompt_tokens,
-          completion_tokens=excluded.completion_tokens,
-          total_tokens=excluded.total_tokens,
-          estimated_cost_usd=excluded.estimated_cost_usd,
-          error_type=NULL,
-          error_message=NULL,
-          raw_text=NULL,
-          updated_at=excluded.updated_at;
-        """,
-        (
-            key,
-            "ok",
-            payload,
-            provider,
-            model,
-            prompt_tokens,
-            completion_tokens,
-            total_tokens,
-            estimated_cost_usd,
-            None,
-            None,
-            None,
-            ts,
-            ts,
-        ),
+    return (
+        key, "ok", payload, provider, model,
+        prompt_tokens, completion_tokens, total_tokens, estimated_cost_usd,
+        None, None, None, ts, ts,
     )
-    conn.commit()
 
 
-def db_upsert_error(
-    conn: sqlite3.Connection,
+def _error_row(
     key: str,
     provider: str,
     model: str,
@@ -220,47 +231,36 @@ def db_upsert_error(
     err_type: str,
     err_msg: str,
     raw_text: str | None,
-) -> None:
+) -> tuple[Any, ...]:
     ts = now_iso()
-    conn.execute(
-        """
-        INSERT INTO explanations(
-          key,status,explanation_json,provider,model,prompt_tokens,completion_tokens,total_tokens,estimated_cost_usd,
-          error_type,error_message,raw_text,created_at,updated_at
-        )
-        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        ON CONFLICT(key) DO UPDATE SET
-          status=excluded.status,
-          explanation_json=NULL,
-          provider=excluded.provider,
-          model=excluded.model,
-          prompt_tokens=excluded.prompt_tokens,
-          completion_tokens=excluded.completion_tokens,
-          total_tokens=excluded.total_tokens,
-          estimated_cost_usd=excluded.estimated_cost_usd,
-          error_type=excluded.error_type,
-          error_message=excluded.error_message,
-          raw_text=excluded.raw_text,
-          updated_at=excluded.updated_at;
-        """,
-        (
-            key,
-            "error",
-            None,
-            provider,
-            model,
-            prompt_tokens,
-            completion_tokens,
-            total_tokens,
-            estimated_cost_usd,
-            err_type,
-            err_msg,
-            raw_text,
-            ts,
-            ts,
-        ),
+    return (
+        key, "error", None, provider, model,
+        prompt_tokens, completion_tokens, total_tokens, estimated_cost_usd,
+        err_type, err_msg, raw_text, ts, ts,
     )
-    conn.commit()
+
+
+class BatchWriter:
+    """Buffers upsert rows and commits them in one transaction per batch."""
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = max(1, batch_size)
+        self._rows: list[tuple[Any, ...]] = []
+        self.committed = 0
+
+    def add(self, row: tuple[Any, ...]) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        with self.conn:  # BEGIN ... COMMIT (rolls back on error)
+            self.conn.executemany(_UPSERT_SQL, self._rows)
+        self.committed += len(self._rows)
+        self._rows.clear()
 
 
 def print_recent_errors(conn: sqlite3.Connection, limit: int = 5) -> None:
@@ -284,22 +284,92 @@ def print_recent_errors(conn: sqlite3.Connection, limit: int = 5) -> None:
         print(f"- {t}  {k}  {et}: {em}")
 
 
-def rebuild_output(conn: sqlite3.Connection, out_path: Path) -> int:
-    rows = conn.execute(
-        "SELECT explanation_json FROM explanations WHERE status='ok' ORDER BY updated_at ASC"
-    ).fetchall()
-
-    out_path.parent.mkdir(parents=True, exist_ok=True)
+def _write_jsonl_atomic(out_path: Path, payloads: Iterable[str]) -> int:
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
     n = 0
-    with out_path.open("w", encoding="utf-8") as f:
-        for (payload,) in rows:
-            if not payload:
-                continue
+    with tmp.open("w", encoding="utf-8") as f:
+        for payload in payloads:
             f.write(payload.strip() + "\n")
             n += 1
+    os.replace(tmp, out_path)
     return n
 
 
+def rebuild_output(conn: sqlite3.Connection, out_path: Path, incremental: bool = True) -> int:
+    """
+    Sync the JSONL with ok rows in the DB. Returns the number of lines written.
+
+    Incremental mode appends rows that were never exported. If any exported row
+    changed since (export_state='dirty') or the file is missing, the whole file is
+    rewritten atomically instead.
+    """
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    dirty = conn.execute(
+        "SELECT 1 FROM explanations WHERE export_state='dirty' LIMIT 1"
+    ).fetchone()
+
+    if incremental and not dirty and out_path.exists():
+        rows = conn.execute(
+            """
+            SELECT key, explanation_json FROM explanations
+            WHERE status='ok' AND export_state IS NULL
+            ORDER BY updated_at ASC
+            """
+        ).fetchall()
+        n = 0
+        with out_path.open("a", encoding="utf-8") as f:
+            for _, payload in rows:
+                if not payload:
+                    continue
+                f.write(payload.strip() + "\n")
+                n += 1
+        with conn:
+            conn.executemany(
+                "UPDATE explanations SET export_state='clean' WHERE key=?",
+                [(k,) for k, _ in rows],
+            )
+        return n
+
+    rows = conn.execute(
+        "SELECT explanation_json FROM explanations WHERE status='ok' ORDER BY updated_at ASC"
+    ).fetchall()
+    n = _write_jsonl_atomic(out_path, (payload for (payload,) in rows if payload))
+    with conn:
+        conn.execute(
+            "UPDATE explanations SET export_state="
+            "CASE WHEN status='ok' THEN 'clean' ELSE NULL END"
+        )
+    return n
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate_per_sec` refill, bursts up to `capacity`.
+    acquire() blocks until a token is available. rate <= 0 disables limiting.
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float | None = None):
+        self.rate = float(rate_per_sec)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_s = (tokens - self._tokens) / self.rate
+            time.sleep(wait_s)
+
+
 def build_schema_with_ordering() -> dict[str, Any]:
     # Gemini 2.0 系では propertyOrdering が効く/要求されるケースがあるため付与しておく（害は少ない）
     schema = WkbkExplanation.model_json_schema()
@@ -358,6 +428,13 @@ def estimate_cost_usd(
     return (prompt_tokens / 1000.0) * price_in + (completion_tokens / 1000.0) * price_out
 
 
+def _add_usage(total: dict[str, int | None], usage: dict[str, int | None]) -> None:
+    """Fold one attempt's token counts into the per-task total (retries included)."""
+    for k, v in usage.items():
+        if v is not None:
+            total[k] = (total.get(k) or 0) + v
+
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=1, max=10),
@@ -370,8 +447,12 @@ def gemini_generate_json(
     system_prompt: str,
     user_text: str,
     response_schema: dict[str, Any],
-) -> tuple[dict[str, Any], str, dict[str, int | None]]:
+    limiter: TokenBucket,
+    usage: dict[str, int | None],
+) -> tuple[dict[str, Any], str]:
+    """One Gemini call; every attempt takes a limiter token and adds its tokens to `usage`."""
     prompt = f"{system_prompt}\n\n### INPUT\n{user_text}\n"
+    limiter.acquire()
     try:
         resp = client.models.generate_content(
             model=model,
@@ -381,6 +462,13 @@ def gemini_generate_json(
                 response_json_schema=response_schema,
             ),
         )
+        # 失敗扱いの応答でもトークンは課金されるので、判定より先に集計する
+        usage_meta = getattr(resp, "usage_metadata", None)
+        _add_usage(usage, {
+            "prompt_tokens": getattr(usage_meta, "prompt_token_count", None) if usage_meta else None,
+            "completion_tokens": getattr(usage_meta, "candidates_token_count", None) if usage_meta else None,
+            "total_tokens": getattr(usage_meta, "total_token_count", None) if usage_meta else None,
+        })
         raw_text = (resp.text or "").strip()
         if not raw_text:
             raise RetryableGeminiError("Empty response text from Gemini.")
@@ -389,15 +477,7 @@ def gemini_generate_json(
         except json.JSONDecodeError as je:
             # 返答が JSON 以外になったケースはリトライ対象にする
             raise RetryableGeminiError(f"JSON decode failed: {je}") from je
-        usage_meta = getattr(resp, "usage_metadata", None)
-        prompt_tokens = getattr(usage_meta, "prompt_token_count", None) if usage_meta else None
-        completion_tokens = getattr(usage_meta, "candidates_token_count", None) if usage_meta else None
-        total_tokens = getattr(usage_meta, "total_token_count", None) if usage_meta else None
-        return payload, raw_text, {
-            "prompt_tokens": prompt_tokens,
-            "completion_tokens": completion_tokens,
-            "total_tokens": total_tokens,
-        }
+        return payload, raw_text
     except RetryableGeminiError:
         raise
     except gax_exceptions.ResourceExhausted as e:
@@ -423,7 +503,10 @@ def openai_generate_json(
     system_prompt: str,
     user_text: str,
     response_schema: dict[str, Any],
-) -> tuple[dict[str, Any], str, dict[str, int | None]]:
+    limiter: TokenBucket,
+    usage: dict[str, int | None],
+) -> tuple[dict[str, Any], str]:
+    """One OpenAI call; every attempt takes a limiter token and adds its tokens to `usage`."""
     body = {
         "model": model,
         "input": [
@@ -448,10 +531,17 @@ def openai_generate_json(
         },
         method="POST",
     )
+    limiter.acquire()
     try:
         with urllib.request.urlopen(req, timeout=60) as resp:
             raw_text = resp.read().decode("utf-8")
         data = json.loads(raw_text)
+        resp_usage = data.get("usage") or {}
+        _add_usage(usage, {
+            "prompt_tokens": resp_usage.get("input_tokens"),
+            "completion_tokens": resp_usage.get("output_tokens"),
+            "total_tokens": resp_usage.get("total_tokens"),
+        })
         # Extract JSON payload
         payload_text = None
         output = data.get("output", [])
@@ -464,12 +554,7 @@ def openai_generate_json(
         if not payload_text:
             raise RetryableOpenAIError("OpenAI response missing output text")
         payload = json.loads(payload_text)
-        usage = data.get("usage") or {}
-        return payload, payload_text, {
-            "prompt_tokens": usage.get("input_tokens"),
-            "completion_tokens": usage.get("output_tokens"),
-            "total_tokens": usage.get("total_tokens"),
-        }
+        return payload, payload_text
     except urllib.error.HTTPError as e:
         raw = ""
         try:
@@ -483,6 +568,159 @@ def openai_generate_json(
         raise RetryableOpenAIError(f"OpenAI call failed: {type(e).__name__}: {e}") from e
 
 
+@dataclass
+class GenTask:
+    key: str
+    title: str
+    lineage_key: str
+    tags: list[str]
+    difficulty: int | None
+    user_text: str
+
+
+@dataclass
+class GenResult:
+    task: GenTask
+    explanation: dict[str, Any] | None = None
+    usage: dict[str, int | None] = field(
+        default_factory=lambda: {"prompt_tokens": None, "completion_tokens": None, "total_tokens": None}
+    )
+    raw_text: str | None = None
+    error_type: str | None = None
+    error_message: str | None = None
+    elapsed_s: float = 0.0
+
+
+def build_task(o: dict[str, Any]) -> GenTask | None:
+    key = o.get("key")
+    if not key:
+        return None
+    title = (o.get("title") or "").strip()
+    lineage_key = (o.get("lineage_key") or "").strip()
+    tags = o.get("tag_list") or []
+    difficulty = o.get("difficulty")
+
+    init_sfen = (o.get("init_sfen") or "").strip()
+    moves_answers = o.get("moves_answers") or []
+    # pick first solution as canonical
+    solution = (moves_answers[0].get("moves_str") if moves_answers else "") or ""
+    solution = solution.strip()
+
+    user_text = json.dumps(
+        {
+            "key": key,
+            "title": title,
+            "lineage_key": lineage_key,
+            "tags": tags,
+            "difficulty": difficulty,
+            "init_sfen": init_sfen,
+            "answer_moves_usi": solution,
+            "note": "answer_moves_usi は空白区切りのUSI手順です。sequence はこれと同じ手数で返してください。",
+        },
+        ensure_ascii=False,
+    )
+    return GenTask(key, title, lineage_key, tags, difficulty, user_text)
+
+
+def generate_one(
+    task: GenTask,
+    provider: str,
+    model: str,
+    api_key: str,
+    client: Any,
+    schema: dict[str, Any],
+    limiter: TokenBucket,
+    sleep_secs: float = 0.0,
+) -> GenResult:
+    """Worker body: one LLM call + validation. Never touches the DB."""
+    result = GenResult(task=task)
+    t0 = time.monotonic()
+    try:
+        if provider == "openai":
+            payload, raw_text = openai_generate_json(
+                api_key, model, SYSTEM_PROMPT, task.user_text, schema, limiter, result.usage
+            )
+        else:
+            payload, raw_text = gemini_generate_json(
+                client, model, SYSTEM_PROMPT, task.user_text, schema, limiter, result.usage
+            )
+        result.raw_text = raw_text
+        exp = WkbkExplanation.model_validate(payload)
+        # ensure metadata (trust input more if model omitted)
+        exp = exp.model_copy(
+            update={
+                "key": task.key,
+                "title": task.title or exp.title,
+                "lineage_key": task.lineage_key or exp.lineage_key,
+                "tags": task.tags or exp.tags,
+                "difficulty": task.difficulty if task.difficulty is not None else exp.difficulty,
+            }
+        )
+        result.explanation = exp.model_dump()
+    except (ValidationError, Exception) as e:
+        result.error_type = type(e).__name__
+        result.error_message = str(e)
+        if isinstance(e, OpenAIErrorWithBody) and result.raw_text is None:
+            result.raw_text = e.raw_text
+    result.elapsed_s = time.monotonic() - t0
+    if sleep_secs:
+        time.sleep(sleep_secs)
+    return result
+
+
+class RunStats:
+    """Cumulative counters plus throughput / cost-per-minute for the progress bar."""
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.requests = 0
+        self.ok = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.cost_usd = 0.0
+
+    def add_usage(self, usage: dict[str, int | None], cost: float | None) -> None:
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        total_tokens = usage.get("total_tokens")
+        if total_tokens is None:
+            total_tokens = prompt_tokens + completion_tokens
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.total_tokens += total_tokens
+        if cost is not None:
+            self.cost_usd += cost
+
+    def postfix(self) -> dict[str, str]:
+        minutes = max(time.monotonic() - self.started, 1e-6) / 60.0
+        done = self.ok + self.errors
+        return {
+            "ok": str(self.ok),
+            "err": str(self.errors),
+            "items/min": f"{done / minutes:.1f}",
+            "tok/min": f"{self.total_tokens / minutes:.0f}",
+            "usd/min": f"{self.cost_usd / minutes:.4f}",
+        }
+
+
+def iter_pending(
+    records: list[dict[str, Any]],
+    statuses: dict[str, str],
+    force: bool,
+    skip_errors: bool,
+) -> Iterator[GenTask]:
+    for o in records:
+        task = build_task(o)
+        if task is None:
+            continue
+        st = statuses.get(task.key)
+        if not force and (st == "ok" or (skip_errors and st is not None)):
+            continue
+        yield task
+
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", type=str, default=str(DEFAULT_IN))
@@ -498,7 +736,15 @@ def main() -> int:
     ap.add_argument("--max-total-tokens", type=int, default=2_000_000)
     ap.add_argument("--max-estimated-cost-usd", type=float, default=5.0)
     ap.add_argument("--force", action="store_true")
+    ap.add_argument("--skip-errors", action="store_true",
+                    help="on resume, also skip keys whose last attempt failed")
     ap.add_argument("--provider", type=str, choices=["openai", "gemini"], default=DEFAULT_PROVIDER)
+    ap.add_argument("--concurrency", type=int, default=None,
+                    help="concurrent in-flight requests (default: <PROVIDER>_CONCURRENCY or per-provider default)")
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                    help="results per SQLite transaction")
+    ap.add_argument("--full-rebuild", action="store_true",
+                    help="rewrite the whole JSONL instead of appending new rows")
     args = ap.parse_args()
 
     # 1) .env は repo root 固定（find_dotenv を使わない）
@@ -528,6 +774,12 @@ def main() -> int:
             return 2
         model = os.environ.get("GEMINI_MODEL", DEFAULT_GEMINI_MODEL).strip()
 
+    concurrency = args.concurrency
+    if concurrency is None:
+        raw = os.environ.get(f"{provider.upper()}_CONCURRENCY", "").strip()
+        concurrency = int(raw) if raw.isdigit() else DEFAULT_CONCURRENCY[provider]
+    concurrency = max(1, concurrency)
+
     in_path = Path(args.input)
     db_path = Path(args.db)
     out_path = Path(args.output)
@@ -537,9 +789,11 @@ def main() -> int:
     print(f"using provider: {provider}")
     print(f"using model: {model}")
     print(f"using API key: {mask_key(api_key)}")
+    print(f"concurrency: {concurrency}  max-rpm: {args.max_rpm or 'unlimited'}  batch-size: {args.batch_size}")
 
     db_path.parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
     ensure_db(conn)
 
     client = genai.Client(api_key=api_key) if provider == "gemini" else None
@@ -558,253 +812,120 @@ def main() -> int:
     if args.max_items is not None:
         records = records[: args.max_items]
 
-    processed = 0
-    done_ok = 0
-    skipped_cache = 0
-    errors = 0
+    # resume: the DB status column decides what is left to do
+    statuses = db_load_statuses(conn)
+    pending = list(iter_pending(records, statuses, args.force, args.skip_errors))
+    skipped_cache = sum(1 for o in records if o.get("key")) - len(pending)
+
+    limiter = TokenBucket((args.max_rpm or 0.0) / 60.0)
+    writer = BatchWriter(conn, args.batch_size)
+    stats = RunStats()
     quota_exhausted = False
-    total_cost = 0.0
-    cost_guard_enabled = True
     guardrail_warned = False
-    request_count = 0
-    cumulative_prompt_tokens = 0
-    cumulative_completion_tokens = 0
-    cumulative_total_tokens = 0
-    last_request_at: float | None = None
-
-    for o in tqdm(records, desc="records"):
-        key = o.get("key")
-        if not key:
-            continue
-
-        if (not args.force) and db_get_status(conn, key) == "ok":
-            skipped_cache += 1
-            continue
-
-        if request_count >= args.max_requests:
-            db_upsert_error(
-                conn,
-                key,
-                provider,
-                model,
-                None,
-                None,
-                None,
-                None,
-                "GuardrailExceeded",
-                "guardrail: exceeded max-requests",
-                None,
-            )
-            print("guardrail: exceeded max-requests; stopping.")
-            break
-
-        title = (o.get("title") or "").strip()
-        lineage_key = (o.get("lineage_key") or "").strip()
-        tags = o.get("tag_list") or []
-        difficulty = o.get("difficulty")
-
-        init_sfen = (o.get("init_sfen") or "").strip()
-        moves_answers = o.get("moves_answers") or []
-        # pick first solution as canonical
-        solution = (moves_answers[0].get("moves_str") if moves_answers else "") or ""
-        solution = solution.strip()
-
-        user_text = json.dumps(
-            {
-                "key": key,
-                "title": title,
-                "lineage_key": lineage_key,
-                "tags": tags,
-                "difficulty": difficulty,
-                "init_sfen": init_sfen,
-                "answer_moves_usi": solution,
-                "note": "answer_moves_usi は空白区切りのUSI手順です。sequence はこれと同じ手数で返してください。",
-            },
-            ensure_ascii=False,
-        )
-
-        raw_text: str | None = None
-        usage = {"prompt_tokens": None, "completion_tokens": None, "total_tokens": None}
-        if args.max_items is not None and processed >= args.max_items:
-            break
-        if args.max_cost_usd is not None and total_cost >= args.max_cost_usd:
-            print(f"max-cost-usd reached: {total_cost:.6f} >= {args.max_cost_usd:.6f}. stopping.")
-            break
-        if args.max_total_tokens is not None and cumulative_total_tokens >= args.max_total_tokens:
-            db_upsert_error(
-                conn,
-                key,
-                provider,
-                model,
-                None,
-                None,
-                None,
-                None,
-                "GuardrailExceeded",
-                "guardrail: exceeded max-total-tokens",
-                None,
-            )
-            print("guardrail: exceeded max-total-tokens; stopping.")
-            break
-        if args.max_estimated_cost_usd is not None and total_cost >= args.max_estimated_cost_usd:
-            db_upsert_error(
-                conn,
-                key,
-                provider,
-                model,
-                None,
-                None,
-                None,
-                None,
-                "GuardrailExceeded",
-                "guardrail: exceeded max-estimated-cost-usd",
-                None,
-            )
-            print("guardrail: exceeded max-estimated-cost-usd; stopping.")
-            break
-        if args.max_rpm:
-            min_interval = 60.0 / args.max_rpm
-            if last_request_at is not None:
-                elapsed = time.time() - last_request_at
-                if elapsed < min_interval:
-                    time.sleep(min_interval - elapsed)
-        try:
-            request_count += 1
-            if provider == "openai":
-                payload, raw_text, usage = openai_generate_json(api_key, model, SYSTEM_PROMPT, user_text, schema)
-            else:
-                payload, raw_text, usage = gemini_generate_json(client, model, SYSTEM_PROMPT, user_text, schema)
-            # validate
-            exp = WkbkExplanation.model_validate(payload)
-
-            # ensure metadata (trust input more if model omitted)
-            exp = exp.model_copy(
-                update={
-                    "key": key,
-                    "title": title or exp.title,
-                    "lineage_key": lineage_key or exp.lineage_key,
-                    "tags": tags or exp.tags,
-                    "difficulty": difficulty if difficulty is not None else exp.difficulty,
-                }
-            )
+    stop_reason: str | None = None
+
+    def guardrail_before_submit() -> str | None:
+        if stats.requests >= args.max_requests:
+            return "max-requests"
+        if args.max_cost_usd is not None and stats.cost_usd >= args.max_cost_usd:
+            return "max-cost-usd"
+        if args.max_total_tokens is not None and stats.total_tokens >= args.max_total_tokens:
+            return "max-total-tokens"
+        if args.max_estimated_cost_usd is not None and stats.cost_usd >= args.max_estimated_cost_usd:
+            return "max-estimated-cost-usd"
+        return None
 
-            estimated_cost = estimate_cost_usd(
-                provider,
-                usage.get("prompt_tokens"),
-                usage.get("completion_tokens"),
-            )
-            if estimated_cost is None and not guardrail_warned:
-                print("warning: price per 1K tokens not set; cost guardrails may be ineffective.")
-                guardrail_warned = True
-            if estimated_cost is not None:
-                total_cost += estimated_cost
-            prompt_tokens = usage.get("prompt_tokens") or 0
-            completion_tokens = usage.get("completion_tokens") or 0
-            total_tokens = usage.get("total_tokens")
-            if total_tokens is None:
-                total_tokens = prompt_tokens + completion_tokens
-            cumulative_prompt_tokens += prompt_tokens
-            cumulative_completion_tokens += completion_tokens
-            cumulative_total_tokens += total_tokens
-            if args.max_total_tokens is not None and cumulative_total_tokens > args.max_total_tokens:
-                db_upsert_error(
-                    conn,
-                    key,
-                    provider,
-                    model,
-                    usage.get("prompt_tokens"),
-                    usage.get("completion_tokens"),
-                    usage.get("total_tokens"),
-                    estimated_cost,
-                    "GuardrailExceeded",
-                    "guardrail: exceeded max-total-tokens",
-                    raw_text,
-                )
-                print("guardrail: exceeded max-total-tokens; stopping.")
-                break
-            if args.max_estimated_cost_usd is not None and estimated_cost is not None and total_cost > args.max_estimated_cost_usd:
-                db_upsert_error(
-                    conn,
-                    key,
-                    provider,
-                    model,
-                    usage.get("prompt_tokens"),
-                    usage.get("completion_tokens"),
-                    usage.get("total_tokens"),
-                    estimated_cost,
-                    "GuardrailExceeded",
-                    "guardrail: exceeded max-estimated-cost-usd",
-                    raw_text,
-                )
-                print("guardrail: exceeded max-estimated-cost-usd; stopping.")
-                break
-            db_upsert_ok(
-                conn,
-                key,
-                exp.model_dump(),
-                provider,
-                model,
-                usage.get("prompt_tokens"),
-                usage.get("completion_tokens"),
-                usage.get("total_tokens"),
-                estimated_cost,
-            )
-            done_ok += 1
-            print(
-                f"[{key}] tokens in/out/total="
-                f"{usage.get('prompt_tokens')}/{usage.get('completion_tokens')}/{usage.get('total_tokens')} "
-                f"est_cost_usd={estimated_cost if estimated_cost is not None else 'n/a'}"
-            )
-            print(
-                "cumulative tokens in/out/total="
-                f"{cumulative_prompt_tokens}/{cumulative_completion_tokens}/{cumulative_total_tokens} "
-                f"estimated_cost_usd={total_cost:.6f}"
-            )
-        except (ValidationError, Exception) as e:
-            et = type(e).__name__
-            em = str(e)
-            if isinstance(e, OpenAIErrorWithBody) and raw_text is None:
-                raw_text = e.raw_text
+    def record_guardrail(key: str, reason: str) -> None:
+        if reason == "max-cost-usd":
+            # --max-cost-usd is a soft stop: nothing is recorded for the key
+            return
+        writer.add(_error_row(key, provider, model, None, None, None, None,
+                              "GuardrailExceeded", f"guardrail: exceeded {reason}", None))
+
+    def handle(res: GenResult) -> None:
+        nonlocal quota_exhausted, guardrail_warned
+        key = res.task.key
+        usage = res.usage
+        # usage covers every attempt, including retries and failed calls that were still billed
+        estimated_cost = estimate_cost_usd(provider, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        stats.add_usage(usage, estimated_cost)
+        if res.explanation is None:
+            em = res.error_message or ""
             if "ResourceExhausted" in em or "TooManyRequests" in em or "429" in em:
                 quota_exhausted = True
-            db_upsert_error(
-                conn,
-                key,
-                provider,
-                model,
-                usage.get("prompt_tokens"),
-                usage.get("completion_tokens"),
-                usage.get("total_tokens"),
-                None,
-                et,
-                em[:400],
-                raw_text,
-            )
-            errors += 1
-            print(f"[{key}] error: {et}: {em[:200]}")
-            print(
-                "cumulative tokens in/out/total="
-                f"{cumulative_prompt_tokens}/{cumulative_completion_tokens}/{cumulative_total_tokens} "
-                f"estimated_cost_usd={total_cost:.6f}"
-            )
-        processed += 1
-        last_request_at = time.time()
-        if args.sleep_secs:
-            time.sleep(args.sleep_secs)
-
-    rebuilt = rebuild_output(conn, out_path)
+            writer.add(_error_row(key, provider, model, usage.get("prompt_tokens"),
+                                  usage.get("completion_tokens"), usage.get("total_tokens"),
+                                  estimated_cost, res.error_type or "Error", em[:400], res.raw_text))
+            stats.errors += 1
+            tqdm.write(f"[{key}] error: {res.error_type}: {em[:200]}")
+            return
+
+        if estimated_cost is None and not guardrail_warned:
+            tqdm.write("warning: price per 1K tokens not set; cost guardrails may be ineffective.")
+            guardrail_warned = True
+        writer.add(_ok_row(key, res.explanation, provider, model, usage.get("prompt_tokens"),
+                           usage.get("completion_tokens"), usage.get("total_tokens"), estimated_cost))
+        stats.ok += 1
+
+    # bounded in-flight window: at most `concurrency` requests are outstanding, so
+    # guardrails are checked before every submission rather than after the fact.
+    task_iter = iter(pending)
+    in_flight: set[Future[GenResult]] = set()
+    bar = tqdm(total=len(pending), desc="records")
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"wkbk-{provider}") as pool:
+            while True:
+                while stop_reason is None and len(in_flight) < concurrency:
+                    task = next(task_iter, None)
+                    if task is None:
+                        break
+                    reason = guardrail_before_submit()
+                    if reason is not None:
+                        record_guardrail(task.key, reason)
+                        stop_reason = reason
+                        break
+                    stats.requests += 1
+                    in_flight.add(pool.submit(
+                        generate_one, task, provider, model, api_key, client, schema,
+                        limiter, args.sleep_secs,
+                    ))
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    handle(fut.result())
+                    bar.update(1)
+                bar.set_postfix(stats.postfix(), refresh=False)
+    except KeyboardInterrupt:
+        stop_reason = "interrupted"
+        print("interrupted; flushing completed results.")
+    finally:
+        bar.close()
+        writer.flush()
+
+    if stop_reason and stop_reason != "interrupted":
+        print(f"guardrail: exceeded {stop_reason}; stopping.")
+
+    rebuilt = rebuild_output(conn, out_path, incremental=not args.full_rebuild)
+    elapsed_min = max(time.monotonic() - stats.started, 1e-6) / 60.0
 
     print("----")
     print(f"input:   {in_path}")
     print(f"db:      {db_path}")
     print(f"output:  {out_path}")
     print(f"matched: {matched}")
-    print(f"done:    {processed}")
-    print(f"ok_count: {done_ok}")
-    print(f"error_count: {errors}")
+    print(f"done:    {stats.ok + stats.errors}")
+    print(f"ok_count: {stats.ok}")
+    print(f"error_count: {stats.errors}")
     print(f"skipped_cache: {skipped_cache}")
-    print(f"estimated_total_cost_usd: {total_cost:.6f}")
-    print(f"rebuilt output lines: {rebuilt}")
+    print(
+        "cumulative tokens in/out/total="
+        f"{stats.prompt_tokens}/{stats.completion_tokens}/{stats.total_tokens}"
+    )
+    print(f"estimated_total_cost_usd: {stats.cost_usd:.6f}")
+    print(f"throughput: {(stats.ok + stats.errors) / elapsed_min:.1f} items/min, "
+          f"{stats.cost_usd / elapsed_min:.4f} usd/min")
+    print(f"output lines written: {rebuilt}")
     print_recent_errors(conn, limit=5)
     if quota_exhausted:
         print("Note: 429/Resource exhausted detected. Please check Billing/Quota.")